@@ -7,30 +7,89 @@ Author: Satwant Kumar (Satwant.Dagar@gmail.com)
 Date: August 24, 2025
 """
 
+import asyncio
+import glob
 import os
 import sys
 import time
 import json
 import logging
 import subprocess
-import requests
+from concurrent.futures import Future, ThreadPoolExecutor
 from pathlib import Path
 
+from autoripper import aio, cdrom, eventlog, metrics, tracing
+from autoripper.accuraterip import AccurateRipDatabase
+from autoripper.catalog import LibraryCatalog, LibraryWatcher, duplicate_policy
+from autoripper.cdrom import open_drive
+from autoripper.connectivity import ConnectivityMonitor
+from autoripper.discinfo import disc_info, read_disc_info, write_disc_info
+from autoripper.encoding import EncoderPool, EncoderSlots
+from autoripper.journal import Journal, default_journal_path
+from autoripper.mbindex import MusicBrainzIndex
+from autoripper.metadata_cache import MetadataCache
+from autoripper.musicbrainz import MusicBrainzClient, release_metadata
+from autoripper.pipeline import DEFAULT_CD_FORMAT, AlbumLayout, RipPipeline
+from autoripper.probe import DiscProbe, discard_saved_probe, load_saved_probe, probe_disc
+from autoripper.reconcile import MetadataReconciler, default_state_path
+from autoripper.runner import AbcdeProgress, CdparanoiaProgress, HandBrakeProgress
+from autoripper.supervisor import AsyncSupervisor, Supervisor, set_drive_context
+from autoripper.transfer import TransferEngine
+from autoripper.uevent import UeventMonitor, ensure_kernel_polling
+
 class AutoRipper:
-    def __init__(self):
-        """Initialize the auto-ripper"""
-        self.device = "/dev/sr0"
+    def __init__(self, device=None, encoder_slots=None, services_only=False):
+        """Initialize the auto-ripper for one drive, or only for the services shared by all drives"""
         self.config = self.load_config()
+        if services_only:
+            # Resumed encodes, catalog, reconciler and network copy; never touches a drive
+            self.device = None
+            self.drive_name = ''
+            self.lockfile = None
+        else:
+            self.device = device or os.getenv('CDROM_DEVICE') or self.config.get('device', '/dev/sr0')
+            self.drive_name = os.path.basename(self.device)
+            self.lockfile = f"/tmp/auto-ripper-{self.drive_name}.lock"
+        # Shared with other drive workers when running under the supervisor
+        self.encoder_slots = encoder_slots or EncoderSlots(self.config.get('encoder_slots'))
+        self.encoder_pool = EncoderPool(self.encoder_slots)
+        metrics.QUEUE_DEPTH.set_function(lambda: self.encoder_pool.queue_depth,
+                                         queue='encode', drive=self.drive_name)
+        self.journal = self.open_journal()
+        self.pipeline = RipPipeline(self.config, self.encoder_pool, self.journal,
+                                    AccurateRipDatabase.from_config(self.config),
+                                    on_progress=self.report_progress)
+        # Rips whose tracks are still being encoded after the disc was ejected
+        self.rip_jobs = []
+        self._media_monitor = None
+        self._media_monitor_failed = False
+        # Facts about the disc in the drive, computed once per insertion
+        self.probe = None
+        self._media_inserted_at = None
+        # Last ProgressEvent of the external tool running on this drive
+        self.progress = None
+        self.metadata_cache = self.open_metadata_cache()
+        self.mb_index = self.open_mb_index()
+        self.catalog = self.open_catalog()
+        self.connectivity = ConnectivityMonitor.shared(self.config)
+        self.musicbrainz = MusicBrainzClient.shared(self.config, self.connectivity)
+        self.reconciler = self.open_reconciler()
+        self.transfers = self.open_transfers()
+        # Lookups share the asyncio core's executor instead of a thread per drive
+        self.metadata_executor = aio.executor() or ThreadPoolExecutor(max_workers=1, thread_name_prefix='metadata')
+        set_drive_context(self.device)
         self.setup_logging()
+        tracing.configure(self.config)
         
         # Get current user info
         self.current_user = os.getenv('SUDO_USER') or os.getenv('USER') or 'rsd'
         self.current_uid = os.getuid()
         
-        logging.info(f"AutoRipper initialized with device: {self.device}")
+        logging.info(f"AutoRipper initialized with device: {self.device or 'none (shared services)'}")
         logging.info(f"Running as user: {self.current_user}, UID: {self.current_uid}")
     
-    def load_config(self):
+    @staticmethod
+    def load_config():
         """Load configuration from JSON file"""
         config_path = "/opt/auto-ripper/config.json"
         if os.path.exists(config_path):
@@ -47,65 +106,35 @@ class AutoRipper:
             'unique_artist': 'Unknown_Artist',
             'unique_album': 'Unknown_Album',
             'quiet_mode': True,  # Reduce log noise when no disc is present
-            'log_wait_interval': 30  # Seconds between waiting logs
+            'log_wait_interval': 30,  # Seconds between waiting logs
+            'disc_detection': 'uevent',  # 'uevent' or 'poll'
+            'poll_fallback_interval': 60,  # Safety-net poll while waiting on uevents
+            'rip_engine': 'pipeline'  # 'pipeline' (native) or 'abcde'
         }
     
     def setup_logging(self):
-        """Setup logging configuration with rotation and cleanup"""
-        log_dir = "/var/log/auto-ripper"
-        os.makedirs(log_dir, exist_ok=True)
-        
-        # Check log file size and rotate if needed
-        log_file = f"{log_dir}/auto-ripper.log"
-        if os.path.exists(log_file):
-            file_size = os.path.getsize(log_file)
-            max_size = 10 * 1024 * 1024  # 10MB
-            
-            if file_size > max_size:
-                # Rotate log file
-                backup_file = f"{log_dir}/auto-ripper.log.old"
-                if os.path.exists(backup_file):
-                    os.remove(backup_file)
-                os.rename(log_file, backup_file)
-                logging.info("Log file rotated due to size limit")
-        
-        logging.basicConfig(
-            level=logging.INFO,
-            format='%(asctime)s - %(levelname)s - %(message)s',
-            handlers=[
-                logging.FileHandler(log_file),
-                logging.StreamHandler()
-            ]
-        )
-        
-        # Clean up old log files
-        self.cleanup_old_logs(log_dir)
-    
-    def cleanup_old_logs(self, log_dir):
-        """Clean up old log files to prevent disk space issues"""
+        """Structured logging through a background writer with continuous rotation (config 'logging')"""
+        eventlog.setup(self.config)
+    
+    def get_drive_status(self):
+        """Drive status via CDROM_DRIVE_STATUS ioctl, or None if unsupported"""
         try:
-            import glob
-            import time
-            
-            # Keep only the last 5 log files
-            log_files = glob.glob(f"{log_dir}/auto-ripper.log*")
-            log_files.sort(key=os.path.getctime, reverse=True)
-            
-            # Remove old log files beyond the 5th one
-            for old_log in log_files[5:]:
-                try:
-                    os.remove(old_log)
-                    logging.info(f"Removed old log file: {old_log}")
-                except Exception as e:
-                    logging.warning(f"Could not remove old log file {old_log}: {e}")
-                    
-        except Exception as e:
-            logging.warning(f"Error cleaning up old logs: {e}")
+            with open_drive(self.device) as drive:
+                return drive.drive_status()
+        except OSError as e:
+            if not getattr(self, '_drive_status_unsupported', False):
+                logging.warning(f"Drive status ioctl unavailable on {self.device}: {e}")
+                self._drive_status_unsupported = True
+            return None
     
     def is_disc_present(self):
         """Check if a disc is present in the drive"""
+        status = self.get_drive_status()
+        if status is not None and status != cdrom.CDS_NO_INFO:
+            return status == cdrom.CDS_DISC_OK
+        
         try:
-            # Try to read from the device
+            # Drive can't report its status, try to read from the device
             result = subprocess.run(['dd', f'if={self.device}', 'of=/dev/null', 'bs=2048', 'count=1'], 
                                   capture_output=True, text=True, timeout=5)
             return result.returncode == 0
@@ -120,29 +149,196 @@ class AutoRipper:
                 self._last_error_log_time = current_time
             return False
     
-    def get_disc_type(self):
+    def open_metadata_cache(self):
+        """Open the on-disk MusicBrainz cache, or None if the state dir is unusable"""
+        if not self.config.get('metadata_cache', {}).get('enabled', True):
+            return None
+        try:
+            return MetadataCache.from_config(self.config)
+        except Exception as e:
+            logging.warning(f"Metadata cache unavailable: {e}")
+            return None
+    
+    def open_journal(self):
+        """Crash-safe rip journal shared by every drive worker, or None if disabled"""
+        if not self.config.get('journal_enabled', True):
+            return None
+        try:
+            return Journal.shared(default_journal_path(self.config))
+        except OSError as e:
+            logging.warning(f"Rip journal unavailable, interrupted rips will start over: {e}")
+            return None
+    
+    def open_mb_index(self):
+        """Open the offline MusicBrainz index if one has been imported"""
+        try:
+            index = MusicBrainzIndex.open_for_lookup(self.config)
+            if index is not None:
+                logging.info(f"Using offline MusicBrainz index: {index.path}")
+            return index
+        except Exception as e:
+            logging.warning(f"Offline MusicBrainz index unavailable: {e}")
+            return None
+    
+    def open_catalog(self):
+        """Library catalog shared by every drive worker, or None if disabled or unusable"""
+        if not self.config.get('library_catalog', {}).get('enabled', True):
+            return None
+        try:
+            return LibraryCatalog.shared(self.config)
+        except Exception as e:
+            logging.warning(f"Library catalog unavailable, falling back to directory checks: {e}")
+            return None
+    
+    def start_library_watcher(self):
+        """Keep the catalog current while the library is changed outside the ripper"""
+        settings = self.config.get('library_catalog', {})
+        if self.catalog is None or not settings.get('watch', True):
+            return
+        watcher = LibraryWatcher(self.catalog, self.config.get('output_dir', '/mnt/MUSIC'),
+                                 settings.get('rescan_interval_minutes', 60) * 60)
+        watcher.start()
+    
+    def catalog_album(self, album_dir, old_dir=None):
+        """Record a finished (or renamed) album in the library catalog"""
+        if self.catalog is None:
+            return
+        try:
+            if old_dir is not None:
+                self.catalog.moved(old_dir, album_dir)
+            else:
+                self.catalog.index_album(album_dir)
+        except Exception as e:
+            logging.warning(f"Could not update library catalog for {album_dir}: {e}")
+    
+    def unique_name(self, parent, base, numbered=False):
+        """Free directory name under parent: base, or base_NN if that is taken"""
+        if self.catalog is not None:
+            return self.catalog.unique_name(parent, base, numbered)
+        if not numbered and not os.path.exists(os.path.join(parent, base)):
+            return base
+        counter = 1
+        while os.path.exists(os.path.join(parent, f"{base}_{counter:02d}")):
+            counter += 1
+        return f"{base}_{counter:02d}"
+    
+    def open_transfers(self):
+        """Network copy queue shared by every drive worker, or None if network_copy is off"""
+        if not self.config.get('network_copy') or not self.config.get('network_path'):
+            return None
+        return TransferEngine.shared(self.config)
+    
+    def start_network_copy(self):
+        """Copy queued albums (including ones left from earlier runs) to network_path"""
+        if self.transfers is None:
+            return
+        if self.transfers.pending:
+            logging.info(f"{len(self.transfers.pending)} albums waiting to be copied to "
+                         f"{self.transfers.destination_root}")
+        self.transfers.start()
+    
+    def album_moved(self, old_dir, new_dir):
+        """The metadata reconciler renamed an album"""
+        self.catalog_album(new_dir, old_dir)
+        if self.transfers is not None:
+            self.transfers.enqueue(new_dir, replaces=old_dir)
+    
+    def start_metrics(self):
+        """Serve /metrics for the whole process, including the shared queues"""
+        if self.transfers is not None:
+            metrics.QUEUE_DEPTH.set_function(lambda: len(self.transfers.pending),
+                                             queue='network_copy', drive='')
+        if self.reconciler is not None:
+            metrics.QUEUE_DEPTH.set_function(lambda: len(self.reconciler.pending),
+                                             queue='metadata_reconcile', drive='')
+        metrics.start_metrics_server(self.config)
+    
+    def open_reconciler(self):
+        """Background worker (shared by all drives) that renames placeholder rips"""
+        settings = self.config.get('metadata_reconcile', {})
+        if not settings.get('enabled', True):
+            return None
+        return MetadataReconciler.shared(
+            default_state_path(self.config), self.lookup_musicbrainz_many, self.reconciled_layout,
+            connectivity=self.connectivity,
+            interval=settings.get('interval_minutes', 15) * 60,
+            # Never move an album the journal says is still being ripped
+            is_busy=lambda disc_id: self.journal is not None and self.journal.pending(disc_id) is not None,
+            on_moved=self.album_moved)
+    
+    def start_metadata_reconciler(self):
+        """Queue every placeholder album on disk and start resolving them"""
+        if self.reconciler is None:
+            return
+        added = self.reconciler.scan(self.config.get('output_dir', '/mnt/MUSIC'))
+        if self.reconciler.pending:
+            logging.info(f"{len(self.reconciler.pending)} albums waiting for metadata "
+                         f"({added} found on disk)")
+        self.reconciler.start()
+    
+    def reconciled_layout(self, info, data):
+        """Album layout for a placeholder rip from a MusicBrainz response, or None"""
+        metadata = {'disc_id': info['disc_id'], 'freedb_id': info.get('freedb_id'),
+                    'artist': None, 'album': None, 'tracks': [], 'source': None}
+        self.apply_musicbrainz_release(metadata, data)
+        if not (metadata['artist'] and metadata['album']):
+            return None
+        return self.album_layout(metadata)
+    
+    def current_probe(self):
+        """Probe for the disc in the drive, computed once per insertion
+        
+        Reuses the probe saved by trigger-rip.sh when it is still valid,
+        otherwise reads drive status and TOC in a single ioctl session.
+        """
+        if self.probe is not None and self.probe.valid:
+            return self.probe
+        
+        probe = load_saved_probe(self.device, self.config.get('probe_max_age', 300))
+        if probe:
+            logging.info(f"Reusing disc probe from trigger: {probe}")
+        else:
+            start = time.time()
+            try:
+                probe = probe_disc(self.device, wait=self.config.get('media_ready_timeout', 30),
+                                   inserted_at=self._media_inserted_at)
+                logging.info(f"Probed disc in {(time.time() - start) * 1000:.1f}ms: {probe}")
+            except OSError as e:
+                logging.warning(f"ioctl probe unavailable ({e})")
+                probe = DiscProbe(self.device, 'unknown', inserted_at=self._media_inserted_at)
+        
+        self.probe = probe
+        return probe
+    
+    def drop_probe(self):
+        """Forget the current disc (media changed or ejected)"""
+        if self.probe is not None:
+            self.probe.invalidate()
+        self.probe = None
+        discard_saved_probe(self.device)
+    
+    def get_disc_type(self, probe=None):
         """Determine if the disc is audio CD or data/DVD with enhanced detection"""
         try:
             logging.info("Determining disc type...")
             
-            # Check for audio CD first with cd-discid
-            try:
-                result = subprocess.run(['cd-discid', self.device], 
-                                      capture_output=True, text=True, timeout=15)
-                if result.returncode == 0:
-                    logging.info(f"Audio CD detected via cd-discid: {result.stdout.strip()}")
-                    return 'audio_cd'
-                else:
-                    logging.warning(f"cd-discid failed: return code {result.returncode}, stderr: {result.stderr[:100]}")
-            except subprocess.TimeoutExpired:
-                logging.warning("cd-discid timed out")
-            except Exception as e:
-                logging.warning(f"cd-discid error: {e}")
+            # Native probe: drive status and TOC in one open, no external tools
+            probe = probe or self.current_probe()
+            if probe.disc_type in ('audio_cd', 'mixed_cd', 'data_disc'):
+                track_count = probe.toc.track_count if probe.toc else 0
+                logging.info(f"Disc classified as {probe.disc_type} via ioctl probe ({track_count} tracks)")
+                return probe.disc_type
+            if probe.disc_type == 'no_disc':
+                logging.error("No disc in drive")
+                return 'unknown'
+            logging.warning(f"ioctl probe inconclusive ({probe.disc_type}), trying external tools")
             
             # Try cdparanoia as alternative audio CD detection
+            # (cd-discid is skipped: it uses the same TOC ioctls that just failed)
             try:
-                result = subprocess.run(['cdparanoia', '-Q', '-d', self.device], 
-                                      capture_output=True, text=True, timeout=15)
+                with tracing.span('disc_type.cdparanoia'):
+                    result = subprocess.run(['cdparanoia', '-Q', '-d', self.device], 
+                                          capture_output=True, text=True, timeout=15)
                 if result.returncode == 0:
                     logging.info("Audio CD detected via cdparanoia")
                     return 'audio_cd'
@@ -155,8 +351,9 @@ class AutoRipper:
             
             # Check for data disc/DVD
             try:
-                result = subprocess.run(['file', '-s', self.device], 
-                                      capture_output=True, text=True, timeout=10)
+                with tracing.span('disc_type.file'):
+                    result = subprocess.run(['file', '-s', self.device], 
+                                          capture_output=True, text=True, timeout=10)
                 if 'ISO 9660' in result.stdout or 'UDF' in result.stdout:
                     logging.info("Data disc detected")
                     return 'data_disc'
@@ -165,8 +362,9 @@ class AutoRipper:
             
             # Try blkid as alternative data disc detection
             try:
-                result = subprocess.run(['blkid', self.device], 
-                                      capture_output=True, text=True, timeout=10)
+                with tracing.span('disc_type.blkid'):
+                    result = subprocess.run(['blkid', self.device], 
+                                          capture_output=True, text=True, timeout=10)
                 if result.returncode == 0:
                     logging.info("Data disc detected via blkid")
                     return 'data_disc'
@@ -175,8 +373,9 @@ class AutoRipper:
             
             # Final check - if media is present but type unknown, default to audio_cd
             try:
-                result = subprocess.run(['dd', f'if={self.device}', 'of=/dev/null', 'bs=2048', 'count=1'], 
-                                      capture_output=True, text=True, timeout=10)
+                with tracing.span('disc_type.dd'):
+                    result = subprocess.run(['dd', f'if={self.device}', 'of=/dev/null', 'bs=2048', 'count=1'], 
+                                          capture_output=True, text=True, timeout=10)
                 if result.returncode == 0:
                     logging.warning("Media detected but type unknown - defaulting to audio_cd")
                     return 'audio_cd'  # Default to audio CD if media is present
@@ -190,101 +389,155 @@ class AutoRipper:
             logging.error(f"Error determining disc type: {e}")
             return 'unknown'
     
-    def get_disc_metadata(self):
+    def get_disc_metadata(self, probe=None):
         """Get disc metadata using multiple methods"""
         metadata = {
             'disc_id': None,
+            'freedb_id': None,
             'artist': None,
             'album': None,
-            'tracks': []
+            'tracks': [],
+            'source': None
         }
         
         try:
-            # Get disc ID
-            result = subprocess.run(['cd-discid', self.device], 
-                                  capture_output=True, text=True, timeout=10)
-            if result.returncode == 0:
-                disc_info = result.stdout.strip().split()
-                if len(disc_info) > 0:
-                    metadata['disc_id'] = disc_info[0]
-                    logging.info(f"Disc ID: {metadata['disc_id']}")
+            # Disc IDs come from the TOC read once by the probe
+            probe = probe or self.current_probe()
+            toc = probe.toc
+            if probe.disc_id:
+                metadata['disc_id'] = probe.disc_id
+                metadata['freedb_id'] = probe.freedb_id
+                logging.info(f"Disc ID: {metadata['disc_id']} (freedb: {metadata['freedb_id']})")
+            else:
+                logging.warning("No audio TOC available, cannot compute disc ID")
             
-            # Try MusicBrainz lookup if we have internet
-            if metadata['disc_id'] and self.test_internet_connection():
-                try:
-                    import urllib.request
-                    import json
-                    
-                    url = f"https://musicbrainz.org/ws/2/discid/{metadata['disc_id']}?inc=recordings+artist-credits&fmt=json"
-                    logging.info(f"Querying MusicBrainz: {url}")
-                    
-                    with urllib.request.urlopen(url, timeout=15) as response:
-                        data = json.loads(response.read().decode())
-                        
-                        if 'releases' in data and len(data['releases']) > 0:
-                            release = data['releases'][0]
-                            
-                            # Extract artist
-                            if 'artist-credit' in release:
-                                artist_names = [ac['name'] for ac in release['artist-credit'] if 'name' in ac]
-                                if artist_names:
-                                    metadata['artist'] = ', '.join(artist_names)
-                            
-                            # Extract album
-                            if 'title' in release:
-                                metadata['album'] = release['title']
-                            
-                            logging.info(f"MusicBrainz metadata: {metadata['artist']} - {metadata['album']}")
-                            
-                except Exception as e:
-                    logging.warning(f"MusicBrainz lookup failed: {e}")
+            if metadata['disc_id']:
+                data = self.lookup_musicbrainz(metadata['disc_id'], toc)
+                if data:
+                    self.apply_musicbrainz_release(metadata, data)
             
         except Exception as e:
             logging.error(f"Error getting disc metadata: {e}")
         
         return metadata
     
-    def check_for_file_collisions(self, disc_id):
+    def lookup_musicbrainz(self, disc_id, toc):
+        """MusicBrainz response for disc_id, from the local cache, the offline
+        index or the network
+        
+        Returns None if the disc is unknown or the lookup failed.
+        """
+        return self.lookup_musicbrainz_many({disc_id: toc}).get(disc_id)
+    
+    def lookup_musicbrainz_many(self, discs):
+        """Responses for {disc_id: toc}: cache and offline index first, then one
+        rate-limited batch over the network for the rest
+        
+        Discs that are unknown or could not be looked up map to None.
+        """
+        results = {}
+        remote = {}
+        for disc_id, toc in discs.items():
+            with tracing.span('metadata.local'):
+                known, data = self.lookup_local(disc_id, toc)
+            if known:
+                results[disc_id] = data
+            else:
+                remote[disc_id] = toc
+        
+        # Try MusicBrainz lookup if we have internet
+        if remote and not self.test_internet_connection():
+            logging.info("Offline, skipping MusicBrainz lookup")
+        elif remote:
+            with tracing.span('metadata.musicbrainz', discs=len(remote)):
+                answers = self.musicbrainz.lookup_many(
+                    {disc_id: toc.musicbrainz_toc if toc is not None else None
+                     for disc_id, toc in remote.items()})
+            for disc_id, data in answers.items():
+                if data is None:
+                    logging.info(f"Disc {disc_id} not found on MusicBrainz")
+                # Only real answers are cached; failed lookups are retried next time
+                if self.metadata_cache is not None:
+                    self.metadata_cache.put(disc_id, data)
+                results[disc_id] = data
+        return {disc_id: results.get(disc_id) for disc_id in discs}
+    
+    def lookup_local(self, disc_id, toc):
+        """(True, response) if the cache or the offline index knows the disc
+        (response is None for a cached "not found"), else (False, None)"""
+        cache = self.metadata_cache
+        if cache is not None:
+            entry = cache.get(disc_id)
+            if entry is not None:
+                if entry.data is None:
+                    logging.info(f"Metadata cache: disc {disc_id} known to be missing from MusicBrainz")
+                else:
+                    logging.info(f"Metadata cache hit for disc {disc_id}")
+                return True, entry.data
+        
+        # Offline mirror index: exact disc ID first, then a fuzzy TOC match
+        if self.mb_index is not None:
+            try:
+                data = self.mb_index.lookup(disc_id)
+                if data is None and toc is not None:
+                    _, offsets, leadout = toc.audio_session
+                    data = self.mb_index.lookup_toc(len(offsets), leadout, offsets)
+                if data:
+                    logging.info(f"Offline MusicBrainz index hit for disc {disc_id}")
+                    return True, data
+            except Exception as e:
+                logging.warning(f"Offline MusicBrainz index lookup failed: {e}")
+        return False, None
+    
+    def apply_musicbrainz_release(self, metadata, data):
+        """Fill metadata from the first release of a MusicBrainz discid response"""
+        release = release_metadata(data, metadata['disc_id'])
+        for key in ('artist', 'album', 'date'):
+            if release[key]:
+                metadata[key] = release[key]
+        # Full track listing of the medium carrying this disc ID
+        metadata['tracks'] = release['tracks']
+        metadata['source'] = 'musicbrainz'
+        logging.info(f"MusicBrainz metadata: {metadata['artist']} - {metadata['album']} "
+                     f"({len(release['tracks'])} tracks)")
+    
+    def already_in_library(self, probe):
+        """Whether the disc is fully ripped already and library_catalog.duplicates says to skip it"""
+        if not probe.disc_id or self.catalog is None:
+            return False
+        existing = self.catalog.albums_for_disc(probe.disc_id, complete_only=True)
+        if not existing:
+            return False
+        where = f"{existing[0]['path']}{f' (+{len(existing) - 1} more)' if len(existing) > 1 else ''}"
+        if duplicate_policy(self.config) == 'skip':
+            logging.info(f"Disc already in the library at {where}, skipping (library_catalog.duplicates = skip)")
+            return True
+        logging.warning(f"Disc already in the library at {where}, ripping another copy")
+        return False
+    
+    def check_for_file_collisions(self, probe):
         """Check if ripping this disc would overwrite existing files and create unique naming"""
         try:
+            logging.info(f"Checking for file collisions (disc ID: {probe.disc_id or 'unknown'})")
             output_dir = self.config.get('output_dir', '/mnt/MUSIC')
             
-            # Find the next available unique directory name
-            unique_artist = "Unknown_Artist"
-            unique_album = "Unknown_Album"
-            counter = 1
-            
-            # Check if base names exist and find next available
-            base_artist_path = os.path.join(output_dir, unique_artist)
-            if os.path.exists(base_artist_path):
-                logging.info(f"Base artist directory exists: {base_artist_path}")
-                
-                # Find next available number
-                while os.path.exists(os.path.join(output_dir, f"{unique_artist}_{counter:02d}")):
-                    counter += 1
-                
-                unique_artist = f"{unique_artist}_{counter:02d}"
-                unique_album = f"Unknown_Album_{counter:02d}"
+            # Next available unique directory names (catalog lookups, not directory scans)
+            unique_artist = self.unique_name(output_dir, "Unknown_Artist")
+            # Numbered artists get the matching album number: Unknown_Artist_03/Unknown_Album_03
+            unique_album = "Unknown_Album" + unique_artist[len("Unknown_Artist"):]
+            if unique_artist != "Unknown_Artist":
                 logging.info(f"Using unique naming: {unique_artist}/{unique_album}")
             
+            album_name = self.unique_name(os.path.join(output_dir, unique_artist), unique_album)
+            if album_name != unique_album:
+                logging.warning(f"Album directory exists: {os.path.join(output_dir, unique_artist, unique_album)}")
+                logging.info(f"Using unique album name: {album_name}")
+                unique_album = album_name
+            
             # Update the config to use unique naming
             self.config['unique_artist'] = unique_artist
             self.config['unique_album'] = unique_album
             
-            # Check if the specific album directory exists
-            album_path = os.path.join(output_dir, unique_artist, unique_album)
-            if os.path.exists(album_path):
-                logging.warning(f"Album directory exists: {album_path}")
-                
-                # Find next available album number
-                album_counter = 1
-                while os.path.exists(os.path.join(output_dir, unique_artist, f"{unique_album}_{album_counter:02d}")):
-                    album_counter += 1
-                
-                unique_album = f"{unique_album}_{album_counter:02d}"
-                self.config['unique_album'] = unique_album
-                logging.info(f"Using unique album name: {unique_album}")
-            
             logging.info(f"No file collisions detected - will use unique naming: {unique_artist}/{unique_album}")
             return True
             
@@ -294,26 +547,21 @@ class AutoRipper:
             return False
     
     def test_internet_connection(self):
-        """Test if internet connection is available"""
-        try:
-            requests.get("https://www.google.com", timeout=5)
-            return True
-        except:
-            return False
+        """Whether the metadata endpoints are reachable (cached state, never blocks)"""
+        return self.connectivity.is_online()
     
-    def rip_audio_cd(self):
-        """Rip audio CD using abcde with enhanced metadata handling"""
+    def rip_audio_cd(self, probe=None):
+        """Rip audio CD with the native pipeline (or abcde, see rip_engine)"""
         logging.info("Starting audio CD rip...")
+        probe = probe or self.current_probe()
+        if self.already_in_library(probe):
+            return True
         
-        # Pre-fetch metadata for logging and verification
-        metadata = self.get_disc_metadata()
-        if metadata['disc_id']:
-            logging.info(f"Pre-rip metadata check: Disc ID {metadata['disc_id']}")
-            if metadata['artist'] and metadata['album']:
-                logging.info(f"Expected output: {metadata['artist']} - {metadata['album']}")
+        # Metadata is looked up while the disc is read; only naming waits for it
+        metadata = self.prefetch_metadata(probe)
         
-        # Check if another rip is already in progress
-        lockfile = "/tmp/auto-ripper.lock"
+        # Check if another rip is already in progress on this drive
+        lockfile = self.lockfile
         if os.path.exists(lockfile):
             # Check if the process is still running
             try:
@@ -333,8 +581,9 @@ class AutoRipper:
                     pass
         
         # CRITICAL: Check for potential file collisions before ripping
-        disc_id = metadata.get('disc_id', 'unknown')
-        if not self.check_for_file_collisions(disc_id):
+        with tracing.span('collision_check'):
+            collision_free = self.check_for_file_collisions(probe)
+        if not collision_free:
             logging.error("Potential file collision detected - aborting rip to prevent data loss")
             return False
         
@@ -343,44 +592,10 @@ class AutoRipper:
             with open(lockfile, 'w') as f:
                 f.write(str(os.getpid()))
             
-            # Try online metadata first
-            logging.info("Attempting online metadata retrieval...")
-            result = subprocess.run(['abcde', '-d', self.device, '-c', '/opt/auto-ripper/abcde.conf'], 
-                                  capture_output=True, text=True, timeout=3600)  # 1 hour timeout
-            
-            if result.returncode == 0:
-                logging.info("Online rip completed successfully")
-                return True
-            else:
-                logging.warning("Online rip failed, checking for errors...")
-                
-                # Check if it's a metadata/network error
-                stderr_lower = result.stderr.lower()
-                if any(error in stderr_lower for error in ['timeout', 'connection', 'network', 'lookup', 'cddb']):
-                    logging.warning("Network/metadata error detected, retrying in offline mode")
-                    
-                    # Try offline mode
-                    logging.info("Retry command: abcde -d /dev/sr0 -c /opt/auto-ripper/abcde-offline.conf")
-                    result = subprocess.run(['abcde', '-d', self.device, '-c', '/opt/auto-ripper/abcde-offline.conf'], 
-                                          capture_output=True, text=True, timeout=3600)
-                    
-                    if result.returncode == 0:
-                        logging.info("Offline rip completed successfully")
-                        # Try to fix metadata for offline rips
-                        self.fix_offline_metadata()
-                        return True
-                    else:
-                        logging.error("Offline rip also failed")
-                        logging.error(f"Full stderr: {result.stderr}")
-                        return False
-                else:
-                    logging.error(f"Error ripping audio CD (return code: {result.returncode})")
-                    logging.error(f"Full stderr: {result.stderr}")
-                    return False
+            if self.config.get('rip_engine', 'pipeline') == 'abcde':
+                return self.rip_with_abcde(probe, metadata)
+            return self.rip_with_pipeline(probe, metadata)
                     
-        except subprocess.TimeoutExpired:
-            logging.error("Rip process timed out after 1 hour")
-            return False
         except Exception as e:
             logging.error(f"Unexpected error during rip: {e}")
             return False
@@ -392,35 +607,256 @@ class AutoRipper:
             except:
                 pass
     
+    def prefetch_metadata(self, probe):
+        """Start resolving the disc's metadata (cache, index, network) in the background
+        
+        Returns a Future of the get_disc_metadata() dict.
+        """
+        parent = tracing.current()
+        
+        def lookup():
+            set_drive_context(self.device)
+            with tracing.span('metadata', parent=parent) as span:
+                metadata = self.get_disc_metadata(probe)
+                span.set(source=metadata.get('source'))
+            if metadata['artist'] and metadata['album']:
+                logging.info(f"Expected output: {metadata['artist']} - {metadata['album']}")
+            return metadata
+        return self.metadata_executor.submit(lookup)
+    
+    def rip_with_abcde(self, probe, metadata):
+        """Legacy rip: abcde reads, encodes and tags
+        
+        The disc is read exactly once. abcde keeps the WAVs and a status file
+        in its abcde.<freedb id> work directory, so the read runs on its own
+        and the metadata, encode and tag stages resume from there with -C. A
+        failed lookup only reruns those stages with the offline config.
+        metadata (the prefetch Future) is only needed after the read.
+        """
+        online_conf = '/opt/auto-ripper/abcde.conf'
+        offline_conf = '/opt/auto-ripper/abcde-offline.conf'
+        
+        track_count = len(probe.toc.audio_tracks) if probe.toc else None
+        if not probe.freedb_id:
+            logging.warning("No disc ID for a staged abcde run, ripping in one pass")
+            conf = online_conf if metadata.result().get('source') else offline_conf
+            with self.encoder_slots:
+                result = self.run_tool(['abcde', '-d', self.device, '-c', conf], 3600,
+                                       AbcdeProgress(track_count), CdparanoiaProgress(), phase='abcde')
+            if not result.ok:
+                logging.error(f"Error ripping audio CD ({result.describe()})")
+                logging.error(f"Last output: {result.output}")
+            return result.ok
+        
+        logging.info("Reading disc with abcde...")
+        result = self.run_tool(['abcde', '-d', self.device, '-c', online_conf, '-a', 'read'],
+                               3600, AbcdeProgress(track_count), CdparanoiaProgress(),
+                               phase='abcde.read')  # 1 hour timeout
+        if not result.ok:
+            logging.error(f"Error reading audio CD ({result.describe()})")
+            logging.error(f"Last output: {result.output}")
+            return False
+        
+        # No point letting abcde query the network when our own lookup failed
+        with tracing.span('metadata.wait'):
+            conf = online_conf if metadata.result().get('source') else offline_conf
+        stages = 'encode,tag,move,clean'
+        with self.encoder_slots:
+            result = self.run_tool(['abcde', '-C', probe.freedb_id, '-c', conf, '-a',
+                                    stages if conf == offline_conf else f"cddb,{stages}"],
+                                   3600, AbcdeProgress(track_count), phase='abcde.encode')
+        
+        if result.ok:
+            logging.info("Rip completed successfully")
+            if conf == offline_conf:
+                self.fix_offline_metadata(probe)
+            return True
+        
+        # Check if it's a metadata/network error
+        output_lower = result.output.lower()
+        if conf == online_conf and not result.timed_out and any(
+                error in output_lower for error in ['timeout', 'connection', 'network', 'lookup', 'cddb']):
+            logging.warning("Network/metadata error detected, finishing from the extracted audio "
+                            "in offline mode (no re-read)")
+            with self.encoder_slots:
+                result = self.run_tool(['abcde', '-C', probe.freedb_id, '-c', offline_conf,
+                                        '-a', stages], 3600, AbcdeProgress(track_count),
+                                       phase='abcde.encode_offline')
+            if result.ok:
+                logging.info("Offline rip completed successfully")
+                # Try to fix metadata for offline rips
+                self.fix_offline_metadata(probe)
+                return True
+            logging.error(f"Offline rip also failed ({result.describe()})")
+        else:
+            logging.error(f"Error ripping audio CD ({result.describe()})")
+        logging.error(f"Last output: {result.output}")
+        return False
+    
+    def fix_offline_metadata(self, probe):
+        """Record an offline abcde rip so the reconciler can name and tag it later"""
+        output_dir = self.config.get('output_dir', '/mnt/MUSIC')
+        # abcde-offline.conf names albums CD_<freedb id>/Disc_<freedb id>_<date>,
+        # or Unknown_Artist_01/Unknown_Album_01 without cd-discid
+        candidates = glob.glob(os.path.join(output_dir, f"CD_{probe.freedb_id}", f"Disc_{probe.freedb_id}_*"))
+        candidates += glob.glob(os.path.join(output_dir, 'Unknown_Artist_01', 'Unknown_Album_01'))
+        candidates = [path for path in candidates if read_disc_info(path) is None]
+        if not candidates or probe.toc is None:
+            logging.warning("Offline rip directory not found, it will keep its placeholder names")
+            return
+        album_dir = max(candidates, key=os.path.getmtime)
+        write_disc_info(album_dir, disc_info(probe.toc, self.config.get('formats', ['flac', 'mp3']), None))
+        self.catalog_album(album_dir)
+        if self.reconciler is not None:
+            self.reconciler.add(album_dir)
+    
+    def rip_with_pipeline(self, probe, metadata):
+        """Extract with the native pipeline
+        
+        Returns once every track has been read, so the disc can be ejected;
+        encoding carries on in the background and reports through
+        encoding_finished(). metadata is the prefetch Future; reading does
+        not wait for it.
+        """
+        if probe.toc is None or not probe.toc.audio_tracks:
+            logging.error("No audio TOC available, cannot rip with the native pipeline")
+            return False
+        
+        # An interrupted rip of this disc is finished in place
+        layout = self.pipeline.resumable_layout(probe.disc_id)
+        if layout is None:
+            # Reading starts now; the names follow once the lookup is done
+            layout = Future()
+            
+            def resolved(done):
+                try:
+                    layout.set_result(self.album_layout(done.result()))
+                except Exception as e:
+                    logging.error(f"Could not name album from metadata: {e}")
+                    layout.set_result(self.album_layout({}))
+            metadata.add_done_callback(resolved)
+        tracks = probe.toc.audio_tracks
+        logging.info(f"Extracting {len(tracks)} tracks")
+        with tracing.span('extract', tracks=len(tracks)):
+            job = self.pipeline.extract(self.device, tracks, layout, probe.disc_id, probe.toc)
+        
+        # Names may be placeholders: record the disc so tagging can be redone later
+        with tracing.span('metadata.wait'):
+            metadata = metadata.result()
+        if read_disc_info(job.layout.album_dir) is None:
+            named = job.layout.artist == metadata.get('artist')
+            write_disc_info(job.layout.album_dir, disc_info(probe.toc, self.pipeline.formats,
+                                                            metadata.get('source') if named else None,
+                                                            job.checksums))
+        
+        if job.read_failed:
+            logging.error(f"Extraction stopped at track {job.read_failed[0]}")
+        self.rip_jobs.append(job)
+        job.add_done_callback(self.encoding_finished)
+        return not job.read_failed
+    
+    def album_layout(self, metadata):
+        """Output naming for a disc: MusicBrainz names, else the unique fallback names"""
+        output_dir = self.config.get('output_dir', '/mnt/MUSIC')
+        naming = self.config.get('naming', {})
+        artist = metadata.get('artist') or self.config.get('unique_artist', 'Unknown_Artist')
+        album = metadata.get('album') or self.config.get('unique_album', 'Unknown_Album')
+        titles = {track['number']: track['title'] for track in metadata.get('tracks', [])}
+        layout = AlbumLayout(output_dir, artist, album, titles, metadata.get('date'),
+                             naming.get('cd_format', DEFAULT_CD_FORMAT),
+                             naming.get('sanitize_filenames', True))
+        
+        # Never write into an existing album directory. The placeholder
+        # names were already reserved by check_for_file_collisions()
+        if metadata.get('artist') or metadata.get('album'):
+            parent, base = os.path.split(layout.album_dir)
+            name = self.unique_name(parent, base)
+            if name != base:
+                layout.album = album + name[len(base):]
+                logging.info(f"Album directory exists, using unique album name: {layout.album}")
+        return layout
+    
+    def encoding_finished(self, job):
+        """Called from the encoder pool once every track of a rip is encoded"""
+        if job in self.rip_jobs:
+            self.rip_jobs.remove(job)
+        duration = job.finished_at - job.started_at
+        if job.succeeded:
+            logging.info(f"Encoding finished for {job.layout.album_dir} ({duration:.0f}s total, "
+                         f"drive released after {job.extracted_at - job.started_at:.0f}s)",
+                         extra={'event': 'encoded', 'disc': job.disc_id, 'duration': round(duration, 1)})
+            self.send_notification(f"Encoding finished: {job.layout.artist} - {job.layout.album}")
+            self.catalog_album(job.layout.album_dir)
+            if self.transfers is not None:
+                self.transfers.enqueue(job.layout.album_dir)
+            if self.reconciler is not None:
+                self.reconciler.add(job.layout.album_dir)
+        else:
+            logging.error(f"Rip of {job.layout.album_dir} incomplete: read failures {job.read_failed}, "
+                          f"encode failures {job.encode_failed}")
+            self.send_notification(f"Encoding incomplete: {job.layout.artist} - {job.layout.album}")
+    
+    def resume_interrupted_rips(self):
+        """Finish encoding rips cut short by a crash or power loss"""
+        for job in self.pipeline.resume_pending():
+            self.rip_jobs.append(job)
+            job.add_done_callback(self.encoding_finished)
+    
+    def wait_for_background_work(self):
+        """Block until every background encode (and the network copies it queued) has finished"""
+        for job in list(self.rip_jobs):
+            job.wait()
+        if self.transfers is not None:
+            # Albums that can't be copied now stay queued for the next run
+            self.transfers.wait_idle()
+    
     def rip_dvd(self):
         """Rip DVD using handbrake-cli"""
         logging.info("Starting DVD rip...")
         
         try:
             # Use handbrake-cli for DVD ripping
-            output_file = f"/tmp/dvd_rip_{int(time.time())}.mkv"
-            result = subprocess.run(['handbrake-cli', '-i', self.device, '-o', output_file, '--preset', 'Fast 1080p30'], 
-                                  capture_output=True, text=True, timeout=7200)  # 2 hour timeout
+            output_file = f"/tmp/dvd_rip_{self.drive_name}_{int(time.time())}.mkv"
+            with self.encoder_slots:
+                result = self.run_tool(['handbrake-cli', '-i', self.device, '-o', output_file,
+                                        '--preset', 'Fast 1080p30'], 7200, HandBrakeProgress())  # 2 hour timeout
             
-            if result.returncode == 0:
-                logging.info("DVD rip completed successfully")
+            if result.ok:
+                logging.info(f"DVD rip completed successfully ({result.duration / 60:.0f} min)")
                 return True
             else:
-                logging.error(f"Error ripping DVD (return code: {result.returncode})")
-                logging.error(f"Full stderr: {result.stderr}")
+                logging.error(f"Error ripping DVD ({result.describe()})")
+                logging.error(f"Last output: {result.output}")
                 return False
                 
-        except subprocess.TimeoutExpired:
-            logging.error("DVD rip process timed out after 2 hours")
-            return False
         except Exception as e:
             logging.error(f"Unexpected error during DVD rip: {e}")
             return False
     
+    def run_tool(self, args, timeout, *parsers, phase=None):
+        """Run a long external tool with streamed output, progress reports and group kill on timeout"""
+        self.progress = None
+        try:
+            with tracing.span(phase or os.path.basename(args[0])) as span:
+                result = aio.run_command(args, timeout, parsers, on_progress=self.report_progress)
+                span.set(ok=result.ok)
+                return result
+        finally:
+            self.progress = None
+    
+    def report_progress(self, event):
+        """Keep the latest progress of the running tool and log every 10%"""
+        previous = self.progress
+        self.progress = event
+        step = int(event.fraction * 10)
+        if previous is None or previous.tool != event.tool or int(previous.fraction * 10) != step:
+            logging.info(f"{event.tool}: {event.fraction:.0%} ({event.detail})")
+    
     def eject_disc(self):
         """Eject the disc from the drive"""
         try:
-            result = subprocess.run(['eject', self.device], capture_output=True, text=True, timeout=10)
+            with tracing.span('eject'):
+                result = subprocess.run(['eject', self.device], capture_output=True, text=True, timeout=10)
             if result.returncode == 0:
                 logging.info("Disc ejected")
             else:
@@ -432,51 +868,182 @@ class AutoRipper:
         """Send a notification (placeholder for future implementation)"""
         logging.info(f"Notification: {message}")
     
-    def wait_for_disc(self):
-        """Wait for a disc to be inserted with intelligent logging"""
-        logging.info("Waiting for disc insertion...")
+    def get_media_monitor(self):
+        """Kernel uevent monitor for this drive, or None to fall back to polling"""
+        if self.config.get('disc_detection', 'uevent') != 'uevent':
+            return None
+        if self._media_monitor is None and not self._media_monitor_failed:
+            try:
+                self._media_monitor = UeventMonitor()
+                ensure_kernel_polling(self.drive_name)
+                logging.info("Using kernel uevents for disc detection")
+            except OSError as e:
+                self._media_monitor_failed = True
+                logging.warning(f"uevent monitor unavailable ({e}), falling back to polling")
+        return self._media_monitor
+    
+    def wait_for_media_ready(self, timeout, stop_event=None):
+        """Wait up to timeout seconds for freshly inserted media to become readable"""
+        deadline = time.time() + timeout
+        while not (stop_event and stop_event.is_set()):
+            if self.is_disc_present():
+                return True
+            if time.time() >= deadline:
+                return False
+            if self.get_drive_status() in (cdrom.CDS_NO_DISC, cdrom.CDS_TRAY_OPEN):
+                return False  # Media was removed, not inserted
+            time.sleep(1)
+        return False
+    
+    def wait_for_disc(self, stop_event=None):
+        """Wait for a disc to be inserted with intelligent logging
+        
+        Sleeps on kernel media change uevents when available and only
+        touches the drive when the kernel reports new media, with a slow
+        poll as a safety net. Falls back to 1-second polling otherwise.
+        Returns True once a disc is present, or False if stop_event is set.
+        """
+        logging.info(f"Waiting for disc insertion in {self.device}...")
         
         # Track how long we've been waiting to reduce log spam
         wait_start_time = time.time()
         last_log_time = wait_start_time
         log_interval = self.config.get('log_wait_interval', 30)  # Configurable interval
+        fallback_interval = self.config.get('poll_fallback_interval', 60)
+        ready_timeout = self.config.get('media_ready_timeout', 30)
         
-        while True:
+        monitor = self.get_media_monitor()
+        if monitor:
+            monitor.drain()
+        last_check_time = wait_start_time
+        check_now = True  # A disc may already be in the drive
+        media_changed = False
+        
+        while not (stop_event and stop_event.is_set()):
             current_time = time.time()
             
-            if self.is_disc_present():
-                time.sleep(2)  # Give it a moment to settle
-                if self.is_disc_present():  # Double-check
+            if check_now:
+                last_check_time = current_time
+                if self.wait_for_media_ready(ready_timeout if media_changed else 0, stop_event):
                     wait_duration = current_time - wait_start_time
                     if wait_duration > 5:  # Only log if we waited more than 5 seconds
                         logging.info(f"Disc detected after waiting {wait_duration:.1f} seconds")
                     return True
+            
+            # Only log periodically to reduce spam
+            if current_time - last_log_time >= log_interval:
+                wait_duration = current_time - wait_start_time
+                logging.info(f"Still waiting for disc... ({wait_duration:.0f}s elapsed)")
+                last_log_time = current_time
+            
+            if monitor:
+                # Short select() timeout keeps stop_event responsive without forking
+                media_changed = monitor.wait_for_media_change(self.drive_name, timeout=1.0)
+                if media_changed:
+                    self.drop_probe()
+                    self._media_inserted_at = time.time()
+                check_now = media_changed or (
+                    fallback_interval > 0 and time.time() - last_check_time >= fallback_interval)
             else:
-                # Only log periodically to reduce spam
-                if current_time - last_log_time >= log_interval:
+                time.sleep(1)
+                check_now = True
+        
+        return False
+    
+    async def wait_for_media_ready_async(self, core, timeout):
+        """wait_for_media_ready() on the event loop; drive ioctls run in the core's executor"""
+        deadline = time.time() + timeout
+        while True:
+            if await core.run_blocking(self.is_disc_present):
+                return True
+            if time.time() >= deadline:
+                return False
+            if await core.run_blocking(self.get_drive_status) in (cdrom.CDS_NO_DISC, cdrom.CDS_TRAY_OPEN):
+                return False  # Media was removed, not inserted
+            await asyncio.sleep(1)
+    
+    async def wait_for_disc_async(self, core):
+        """wait_for_disc() on the event loop
+        
+        Waits on the core's shared uevent socket (or polls without one)
+        and returns once a disc is present; cancel the task to stop waiting.
+        """
+        logging.info(f"Waiting for disc insertion in {self.device}...")
+        
+        wait_start_time = time.time()
+        last_log_time = wait_start_time
+        log_interval = self.config.get('log_wait_interval', 30)
+        fallback_interval = self.config.get('poll_fallback_interval', 60)
+        ready_timeout = self.config.get('media_ready_timeout', 30)
+        
+        last_check_time = wait_start_time
+        check_now = True  # A disc may already be in the drive
+        media_changed = False
+        
+        while True:
+            current_time = time.time()
+            
+            if check_now:
+                last_check_time = current_time
+                if await self.wait_for_media_ready_async(core, ready_timeout if media_changed else 0):
                     wait_duration = current_time - wait_start_time
-                    logging.info(f"Still waiting for disc... ({wait_duration:.0f}s elapsed)")
-                    last_log_time = current_time
+                    if wait_duration > 5:
+                        logging.info(f"Disc detected after waiting {wait_duration:.1f} seconds")
+                    return True
             
-            time.sleep(1)
+            if current_time - last_log_time >= log_interval:
+                logging.info(f"Still waiting for disc... ({current_time - wait_start_time:.0f}s elapsed)")
+                last_log_time = current_time
+            
+            if core.media is not None:
+                # No select() timeout needed to stay responsive: cancellation ends the wait
+                timeout = log_interval
+                if fallback_interval > 0:
+                    timeout = min(timeout, max(1.0, last_check_time + fallback_interval - time.time()))
+                media_changed = await core.media.wait(self.drive_name, timeout)
+                if media_changed:
+                    self.drop_probe()
+                    self._media_inserted_at = time.time()
+                check_now = media_changed or (
+                    fallback_interval > 0 and time.time() - last_check_time >= fallback_interval)
+            else:
+                await asyncio.sleep(1)
+                check_now = True
+    
+    def process_disc(self, probe=None):
+        """Main disc processing function, traced with a span per phase"""
+        with tracing.span('process_disc', root=True, drive=self.drive_name) as span:
+            started = time.monotonic()
+            success = self._process_disc(probe, span)
+            span.set(ok=success)
+            logging.info(f"Disc processing {'succeeded' if success else 'failed'} "
+                         f"after {time.monotonic() - started:.0f}s",
+                         extra={'event': 'disc_done', 'duration': round(time.monotonic() - started, 1)})
+            return success
     
-    def process_disc(self):
-        """Main disc processing function"""
+    def _process_disc(self, probe, span):
         logging.info("Disc detected, analyzing...")
         
-        # Wait a moment for disc to settle
-        logging.info("Waiting 3 seconds for disc to settle...")
-        time.sleep(3)
+        # The probe waits for the drive to become ready, no fixed settle delay
+        with tracing.span('probe'):
+            probe = probe or self.current_probe()
+        if probe.inserted_at and probe.ready_at:
+            logging.info(f"Disc ready {probe.ready_at - probe.inserted_at:.1f}s after insertion")
+        span.set(disc_id=probe.disc_id)
         
         logging.info("Starting disc type determination...")
-        disc_type = self.get_disc_type()
+        with tracing.span('disc_type') as type_span:
+            disc_type = self.get_disc_type(probe)
+            type_span.set(result=disc_type)
+        span.set(type=disc_type)
         logging.info(f"Disc type determination result: {disc_type}")
         
         success = False
         
-        if disc_type == 'audio_cd':
+        if disc_type in ('audio_cd', 'mixed_cd'):
             logging.info("Processing as audio CD...")
-            success = self.rip_audio_cd()
+            with tracing.span('rip_audio_cd'):
+                success = self.rip_audio_cd(probe)
             if success:
                 self.send_notification("Audio CD ripped successfully")
                 logging.info("Audio CD rip completed successfully")
@@ -486,7 +1053,8 @@ class AutoRipper:
                 
         elif disc_type == 'data_disc':
             logging.info("Processing as data disc/DVD...")
-            success = self.rip_dvd()
+            with tracing.span('rip_dvd'):
+                success = self.rip_dvd()
             if success:
                 self.send_notification("DVD ripped successfully")
                 logging.info("DVD rip completed successfully")
@@ -503,10 +1071,16 @@ class AutoRipper:
             logging.warning("Skipping rip process...")
             self.send_notification("Unknown disc type - check logs for details")
         
+        if disc_type in ('audio_cd', 'mixed_cd', 'data_disc'):
+            metrics.record_disc(self.drive_name, disc_type, 'ok' if success else 'failed')
+        else:
+            metrics.record_disc(self.drive_name, disc_type or 'unknown', 'skipped')
+        
         # Only eject if configured to do so
         if self.config.get('eject_after_rip', True):
             logging.info("Ejecting disc (eject_after_rip = true)")
             self.eject_disc()
+            self.drop_probe()
         else:
             logging.info("Not ejecting disc (eject_after_rip = false)")
         
@@ -531,13 +1105,44 @@ class AutoRipper:
 
 def main():
     if len(sys.argv) > 1 and sys.argv[1] == '--daemon':
-        # Run as daemon (called by systemd or udev)
-        ripper = AutoRipper()
+        # Run as daemon (called by systemd or udev) for a single drive
+        device = sys.argv[2] if len(sys.argv) > 2 else None
+        ripper = AutoRipper(device)
+        ripper.start_network_copy()
         ripper.process_disc()
-    else:
-        # Run interactive mode
-        ripper = AutoRipper()
+        # The disc is already ejected; stay alive until its tracks are encoded
+        ripper.wait_for_background_work()
+    elif len(sys.argv) > 2 and sys.argv[1] == '--device':
+        # Watch a single drive only
+        ripper = AutoRipper(sys.argv[2])
+        ripper.resume_interrupted_rips()
+        ripper.start_library_watcher()
+        ripper.start_metadata_reconciler()
+        ripper.start_network_copy()
+        ripper.start_metrics()
         ripper.run()
+    else:
+        # Supervise every optical drive: one asyncio task per drive on a
+        # shared event loop, or one thread per drive with async_core disabled
+        config = AutoRipper.load_config()
+        core = None
+        if config.get('async_core', {}).get('enabled', True):
+            # Installed first so the background services start on its loop
+            core = aio.AsyncCore.install(config)
+        # One encoder cap for resumed encodes and every drive
+        encoder_slots = EncoderSlots(config.get('encoder_slots'))
+        ripper = AutoRipper(encoder_slots=encoder_slots, services_only=True)
+        ripper.resume_interrupted_rips()
+        ripper.start_library_watcher()
+        ripper.start_metadata_reconciler()
+        ripper.start_network_copy()
+        ripper.start_metrics()
+        factory = lambda device, slots: AutoRipper(device, slots)
+        if core is not None:
+            supervisor = AsyncSupervisor(factory, core, ripper.config, encoder_slots)
+        else:
+            supervisor = Supervisor(factory, ripper.config, encoder_slots)
+        supervisor.run()
 
 if __name__ == "__main__":
     main()
@@ -0,0 +1,7 @@
+"""
+Grim Ripper support package
+
+Native building blocks used by auto-ripper.py (drive supervision, probing,
+metadata, encoding). Modules are imported directly, e.g.
+``from autoripper.supervisor import Supervisor``.
+"""
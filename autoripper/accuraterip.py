@@ -0,0 +1,233 @@
+#!/usr/bin/env python3
+"""
+AccurateRip verification against a local database
+
+Computes CRC32 and AccurateRip v1/v2 checksums on the PCM stream while a
+track is extracted and compares them with the dBAR files of a local
+AccurateRip database (same layout as accuraterip.com/accuraterip/, or all
+files in one directory). A track whose checksum matches any submitted
+pressing is known-good after a single fast read.
+
+Usage: python3 -m autoripper.accuraterip [--db DIR] [/dev/sr0]
+Prints the disc's dBAR file name and any checksums found for it.
+"""
+
+import json
+import logging
+import os
+import struct
+import sys
+import zlib
+from array import array
+from itertools import repeat
+from operator import mul, rshift
+from typing import List, Optional, Tuple
+
+from autoripper.discid import LEAD_IN_FRAMES, Toc, read_toc
+
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+SAMPLES_PER_FRAME = 588
+# AccurateRip ignores the first and last five frames of the disc
+SKIPPED_SAMPLES = 5 * SAMPLES_PER_FRAME
+WAV_HEADER_BYTES = 44
+
+_DBAR_HEADER = struct.Struct('<BIII')
+_DBAR_TRACK = struct.Struct('<BII')
+
+
+def default_database_path(config: dict) -> str:
+    state_dir = config.get('state_dir', '/var/lib/auto-ripper')
+    return config.get('accuraterip', {}).get('database') or os.path.join(state_dir, 'accuraterip')
+
+
+def disc_ids(toc: Toc) -> Tuple[int, int, int, int]:
+    """(track_count, id1, id2, cddb_id) identifying a disc in AccurateRip"""
+    _, offsets, leadout = toc.audio_session
+    id1 = id2 = 0
+    for position, offset in enumerate(offsets, 1):
+        lba = offset - LEAD_IN_FRAMES
+        id1 += lba
+        id2 += max(lba, 1) * position
+    leadout_lba = leadout - LEAD_IN_FRAMES
+    id1 += leadout_lba
+    id2 += leadout_lba * (len(offsets) + 1)
+    return len(offsets), id1 & 0xFFFFFFFF, id2 & 0xFFFFFFFF, int(toc.freedb_id, 16)
+
+
+def dbar_name(toc: Toc) -> str:
+    count, id1, id2, cddb = disc_ids(toc)
+    return f"dBAR-{count:03d}-{id1:08x}-{id2:08x}-{cddb:08x}.bin"
+
+
+def dbar_relative_path(toc: Toc) -> str:
+    """Path of the dBAR file below the database root, as on accuraterip.com"""
+    _, id1, _, _ = disc_ids(toc)
+    return os.path.join(f"{id1 & 0xF:x}", f"{id1 >> 4 & 0xF:x}", f"{id1 >> 8 & 0xF:x}",
+                        dbar_name(toc))
+
+
+class TrackChecksum:
+    """
+    Incremental CRC32 and AccurateRip v1/v2 of one track's PCM
+
+    Fed the raw cdparanoia output chunk by chunk; the WAV header is skipped
+    and samples are 32-bit little-endian stereo words.
+    """
+
+    def __init__(self, total_samples: int, first: bool = False, last: bool = False,
+                 header_bytes: int = WAV_HEADER_BYTES):
+        self.start = SKIPPED_SAMPLES - 1 if first else 0
+        self.end = total_samples - SKIPPED_SAMPLES if last else total_samples
+        self._skip = header_bytes
+        self._pending = b''
+        self._position = 0  # samples seen so far
+        self._v1 = 0
+        self._v2 = 0
+        self.crc32 = 0
+
+    def update(self, data):
+        data = bytes(data)
+        if self._skip:
+            skipped = data[:self._skip]
+            data = data[self._skip:]
+            self._skip -= len(skipped)
+        self.crc32 = zlib.crc32(data, self.crc32)
+        data = self._pending + data
+        usable = len(data) - len(data) % 4
+        self._pending = data[usable:]
+        if usable:
+            self._add_words(data[:usable])
+
+    def _add_words(self, data: bytes):
+        count = len(data) // 4
+        first = self._position
+        self._position += count
+        lo = max(self.start, first)
+        hi = min(self.end, self._position)
+        if lo >= hi:
+            return
+        begin, stop = (lo - first) * 4, (hi - first) * 4
+        if numpy is not None:
+            words = numpy.frombuffer(data[begin:stop], dtype='<u4').astype(numpy.uint64)
+            products = words * numpy.arange(lo + 1, hi + 1, dtype=numpy.uint64)
+            low = int((products & 0xFFFFFFFF).sum(dtype=numpy.uint64))
+            self._v1 += low
+            self._v2 += low + int((products >> 32).sum(dtype=numpy.uint64))
+            return
+        words = array('I')
+        words.frombytes(data[begin:stop])
+        if sys.byteorder == 'big':
+            words.byteswap()
+        products = list(map(mul, words, range(lo + 1, hi + 1)))
+        total = sum(products)
+        high = sum(map(rshift, products, repeat(32)))
+        self._v1 += total
+        self._v2 += total - high * 0xFFFFFFFF
+
+    @property
+    def v1(self) -> int:
+        return self._v1 & 0xFFFFFFFF
+
+    @property
+    def v2(self) -> int:
+        return self._v2 & 0xFFFFFFFF
+
+    def as_dict(self) -> dict:
+        return {'crc32': f"{self.crc32:08x}", 'v1': f"{self.v1:08x}", 'v2': f"{self.v2:08x}"}
+
+
+class DiscChecksums:
+    """Checksums submitted for one disc: per pressing, per track (confidence, crc)"""
+
+    def __init__(self, pressings: List[List[Tuple[int, int]]]):
+        self.pressings = pressings
+
+    @classmethod
+    def parse(cls, data: bytes, track_count: int) -> 'DiscChecksums':
+        pressings = []
+        offset = 0
+        while offset + _DBAR_HEADER.size <= len(data):
+            count, _, _, _ = _DBAR_HEADER.unpack_from(data, offset)
+            offset += _DBAR_HEADER.size
+            tracks = []
+            for _ in range(count):
+                if offset + _DBAR_TRACK.size > len(data):
+                    break
+                confidence, crc, _ = _DBAR_TRACK.unpack_from(data, offset)
+                offset += _DBAR_TRACK.size
+                tracks.append((confidence, crc))
+            if count == track_count and len(tracks) == count:
+                pressings.append(tracks)
+        return cls(pressings)
+
+    def match(self, position: int, checksum: TrackChecksum) -> Optional[Tuple[str, int]]:
+        """('v1'|'v2', confidence) of the best matching submission, or None"""
+        best = None
+        for tracks in self.pressings:
+            confidence, crc = tracks[position - 1]
+            for version, value in (('v2', checksum.v2), ('v1', checksum.v1)):
+                if crc == value and confidence and (best is None or confidence > best[1]):
+                    best = (version, confidence)
+        return best
+
+
+class AccurateRipDatabase:
+    """Directory of dBAR files"""
+
+    def __init__(self, path: str):
+        self.path = path
+
+    @classmethod
+    def from_config(cls, config: dict) -> Optional['AccurateRipDatabase']:
+        if not config.get('accuraterip', {}).get('enabled', True):
+            return None
+        path = default_database_path(config)
+        return cls(path) if os.path.isdir(path) else None
+
+    def lookup(self, toc: Toc) -> Optional[DiscChecksums]:
+        """Submitted checksums for the disc, or None if the database lacks it"""
+        for candidate in (os.path.join(self.path, dbar_relative_path(toc)),
+                          os.path.join(self.path, dbar_name(toc))):
+            try:
+                with open(candidate, 'rb') as f:
+                    data = f.read()
+            except FileNotFoundError:
+                continue
+            checksums = DiscChecksums.parse(data, len(toc.audio_session[1]))
+            if checksums.pressings:
+                return checksums
+            logging.warning(f"AccurateRip file {candidate} has no usable entries")
+        return None
+
+
+def main():
+    args = sys.argv[1:]
+    db_path = None
+    if '--db' in args:
+        index = args.index('--db')
+        db_path = args[index + 1]
+        del args[index:index + 2]
+    device = args[0] if args else '/dev/sr0'
+
+    try:
+        toc = read_toc(device)
+    except (OSError, ValueError) as e:
+        print(f"Could not read TOC from {device}: {e}", file=sys.stderr)
+        sys.exit(1)
+
+    result = {'dbar': dbar_relative_path(toc), 'pressings': None}
+    if db_path:
+        checksums = AccurateRipDatabase(db_path).lookup(toc)
+        if checksums:
+            result['pressings'] = [[{'confidence': confidence, 'crc': f"{crc:08x}"}
+                                    for confidence, crc in tracks]
+                                   for tracks in checksums.pressings]
+    print(json.dumps(result, indent=2))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,443 @@
+"""
+Asyncio execution core
+
+One event loop carries what used to need a thread each: waiting for media
+on every drive, the background services (connectivity, metadata
+reconciliation, library watcher, network copy) and supervision of external
+tools. Blocking work (ioctls, SQLite, HTTP, file copies) runs in a small
+shared executor, and each disc is processed as a cancellable stage in a
+thread of its own that only exists while the disc is being ripped.
+
+Code outside the loop keeps calling plain functions: services hand their
+step() to adopt() instead of starting a thread when a core is running, and
+run_command() routes a tool through the loop so per-tool concurrency
+limits apply across drives and cancelling a stage kills its tools.
+"""
+
+import asyncio
+import contextvars
+import logging
+import os
+import signal
+import threading
+from concurrent.futures import CancelledError, ThreadPoolExecutor
+from typing import Awaitable, Callable, Dict, Iterable, List, Optional
+
+from autoripper import runner
+from autoripper.runner import CommandResult, OutputParser, OutputSink, ProgressEvent
+from autoripper.uevent import UeventMonitor, ensure_kernel_polling, is_media_change
+
+DEFAULT_BLOCKING_WORKERS = 6
+DEFAULT_TOOL_LIMITS = {'handbrake-cli': 1}
+# How long a cancelled stage may take to unwind before shutdown goes on
+STAGE_GRACE = 30
+# How often a sleeping service checks its threading wake event
+WAKE_POLL = 1.0
+# Delay before a service whose step() raised runs again
+SERVICE_RETRY = 60
+
+_core = None
+_core_lock = threading.Lock()
+_stage = contextvars.ContextVar('stage', default=None)
+
+
+class Stage:
+    """A unit of blocking work the loop can cancel, such as processing one disc"""
+
+    def __init__(self, name: str):
+        self.name = name
+        self.cancelled = threading.Event()
+        self._tools = set()
+        self._lock = threading.Lock()
+
+    def cancel(self):
+        """Kill the tools the stage is running and make it skip new ones"""
+        self.cancelled.set()
+        with self._lock:
+            tools = list(self._tools)
+        for future in tools:
+            future.cancel()
+
+
+class ToolLimits:
+    """Per-tool concurrency limits (by executable name), shared by every drive"""
+
+    def __init__(self, limits: Dict[str, int] = None):
+        self.limits = dict(DEFAULT_TOOL_LIMITS if limits is None else limits)
+        self._semaphores: Dict[str, asyncio.Semaphore] = {}
+
+    def semaphore(self, args: List[str]) -> Optional[asyncio.Semaphore]:
+        tool = os.path.basename(args[0])
+        limit = self.limits.get(tool)
+        if not limit:
+            return None
+        if tool not in self._semaphores:
+            self._semaphores[tool] = asyncio.Semaphore(limit)
+        return self._semaphores[tool]
+
+
+class MediaEvents:
+    """
+    One uevent socket on the loop for every drive
+
+    Replaces a UeventMonitor per drive worker. Events arriving while no
+    task waits for that drive (e.g. during a rip) are simply dropped.
+    """
+
+    def __init__(self, loop: asyncio.AbstractEventLoop):
+        self.loop = loop
+        self.monitor = UeventMonitor()
+        self._waiters: Dict[str, List[asyncio.Future]] = {}
+        self._polling = set()
+        loop.add_reader(self.monitor.fileno(), self._readable)
+
+    def _readable(self):
+        for event in self.monitor.read_events():
+            overflow = event.get('ACTION') == 'overflow'
+            for drive_name, waiters in self._waiters.items():
+                if overflow or is_media_change(event, drive_name):
+                    for future in waiters:
+                        if not future.done():
+                            future.set_result(True)
+
+    async def wait(self, drive_name: str, timeout: float) -> bool:
+        """True if drive_name reported a media change (or events were lost) within timeout"""
+        if drive_name not in self._polling:
+            self._polling.add(drive_name)
+            ensure_kernel_polling(drive_name)
+        future = self.loop.create_future()
+        waiters = self._waiters.setdefault(drive_name, [])
+        waiters.append(future)
+        try:
+            return await asyncio.wait_for(future, timeout)
+        except asyncio.TimeoutError:
+            return False
+        finally:
+            waiters.remove(future)
+            if not waiters:
+                del self._waiters[drive_name]
+
+    def close(self):
+        self.loop.remove_reader(self.monitor.fileno())
+        self.monitor.close()
+
+
+class AsyncCore:
+    """
+    The process-wide event loop with its executors and tool limits
+
+    install() makes the core visible to adopt(), run_command() and
+    executor() before the loop runs; run() then drives a main coroutine
+    (usually the drive supervisor) until it returns or the process is
+    stopped with SIGINT/SIGTERM.
+    """
+
+    def __init__(self, blocking_workers: int = DEFAULT_BLOCKING_WORKERS,
+                 tool_limits: Dict[str, int] = None, disc_detection: str = 'uevent'):
+        self.blocking = ThreadPoolExecutor(max_workers=blocking_workers, thread_name_prefix='blocking')
+        # Disc stages hold their thread for hours; keep them off the shared pool
+        self.stages = ThreadPoolExecutor(max_workers=32, thread_name_prefix='stage')
+        self.limits = ToolLimits(tool_limits)
+        self.disc_detection = disc_detection
+        self.loop: Optional[asyncio.AbstractEventLoop] = None
+        self.thread_id = None
+        self.media: Optional[MediaEvents] = None
+        self._starters = []
+        self._tasks = []
+
+    @classmethod
+    def install(cls, config: dict) -> 'AsyncCore':
+        """Create the process-wide core from config.json 'async_core'"""
+        global _core
+        settings = config.get('async_core', {})
+        with _core_lock:
+            if _core is None:
+                _core = cls(settings.get('blocking_workers', DEFAULT_BLOCKING_WORKERS),
+                            settings.get('tool_limits'), config.get('disc_detection', 'uevent'))
+            return _core
+
+    def run(self, main):
+        """Run the loop until main finishes; returns main's result"""
+        try:
+            return asyncio.run(self._main(main))
+        except KeyboardInterrupt:
+            logging.info("Stopped by user")
+        finally:
+            self.blocking.shutdown(wait=False, cancel_futures=True)
+            self.stages.shutdown(wait=False, cancel_futures=True)
+
+    async def _main(self, main):
+        self.loop = asyncio.get_running_loop()
+        self.thread_id = threading.get_ident()
+        task = asyncio.current_task()
+        self.loop.add_signal_handler(signal.SIGTERM, task.cancel)
+        if self.disc_detection == 'uevent':
+            try:
+                self.media = MediaEvents(self.loop)
+                logging.info("Using kernel uevents for disc detection")
+            except OSError as e:
+                logging.warning(f"uevent monitor unavailable ({e}), falling back to polling")
+        for starter in self._starters:
+            self._tasks.append(self.loop.create_task(starter()))
+        try:
+            return await main
+        except asyncio.CancelledError:
+            logging.info("Shutting down")
+        finally:
+            for service_task in self._tasks:
+                service_task.cancel()
+            await asyncio.gather(*self._tasks, return_exceptions=True)
+            if self.media is not None:
+                self.media.close()
+
+    def adopt(self, name: str, step: Callable[[bool], float], wake: threading.Event = None,
+              setup: Callable[[], Optional[int]] = None, teardown: Callable[[], None] = None):
+        """
+        Run a service on the loop: setup() may return a descriptor to wait
+        on, step(readable) does one round of work in the blocking executor
+        and returns the seconds until it wants to run again; setting wake
+        or the descriptor becoming readable runs it early
+        """
+        starter = lambda: self._run_service(name, step, wake, setup, teardown)
+        self.add_task(starter)
+        return starter
+
+    def add_task(self, starter: Callable[[], Awaitable]):
+        """
+        Run starter() as a task on the loop (from any thread, or before the
+        loop is running); it is cancelled when the core shuts down
+        """
+        if self.loop is None:
+            self._starters.append(starter)
+        else:
+            self.loop.call_soon_threadsafe(
+                lambda: self._tasks.append(self.loop.create_task(starter())))
+
+    async def _run_service(self, name, step, wake, setup, teardown):
+        readable = asyncio.Event()
+        fd = None
+        try:
+            if setup is not None:
+                fd = await self.run_blocking(setup)
+            while True:
+                was_readable = readable.is_set()
+                readable.clear()
+                try:
+                    wait = await self.run_blocking(step, was_readable)
+                except Exception as e:
+                    logging.error(f"{name} failed: {e}")
+                    wait = SERVICE_RETRY
+                if fd is not None:
+                    # One wakeup per batch; step() drains the descriptor before it is re-armed
+                    self.loop.add_reader(fd, lambda: (self.loop.remove_reader(fd), readable.set()))
+                await self._sleep(wait, wake, readable)
+                if fd is not None:
+                    self.loop.remove_reader(fd)
+        finally:
+            if teardown is not None:
+                teardown()
+
+    async def _sleep(self, seconds: float, wake: Optional[threading.Event], readable: asyncio.Event):
+        deadline = self.loop.time() + max(0.0, seconds)
+        while wake is None or not wake.is_set():
+            remaining = deadline - self.loop.time()
+            if remaining <= 0:
+                break
+            try:
+                await asyncio.wait_for(readable.wait(), min(remaining, WAKE_POLL))
+                break
+            except asyncio.TimeoutError:
+                continue
+        if wake is not None:
+            wake.clear()
+
+    async def run_blocking(self, func: Callable, *args):
+        """func(*args) in the blocking executor, keeping the caller's drive log context"""
+        context = contextvars.copy_context()
+        return await self.loop.run_in_executor(self.blocking, context.run, func, *args)
+
+    async def stage(self, name: str, func: Callable, *args):
+        """
+        func(*args) as a cancellable stage in its own thread. Cancelling the
+        awaiting task cancels the stage's tools and waits up to STAGE_GRACE
+        for func to return before re-raising.
+        """
+        stage = Stage(name)
+        context = contextvars.copy_context()
+        context.run(_stage.set, stage)
+        future = self.loop.run_in_executor(self.stages, context.run, func, *args)
+        try:
+            return await asyncio.shield(future)
+        except asyncio.CancelledError:
+            logging.info(f"Cancelling {name}")
+            stage.cancel()
+            await asyncio.wait([future], timeout=STAGE_GRACE)
+            raise
+
+    async def run_tool(self, args: List[str], timeout: float = None, parsers: Iterable[OutputParser] = (),
+                       on_progress: Callable[[ProgressEvent], None] = None,
+                       cancel: threading.Event = None, tail_lines: int = runner.TAIL_LINES,
+                       cwd: str = None, env: dict = None) -> CommandResult:
+        """run_command_async() once the tool's concurrency limit allows it"""
+        semaphore = self.limits.semaphore(args)
+        if semaphore is None:
+            return await run_command_async(args, timeout, parsers, on_progress, cancel, tail_lines, cwd, env)
+        if semaphore.locked():
+            logging.info(f"Waiting for a free {os.path.basename(args[0])} slot")
+        async with semaphore:
+            return await run_command_async(args, timeout, parsers, on_progress, cancel, tail_lines, cwd, env)
+
+
+async def _kill_group(process: asyncio.subprocess.Process):
+    """runner._kill_group() without blocking the loop"""
+    loop = asyncio.get_running_loop()
+    for sig in (signal.SIGTERM, signal.SIGKILL):
+        try:
+            os.killpg(process.pid, sig)
+        except (ProcessLookupError, PermissionError):
+            return
+        if sig == signal.SIGKILL:
+            return
+        deadline = loop.time() + runner.KILL_GRACE
+        try:
+            while process.returncode is None and loop.time() < deadline:
+                await asyncio.sleep(0.1)
+        except asyncio.CancelledError:
+            # Shutting down; don't leave the group running
+            os.killpg(process.pid, signal.SIGKILL)
+            raise
+        if process.returncode is not None:
+            # The leader is gone; make sure no helper survived it
+            try:
+                os.killpg(process.pid, signal.SIGKILL)
+            except (ProcessLookupError, PermissionError):
+                pass
+            return
+
+
+async def run_command_async(args: List[str], timeout: float = None, parsers: Iterable[OutputParser] = (),
+                            on_progress: Callable[[ProgressEvent], None] = None,
+                            cancel: threading.Event = None, tail_lines: int = runner.TAIL_LINES,
+                            cwd: str = None, env: dict = None) -> CommandResult:
+    """
+    runner.run_command() on the event loop. Timeouts and a set cancel event
+    are reported in the result; cancelling the task kills the process group
+    and re-raises CancelledError.
+    """
+    loop = asyncio.get_running_loop()
+    sink = OutputSink(parsers, on_progress, tail_lines)
+    started = loop.time()
+    deadline = started + timeout if timeout else None
+    process = await asyncio.create_subprocess_exec(
+        *args, stdin=asyncio.subprocess.DEVNULL, stdout=asyncio.subprocess.PIPE,
+        stderr=asyncio.subprocess.PIPE, cwd=cwd, env=env, start_new_session=True)
+
+    async def pump(stream):
+        while True:
+            data = await stream.read(65536)
+            sink.feed(stream, data)
+            if not data:
+                return
+
+    pumps = [loop.create_task(pump(process.stdout)), loop.create_task(pump(process.stderr))]
+    timed_out = cancelled = lingering = False
+    exited_at = None
+    try:
+        while not all(task.done() for task in pumps):
+            now = loop.time()
+            if deadline is not None and now >= deadline and exited_at is None:
+                timed_out = True
+                break
+            if cancel is not None and cancel.is_set():
+                cancelled = True
+                break
+            if exited_at is None and process.returncode is not None:
+                exited_at = now
+            if exited_at is not None and now - exited_at > runner.DRAIN_GRACE:
+                lingering = True  # A daemonized helper kept the pipes open
+                break
+            wait = runner.POLL_INTERVAL if deadline is None else max(0.0, min(runner.POLL_INTERVAL, deadline - now))
+            await asyncio.wait(pumps, timeout=wait)
+    except asyncio.CancelledError:
+        runner.log_interrupted(args, False, True, loop.time() - started)
+        raise
+    finally:
+        if process.returncode is None or lingering or timed_out or cancelled:
+            await _kill_group(process)
+        for task in pumps:
+            task.cancel()
+        await asyncio.gather(*pumps, return_exceptions=True)
+        try:
+            await asyncio.wait_for(process.wait(), runner.KILL_GRACE)
+        except asyncio.TimeoutError:
+            pass
+
+    duration = loop.time() - started
+    runner.log_interrupted(args, timed_out, cancelled, duration)
+    return CommandResult(list(args), process.returncode, sink.output, timed_out, cancelled, duration)
+
+
+async def _in_context(context: contextvars.Context, coro):
+    for var, value in context.items():
+        var.set(value)
+    return await coro
+
+
+def running_core() -> Optional[AsyncCore]:
+    return _core
+
+
+def executor() -> Optional[ThreadPoolExecutor]:
+    """The core's blocking executor, or None when no core is installed"""
+    return _core.blocking if _core is not None else None
+
+
+def cancel_event() -> Optional[threading.Event]:
+    """Set when the stage this thread runs in is cancelled; None outside a stage"""
+    stage = _stage.get()
+    return stage.cancelled if stage is not None else None
+
+
+def adopt(name: str, step: Callable[[bool], float], wake: threading.Event = None,
+          setup: Callable[[], Optional[int]] = None, teardown: Callable[[], None] = None):
+    """AsyncCore.adopt() on the installed core; None means the caller starts its own thread"""
+    if _core is None:
+        return None
+    return _core.adopt(name, step, wake, setup, teardown)
+
+
+def run_command(args: List[str], timeout: float = None, parsers: Iterable[OutputParser] = (),
+                on_progress: Callable[[ProgressEvent], None] = None,
+                cancel: threading.Event = None, tail_lines: int = runner.TAIL_LINES,
+                cwd: str = None, env: dict = None) -> CommandResult:
+    """
+    runner.run_command() for worker threads. With a running core the tool
+    is supervised on the loop under its concurrency limit, and inside a
+    stage it is killed when the stage is cancelled.
+    """
+    core = _core
+    stage = _stage.get()
+    if cancel is None and stage is not None:
+        cancel = stage.cancelled
+    if core is None or core.loop is None or not core.loop.is_running():
+        return runner.run_command(args, timeout, parsers, on_progress, cancel, tail_lines, cwd, env)
+    if threading.get_ident() == core.thread_id:
+        raise RuntimeError("aio.run_command() would block the event loop; await AsyncCore.run_tool()")
+    if cancel is not None and cancel.is_set():
+        return CommandResult(list(args), None, '', False, True, 0.0)
+
+    # Log records of the tool keep the calling thread's drive tag
+    future = asyncio.run_coroutine_threadsafe(_in_context(
+        contextvars.copy_context(), core.run_tool(args, timeout, parsers, on_progress, cancel,
+                                                  tail_lines, cwd, env)), core.loop)
+    if stage is not None:
+        with stage._lock:
+            stage._tools.add(future)
+    try:
+        return future.result()
+    except CancelledError:
+        return CommandResult(list(args), None, '', False, True, 0.0)
+    finally:
+        if stage is not None:
+            with stage._lock:
+                stage._tools.discard(future)
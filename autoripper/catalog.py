@@ -0,0 +1,584 @@
+#!/usr/bin/env python3
+"""
+Indexed catalog of the music library
+
+A SQLite index of every artist and album directory under output_dir: disc
+ID, names, formats, track files with their sizes and AccurateRip CRCs, and
+when the disc was ripped. "Is this disc already in the library?" and "what
+is the next free Unknown_Artist_NN?" become index lookups instead of walks
+over a large (often network-mounted) library. The ripper updates the
+catalog as rips finish; LibraryWatcher follows changes made by anyone else
+through inotify and catches up after downtime by comparing directory
+mtimes.
+
+library_catalog.duplicates decides what happens to a disc that is
+already fully ripped: "rip" another copy (the default) or "skip" it. The
+daemon and the udev trigger (through the skip command) both follow it.
+
+Usage: python3 -m autoripper.catalog [--db PATH] [--output-dir DIR] sync|contains DISC_ID|skip DISC_ID|duplicates|stats
+"""
+
+import errno
+import json
+import logging
+import os
+import select
+import sqlite3
+import sys
+import threading
+import time
+import urllib.parse
+from typing import Dict, List, Optional, Tuple
+
+from autoripper import aio, inotify
+from autoripper.discinfo import read_disc_info
+from autoripper.encoding import track_files
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS dirs (
+    path TEXT PRIMARY KEY,
+    mtime REAL NOT NULL
+);
+CREATE TABLE IF NOT EXISTS albums (
+    path TEXT PRIMARY KEY,
+    disc_id TEXT,
+    freedb_id TEXT,
+    artist TEXT,
+    album TEXT,
+    formats TEXT,
+    track_count INTEGER NOT NULL,
+    complete INTEGER NOT NULL,
+    metadata_source TEXT,
+    ripped_at REAL,
+    indexed_at REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS albums_disc ON albums (disc_id);
+CREATE TABLE IF NOT EXISTS tracks (
+    path TEXT PRIMARY KEY,
+    album_path TEXT NOT NULL,
+    number INTEGER NOT NULL,
+    format TEXT NOT NULL,
+    size INTEGER NOT NULL,
+    mtime REAL NOT NULL,
+    crc32 TEXT
+);
+CREATE INDEX IF NOT EXISTS tracks_album ON tracks (album_path);
+CREATE TABLE IF NOT EXISTS name_counters (
+    parent TEXT NOT NULL,
+    base TEXT NOT NULL,
+    next INTEGER NOT NULL,
+    PRIMARY KEY (parent, base)
+);
+CREATE TABLE IF NOT EXISTS reserved_names (
+    path TEXT PRIMARY KEY,
+    reserved_at REAL NOT NULL
+);
+"""
+
+ALBUM_COLUMNS = ('path', 'disc_id', 'freedb_id', 'artist', 'album', 'formats', 'track_count',
+                 'complete', 'metadata_source', 'ripped_at')
+
+# Quiet period after the last change in an album before it is re-indexed
+SETTLE_SECONDS = 2
+DEFAULT_RESCAN_INTERVAL = 3600
+# A name handed out by unique_name() stays taken this long even before its directory exists
+RESERVATION_SECONDS = 24 * 3600
+DUPLICATE_POLICIES = ('rip', 'skip')
+DIR_EVENTS = (inotify.IN_CREATE | inotify.IN_DELETE | inotify.IN_MOVED_FROM
+              | inotify.IN_MOVED_TO | inotify.IN_ONLYDIR)
+ALBUM_EVENTS = DIR_EVENTS | inotify.IN_CLOSE_WRITE | inotify.IN_ATTRIB
+
+_shared = {}
+_shared_lock = threading.Lock()
+
+
+def default_catalog_path(config: dict) -> str:
+    state_dir = config.get('state_dir', '/var/lib/auto-ripper')
+    return config.get('library_catalog', {}).get('path') or os.path.join(state_dir, 'library.sqlite')
+
+
+def duplicate_policy(config: dict) -> str:
+    """What to do with a disc already in the library: 'rip' another copy or 'skip' it"""
+    policy = config.get('library_catalog', {}).get('duplicates', 'rip')
+    if policy not in DUPLICATE_POLICIES:
+        logging.warning(f"Unknown library_catalog.duplicates '{policy}', ripping another copy")
+        return 'rip'
+    return policy
+
+
+def _subtree(path: str) -> Tuple[str, str]:
+    """Key range holding path's descendants ('/' sorts right before '0')"""
+    return path + '/', path + '0'
+
+
+class LibraryCatalog:
+    """Disc ID and directory name index over the library in output_dir"""
+
+    def __init__(self, path: str, readonly: bool = False):
+        """
+        readonly never creates or writes the database, e.g. for lookups
+        from the root-owned udev hook; a missing database raises
+        FileNotFoundError
+        """
+        self.path = path
+        self._lock = threading.Lock()
+        if readonly:
+            if not os.path.exists(path):
+                raise FileNotFoundError(path)
+            self._db = sqlite3.connect(f"file:{urllib.parse.quote(os.path.abspath(path))}?mode=ro",
+                                       uri=True, check_same_thread=False, isolation_level=None)
+            return
+        os.makedirs(os.path.dirname(path) or '.', exist_ok=True)
+        self._db = sqlite3.connect(path, check_same_thread=False, isolation_level=None)
+        self._db.execute("PRAGMA journal_mode=WAL")
+        self._db.execute("PRAGMA synchronous=NORMAL")
+        self._db.executescript(SCHEMA)
+
+    @classmethod
+    def shared(cls, config: dict) -> 'LibraryCatalog':
+        """One catalog connection per database and process, shared by every drive worker"""
+        path = default_catalog_path(config)
+        with _shared_lock:
+            if path not in _shared:
+                _shared[path] = cls(path)
+            return _shared[path]
+
+    def index_album(self, album_dir: str) -> Optional[dict]:
+        """
+        (Re)index one album directory from what is on disk and return its
+        row; a directory that no longer exists is dropped from the catalog.
+        """
+        album_dir = os.path.normpath(album_dir)
+        try:
+            mtime = os.stat(album_dir).st_mtime
+            files = track_files(album_dir)
+        except (FileNotFoundError, NotADirectoryError):
+            self.remove_tree(album_dir)
+            return None
+        info = read_disc_info(album_dir) or {}
+        checksums = info.get('checksums') or {}
+        tracks = []
+        for (number, fmt), path in sorted(files.items()):
+            try:
+                st = os.stat(path)
+            except OSError:
+                continue
+            tracks.append((path, album_dir, number, fmt, st.st_size, st.st_mtime,
+                           checksums.get(str(number), {}).get('crc32')))
+
+        formats = sorted({fmt for _, _, _, fmt, _, _, _ in tracks})
+        expected = {(number, fmt) for number in info.get('tracks') or []
+                    for fmt in info.get('formats') or []}
+        album = None
+        if tracks or info:
+            album = {
+                'path': album_dir,
+                'disc_id': info.get('disc_id'),
+                'freedb_id': info.get('freedb_id'),
+                'artist': info.get('artist') or os.path.basename(os.path.dirname(album_dir)),
+                'album': info.get('album') or os.path.basename(album_dir),
+                'formats': ','.join(formats),
+                'track_count': len({number for _, _, number, _, _, _, _ in tracks}),
+                'complete': int(bool(expected) and expected <= set(files)),
+                'metadata_source': info.get('metadata_source'),
+                'ripped_at': info.get('ripped_at'),
+            }
+
+        with self._lock:
+            self._db.execute("BEGIN IMMEDIATE")
+            try:
+                self._db.execute("INSERT OR REPLACE INTO dirs (path, mtime) VALUES (?, ?)",
+                                 (album_dir, mtime))
+                self._db.execute("INSERT OR IGNORE INTO dirs (path, mtime) VALUES (?, 0)",
+                                 (os.path.dirname(album_dir),))
+                self._db.execute("DELETE FROM tracks WHERE album_path = ?", (album_dir,))
+                if album is None:
+                    self._db.execute("DELETE FROM albums WHERE path = ?", (album_dir,))
+                else:
+                    self._db.execute(
+                        f"INSERT OR REPLACE INTO albums ({', '.join(ALBUM_COLUMNS)}, indexed_at) "
+                        f"VALUES ({', '.join('?' * len(ALBUM_COLUMNS))}, ?)",
+                        [album[column] for column in ALBUM_COLUMNS] + [time.time()])
+                    self._db.executemany(
+                        "INSERT OR REPLACE INTO tracks (path, album_path, number, format, size, mtime, crc32) "
+                        "VALUES (?, ?, ?, ?, ?, ?, ?)", tracks)
+                self._db.execute("COMMIT")
+            except BaseException:
+                self._db.execute("ROLLBACK")
+                raise
+        return album
+
+    def add_dir(self, path: str, mtime: float = 0):
+        """Record a directory (e.g. an artist) so its name counts as taken"""
+        with self._lock:
+            self._db.execute("INSERT OR REPLACE INTO dirs (path, mtime) VALUES (?, ?)",
+                             (os.path.normpath(path), mtime))
+
+    def remove_tree(self, path: str):
+        """Forget path and everything below it"""
+        path = os.path.normpath(path)
+        low, high = _subtree(path)
+        with self._lock:
+            self._db.execute("BEGIN IMMEDIATE")
+            try:
+                for table, column in (('dirs', 'path'), ('albums', 'path'), ('tracks', 'album_path')):
+                    self._db.execute(f"DELETE FROM {table} WHERE {column} = ? "
+                                     f"OR ({column} >= ? AND {column} < ?)", (path, low, high))
+                self._db.execute("COMMIT")
+            except BaseException:
+                self._db.execute("ROLLBACK")
+                raise
+
+    def moved(self, old_path: str, new_path: str):
+        """An album directory was renamed (e.g. by the metadata reconciler)"""
+        self.remove_tree(old_path)
+        self.index_album(new_path)
+
+    def albums_for_disc(self, disc_id: str, complete_only: bool = False) -> List[dict]:
+        query = f"SELECT {', '.join(ALBUM_COLUMNS)} FROM albums WHERE disc_id = ?"
+        if complete_only:
+            query += " AND complete = 1"
+        with self._lock:
+            rows = self._db.execute(query, (disc_id,)).fetchall()
+        return [dict(zip(ALBUM_COLUMNS, row)) for row in rows]
+
+    def contains(self, disc_id: str) -> bool:
+        """Whether a complete rip of disc_id is already in the library"""
+        with self._lock:
+            return self._db.execute("SELECT 1 FROM albums WHERE disc_id = ? AND complete = 1 LIMIT 1",
+                                    (disc_id,)).fetchone() is not None
+
+    def _taken(self, path: str) -> bool:
+        if self._db.execute("SELECT 1 FROM dirs WHERE path = ? UNION ALL "
+                            "SELECT 1 FROM reserved_names WHERE path = ?", (path, path)).fetchone():
+            return True
+        # One stat of the final candidate guards against a stale index
+        return os.path.lexists(path)
+
+    def unique_name(self, parent: str, base: str, numbered: bool = False) -> str:
+        """
+        Free directory name under parent: base itself if it is free (and
+        numbered is False), else base_NN with the next free number. A
+        persistent counter remembers where the last search ended, so the
+        search starts past every name already in use instead of at 01.
+
+        The name is reserved in the same write transaction, so drives
+        asking at the same time (in this or another process) never get the
+        same name before either has created its directory.
+        """
+        parent = os.path.normpath(parent)
+        with self._lock:
+            # IMMEDIATE takes the database write lock up front: other processes wait here
+            self._db.execute("BEGIN IMMEDIATE")
+            try:
+                now = time.time()
+                self._db.execute("DELETE FROM reserved_names WHERE reserved_at < ?",
+                                 (now - RESERVATION_SECONDS,))
+                if not numbered and not self._taken(os.path.join(parent, base)):
+                    name = base
+                else:
+                    row = self._db.execute("SELECT next FROM name_counters WHERE parent = ? AND base = ?",
+                                           (parent, base)).fetchone()
+                    number = row[0] if row else 1
+                    while self._taken(os.path.join(parent, f"{base}_{number:02d}")):
+                        number += 1
+                    self._db.execute("INSERT OR REPLACE INTO name_counters (parent, base, next) "
+                                     "VALUES (?, ?, ?)", (parent, base, number + 1))
+                    name = f"{base}_{number:02d}"
+                self._db.execute("INSERT OR REPLACE INTO reserved_names (path, reserved_at) VALUES (?, ?)",
+                                 (os.path.join(parent, name), now))
+                self._db.execute("COMMIT")
+            except BaseException:
+                self._db.execute("ROLLBACK")
+                raise
+        return name
+
+    def duplicates(self) -> Dict[str, List[str]]:
+        """disc_id -> album paths, for every disc in the library more than once"""
+        with self._lock:
+            rows = self._db.execute(
+                "SELECT disc_id, path FROM albums WHERE disc_id IN "
+                "(SELECT disc_id FROM albums WHERE disc_id IS NOT NULL "
+                "GROUP BY disc_id HAVING COUNT(*) > 1) ORDER BY disc_id, path").fetchall()
+        result: Dict[str, List[str]] = {}
+        for disc_id, path in rows:
+            result.setdefault(disc_id, []).append(path)
+        return result
+
+    def stats(self) -> dict:
+        with self._lock:
+            albums, identified, complete = self._db.execute(
+                "SELECT COUNT(*), COUNT(disc_id), COALESCE(SUM(complete), 0) FROM albums").fetchone()
+            tracks, size = self._db.execute(
+                "SELECT COUNT(*), COALESCE(SUM(size), 0) FROM tracks").fetchone()
+        return {'albums': albums, 'albums_with_disc_id': identified, 'complete_albums': complete,
+                'track_files': tracks, 'bytes': size}
+
+    def sync(self, output_dir: str) -> int:
+        """
+        Bring the catalog in line with output_dir (artist/album depth):
+        albums whose directory mtime changed are re-indexed, directories
+        that are gone are dropped. Returns the number of albums re-indexed.
+        """
+        output_dir = os.path.normpath(output_dir)
+        low, high = _subtree(output_dir)
+        with self._lock:
+            known = dict(self._db.execute("SELECT path, mtime FROM dirs WHERE path >= ? AND path < ?",
+                                          (low, high)).fetchall())
+        seen = set()
+        changed = 0
+        for artist, artist_mtime in _subdirs(output_dir):
+            seen.add(artist)
+            if known.get(artist) != artist_mtime:
+                self.add_dir(artist, artist_mtime)
+            for album_dir, album_mtime in _subdirs(artist):
+                seen.add(album_dir)
+                if known.get(album_dir) != album_mtime:
+                    try:
+                        self.index_album(album_dir)
+                        changed += 1
+                    except OSError as e:
+                        logging.warning(f"Could not index {album_dir}: {e}")
+        for path in set(known) - seen:
+            self.remove_tree(path)
+        if changed or len(known) != len(seen):
+            logging.info(f"Library catalog synced: {changed} albums re-indexed, "
+                         f"{len(set(known) - seen)} directories removed")
+        return changed
+
+    def close(self):
+        with self._lock:
+            self._db.close()
+
+
+class LibraryWatcher:
+    """
+    Keeps a LibraryCatalog current while other programs change the library
+
+    Watches output_dir, every artist directory and every album directory.
+    Changes inside an album are batched until it has been quiet for
+    SETTLE_SECONDS and then re-indexed in one go. When inotify is missing,
+    the event queue overflows or max_user_watches runs out, the watcher
+    falls back to mtime-based sync() passes every rescan_interval seconds.
+    """
+
+    def __init__(self, catalog: LibraryCatalog, output_dir: str,
+                 rescan_interval: float = DEFAULT_RESCAN_INTERVAL):
+        self.catalog = catalog
+        self.output_dir = os.path.normpath(output_dir)
+        self.rescan_interval = rescan_interval
+        self._inotify = None
+        self._paths: Dict[int, str] = {}
+        self._dirty: Dict[str, float] = {}
+        # False once max_user_watches ran out and some directories are unwatched
+        self._complete = True
+        self._resync = False
+        self._last_sync = 0.0
+        self._thread = None
+
+    def start(self):
+        if self._thread is None:
+            self._thread = aio.adopt('library-watcher', self.step, setup=self._open, teardown=self._close)
+        if self._thread is None:
+            self._thread = threading.Thread(target=self.run, name='library-watcher', daemon=True)
+            self._thread.start()
+
+    def _depth(self, path: str) -> int:
+        if path == self.output_dir:
+            return 0
+        return 1 if os.path.dirname(path) == self.output_dir else 2
+
+    def _watch(self, path: str) -> bool:
+        if self._inotify is None or not self._complete:
+            return False
+        try:
+            wd = self._inotify.add_watch(path, ALBUM_EVENTS if self._depth(path) == 2 else DIR_EVENTS)
+        except OSError as e:
+            if e.errno == errno.ENOSPC:  # fs.inotify.max_user_watches reached
+                logging.warning(f"Out of inotify watches at {path}, falling back to rescans "
+                                f"every {self.rescan_interval:.0f}s (raise fs.inotify.max_user_watches)")
+                self._complete = False
+            return False
+        self._paths[wd] = path
+        return True
+
+    def _watch_artist(self, artist: str):
+        self._watch(artist)
+        for album_dir, _ in _subdirs(artist):
+            self._watch(album_dir)
+            self._dirty[album_dir] = time.monotonic()
+
+    def _forget_watches(self, path: str):
+        """Drop watch mappings at or below a path that was moved away"""
+        low, _ = _subtree(path)
+        for wd, watched in list(self._paths.items()):
+            if watched == path or watched.startswith(low):
+                del self._paths[wd]
+        for album_dir in [d for d in self._dirty if d == path or d.startswith(low)]:
+            del self._dirty[album_dir]
+
+    def handle(self, event: inotify.InotifyEvent):
+        if event.mask & inotify.IN_Q_OVERFLOW:
+            logging.warning("Library watcher missed events, rescanning")
+            self._resync = True
+            return
+        if event.mask & inotify.IN_IGNORED:
+            self._paths.pop(event.wd, None)
+            return
+        base = self._paths.get(event.wd)
+        if base is None:
+            return
+        path = os.path.join(base, event.name) if event.name else base
+        depth = self._depth(base)
+        if depth == 2:
+            if event.name:
+                self._dirty[base] = time.monotonic()
+            return
+        if not event.mask & inotify.IN_ISDIR or event.name.startswith('.'):
+            return
+        if event.mask & (inotify.IN_CREATE | inotify.IN_MOVED_TO):
+            if depth == 0:
+                self.catalog.add_dir(path)
+                self._watch_artist(path)
+            else:
+                self._watch(path)
+                self._dirty[path] = time.monotonic()
+        elif event.mask & (inotify.IN_DELETE | inotify.IN_MOVED_FROM):
+            self._forget_watches(path)
+            self.catalog.remove_tree(path)
+
+    def _flush(self, force: bool = False):
+        now = time.monotonic()
+        for album_dir, changed_at in list(self._dirty.items()):
+            if force or now - changed_at >= SETTLE_SECONDS:
+                del self._dirty[album_dir]
+                try:
+                    self.catalog.index_album(album_dir)
+                except (OSError, sqlite3.Error) as e:
+                    logging.error(f"Could not index {album_dir}: {e}")
+
+    def _open(self) -> Optional[int]:
+        """Watch the library and sync it once; returns the inotify descriptor, if any"""
+        try:
+            self._inotify = inotify.Inotify()
+        except OSError as e:
+            logging.warning(f"inotify unavailable ({e}), library catalog relies on periodic rescans")
+        if self._watch(self.output_dir):
+            for artist, _ in _subdirs(self.output_dir):
+                self._watch_artist(artist)
+        self._dirty.clear()  # Startup sync below covers everything already there
+        self._last_sync = time.monotonic()
+        self.catalog.sync(self.output_dir)
+        logging.info(f"Library watcher started ({len(self._paths)} directories watched)")
+        return self._inotify.fileno() if self._inotify is not None else None
+
+    def _close(self):
+        if self._inotify is not None:
+            self._inotify.close()
+
+    def step(self, readable: bool = False) -> float:
+        """Apply queued events and due rescans; returns the seconds until the next step"""
+        if self._inotify is not None:
+            if readable:
+                for event in self._inotify.read_events():
+                    self.handle(event)
+            self._flush()
+        overdue = time.monotonic() - self._last_sync >= self.rescan_interval
+        if self._resync or (overdue and (self._inotify is None or not self._complete)):
+            self._resync = False
+            self._flush(force=True)
+            self.catalog.sync(self.output_dir)
+            self._last_sync = time.monotonic()
+        return 1.0 if self._inotify is not None else min(self.rescan_interval, 60)
+
+    def run(self, stop_event: threading.Event = None):
+        stop_event = stop_event or threading.Event()
+        self._open()
+        try:
+            readable = False
+            while not stop_event.is_set():
+                wait = self.step(readable)
+                if self._inotify is not None:
+                    readable = bool(select.select([self._inotify], [], [], wait)[0])
+                else:
+                    stop_event.wait(wait)
+        finally:
+            self._close()
+
+
+def _subdirs(path: str) -> List[Tuple[str, float]]:
+    """(path, mtime) of the visible subdirectories of path"""
+    try:
+        entries = list(os.scandir(path))
+    except OSError:
+        return []
+    result = []
+    for entry in entries:
+        try:
+            if entry.is_dir(follow_symlinks=False) and not entry.name.startswith('.'):
+                result.append((entry.path, entry.stat(follow_symlinks=False).st_mtime))
+        except OSError:
+            continue
+    return result
+
+
+def lookup_disc(path: str, disc_id: str) -> List[dict]:
+    """Complete rips of disc_id, read without creating or writing the catalog; [] if there is none yet"""
+    try:
+        catalog = LibraryCatalog(path, readonly=True)
+    except FileNotFoundError:
+        return []
+    try:
+        return catalog.albums_for_disc(disc_id, complete_only=True)
+    except sqlite3.Error as e:
+        logging.warning(f"Could not read library catalog {path}: {e}")
+        return []
+    finally:
+        catalog.close()
+
+
+def main():
+    args = sys.argv[1:]
+    config = {}
+    if os.path.exists('/opt/auto-ripper/config.json'):
+        with open('/opt/auto-ripper/config.json') as f:
+            config = json.load(f)
+    options = {}
+    for option in ('--db', '--output-dir'):
+        if option in args:
+            index = args.index(option)
+            options[option] = args[index + 1]
+            del args[index:index + 2]
+    if not args or args[0] not in ('sync', 'contains', 'skip', 'duplicates', 'stats') \
+            or (args[0] in ('contains', 'skip') and len(args) < 2):
+        print(__doc__.strip().split('Usage:')[1].strip(), file=sys.stderr)
+        sys.exit(2)
+
+    logging.basicConfig(level=logging.INFO, format='%(message)s')
+    path = options.get('--db') or default_catalog_path(config)
+    command = args[0]
+    if command in ('contains', 'skip'):
+        # skip: exit 0 only if the disc is in the library and the policy says not to rip it again
+        albums = lookup_disc(path, args[1])
+        for album in albums:
+            print(album['path'])
+        if command == 'skip' and duplicate_policy(config) != 'skip':
+            sys.exit(1)
+        sys.exit(0 if albums else 1)
+
+    catalog = LibraryCatalog(path)
+    if command == 'sync':
+        catalog.sync(options.get('--output-dir') or config.get('output_dir', '/mnt/MUSIC'))
+        print(json.dumps(catalog.stats()))
+    elif command == 'duplicates':
+        for disc_id, paths in catalog.duplicates().items():
+            print(disc_id)
+            for path in paths:
+                print(f"  {path}")
+    else:
+        print(json.dumps(catalog.stats()))
+    catalog.close()
+
+
+if __name__ == "__main__":
+    main()
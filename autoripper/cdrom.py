@@ -0,0 +1,299 @@
+"""
+In-process drive and disc probing with the Linux CDROM ioctls
+
+Replaces the cd-discid / cdparanoia -Q / file -s / blkid / dd chain with a
+single open of the device: drive status, disc status, TOC header/entries
+and the media-changed flag. Backends can also read raw audio sectors and
+set the read speed for the native read engine. The backend is pluggable
+so a FakeBackend can stand in for a real drive (see register_backend).
+"""
+
+import ctypes
+import errno
+import fcntl
+import hashlib
+import logging
+import os
+import struct
+import sys
+from collections import OrderedDict, namedtuple
+from typing import Callable, Dict, List, Optional, Tuple
+
+# ioctl requests from <linux/cdrom.h>
+CDROMREADTOCHDR = 0x5305
+CDROMREADTOCENTRY = 0x5306
+CDROMREADAUDIO = 0x530e
+CDROM_SELECT_SPEED = 0x5322
+CDROM_MEDIA_CHANGED = 0x5325
+CDROM_DRIVE_STATUS = 0x5326
+CDROM_DISC_STATUS = 0x5327
+CDSL_CURRENT = 0x7fffffff
+
+CDROM_LBA = 0x01
+CDROM_LEADOUT = 0xAA
+CDROM_DATA_TRACK = 0x04
+
+# Bytes in one raw audio sector (588 stereo 16-bit samples)
+CD_FRAMESIZE_RAW = 2352
+
+# CDROM_DRIVE_STATUS results
+CDS_NO_INFO = 0
+CDS_NO_DISC = 1
+CDS_TRAY_OPEN = 2
+CDS_DRIVE_NOT_READY = 3
+CDS_DISC_OK = 4
+
+# CDROM_DISC_STATUS results
+CDS_AUDIO = 100
+CDS_DATA_1 = 101
+CDS_DATA_2 = 102
+CDS_XA_2_1 = 103
+CDS_XA_2_2 = 104
+CDS_MIXED = 105
+
+DRIVE_STATUS_NAMES = {
+    CDS_NO_INFO: 'no_info',
+    CDS_NO_DISC: 'no_disc',
+    CDS_TRAY_OPEN: 'tray_open',
+    CDS_DRIVE_NOT_READY: 'not_ready',
+    CDS_DISC_OK: 'disc_ok',
+}
+
+# struct cdrom_tochdr / struct cdrom_tocentry (LBA addressing)
+TOCHDR_FORMAT = 'BB'
+TOCENTRY_FORMAT = 'BBBxiB3x'
+# struct cdrom_read_audio: addr (LBA), addr_format, nframes, buf pointer
+READAUDIO_FORMAT = '@iBiP'
+
+TocEntry = namedtuple('TocEntry', ['track', 'lba', 'is_data'])
+TocEntry.__doc__ = "One TOC entry; track is CDROM_LEADOUT (0xAA) for the lead-out"
+
+
+class CdromBackend:
+    """
+    Interface for drive probing backends
+
+    Backends are context managers; every method may raise OSError when the
+    drive or disc cannot answer.
+    """
+
+    def drive_status(self) -> int:
+        raise NotImplementedError
+
+    def disc_status(self) -> int:
+        raise NotImplementedError
+
+    def read_toc(self) -> List[TocEntry]:
+        """Return the TOC entries in track order, lead-out last"""
+        raise NotImplementedError
+
+    def media_changed(self) -> bool:
+        raise NotImplementedError
+
+    def read_audio(self, lba: int, frames: int) -> bytes:
+        """Read frames raw audio sectors starting at lba (raises OSError on read errors)"""
+        raise NotImplementedError
+
+    def set_speed(self, speed: int):
+        """Select the read speed (in multiples of 1x); 0 means the drive's maximum"""
+        raise NotImplementedError
+
+    def close(self):
+        pass
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.close()
+        return False
+
+
+class IoctlBackend(CdromBackend):
+    """Probe a real drive through the Linux CDROM ioctls"""
+
+    def __init__(self, device: str):
+        self.device = device
+        # O_NONBLOCK lets us open a drive with no disc without closing the tray
+        self.fd = os.open(device, os.O_RDONLY | os.O_NONBLOCK)
+
+    def drive_status(self) -> int:
+        return fcntl.ioctl(self.fd, CDROM_DRIVE_STATUS, CDSL_CURRENT)
+
+    def disc_status(self) -> int:
+        return fcntl.ioctl(self.fd, CDROM_DISC_STATUS)
+
+    def media_changed(self) -> bool:
+        return bool(fcntl.ioctl(self.fd, CDROM_MEDIA_CHANGED, CDSL_CURRENT))
+
+    def read_toc(self) -> List[TocEntry]:
+        header = fcntl.ioctl(self.fd, CDROMREADTOCHDR, bytes(struct.calcsize(TOCHDR_FORMAT)))
+        first, last = struct.unpack(TOCHDR_FORMAT, header)
+
+        entries = []
+        for track in list(range(first, last + 1)) + [CDROM_LEADOUT]:
+            request = struct.pack(TOCENTRY_FORMAT, track, 0, CDROM_LBA, 0, 0)
+            reply = fcntl.ioctl(self.fd, CDROMREADTOCENTRY, request)
+            number, adr_ctrl, _, lba, _ = struct.unpack(TOCENTRY_FORMAT, reply)
+            entries.append(TocEntry(number, lba, bool(_control_bits(adr_ctrl) & CDROM_DATA_TRACK)))
+        return entries
+
+    def read_audio(self, lba: int, frames: int) -> bytes:
+        buffer = ctypes.create_string_buffer(frames * CD_FRAMESIZE_RAW)
+        request = struct.pack(READAUDIO_FORMAT, lba, CDROM_LBA, frames, ctypes.addressof(buffer))
+        fcntl.ioctl(self.fd, CDROMREADAUDIO, request)
+        return buffer.raw
+
+    def set_speed(self, speed: int):
+        fcntl.ioctl(self.fd, CDROM_SELECT_SPEED, speed)
+
+    def close(self):
+        if self.fd is not None:
+            os.close(self.fd)
+            self.fd = None
+
+
+def _control_bits(adr_ctrl: int) -> int:
+    """Extract cdte_ctrl from the adr:4/ctrl:4 bitfield byte"""
+    if sys.byteorder == 'little':
+        return adr_ctrl >> 4
+    return adr_ctrl & 0x0F
+
+
+class FakeBackend(CdromBackend):
+    """
+    In-memory drive for tests and dry runs
+
+    toc is a list of (lba, is_data) track starts followed by the lead-out
+    LBA, e.g. FakeBackend(toc=[(0, False), (15000, False), 30000]).
+    Audio sectors hold deterministic pseudo-random data. bad_sectors maps
+    an LBA to how many reads fail with EIO before it reads back, and
+    unstable_sectors to how many reads return corrupted data. Like a real
+    drive, it answers re-reads of the last cache_frames sectors it read from
+    its cache instead of the disc.
+    """
+
+    def __init__(self, device: str = '/dev/fake', toc=None,
+                 drive_status: int = None, media_changed: bool = False,
+                 bad_sectors: Dict[int, int] = None, unstable_sectors: Dict[int, int] = None,
+                 cache_frames: int = 0):
+        self.device = device
+        self.bad_sectors = dict(bad_sectors or {})
+        self.unstable_sectors = dict(unstable_sectors or {})
+        self.cache_frames = cache_frames
+        self._cache = OrderedDict()
+        self.speed = 0
+        self.reads = 0
+        self.entries = []
+        if toc:
+            for number, (lba, is_data) in enumerate(toc[:-1], start=1):
+                self.entries.append(TocEntry(number, lba, is_data))
+            self.entries.append(TocEntry(CDROM_LEADOUT, toc[-1], False))
+        if drive_status is None:
+            drive_status = CDS_DISC_OK if self.entries else CDS_NO_DISC
+        self._drive_status = drive_status
+        self._media_changed = media_changed
+
+    def drive_status(self) -> int:
+        return self._drive_status
+
+    def disc_status(self) -> int:
+        kinds = {entry.is_data for entry in self.entries[:-1]}
+        if not kinds:
+            return CDS_NO_INFO
+        if kinds == {False}:
+            return CDS_AUDIO
+        if kinds == {True}:
+            return CDS_DATA_1
+        return CDS_MIXED
+
+    def read_toc(self) -> List[TocEntry]:
+        if self._drive_status != CDS_DISC_OK:
+            raise OSError(5, 'No medium found')
+        return list(self.entries)
+
+    def media_changed(self) -> bool:
+        changed, self._media_changed = self._media_changed, False
+        return changed
+
+    @staticmethod
+    def sector_data(lba: int) -> bytes:
+        """The correct content of an audio sector on the fake disc"""
+        seed = hashlib.sha256(lba.to_bytes(4, 'little', signed=True)).digest()
+        return (seed * (CD_FRAMESIZE_RAW // len(seed) + 1))[:CD_FRAMESIZE_RAW]
+
+    def read_audio(self, lba: int, frames: int) -> bytes:
+        self.reads += 1
+        if not self.entries or lba < 0 or lba + frames > self.entries[-1].lba:
+            raise OSError(errno.EIO, 'Read beyond the disc')
+        data = []
+        for sector in range(lba, lba + frames):
+            if sector in self._cache:
+                data.append(self._cache[sector])
+                continue
+            if self.bad_sectors.get(sector, 0) > 0:
+                self.bad_sectors[sector] -= 1
+                raise OSError(errno.EIO, f'Read error at sector {sector}')
+            content = self.sector_data(sector)
+            if self.unstable_sectors.get(sector, 0) > 0:
+                self.unstable_sectors[sector] -= 1
+                content = os.urandom(CD_FRAMESIZE_RAW)
+            data.append(content)
+            if self.cache_frames:
+                self._cache[sector] = content
+                while len(self._cache) > self.cache_frames:
+                    self._cache.popitem(last=False)
+        return b''.join(data)
+
+    def set_speed(self, speed: int):
+        self.speed = speed
+
+
+_backend_factory: Callable[[str], CdromBackend] = IoctlBackend
+
+
+def register_backend(factory: Callable[[str], CdromBackend]):
+    """Replace the backend used by open_drive (e.g. with a FakeBackend factory)"""
+    global _backend_factory
+    _backend_factory = factory
+
+
+def open_drive(device: str) -> CdromBackend:
+    """Open device with the registered backend"""
+    return _backend_factory(device)
+
+
+def classify_toc(entries: List[TocEntry]) -> str:
+    """Classify a TOC as 'audio_cd', 'data_disc', 'mixed_cd' or 'unknown'"""
+    tracks = [entry for entry in entries if entry.track != CDROM_LEADOUT]
+    audio = sum(1 for entry in tracks if not entry.is_data)
+    data = len(tracks) - audio
+    if audio and data:
+        return 'mixed_cd'
+    if audio:
+        return 'audio_cd'
+    if data:
+        return 'data_disc'
+    return 'unknown'
+
+
+def classify_disc(drive: CdromBackend) -> Tuple[str, Optional[List[TocEntry]]]:
+    """
+    Classify the disc in an open drive without forking any tool.
+
+    Returns (disc_type, toc) where disc_type is 'audio_cd', 'data_disc',
+    'mixed_cd', 'no_disc', 'not_ready' or 'unknown'; toc is None unless it
+    could be read.
+    """
+    status = drive.drive_status()
+    if status in (CDS_NO_DISC, CDS_TRAY_OPEN):
+        return 'no_disc', None
+    if status == CDS_DRIVE_NOT_READY:
+        return 'not_ready', None
+
+    try:
+        toc = drive.read_toc()
+    except OSError as e:
+        logging.warning(f"TOC read failed: {e}")
+        return 'unknown', None
+    return classify_toc(toc), toc
@@ -0,0 +1,246 @@
+"""
+Cached network connectivity with a circuit breaker
+
+Instead of fetching a web page before every lookup, ConnectivityMonitor
+keeps an online/offline state that metadata code reads without blocking.
+A background thread refreshes it by probing the metadata endpoints
+themselves: rarely while they answer, and with exponential backoff while
+they don't (the circuit is "open"). Link and route changes reported over
+rtnetlink trigger an immediate probe, and metadata clients report the
+outcome of their own requests, so the state follows reality without extra
+traffic.
+"""
+
+import logging
+import select
+import socket
+import threading
+import time
+import urllib.error
+import urllib.request
+from typing import Callable, List, Optional
+
+from autoripper import aio
+
+NETLINK_ROUTE = 0
+# rtnetlink multicast groups: link up/down, address and route changes
+RTMGRP_LINK = 0x1
+RTMGRP_IPV4_IFADDR = 0x10
+RTMGRP_IPV4_ROUTE = 0x40
+RTMGRP_IPV6_IFADDR = 0x100
+RTMGRP_IPV6_ROUTE = 0x400
+
+DEFAULT_ENDPOINTS = ['https://musicbrainz.org/ws/2/']
+DEFAULT_INTERVAL = 300
+DEFAULT_TIMEOUT = 5
+BASE_BACKOFF = 5
+MAX_BACKOFF = 600
+# Link changes arrive in bursts (address, routes, ...); probe once they settle
+SETTLE_SECONDS = 2
+
+_shared = {}
+_shared_lock = threading.Lock()
+
+
+class ConnectivityMonitor:
+    """
+    Online/offline state of the metadata endpoints
+
+    online is None until the first probe or request has finished; callers
+    treat that as online so the first lookup is simply tried.
+    """
+
+    def __init__(self, endpoints: List[str] = None, interval: float = DEFAULT_INTERVAL,
+                 timeout: float = DEFAULT_TIMEOUT, base_backoff: float = BASE_BACKOFF,
+                 max_backoff: float = MAX_BACKOFF, probe: Callable[[], bool] = None):
+        self.endpoints = endpoints or DEFAULT_ENDPOINTS
+        self.interval = interval
+        self.timeout = timeout
+        self.base_backoff = base_backoff
+        self.max_backoff = max_backoff
+        self.probe = probe or self._probe_endpoints
+        self.online: Optional[bool] = None
+        self.failures = 0
+        # Monotonic time of the next probe; while offline this is when the
+        # open circuit lets the next attempt through
+        self.next_probe = 0.0
+        # Monotonic time a burst of link changes is considered over, while one settles
+        self.settle_until: Optional[float] = None
+        self.changed_at = time.time()
+        self._lock = threading.Lock()
+        self._wake = threading.Event()
+        self._listeners: List[Callable[[bool], None]] = []
+        self._sock = None
+        self._thread = None
+
+    @classmethod
+    def shared(cls, config: dict) -> 'ConnectivityMonitor':
+        """One running monitor per process, shared by every drive worker"""
+        settings = config.get('connectivity', {})
+        with _shared_lock:
+            if 'monitor' not in _shared:
+                base_url = config.get('musicbrainz', {}).get('base_url')
+                monitor = cls(settings.get('endpoints') or ([base_url.rstrip('/') + '/'] if base_url else None),
+                              settings.get('probe_interval', DEFAULT_INTERVAL),
+                              settings.get('probe_timeout', DEFAULT_TIMEOUT),
+                              max_backoff=settings.get('max_backoff', MAX_BACKOFF))
+                monitor.start()
+                _shared['monitor'] = monitor
+            return _shared['monitor']
+
+    def is_online(self) -> bool:
+        """Last known state; never blocks"""
+        return self.online is not False
+
+    def add_listener(self, callback: Callable[[bool], None]):
+        """Call callback(online) from the monitor thread whenever the state flips"""
+        self._listeners.append(callback)
+
+    def record_success(self):
+        """A request to a metadata endpoint got an answer"""
+        with self._lock:
+            changed = self.online is not True
+            self.online = True
+            self.failures = 0
+            self.next_probe = time.monotonic() + self.interval
+        if changed:
+            self._changed(True)
+
+    def record_failure(self):
+        """A request failed at the network level; opens the circuit with backoff"""
+        with self._lock:
+            changed = self.online is not False
+            self.online = False
+            self.failures += 1
+            delay = min(self.max_backoff, self.base_backoff * 2 ** (self.failures - 1))
+            self.next_probe = time.monotonic() + delay
+        self._wake.set()
+        if changed:
+            self._changed(False)
+        else:
+            logging.debug(f"Metadata endpoints still unreachable, next probe in {delay:.0f}s")
+
+    def _changed(self, online: bool):
+        self.changed_at = time.time()
+        logging.info(f"Network {'online' if online else 'offline'} (metadata endpoints "
+                     f"{'reachable' if online else 'unreachable'})")
+        for callback in list(self._listeners):
+            try:
+                callback(online)
+            except Exception as e:
+                logging.error(f"Connectivity listener failed: {e}")
+
+    def _probe_endpoints(self) -> bool:
+        for url in self.endpoints:
+            request = urllib.request.Request(url, method='HEAD')
+            try:
+                urllib.request.urlopen(request, timeout=self.timeout).close()
+                return True
+            except urllib.error.HTTPError:
+                return True  # Any HTTP answer (even 503 rate limiting) means it is reachable
+            except (urllib.error.URLError, OSError) as e:
+                logging.debug(f"Connectivity probe of {url} failed: {e}")
+        return False
+
+    def check(self):
+        """Probe now and update the state"""
+        if self.probe():
+            self.record_success()
+        else:
+            self.record_failure()
+
+    def start(self):
+        if self._thread is None:
+            self._thread = aio.adopt('connectivity', self.step, self._wake, self._open, self._close)
+        if self._thread is None:
+            self._thread = threading.Thread(target=self.run, name='connectivity', daemon=True)
+            self._thread.start()
+
+    def wake(self):
+        """Probe as soon as possible (e.g. after a configuration change)"""
+        with self._lock:
+            self.next_probe = 0.0
+        self._wake.set()
+
+    def _open(self) -> Optional[int]:
+        self._sock = _route_socket()
+        return self._sock.fileno() if self._sock is not None else None
+
+    def _close(self):
+        if self._sock is not None:
+            self._sock.close()
+            self._sock = None
+
+    def step(self, readable: bool = False) -> float:
+        """
+        Re-probe after a route change or when a probe is due; returns the
+        seconds until the next probe
+
+        Never sleeps: after a route change it returns the rest of the settle
+        time and probes on the call after that.
+        """
+        if readable and self._sock is not None and _drain(self._sock) and self.settle_until is None:
+            # Give DHCP and routes a moment, then re-probe without backoff
+            logging.debug("Network link or route changed, re-probing once it settles")
+            self.settle_until = time.monotonic() + SETTLE_SECONDS
+        if self.settle_until is not None:
+            remaining = self.settle_until - time.monotonic()
+            if remaining > 0:
+                return remaining
+            self.settle_until = None
+            with self._lock:
+                self.failures = 0
+                self.next_probe = 0.0
+        if self.next_probe <= time.monotonic():
+            self.check()
+        return max(0.0, self.next_probe - time.monotonic())
+
+    def run(self, stop_event: threading.Event = None):
+        stop_event = stop_event or threading.Event()
+        self._open()
+        try:
+            readable = False
+            while not stop_event.is_set():
+                remaining = self.step(readable)
+                readable = False
+                if remaining <= 0:
+                    continue
+                if self._sock is None:
+                    self._wake.wait(remaining)
+                    self._wake.clear()
+                    continue
+                # Short select timeout so wake() and request outcomes are noticed
+                readable = bool(select.select([self._sock], [], [], min(remaining, 1.0))[0])
+        finally:
+            self._close()
+
+
+def _route_socket() -> Optional[socket.socket]:
+    """rtnetlink socket subscribed to link/address/route changes, or None"""
+    try:
+        sock = socket.socket(socket.AF_NETLINK, socket.SOCK_RAW, NETLINK_ROUTE)
+    except (OSError, AttributeError) as e:
+        logging.debug(f"rtnetlink unavailable ({e}), relying on periodic probes")
+        return None
+    try:
+        sock.bind((0, RTMGRP_LINK | RTMGRP_IPV4_IFADDR | RTMGRP_IPV4_ROUTE
+                   | RTMGRP_IPV6_IFADDR | RTMGRP_IPV6_ROUTE))
+        sock.setblocking(False)
+    except OSError as e:
+        logging.debug(f"rtnetlink subscription failed ({e}), relying on periodic probes")
+        sock.close()
+        return None
+    return sock
+
+
+def _drain(sock: socket.socket) -> bool:
+    """Discard queued notifications; True if there were any"""
+    seen = False
+    while True:
+        try:
+            sock.recv(65536)
+            seen = True
+        except (BlockingIOError, InterruptedError):
+            return seen
+        except OSError:
+            return True  # ENOBUFS: changes were dropped, treat as a change
@@ -0,0 +1,313 @@
+#!/usr/bin/env python3
+"""
+Content-hash deduplication of the music library
+
+Re-rips, other pressings and Unknown_Artist_NN copies can leave the same
+audio in the library several times under different names and tags. Every
+track file listed in the library catalog gets an audio digest that ignores
+tags: FLAC's STREAMINFO MD5 of the decoded PCM, or a hash of the
+memory-mapped audio frames with tag blocks cut off (MP3, and FLAC files
+encoded without an MD5). Digests are stored next to the catalog with the
+size and mtime they were computed from, so a refresh only hashes files that
+are new or changed, spread over a process pool. Identical tracks and whole
+identical albums are reported; byte-identical copies can be replaced with
+hardlinks.
+
+Usage: python3 -m autoripper.dedup [--db PATH] [--workers N] report|link [--dry-run]
+"""
+
+import filecmp
+import hashlib
+import json
+import logging
+import mmap
+import os
+import sqlite3
+import struct
+import sys
+import time
+from concurrent.futures import ProcessPoolExecutor
+from typing import Dict, List, NamedTuple, Optional, Tuple
+
+from autoripper.catalog import SCHEMA as CATALOG_SCHEMA, default_catalog_path
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS content_hashes (
+    path TEXT PRIMARY KEY,
+    size INTEGER NOT NULL,
+    mtime REAL NOT NULL,
+    device INTEGER NOT NULL,
+    inode INTEGER NOT NULL,
+    digest TEXT NOT NULL
+);
+CREATE INDEX IF NOT EXISTS content_hashes_digest ON content_hashes (digest);
+"""
+
+HASH_CHUNK = 1024 * 1024
+# Files handed to a worker process per round trip
+BATCH_SIZE = 64
+COMMIT_EVERY = 500
+ZERO_MD5 = bytes(16)
+
+
+class TrackCopy(NamedTuple):
+    path: str
+    album_path: str
+    size: int
+    device: int
+    inode: int
+    placeholder: bool
+
+
+def _hash_range(data, start: int, end: int) -> str:
+    digest = hashlib.blake2b(digest_size=20)
+    view = memoryview(data)
+    try:
+        for offset in range(start, end, HASH_CHUNK):
+            digest.update(view[offset:min(offset + HASH_CHUNK, end)])
+    finally:
+        view.release()
+    return digest.hexdigest()
+
+
+def _flac_audio(data) -> Tuple[Optional[bytes], int]:
+    """(STREAMINFO MD5, offset of the first audio frame) of a FLAC file"""
+    if data[:4] != b'fLaC':
+        raise ValueError("not a FLAC file")
+    offset = 4
+    md5 = None
+    while offset + 4 <= len(data):
+        header = data[offset]
+        length = int.from_bytes(data[offset + 1:offset + 4], 'big')
+        if header & 0x7f == 0 and length >= 34:  # STREAMINFO
+            md5 = bytes(data[offset + 4 + 18:offset + 4 + 34])
+        offset += 4 + length
+        if header & 0x80:  # Last metadata block
+            break
+    return md5, offset
+
+
+def _mp3_audio(data) -> Tuple[int, int]:
+    """Byte range of an MP3 file's audio frames, without ID3v2/ID3v1/APE tags"""
+    start, end = 0, len(data)
+    while data[start:start + 3] == b'ID3' and start + 10 <= end:
+        size = 0
+        for byte in data[start + 6:start + 10]:
+            size = (size << 7) | (byte & 0x7f)
+        start += 10 + size + (10 if data[start + 5] & 0x10 else 0)
+    if end - start >= 128 and data[end - 128:end - 125] == b'TAG':
+        end -= 128
+    if end - start >= 32 and data[end - 32:end - 24] == b'APETAGEX':
+        size, flags = struct.unpack('<I4xI', data[end - 20:end - 8])
+        end -= size + (32 if flags & 0x80000000 else 0)
+    return start, max(start, end)
+
+
+def audio_digest(path: str, fmt: str) -> Optional[Tuple[str, int, float, int, int, str]]:
+    """
+    (path, size, mtime, device, inode, digest) of one track file, or None if
+    it can't be read. Runs in pool workers, so it only touches the file.
+    """
+    try:
+        with open(path, 'rb') as f:
+            st = os.fstat(f.fileno())
+            if st.st_size == 0:
+                return path, 0, st.st_mtime, st.st_dev, st.st_ino, f"{fmt}:empty"
+            with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as data:
+                if fmt == 'flac':
+                    md5, start = _flac_audio(data)
+                    if md5 and md5 != ZERO_MD5:
+                        digest = f"pcm-md5:{md5.hex()}"
+                    else:
+                        digest = f"flac:{_hash_range(data, start, len(data))}"
+                elif fmt == 'mp3':
+                    digest = f"mp3:{_hash_range(data, *_mp3_audio(data))}"
+                else:
+                    digest = f"{fmt}:{_hash_range(data, 0, len(data))}"
+        return path, st.st_size, st.st_mtime, st.st_dev, st.st_ino, digest
+    except (OSError, ValueError) as e:
+        logging.warning(f"Could not hash {path}: {e}")
+        return None
+
+
+def _audio_digest(job: Tuple[str, str]):
+    return audio_digest(*job)
+
+
+def _same_bytes(first: str, second: str) -> bool:
+    return filecmp.cmp(first, second, shallow=False)
+
+
+class DuplicateFinder:
+    """Audio digests of the catalog's track files and the duplicates among them"""
+
+    def __init__(self, catalog_path: str, workers: int = None):
+        self.catalog_path = catalog_path
+        self.workers = workers or os.cpu_count() or 1
+        self._db = sqlite3.connect(catalog_path, isolation_level=None)
+        self._db.execute("PRAGMA journal_mode=WAL")
+        self._db.execute("PRAGMA synchronous=NORMAL")
+        self._db.executescript(CATALOG_SCHEMA + SCHEMA)
+
+    @classmethod
+    def from_config(cls, config: dict, workers: int = None) -> 'DuplicateFinder':
+        return cls(default_catalog_path(config),
+                   workers or config.get('dedup', {}).get('workers'))
+
+    def refresh(self) -> int:
+        """Hash every catalogued track that is new or changed since it was last hashed"""
+        self._db.execute("DELETE FROM content_hashes WHERE path NOT IN (SELECT path FROM tracks)")
+        stale = self._db.execute(
+            "SELECT t.path, t.format FROM tracks t LEFT JOIN content_hashes h ON h.path = t.path "
+            "WHERE h.path IS NULL OR h.size != t.size OR h.mtime != t.mtime").fetchall()
+        if not stale:
+            return 0
+        logging.info(f"Hashing {len(stale)} new or changed track files with {self.workers} workers")
+        started = time.monotonic()
+        hashed = 0
+        rows = []
+        with ProcessPoolExecutor(max_workers=self.workers) as pool:
+            for result in pool.map(_audio_digest, stale, chunksize=BATCH_SIZE):
+                if result is None:
+                    continue
+                rows.append(result)
+                if len(rows) >= COMMIT_EVERY:
+                    hashed += self._store(rows)
+                    rows = []
+        hashed += self._store(rows)
+        elapsed = time.monotonic() - started
+        logging.info(f"Hashed {hashed} files in {elapsed:.1f}s")
+        return hashed
+
+    def _store(self, rows: list) -> int:
+        if rows:
+            self._db.execute("BEGIN")
+            self._db.executemany(
+                "INSERT OR REPLACE INTO content_hashes (path, size, mtime, device, inode, digest) "
+                "VALUES (?, ?, ?, ?, ?, ?)", rows)
+            self._db.execute("COMMIT")
+        return len(rows)
+
+    def track_groups(self) -> Dict[str, List[TrackCopy]]:
+        """digest -> every copy of that audio, for digests held by more than one file"""
+        rows = self._db.execute(
+            "SELECT h.digest, h.path, t.album_path, h.size, h.device, h.inode, "
+            "COALESCE(a.metadata_source = 'pending', 0) "
+            "FROM content_hashes h JOIN tracks t ON t.path = h.path "
+            "LEFT JOIN albums a ON a.path = t.album_path "
+            "WHERE h.digest IN (SELECT digest FROM content_hashes GROUP BY digest HAVING COUNT(*) > 1) "
+            "ORDER BY h.digest, h.path").fetchall()
+        groups: Dict[str, List[TrackCopy]] = {}
+        for digest, *copy in rows:
+            groups.setdefault(digest, []).append(TrackCopy(*copy[:5], bool(copy[5])))
+        return groups
+
+    def album_groups(self) -> List[List[str]]:
+        """Sets of album directories whose track files all hold the same audio"""
+        signatures: Dict[str, List[Tuple[int, str, str]]] = {}
+        for album_path, number, fmt, digest in self._db.execute(
+                "SELECT t.album_path, t.number, t.format, h.digest FROM tracks t "
+                "JOIN content_hashes h ON h.path = t.path"):
+            signatures.setdefault(album_path, []).append((number, fmt, digest))
+        albums: Dict[Tuple, List[str]] = {}
+        for album_path, tracks in signatures.items():
+            albums.setdefault(tuple(sorted(tracks)), []).append(album_path)
+        return sorted(sorted(paths) for paths in albums.values() if len(paths) > 1)
+
+    @staticmethod
+    def keeper(copies: List[TrackCopy]) -> TrackCopy:
+        """The copy the others are linked to: named albums before placeholders, most links first"""
+        links = {}
+        for copy in copies:
+            links[copy.device, copy.inode] = links.get((copy.device, copy.inode), 0) + 1
+        return min(copies, key=lambda copy: (copy.placeholder, -links[copy.device, copy.inode], copy.path))
+
+    def link(self, dry_run: bool = False) -> Tuple[int, int]:
+        """
+        Replace byte-identical copies with hardlinks to one file. Copies
+        that only share the audio (different tags) and copies on another
+        filesystem are left alone. Returns (files linked, bytes freed).
+        """
+        linked = freed = 0
+        for digest, copies in self.track_groups().items():
+            keeper = self.keeper(copies)
+            for copy in copies:
+                if (copy.device, copy.inode) == (keeper.device, keeper.inode):
+                    continue
+                if copy.device != keeper.device or copy.size != keeper.size:
+                    continue
+                try:
+                    if not _same_bytes(keeper.path, copy.path):
+                        continue
+                    if not dry_run:
+                        tmp_path = os.path.join(os.path.dirname(copy.path),
+                                                f".{os.path.basename(copy.path)}.link")
+                        os.link(keeper.path, tmp_path)
+                        os.replace(tmp_path, copy.path)
+                        st = os.stat(copy.path)
+                        self._db.execute(
+                            "UPDATE content_hashes SET size = ?, mtime = ?, device = ?, inode = ? "
+                            "WHERE path = ?", (st.st_size, st.st_mtime, st.st_dev, st.st_ino, copy.path))
+                        # The file now has the keeper's mtime; don't rehash it next time
+                        self._db.execute("UPDATE tracks SET size = ?, mtime = ? WHERE path = ?",
+                                         (st.st_size, st.st_mtime, copy.path))
+                except OSError as e:
+                    logging.warning(f"Could not link {copy.path} to {keeper.path}: {e}")
+                    continue
+                logging.info(f"{'Would link' if dry_run else 'Linked'} {copy.path} -> {keeper.path}")
+                linked += 1
+                freed += copy.size
+        return linked, freed
+
+    def report(self) -> dict:
+        """Identical albums, plus identical tracks outside those albums"""
+        album_groups = self.album_groups()
+        in_album_groups = {path for group in album_groups for path in group}
+        tracks = []
+        reclaimable = 0
+        for digest, copies in self.track_groups().items():
+            inodes = {(copy.device, copy.inode): copy.size for copy in copies}
+            reclaimable += sum(inodes.values()) - max(inodes.values())
+            if not all(copy.album_path in in_album_groups for copy in copies):
+                tracks.append({'digest': digest, 'paths': [copy.path for copy in copies],
+                               'hardlinked': len(inodes) == 1})
+        return {'albums': album_groups, 'tracks': tracks, 'reclaimable_bytes': reclaimable}
+
+    def close(self):
+        self._db.close()
+
+
+def main():
+    args = sys.argv[1:]
+    options = {}
+    for option in ('--db', '--workers'):
+        if option in args:
+            index = args.index(option)
+            options[option] = args[index + 1]
+            del args[index:index + 2]
+    dry_run = '--dry-run' in args
+    args = [arg for arg in args if arg != '--dry-run']
+    if not args or args[0] not in ('report', 'link'):
+        print(__doc__.strip().split('Usage:')[1].strip(), file=sys.stderr)
+        sys.exit(2)
+
+    logging.basicConfig(level=logging.INFO, format='%(message)s')
+    config = {}
+    if os.path.exists('/opt/auto-ripper/config.json'):
+        with open('/opt/auto-ripper/config.json') as f:
+            config = json.load(f)
+    workers = int(options['--workers']) if '--workers' in options else None
+    finder = (DuplicateFinder(options['--db'], workers) if '--db' in options
+              else DuplicateFinder.from_config(config, workers))
+    finder.refresh()
+    if args[0] == 'link':
+        linked, freed = finder.link(dry_run)
+        print(f"{'Would link' if dry_run else 'Linked'} {linked} files, "
+              f"{freed / 1024 / 1024:.1f} MB {'reclaimable' if dry_run else 'freed'}")
+    else:
+        print(json.dumps(finder.report(), indent=2))
+    finder.close()
+
+
+if __name__ == "__main__":
+    main()
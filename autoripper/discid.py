@@ -0,0 +1,182 @@
+#!/usr/bin/env python3
+"""
+Native MusicBrainz and freedb disc ID computation
+
+Reads the TOC once (through autoripper.cdrom) and derives both disc IDs,
+track offsets and lengths without spawning cd-discid.
+
+Usage: python3 -m autoripper.discid [--musicbrainz|--json] [/dev/sr0]
+"""
+
+import base64
+import hashlib
+import json
+import sys
+from collections import namedtuple
+from typing import List, Tuple
+
+from autoripper.cdrom import CDROM_LEADOUT, TocEntry, open_drive
+
+# Frames (sectors) per second and the 2 second lead-in every address includes
+FRAMES_PER_SECOND = 75
+LEAD_IN_FRAMES = 150
+# Gap between the audio session lead-out and the data session on enhanced CDs
+SESSION_GAP_FRAMES = 11400
+
+_TocBase = namedtuple('Toc', ['first_track', 'last_track', 'offsets', 'leadout', 'data_tracks'])
+
+
+class Toc(_TocBase):
+    """
+    Immutable table of contents
+
+    offsets are the absolute track start addresses (LBA + 150) of every
+    track, leadout the absolute lead-out address and data_tracks the track
+    numbers flagged as data.
+    """
+
+    __slots__ = ()
+
+    @classmethod
+    def from_entries(cls, entries: List[TocEntry]) -> 'Toc':
+        """Build a Toc from cdrom.TocEntry records (lead-out last)"""
+        tracks = [entry for entry in entries if entry.track != CDROM_LEADOUT]
+        leadouts = [entry for entry in entries if entry.track == CDROM_LEADOUT]
+        if not tracks or not leadouts:
+            raise ValueError("TOC has no tracks or no lead-out")
+        return cls(
+            first_track=tracks[0].track,
+            last_track=tracks[-1].track,
+            offsets=tuple(entry.lba + LEAD_IN_FRAMES for entry in tracks),
+            leadout=leadouts[-1].lba + LEAD_IN_FRAMES,
+            data_tracks=tuple(entry.track for entry in tracks if entry.is_data),
+        )
+
+    @classmethod
+    def from_dict(cls, data: dict) -> 'Toc':
+        """Inverse of as_dict"""
+        return cls(data['first_track'], data['last_track'], tuple(data['offsets']),
+                   data['leadout'], tuple(data.get('data_tracks', ())))
+
+    @property
+    def track_count(self) -> int:
+        return len(self.offsets)
+
+    @property
+    def audio_session(self) -> Tuple[int, Tuple[int, ...], int]:
+        """
+        (last_track, offsets, leadout) of the audio session
+
+        Trailing data tracks (enhanced CD / CD-Extra) are dropped and the
+        lead-out moved back by the session gap, as MusicBrainz expects.
+        """
+        last = self.last_track
+        offsets = self.offsets
+        leadout = self.leadout
+        while last in self.data_tracks and last > self.first_track:
+            leadout = offsets[-1] - SESSION_GAP_FRAMES
+            offsets = offsets[:-1]
+            last -= 1
+        return last, offsets, leadout
+
+    @property
+    def audio_tracks(self) -> Tuple[int, ...]:
+        """Track numbers that hold audio"""
+        return tuple(number for number in range(self.first_track, self.last_track + 1)
+                     if number not in self.data_tracks)
+
+    @property
+    def track_lengths(self) -> Tuple[int, ...]:
+        """Length of each track in the audio session, in frames"""
+        _, offsets, leadout = self.audio_session
+        ends = offsets[1:] + (leadout,)
+        return tuple(end - start for start, end in zip(offsets, ends))
+
+    @property
+    def total_seconds(self) -> int:
+        return self.leadout // FRAMES_PER_SECOND
+
+    @property
+    def musicbrainz_id(self) -> str:
+        """MusicBrainz disc ID (SHA-1 of the audio session, MB base64 alphabet)"""
+        last, offsets, leadout = self.audio_session
+        digest = hashlib.sha1()
+        digest.update(f"{self.first_track:02X}{last:02X}{leadout:08X}".encode('ascii'))
+        for number in range(1, 100):
+            index = number - self.first_track
+            offset = offsets[index] if 0 <= index < len(offsets) else 0
+            digest.update(f"{offset:08X}".encode('ascii'))
+        encoded = base64.b64encode(digest.digest()).decode('ascii')
+        return encoded.replace('+', '.').replace('/', '_').replace('=', '-')
+
+    @property
+    def musicbrainz_toc(self) -> str:
+        """TOC string for the MusicBrainz ?toc= fuzzy lookup"""
+        last, offsets, leadout = self.audio_session
+        return ' '.join(str(value) for value in (self.first_track, last, leadout) + offsets)
+
+    @property
+    def freedb_id(self) -> str:
+        """freedb/CDDB disc ID over every track, as printed by cd-discid"""
+        checksum = 0
+        for offset in self.offsets:
+            checksum += _digit_sum(offset // FRAMES_PER_SECOND)
+        length = self.leadout // FRAMES_PER_SECOND - self.offsets[0] // FRAMES_PER_SECOND
+        value = ((checksum % 0xFF) << 24) | (length << 8) | self.track_count
+        return f"{value:08x}"
+
+    def cd_discid_line(self) -> str:
+        """Same output format as the cd-discid tool"""
+        fields = [self.freedb_id, str(self.track_count)]
+        fields += [str(offset) for offset in self.offsets]
+        fields.append(str(self.total_seconds))
+        return ' '.join(fields)
+
+    def as_dict(self) -> dict:
+        return {
+            'musicbrainz_id': self.musicbrainz_id,
+            'freedb_id': self.freedb_id,
+            'first_track': self.first_track,
+            'last_track': self.last_track,
+            'offsets': list(self.offsets),
+            'leadout': self.leadout,
+            'data_tracks': list(self.data_tracks),
+            'track_lengths': list(self.track_lengths),
+        }
+
+
+def _digit_sum(number: int) -> int:
+    total = 0
+    while number > 0:
+        total += number % 10
+        number //= 10
+    return total
+
+
+def read_toc(device: str) -> Toc:
+    """Read the TOC of the disc in device (raises OSError/ValueError)"""
+    with open_drive(device) as drive:
+        return Toc.from_entries(drive.read_toc())
+
+
+def main():
+    args = [arg for arg in sys.argv[1:] if not arg.startswith('--')]
+    flags = [arg for arg in sys.argv[1:] if arg.startswith('--')]
+    device = args[0] if args else '/dev/sr0'
+
+    try:
+        toc = read_toc(device)
+    except (OSError, ValueError) as e:
+        print(f"Could not read TOC from {device}: {e}", file=sys.stderr)
+        sys.exit(1)
+
+    if '--musicbrainz' in flags:
+        print(toc.musicbrainz_id)
+    elif '--json' in flags:
+        print(json.dumps(toc.as_dict()))
+    else:
+        print(toc.cd_discid_line())
+
+
+if __name__ == "__main__":
+    main()
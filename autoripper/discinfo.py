@@ -0,0 +1,63 @@
+"""
+Per-album record of the disc a rip came from
+
+Extraction and metadata are separate stages: the audio is read once and the
+names and tags picked at rip time are only the best answer available then.
+Every album directory gets a small .disc-info.json holding the disc IDs,
+the TOC and where the metadata came from, so an album ripped under
+placeholder names can be tagged and renamed later without the disc.
+"""
+
+import json
+import logging
+import os
+import time
+from typing import Dict, List, Optional
+
+from autoripper.discid import Toc
+
+DISC_INFO_NAME = '.disc-info.json'
+
+# metadata_source of an album still named Unknown_Artist/Unknown_Album
+PENDING = 'pending'
+
+
+def disc_info(toc: Toc, formats: List[str], metadata_source: Optional[str],
+              checksums: Dict[int, dict] = None) -> dict:
+    """checksums: track number -> TrackChecksum.as_dict() of the verified reads"""
+    return {
+        'disc_id': toc.musicbrainz_id,
+        'freedb_id': toc.freedb_id,
+        'musicbrainz_toc': toc.musicbrainz_toc,
+        'toc': toc.as_dict(),
+        'tracks': list(toc.audio_tracks),
+        'formats': list(formats),
+        'metadata_source': metadata_source or PENDING,
+        'checksums': {str(number): checksum for number, checksum in (checksums or {}).items()},
+        'ripped_at': time.time(),
+    }
+
+
+def write_disc_info(album_dir: str, info: dict) -> str:
+    """Atomically (re)write the album's disc info file"""
+    path = os.path.join(album_dir, DISC_INFO_NAME)
+    tmp_path = f"{path}.tmp"
+    with open(tmp_path, 'w') as f:
+        json.dump(info, f, indent=2)
+    os.replace(tmp_path, path)
+    return path
+
+
+def read_disc_info(album_dir: str) -> Optional[dict]:
+    try:
+        with open(os.path.join(album_dir, DISC_INFO_NAME)) as f:
+            return json.load(f)
+    except FileNotFoundError:
+        return None
+    except (OSError, ValueError) as e:
+        logging.warning(f"Unreadable disc info in {album_dir}: {e}")
+        return None
+
+
+def needs_metadata(info: Optional[dict]) -> bool:
+    return bool(info) and info.get('metadata_source') == PENDING
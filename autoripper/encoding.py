@@ -0,0 +1,226 @@
+"""
+Encoding resources shared between drive workers
+
+EncoderSlots caps concurrent CPU-heavy encodes across all drives, and
+EncoderPool runs flac/lame in the background under those slots. tag_file
+rewrites the tags of finished files (metaflac/eyeD3).
+"""
+
+import logging
+import os
+import re
+import threading
+import time
+from concurrent.futures import Future, ThreadPoolExecutor
+from typing import Dict, List, Optional, Tuple
+
+from autoripper import metrics
+from autoripper.aio import run_command
+
+
+def default_encoder_slots() -> int:
+    """
+    Pick a sensible number of concurrent encodes for this machine.
+    abcde runs MAXPROCS=2 encoders per rip, so one slot per two cores.
+    """
+    return max(1, (os.cpu_count() or 2) // 2)
+
+
+class EncoderSlots:
+    """
+    Bounded pool of CPU-heavy encoding slots shared by every drive worker.
+
+    Used as a context manager around an encode so that adding drives scales
+    extraction while encoding stays capped at what the CPU can sustain.
+    """
+
+    def __init__(self, slots: int = None):
+        self.slots = slots or default_encoder_slots()
+        self._semaphore = threading.BoundedSemaphore(self.slots)
+        self._lock = threading.Lock()
+        self._busy = 0
+
+    @property
+    def busy(self) -> int:
+        """Number of slots currently held"""
+        return self._busy
+
+    def acquire(self):
+        if not self._semaphore.acquire(blocking=False):
+            logging.info(f"All {self.slots} encoder slots busy, waiting...")
+            start = time.time()
+            self._semaphore.acquire()
+            logging.info(f"Encoder slot acquired after {time.time() - start:.1f}s")
+        with self._lock:
+            self._busy += 1
+
+    def release(self):
+        with self._lock:
+            self._busy -= 1
+        self._semaphore.release()
+
+    def __enter__(self):
+        self.acquire()
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.release()
+        return False
+
+
+class EncoderPool:
+    """
+    Shared pool that runs encoder processes (flac, lame) in the background
+
+    Worker threads only supervise the external encoder processes; the
+    number that run at once is capped by the shared EncoderSlots, so the
+    pool is safe to share between drives.
+    """
+
+    def __init__(self, slots: EncoderSlots):
+        self.slots = slots
+        self._executor = ThreadPoolExecutor(max_workers=slots.slots, thread_name_prefix='encoder')
+        self._lock = threading.Lock()
+        self._pending = 0
+
+    @property
+    def queue_depth(self) -> int:
+        """Encode jobs submitted but not finished yet"""
+        return self._pending
+
+    def submit(self, fn, *args, **kwargs) -> Future:
+        """Run fn(*args, **kwargs) while holding an encoder slot"""
+        with self._lock:
+            self._pending += 1
+        return self._executor.submit(self._run, fn, args, kwargs)
+
+    def submit_after(self, ready: Optional[Future], fn, *args, **kwargs):
+        """
+        Like submit(), but queue fn only once ready (e.g. a metadata lookup)
+        is done, so waiting for it never holds a worker or an encoder slot
+        """
+        if ready is None or ready.done():
+            self.submit(fn, *args, **kwargs)
+            return
+        with self._lock:
+            self._pending += 1
+        ready.add_done_callback(lambda _: self._executor.submit(self._run, fn, args, kwargs))
+
+    def _run(self, fn, args, kwargs):
+        try:
+            with self.slots:
+                return fn(*args, **kwargs)
+        finally:
+            with self._lock:
+                self._pending -= 1
+
+    def shutdown(self, wait: bool = True):
+        self._executor.shutdown(wait=wait)
+
+
+FORMAT_EXTENSIONS = {'flac': 'flac', 'mp3': 'mp3'}
+_FORMATS_BY_EXTENSION = {ext: fmt for fmt, ext in FORMAT_EXTENSIONS.items()}
+_TRACK_FILE = re.compile(r'^(\d+)\D.*\.([A-Za-z0-9]+)$')
+
+
+def track_files(album_dir: str) -> Dict[Tuple[int, str], str]:
+    """(track number, format) -> path of every encoded track in album_dir"""
+    files = {}
+    for name in os.listdir(album_dir):
+        match = _TRACK_FILE.match(name)
+        if match and match.group(2).lower() in _FORMATS_BY_EXTENSION:
+            files[int(match.group(1)), _FORMATS_BY_EXTENSION[match.group(2).lower()]] = \
+                os.path.join(album_dir, name)
+    return files
+
+
+def encoder_command(fmt: str, source: str, destination: str, config: dict,
+                    tags: dict = None) -> List[str]:
+    """
+    Command line that encodes the WAV source into destination.
+
+    tags may hold artist, album, title, tracknumber, date and genre.
+    """
+    quality = config.get('cd_quality', {})
+    tags = tags or {}
+    if fmt == 'flac':
+        command = ['flac', '--silent', '--verify', f"-{quality.get('flac_compression', 8)}",
+                   '-f', '-o', destination]
+        for key, value in tags.items():
+            if value:
+                command.append(f"--tag={key.upper()}={value}")
+        return command + [source]
+    if fmt == 'mp3':
+        command = ['lame', '--quiet', f"-{quality.get('mp3_quality', 'V0')}", '--vbr-new']
+        flags = {'artist': '--ta', 'album': '--tl', 'title': '--tt',
+                 'tracknumber': '--tn', 'date': '--ty', 'genre': '--tg'}
+        for key, value in tags.items():
+            if value and key in flags:
+                command += [flags[key], str(value)]
+        return command + [source, destination]
+    raise ValueError(f"Unsupported output format: {fmt}")
+
+
+def encode_file(fmt: str, source: str, destination: str, config: dict,
+                tags: dict = None, timeout: int = 1800) -> bool:
+    """Encode source into destination atomically (written as .part, then renamed)"""
+    partial = f"{destination}.part"
+    command = encoder_command(fmt, source, partial, config, tags)
+    try:
+        result = run_command(command, timeout, tail_lines=20)
+    except OSError as e:
+        logging.error(f"{fmt} encoder failed for {source}: {e}")
+        _remove_quietly(partial)
+        return False
+    if not result.ok:
+        logging.error(f"{fmt} encoder failed for {source} ({result.describe()}): "
+                      f"{result.output[-500:]}")
+        _remove_quietly(partial)
+        return False
+    metrics.TRACK_ENCODE_SECONDS.observe(result.duration, format=fmt)
+    os.replace(partial, destination)
+    return True
+
+
+def tag_command(fmt: str, path: str, tags: dict) -> List[str]:
+    """Command line that replaces the tags of an encoded file in place"""
+    if fmt == 'flac':
+        command = ['metaflac', '--remove-all-tags']
+        for key, value in tags.items():
+            if value:
+                command.append(f"--set-tag={key.upper()}={value}")
+        return command + [path]
+    if fmt == 'mp3':
+        command = ['eyeD3', '--quiet', '--remove-all']
+        flags = {'artist': '--artist', 'album': '--album', 'title': '--title',
+                 'date': '--release-year', 'genre': '--genre'}
+        for key, value in tags.items():
+            if not value:
+                continue
+            if key == 'tracknumber':
+                number, _, total = str(value).partition('/')
+                command += ['--track', number] + (['--track-total', total] if total else [])
+            elif key in flags:
+                command += [flags[key], str(value)]
+        return command + [path]
+    raise ValueError(f"Unsupported output format: {fmt}")
+
+
+def tag_file(fmt: str, path: str, tags: dict, timeout: int = 120) -> bool:
+    command = tag_command(fmt, path, tags)
+    try:
+        result = run_command(command, timeout, tail_lines=20)
+    except OSError as e:
+        logging.error(f"Tagging {path} failed: {e}")
+        return False
+    if not result.ok:
+        logging.error(f"Tagging {path} failed ({result.describe()}): {result.output[-500:]}")
+        return False
+    return True
+
+
+def _remove_quietly(path: str):
+    try:
+        os.remove(path)
+    except OSError:
+        pass
@@ -0,0 +1,351 @@
+#!/usr/bin/env python3
+"""
+Structured, non-blocking event log
+
+setup() replaces the synchronous FileHandler: log calls only put the
+record on a queue, and one background thread writes it to the console,
+the human-readable auto-ripper.log and events.jsonl, one JSON object per
+line with the drive, disc ID and phase (the current tracing span) of the
+record plus any duration given with extra={'duration': ...}. Files are
+flushed when the queue runs dry or on warnings, so a busy rip batches its
+writes to the SD card. Both files are rotated while running, once they
+reach logging.max_mb or are logging.max_age_hours old; rotated segments
+are gzipped by a separate thread and only the newest logging.keep are
+kept. Every drive daemon writes to the same files: rotation and pruning
+happen under a file lock, the other writers notice the file was replaced
+and reopen it, and a segment is only compressed once its writers have
+moved on.
+
+The command line filters events by disc, drive, phase, level and age,
+reading only the segments that can hold matching events.
+
+Usage: python3 -m autoripper.eventlog [--file PATH] [--disc ID] [--drive NAME] [--phase NAME] [--level LEVEL] [--since HOURS] [--json]
+"""
+
+import atexit
+import glob
+import gzip
+import json
+import logging
+import os
+import queue
+import re
+import shutil
+import sys
+import threading
+import time
+from logging.handlers import QueueHandler, QueueListener
+from typing import Iterator, List, Optional
+
+from autoripper import tracing
+from autoripper.supervisor import DriveLogFilter
+
+DEFAULT_LOG_DIR = '/var/log/auto-ripper'
+DEFAULT_MAX_MB = 10
+DEFAULT_MAX_AGE_HOURS = 24
+DEFAULT_KEEP = 5
+TEXT_FORMAT = '%(asctime)s - %(levelname)s - [%(drive)s] %(message)s'
+# Longest time a record waits in a file buffer while the queue is idle
+FLUSH_INTERVAL = 1.0
+# A rotated segment is left alone this long after its last write, so writers
+# in other processes can notice the rotation and flush what they buffered
+SEGMENT_SETTLE = 5 * FLUSH_INTERVAL
+# Passed with extra={...} and copied into the JSON event
+EXTRA_FIELDS = ('event', 'duration', 'track')
+SEGMENT = re.compile(r'\.(\d{8}-\d{6})(?:-(\d+))?(\.gz)?$')
+
+_compress_lock = threading.Lock()
+
+
+class EventContextFilter(logging.Filter):
+    """Add the disc ID and phase of the current tracing span to records that don't name them"""
+
+    def filter(self, record):
+        span = tracing.current()
+        if span is not None:
+            if getattr(record, 'phase', None) is None:
+                record.phase = span.name
+            if getattr(record, 'disc', None) is None:
+                record.disc = span.root.attrs.get('disc_id')
+        return True
+
+
+class JsonFormatter(logging.Formatter):
+    def format(self, record):
+        event = {'ts': round(record.created, 3), 'level': record.levelname,
+                 'drive': getattr(record, 'drive', '-')}
+        for key in ('disc', 'phase'):
+            value = getattr(record, key, None)
+            if value:
+                event[key] = value
+        for key in EXTRA_FIELDS:
+            value = getattr(record, key, None)
+            if value is not None:
+                event[key] = value
+        event['msg'] = record.getMessage()
+        return json.dumps(event, separators=(',', ':'), default=str)
+
+
+class RotatingLogFile(logging.Handler):
+    """
+    Buffered log file rotated by size and age; the rotated segment is
+    renamed with a timestamp and compressed by compress_segments()
+    """
+
+    def __init__(self, path: str, max_bytes: int = DEFAULT_MAX_MB * 1024 * 1024,
+                 max_age: float = DEFAULT_MAX_AGE_HOURS * 3600, keep: int = DEFAULT_KEEP):
+        super().__init__()
+        self.path = path
+        self.max_bytes = max_bytes
+        self.max_age = max_age
+        self.keep = keep
+        self._file = None
+        self._size = 0
+        self._opened_at = 0.0
+        self._checked_at = 0.0
+
+    def _open(self):
+        self._file = open(self.path, 'ab')
+        self._size = self._file.tell()
+        self._opened_at = self._checked_at = time.time()
+
+    def _reopen(self):
+        self._file.close()
+        self._open()
+
+    def _rotate(self):
+        self._file.flush()
+        with tracing.rotation_lock(self.path):
+            # Another process may have rotated it since we last looked
+            if not tracing.replaced(self._file, self.path):
+                stamp = time.strftime('%Y%m%d-%H%M%S')
+                segment = f"{self.path}.{stamp}"
+                suffix = 1
+                while os.path.exists(segment) or os.path.exists(segment + '.gz'):
+                    segment = f"{self.path}.{stamp}-{suffix}"
+                    suffix += 1
+                os.replace(self.path, segment)
+        self._reopen()
+        threading.Thread(target=compress_segments, args=(self.path, self.keep, SEGMENT_SETTLE),
+                         name='log-compress', daemon=True).start()
+
+    def emit(self, record):
+        try:
+            line = (self.format(record) + '\n').encode('utf-8', 'replace')
+            if self._file is None:
+                self._open()
+            elif time.time() - self._checked_at >= FLUSH_INTERVAL:
+                self._checked_at = time.time()
+                if tracing.replaced(self._file, self.path):
+                    self._reopen()
+            if self._size and (self._size + len(line) > self.max_bytes
+                               or time.time() - self._opened_at >= self.max_age):
+                self._rotate()
+            self._file.write(line)
+            self._size += len(line)
+            if record.levelno >= logging.WARNING:
+                self._file.flush()
+        except Exception:
+            self.handleError(record)
+
+    def flush(self):
+        with self.lock:
+            if self._file is not None:
+                self._file.flush()
+
+    def close(self):
+        with self.lock:
+            if self._file is not None:
+                self._file.close()
+                self._file = None
+        super().close()
+
+
+def segments(path: str) -> List[str]:
+    """Rotated segments of path, oldest first"""
+    found = []
+    for name in glob.glob(glob.escape(path) + '.*'):
+        match = SEGMENT.search(name[len(path):])
+        if match:
+            found.append(((match.group(1), int(match.group(2) or 0)), name))
+    return [name for _, name in sorted(found)]
+
+
+def compress_segments(path: str, keep: int = DEFAULT_KEEP, delay: float = 0):
+    """
+    gzip rotated segments of path that aren't yet and delete all but the
+    newest keep; segments written to in the last SEGMENT_SETTLE seconds are
+    left for a later pass
+    """
+    time.sleep(delay)
+    with _compress_lock:
+        for segment in segments(path):
+            if segment.endswith('.gz'):
+                continue
+            # Per process, as another daemon may be compressing the same segment
+            temp = f"{segment}.gz.{os.getpid()}.tmp"
+            try:
+                if time.time() - os.path.getmtime(segment) < SEGMENT_SETTLE:
+                    continue
+                with open(segment, 'rb') as source, gzip.open(temp, 'wb') as target:
+                    shutil.copyfileobj(source, target)
+                with tracing.rotation_lock(path):
+                    if os.path.exists(segment) and not os.path.exists(segment + '.gz'):
+                        os.replace(temp, segment + '.gz')
+                        os.remove(segment)
+            except FileNotFoundError:
+                pass  # Compressed or pruned by another process meanwhile
+            except OSError as e:
+                logging.warning(f"Could not compress log segment {segment}: {e}")
+            if os.path.exists(temp):
+                os.remove(temp)
+        with tracing.rotation_lock(path):
+            for segment in segments(path)[:-keep or None]:
+                try:
+                    os.remove(segment)
+                except FileNotFoundError:
+                    pass
+                except OSError as e:
+                    logging.warning(f"Could not remove old log segment {segment}: {e}")
+
+
+class BackgroundListener(QueueListener):
+    """QueueListener that flushes its handlers whenever the queue runs dry"""
+
+    def dequeue(self, block):
+        while True:
+            try:
+                return self.queue.get(timeout=FLUSH_INTERVAL)
+            except queue.Empty:
+                for handler in self.handlers:
+                    handler.flush()
+
+
+def default_events_path(config: dict) -> str:
+    return os.path.join(config.get('logging', {}).get('dir', DEFAULT_LOG_DIR), 'events.jsonl')
+
+
+def setup(config: dict) -> Optional[BackgroundListener]:
+    """
+    Route the root logger through a queue to the background writer
+    configured by config.json 'logging'; None if logging is already set up
+    """
+    root = logging.getLogger()
+    if root.handlers:
+        # Already configured by another drive worker in this process
+        return None
+    settings = config.get('logging', {})
+    log_dir = settings.get('dir', DEFAULT_LOG_DIR)
+    os.makedirs(log_dir, exist_ok=True)
+    max_bytes = int(settings.get('max_mb', DEFAULT_MAX_MB) * 1024 * 1024)
+    max_age = settings.get('max_age_hours', DEFAULT_MAX_AGE_HOURS) * 3600
+    keep = settings.get('keep', DEFAULT_KEEP)
+
+    console = logging.StreamHandler()
+    console.setFormatter(logging.Formatter(TEXT_FORMAT))
+    handlers = [console]
+    if settings.get('text_log', True):
+        text_log = RotatingLogFile(os.path.join(log_dir, 'auto-ripper.log'), max_bytes, max_age, keep)
+        text_log.setFormatter(logging.Formatter(TEXT_FORMAT))
+        handlers.append(text_log)
+    events = RotatingLogFile(default_events_path(config), max_bytes, max_age, keep)
+    events.setFormatter(JsonFormatter())
+    handlers.append(events)
+
+    # Context lives in the thread (or task) that logs, so tag records before queueing them
+    queue_handler = QueueHandler(queue.SimpleQueue())
+    queue_handler.addFilter(DriveLogFilter())
+    queue_handler.addFilter(EventContextFilter())
+    root.setLevel(logging.INFO)
+    root.addHandler(queue_handler)
+    listener = BackgroundListener(queue_handler.queue, *handlers, respect_handler_level=True)
+    listener.start()
+    atexit.register(listener.stop)
+
+    # Segments left uncompressed by a crash mid-rotation
+    file_handlers = [handler for handler in handlers if isinstance(handler, RotatingLogFile)]
+    threading.Thread(target=lambda: [compress_segments(handler.path, keep) for handler in file_handlers],
+                     name='log-compress', daemon=True).start()
+    return listener
+
+
+def read_events(path: str, since: float = None, needles: List[str] = ()) -> Iterator[dict]:
+    """
+    Events from the segments and the current file, oldest first. Lines
+    without every needle are skipped before they are parsed, and segments
+    rotated before since are not opened.
+    """
+    for name in segments(path) + [path]:
+        if since is not None and name != path:
+            rotated = time.mktime(time.strptime(SEGMENT.search(name[len(path):]).group(1), '%Y%m%d-%H%M%S'))
+            if rotated < since:
+                continue
+        try:
+            f = gzip.open(name, 'rt', errors='replace') if name.endswith('.gz') else open(name, errors='replace')
+        except FileNotFoundError:
+            continue
+        with f:
+            try:
+                for line in f:
+                    if not all(needle in line for needle in needles):
+                        continue
+                    try:
+                        event = json.loads(line)
+                    except ValueError:
+                        continue  # Torn last line after a crash
+                    if since is None or event.get('ts', 0) >= since:
+                        yield event
+            except (OSError, EOFError) as e:
+                print(f"Skipping rest of {name}: {e}", file=sys.stderr)
+
+
+def format_event(event: dict) -> str:
+    stamp = time.strftime('%Y-%m-%d %H:%M:%S', time.localtime(event.get('ts', 0)))
+    context = ' '.join(str(event[key]) for key in ('disc', 'phase') if key in event)
+    line = f"{stamp} {event.get('level', '-'):<7} [{event.get('drive', '-')}]"
+    if context:
+        line += f" {context}:"
+    line += f" {event.get('msg', '')}"
+    if 'duration' in event:
+        line += f" ({event['duration']}s)"
+    return line
+
+
+def main():
+    args = sys.argv[1:]
+    config = {}
+    if os.path.exists('/opt/auto-ripper/config.json'):
+        with open('/opt/auto-ripper/config.json') as f:
+            config = json.load(f)
+    options = {'--file': default_events_path(config)}
+    as_json = '--json' in args
+    if as_json:
+        args.remove('--json')
+    try:
+        while args:
+            option, value = args.pop(0), args.pop(0)
+            if option not in ('--file', '--disc', '--drive', '--phase', '--level', '--since'):
+                raise ValueError(option)
+            options[option] = value
+        since = time.time() - float(options['--since']) * 3600 if '--since' in options else None
+        level = logging.getLevelName(options.get('--level', 'DEBUG').upper())
+        if not isinstance(level, int):
+            raise ValueError(options['--level'])
+    except (IndexError, ValueError):
+        print(__doc__.strip().split('Usage:')[1].strip(), file=sys.stderr)
+        sys.exit(2)
+
+    # Events are written compactly, so a filter is also a substring of the raw
+    # line: a cheap prefilter before parsing, the exact match is checked after
+    fields = {key: options[f'--{key}'] for key in ('disc', 'drive', 'phase') if f'--{key}' in options}
+    needles = [json.dumps({key: value}, separators=(',', ':'))[1:-1] for key, value in fields.items()]
+    for event in read_events(options['--file'], since, needles):
+        if any(event.get(key) != value for key, value in fields.items()):
+            continue
+        if logging.getLevelName(event.get('level', 'INFO')) < level:
+            continue
+        print(json.dumps(event) if as_json else format_event(event))
+
+
+if __name__ == "__main__":
+    main()
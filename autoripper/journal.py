@@ -0,0 +1,205 @@
+"""
+Crash-safe rip journal
+
+Append-only JSON-lines file recording what has been done for each disc and
+track (read, verified, encoded per format, tagged, moved). Every record is
+a single write followed by fdatasync, so after a crash, power loss or kill
+the journal says exactly which work survived and a restarted ripper can
+pick up from the last completed track instead of re-ripping the disc.
+
+A torn last line from a crash mid-write is cut off when the journal is
+opened, so the next record starts on a line of its own. When the file has
+grown past COMPACT_BYTES, opening it also compacts it down to the
+unfinished discs.
+"""
+
+import json
+import logging
+import os
+import threading
+import time
+from typing import Dict, List, Optional
+
+STAGES = ('read', 'verified', 'encoded', 'tagged', 'moved')
+
+# Rewrite the journal without finished discs once it grows past this size
+COMPACT_BYTES = 1024 * 1024
+
+_shared = {}
+_shared_lock = threading.Lock()
+
+
+def default_journal_path(config: dict) -> str:
+    state_dir = config.get('state_dir', '/var/lib/auto-ripper')
+    return config.get('journal_path') or os.path.join(state_dir, 'journal.jsonl')
+
+
+class DiscState:
+    """Replayed progress of one disc"""
+
+    def __init__(self, disc_id: str, info: dict, started_at: float):
+        self.disc_id = disc_id
+        self.info = info
+        self.started_at = started_at
+        self.status = None  # None while unfinished, else 'done' or 'abandoned'
+        # track number -> stage -> True, or the set of formats for 'encoded'
+        self.tracks: Dict[int, dict] = {}
+
+    @property
+    def finished(self) -> bool:
+        return self.status is not None
+
+    def has(self, number: int, stage: str, fmt: str = None) -> bool:
+        value = self.tracks.get(number, {}).get(stage)
+        if fmt is not None:
+            return bool(value) and fmt in value
+        return bool(value)
+
+    def encoded_formats(self, number: int) -> set:
+        return set(self.tracks.get(number, {}).get('encoded', ()))
+
+    def apply(self, record: dict):
+        event = record['event']
+        if event == 'track':
+            stages = self.tracks.setdefault(record['track'], {})
+            if record['stage'] == 'encoded':
+                stages.setdefault('encoded', set()).add(record['format'])
+            else:
+                stages[record['stage']] = True
+        elif event == 'info':
+            self.info.update(record['info'])
+        elif event == 'finish':
+            self.status = record.get('status', 'done')
+
+
+class Journal:
+    """Append-only per-disc/per-track progress log"""
+
+    def __init__(self, path: str, sync: bool = True):
+        self.path = path
+        self.sync = sync
+        self._lock = threading.Lock()
+        self.discs: Dict[str, DiscState] = {}
+        os.makedirs(os.path.dirname(path) or '.', exist_ok=True)
+        self._replay()
+        if os.path.exists(path) and os.path.getsize(path) > COMPACT_BYTES:
+            self.compact()
+        self._fd = os.open(path, os.O_WRONLY | os.O_APPEND | os.O_CREAT, 0o644)
+
+    @classmethod
+    def shared(cls, path: str) -> 'Journal':
+        """One Journal per file and process, shared by every drive worker"""
+        with _shared_lock:
+            if path not in _shared:
+                _shared[path] = cls(path)
+            return _shared[path]
+
+    def _replay(self):
+        try:
+            with open(self.path, 'rb') as f:
+                data = f.read()
+        except FileNotFoundError:
+            return
+        data = self._repair_tail(data)
+        for line in data.splitlines():
+            try:
+                record = json.loads(line)
+            except ValueError:
+                logging.warning("Ignoring torn record in rip journal")
+                continue
+            self._apply(record)
+
+    def _repair_tail(self, data: bytes) -> bytes:
+        """
+        Make the file end with a newline before anything is appended: a
+        complete last record only lacks its newline, a torn one is cut off
+        (otherwise the next record would be glued onto it and lost as well)
+        """
+        end = data.rfind(b'\n') + 1
+        if end == len(data):
+            return data
+        try:
+            json.loads(data[end:])
+        except ValueError:
+            logging.warning("Cutting torn last record off the rip journal")
+            with open(self.path, 'r+b') as f:
+                f.truncate(end)
+                os.fsync(f.fileno())
+            return data[:end]
+        with open(self.path, 'ab') as f:
+            f.write(b'\n')
+            os.fsync(f.fileno())
+        return data + b'\n'
+
+    def _apply(self, record: dict):
+        disc_id = record['disc']
+        if record['event'] == 'start':
+            self.discs[disc_id] = DiscState(disc_id, record.get('info', {}), record['ts'])
+        elif disc_id in self.discs:
+            self.discs[disc_id].apply(record)
+
+    def _append(self, record: dict):
+        record['ts'] = time.time()
+        line = (json.dumps(record, separators=(',', ':')) + '\n').encode('utf-8')
+        with self._lock:
+            os.write(self._fd, line)
+            if self.sync:
+                os.fdatasync(self._fd)
+            self._apply(record)
+
+    def begin(self, disc_id: str, info: dict) -> DiscState:
+        """Start a new rip of disc_id, replacing any earlier progress"""
+        self._append({'disc': disc_id, 'event': 'start', 'info': info})
+        return self.discs[disc_id]
+
+    def update(self, disc_id: str, info: dict):
+        """Add to the info recorded at begin() (e.g. names resolved after reading started)"""
+        self._append({'disc': disc_id, 'event': 'info', 'info': info})
+
+    def track(self, disc_id: str, number: int, stage: str, fmt: str = None):
+        """Record that stage (one of STAGES) completed for a track"""
+        record = {'disc': disc_id, 'event': 'track', 'track': number, 'stage': stage}
+        if fmt is not None:
+            record['format'] = fmt
+        self._append(record)
+
+    def finish(self, disc_id: str, status: str = 'done'):
+        self._append({'disc': disc_id, 'event': 'finish', 'status': status})
+
+    def pending(self, disc_id: str = None) -> Optional[DiscState]:
+        """Unfinished progress for disc_id, or None"""
+        state = self.discs.get(disc_id)
+        return state if state is not None and not state.finished else None
+
+    def unfinished(self) -> List[DiscState]:
+        return [state for state in self.discs.values() if not state.finished]
+
+    def compact(self):
+        """Atomically rewrite the journal keeping only unfinished discs"""
+        with self._lock:
+            tmp_path = f"{self.path}.tmp"
+            with open(tmp_path, 'w') as f:
+                for state in self.unfinished():
+                    f.write(json.dumps({'disc': state.disc_id, 'event': 'start',
+                                        'info': state.info, 'ts': state.started_at}) + '\n')
+                    for number, stages in sorted(state.tracks.items()):
+                        for stage, value in stages.items():
+                            record = {'disc': state.disc_id, 'event': 'track',
+                                      'track': number, 'stage': stage, 'ts': state.started_at}
+                            for fmt in (sorted(value) if stage == 'encoded' else [None]):
+                                if fmt is not None:
+                                    record['format'] = fmt
+                                f.write(json.dumps(record) + '\n')
+                f.flush()
+                os.fsync(f.fileno())
+            os.replace(tmp_path, self.path)
+            self.discs = {state.disc_id: state for state in self.unfinished()}
+            old_fd = getattr(self, '_fd', None)
+            if old_fd is not None:
+                os.close(old_fd)
+                self._fd = os.open(self.path, os.O_WRONLY | os.O_APPEND | os.O_CREAT, 0o644)
+        logging.info(f"Compacted rip journal to {len(self.discs)} unfinished discs")
+
+    def close(self):
+        with self._lock:
+            os.close(self._fd)
@@ -0,0 +1,258 @@
+#!/usr/bin/env python3
+"""
+Offline MusicBrainz mirror index
+
+Imports a local MusicBrainz JSON data dump (or any subset of it) into an
+indexed SQLite file keyed by disc ID and TOC, so ripping stations without
+an uplink still get real artist/album/track names. Imports stream the dump
+line by line in batched transactions and lookups go through SQLite's
+memory-mapped pages, so memory stays bounded with millions of releases.
+
+Usage:
+    python3 -m autoripper.mbindex import release.tar.xz [--db PATH]
+    python3 -m autoripper.mbindex lookup DISC_ID [--db PATH]
+    python3 -m autoripper.mbindex stats [--db PATH]
+"""
+
+import bz2
+import gzip
+import io
+import json
+import logging
+import lzma
+import os
+import sqlite3
+import sys
+import tarfile
+import time
+import zlib
+from typing import Iterator, List, Optional
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS releases (
+    id INTEGER PRIMARY KEY,
+    mbid TEXT UNIQUE NOT NULL,
+    payload BLOB NOT NULL
+);
+CREATE TABLE IF NOT EXISTS discs (
+    disc_id TEXT NOT NULL,
+    release INTEGER NOT NULL,
+    track_count INTEGER NOT NULL,
+    leadout INTEGER NOT NULL,
+    offsets TEXT NOT NULL
+);
+CREATE INDEX IF NOT EXISTS discs_id ON discs (disc_id);
+CREATE INDEX IF NOT EXISTS discs_toc ON discs (track_count, leadout);
+CREATE INDEX IF NOT EXISTS discs_release ON discs (release);
+"""
+
+# Fields of a release kept in the index, enough to tag and name a rip
+RELEASE_FIELDS = ('id', 'title', 'date', 'country', 'barcode', 'artist-credit', 'media')
+MEDIUM_FIELDS = ('position', 'format', 'title', 'discs', 'tracks')
+TRACK_FIELDS = ('id', 'number', 'position', 'title', 'length', 'artist-credit', 'recording')
+
+# Frames two TOCs may differ by and still count as the same pressing
+TOC_TOLERANCE = 150
+BATCH_SIZE = 2000
+MMAP_SIZE = 256 * 1024 * 1024
+
+
+def default_index_path(config: dict) -> str:
+    settings = config.get('musicbrainz_index', {})
+    state_dir = config.get('state_dir', '/var/lib/auto-ripper')
+    return settings.get('path', os.path.join(state_dir, 'musicbrainz-index.sqlite'))
+
+
+def _trim(item: dict, fields) -> dict:
+    return {key: item[key] for key in fields if key in item}
+
+
+def trim_release(release: dict) -> dict:
+    """Drop dump fields the ripper never uses to keep the index small"""
+    trimmed = _trim(release, RELEASE_FIELDS)
+    media = []
+    for medium in release.get('media', []):
+        medium = _trim(medium, MEDIUM_FIELDS)
+        medium['tracks'] = [_trim(track, TRACK_FIELDS) for track in medium.get('tracks', [])]
+        for track in medium['tracks']:
+            if 'recording' in track:
+                track['recording'] = _trim(track['recording'], ('id', 'title', 'length'))
+        media.append(medium)
+    trimmed['media'] = media
+    return trimmed
+
+
+def open_dump(path: str) -> Iterator[str]:
+    """
+    Yield JSON lines from a dump file: plain, .gz, .bz2, .xz, or a
+    MusicBrainz JSON dump tarball (mbdump/release member).
+    """
+    if '.tar' in os.path.basename(path):
+        with tarfile.open(path, 'r|*') as archive:
+            for member in archive:
+                if member.isfile() and member.name.endswith('mbdump/release'):
+                    stream = archive.extractfile(member)
+                    yield from io.TextIOWrapper(stream, encoding='utf-8')
+                    return
+        raise ValueError(f"No mbdump/release member in {path}")
+
+    openers = {'.gz': gzip.open, '.bz2': bz2.open, '.xz': lzma.open}
+    opener = openers.get(os.path.splitext(path)[1], open)
+    with opener(path, 'rt', encoding='utf-8') as f:
+        yield from f
+
+
+class MusicBrainzIndex:
+    """Read/write access to the offline index file"""
+
+    def __init__(self, path: str, readonly: bool = False):
+        self.path = path
+        if readonly:
+            self.db = sqlite3.connect(f"file:{path}?mode=ro", uri=True, check_same_thread=False)
+        else:
+            os.makedirs(os.path.dirname(path) or '.', exist_ok=True)
+            self.db = sqlite3.connect(path, check_same_thread=False)
+            self.db.executescript(SCHEMA)
+        # Memory-mapped reads with a small page cache keep RSS bounded
+        self.db.execute(f"PRAGMA mmap_size={MMAP_SIZE}")
+        self.db.execute("PRAGMA cache_size=-8192")
+
+    @classmethod
+    def open_for_lookup(cls, config: dict) -> Optional['MusicBrainzIndex']:
+        """Open the configured index read-only, or None if there is none"""
+        settings = config.get('musicbrainz_index', {})
+        if not settings.get('enabled', True):
+            return None
+        path = default_index_path(config)
+        if not os.path.exists(path):
+            return None
+        return cls(path, readonly=True)
+
+    def import_dump(self, path: str, with_discs_only: bool = True) -> int:
+        """Stream a dump into the index; returns the number of releases imported"""
+        self.db.execute("PRAGMA synchronous=OFF")
+        self.db.execute("PRAGMA journal_mode=MEMORY")
+        imported = 0
+        batch = []
+        started = time.time()
+
+        for line in open_dump(path):
+            line = line.strip()
+            if not line:
+                continue
+            try:
+                release = json.loads(line)
+            except ValueError:
+                logging.warning("Skipping malformed dump line")
+                continue
+            has_discs = any(medium.get('discs') for medium in release.get('media', []))
+            if with_discs_only and not has_discs:
+                continue
+            batch.append(trim_release(release))
+            if len(batch) >= BATCH_SIZE:
+                imported += self._store(batch)
+                batch = []
+                rate = imported / max(time.time() - started, 0.001)
+                logging.info(f"Imported {imported} releases ({rate:.0f}/s)")
+
+        if batch:
+            imported += self._store(batch)
+        self.db.execute("PRAGMA synchronous=FULL")
+        self.db.execute("ANALYZE")
+        return imported
+
+    def _store(self, releases: List[dict]) -> int:
+        with self.db:
+            for release in releases:
+                self.db.execute(
+                    "INSERT INTO releases (mbid, payload) VALUES (?, ?) "
+                    "ON CONFLICT(mbid) DO UPDATE SET payload = excluded.payload",
+                    (release['id'], zlib.compress(json.dumps(release).encode('utf-8'))))
+                # lastrowid is stale when the upsert updated an existing row
+                row_id = self.db.execute(
+                    "SELECT id FROM releases WHERE mbid = ?", (release['id'],)).fetchone()[0]
+                self.db.execute("DELETE FROM discs WHERE release = ?", (row_id,))
+                for medium in release['media']:
+                    for disc in medium.get('discs') or []:
+                        offsets = disc.get('offsets') or []
+                        self.db.execute(
+                            "INSERT INTO discs (disc_id, release, track_count, leadout, offsets) "
+                            "VALUES (?, ?, ?, ?, ?)",
+                            (disc['id'], row_id, len(offsets), disc.get('sectors', 0),
+                             ' '.join(str(offset) for offset in offsets)))
+        return len(releases)
+
+    def _releases(self, row_ids) -> List[dict]:
+        releases = []
+        for row_id in row_ids:
+            row = self.db.execute("SELECT payload FROM releases WHERE id = ?", (row_id,)).fetchone()
+            if row:
+                releases.append(json.loads(zlib.decompress(row[0]).decode('utf-8')))
+        return releases
+
+    def lookup(self, disc_id: str) -> Optional[dict]:
+        """Releases carrying disc_id, shaped like a MusicBrainz discid response"""
+        rows = self.db.execute("SELECT DISTINCT release FROM discs WHERE disc_id = ?",
+                               (disc_id,)).fetchall()
+        if not rows:
+            return None
+        return {'id': disc_id, 'releases': self._releases(row[0] for row in rows)}
+
+    def lookup_toc(self, track_count: int, leadout: int, offsets) -> Optional[dict]:
+        """Fuzzy TOC match (same track count, offsets within TOC_TOLERANCE frames)"""
+        rows = self.db.execute(
+            "SELECT release, offsets FROM discs WHERE track_count = ? AND leadout BETWEEN ? AND ?",
+            (track_count, leadout - TOC_TOLERANCE, leadout + TOC_TOLERANCE)).fetchall()
+        matches = []
+        for row_id, stored in rows:
+            stored_offsets = [int(value) for value in stored.split()]
+            if all(abs(a - b) <= TOC_TOLERANCE for a, b in zip(stored_offsets, offsets)):
+                matches.append(row_id)
+        if not matches:
+            return None
+        return {'releases': self._releases(dict.fromkeys(matches))}
+
+    def stats(self) -> dict:
+        releases = self.db.execute("SELECT COUNT(*) FROM releases").fetchone()[0]
+        discs = self.db.execute("SELECT COUNT(*) FROM discs").fetchone()[0]
+        return {'releases': releases, 'disc_ids': discs, 'size_mb': os.path.getsize(self.path) / 1e6}
+
+    def close(self):
+        self.db.close()
+
+
+def main():
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+    args = sys.argv[1:]
+    db_path = None
+    if '--db' in args:
+        index = args.index('--db')
+        db_path = args[index + 1]
+        del args[index:index + 2]
+    if not args or args[0] not in ('import', 'lookup', 'stats'):
+        print(__doc__.strip().split('Usage:')[1])
+        sys.exit(1)
+
+    if db_path is None:
+        config = {}
+        if os.path.exists('/opt/auto-ripper/config.json'):
+            with open('/opt/auto-ripper/config.json') as f:
+                config = json.load(f)
+        db_path = default_index_path(config)
+
+    command = args[0]
+    index = MusicBrainzIndex(db_path, readonly=(command != 'import'))
+    if command == 'import':
+        for dump in args[1:]:
+            count = index.import_dump(dump)
+            print(f"Imported {count} releases from {dump}")
+        print(json.dumps(index.stats()))
+    elif command == 'lookup':
+        print(json.dumps(index.lookup(args[1]), indent=2))
+    else:
+        print(json.dumps(index.stats()))
+    index.close()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,178 @@
+"""
+Persistent local cache for MusicBrainz lookups
+
+Single-file SQLite store keyed by disc ID holding the full release JSON.
+Entries expire after a TTL, "not found" answers are cached for a shorter
+negative TTL, and the store is kept under a size bound by evicting the
+least recently used entries. A small in-memory layer in front of SQLite
+serves repeat lookups without touching the disk.
+"""
+
+import json
+import logging
+import os
+import sqlite3
+import threading
+import time
+import zlib
+from collections import OrderedDict, namedtuple
+from typing import Optional
+
+from autoripper import metrics
+
+CacheEntry = namedtuple('CacheEntry', ['disc_id', 'data', 'fetched_at'])
+CacheEntry.__doc__ = "Cached lookup result; data is None for a cached 'not found'"
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS releases (
+    disc_id TEXT PRIMARY KEY,
+    payload BLOB,
+    fetched_at REAL NOT NULL,
+    accessed_at REAL NOT NULL,
+    size INTEGER NOT NULL
+);
+CREATE INDEX IF NOT EXISTS releases_accessed ON releases (accessed_at);
+"""
+
+# Only write back access times this stale, so hits stay read-only
+ACCESS_UPDATE_INTERVAL = 3600
+
+
+class MetadataCache:
+    """Disc ID -> MusicBrainz response cache with TTL and LRU eviction"""
+
+    def __init__(self, path: str, ttl: float = 90 * 86400, negative_ttl: float = 6 * 3600,
+                 max_entries: int = 20000, max_bytes: int = 64 * 1024 * 1024,
+                 memory_entries: int = 256):
+        self.path = path
+        self.ttl = ttl
+        self.negative_ttl = negative_ttl
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.memory_entries = memory_entries
+        self.hits = 0
+        self.misses = 0
+
+        self._lock = threading.Lock()
+        self._memory = OrderedDict()
+        os.makedirs(os.path.dirname(path) or '.', exist_ok=True)
+        self._db = sqlite3.connect(path, check_same_thread=False, isolation_level=None)
+        self._db.execute("PRAGMA journal_mode=WAL")
+        self._db.execute("PRAGMA synchronous=NORMAL")
+        self._db.executescript(SCHEMA)
+
+    @classmethod
+    def from_config(cls, config: dict) -> 'MetadataCache':
+        """Build the cache from the 'metadata_cache' section of config.json"""
+        settings = config.get('metadata_cache', {})
+        state_dir = config.get('state_dir', '/var/lib/auto-ripper')
+        return cls(
+            settings.get('path', os.path.join(state_dir, 'metadata.sqlite')),
+            ttl=settings.get('ttl_days', 90) * 86400,
+            negative_ttl=settings.get('negative_ttl_hours', 6) * 3600,
+            max_entries=settings.get('max_entries', 20000),
+            max_bytes=settings.get('max_mb', 64) * 1024 * 1024,
+        )
+
+    def _expired(self, entry: CacheEntry, now: float) -> bool:
+        ttl = self.ttl if entry.data is not None else self.negative_ttl
+        return now - entry.fetched_at > ttl
+
+    def get(self, disc_id: str) -> Optional[CacheEntry]:
+        """
+        Look up disc_id. Returns None on a miss; a CacheEntry whose data is
+        None means the disc is known not to exist upstream.
+        """
+        now = time.time()
+        with self._lock:
+            entry = self._memory.get(disc_id)
+            if entry is not None and not self._expired(entry, now):
+                self._memory.move_to_end(disc_id)
+                self.hits += 1
+                metrics.METADATA_CACHE.inc(result='hit')
+                return entry
+
+            row = self._db.execute(
+                "SELECT payload, fetched_at, accessed_at FROM releases WHERE disc_id = ?",
+                (disc_id,)).fetchone()
+            if row is None:
+                self.misses += 1
+                metrics.METADATA_CACHE.inc(result='miss')
+                return None
+
+            payload, fetched_at, accessed_at = row
+            data = json.loads(zlib.decompress(payload).decode('utf-8')) if payload else None
+            entry = CacheEntry(disc_id, data, fetched_at)
+            if self._expired(entry, now):
+                self._db.execute("DELETE FROM releases WHERE disc_id = ?", (disc_id,))
+                self._memory.pop(disc_id, None)
+                self.misses += 1
+                metrics.METADATA_CACHE.inc(result='miss')
+                return None
+
+            if now - accessed_at > ACCESS_UPDATE_INTERVAL:
+                self._db.execute("UPDATE releases SET accessed_at = ? WHERE disc_id = ?",
+                                 (now, disc_id))
+            self._remember(entry)
+            self.hits += 1
+            metrics.METADATA_CACHE.inc(result='hit')
+            return entry
+
+    def put(self, disc_id: str, data: Optional[dict]):
+        """Store a lookup result; data=None records a negative result"""
+        now = time.time()
+        payload = zlib.compress(json.dumps(data).encode('utf-8')) if data is not None else None
+        size = len(payload) if payload else 0
+        with self._lock:
+            self._db.execute(
+                "INSERT OR REPLACE INTO releases (disc_id, payload, fetched_at, accessed_at, size) "
+                "VALUES (?, ?, ?, ?, ?)", (disc_id, payload, now, now, size))
+            self._remember(CacheEntry(disc_id, data, now))
+            self._evict()
+
+    def invalidate(self, disc_id: str):
+        with self._lock:
+            self._db.execute("DELETE FROM releases WHERE disc_id = ?", (disc_id,))
+            self._memory.pop(disc_id, None)
+
+    def _remember(self, entry: CacheEntry):
+        self._memory[entry.disc_id] = entry
+        self._memory.move_to_end(entry.disc_id)
+        while len(self._memory) > self.memory_entries:
+            self._memory.popitem(last=False)
+
+    def _evict(self):
+        """Drop expired entries, then least recently used ones over the bounds"""
+        now = time.time()
+        self._db.execute(
+            "DELETE FROM releases WHERE (payload IS NOT NULL AND fetched_at < ?) "
+            "OR (payload IS NULL AND fetched_at < ?)",
+            (now - self.ttl, now - self.negative_ttl))
+
+        count, total = self._db.execute(
+            "SELECT COUNT(*), COALESCE(SUM(size), 0) FROM releases").fetchone()
+        if count <= self.max_entries and total <= self.max_bytes:
+            return
+
+        rows = self._db.execute(
+            "SELECT disc_id, size FROM releases ORDER BY accessed_at ASC").fetchall()
+        victims = []
+        for disc_id, size in rows:
+            if count <= self.max_entries and total <= self.max_bytes:
+                break
+            victims.append((disc_id,))
+            count -= 1
+            total -= size
+        self._db.executemany("DELETE FROM releases WHERE disc_id = ?", victims)
+        for (disc_id,) in victims:
+            self._memory.pop(disc_id, None)
+        logging.info(f"Metadata cache evicted {len(victims)} least recently used entries")
+
+    @property
+    def hit_rate(self) -> float:
+        lookups = self.hits + self.misses
+        return self.hits / lookups if lookups else 0.0
+
+    def close(self):
+        with self._lock:
+            self._db.close()
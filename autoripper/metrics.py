@@ -0,0 +1,303 @@
+"""
+Prometheus metrics
+
+A small, dependency-free registry of counters, gauges and histograms and
+an HTTP endpoint serving them at /metrics in the Prometheus text format.
+Recording a value is a dict update under a lock and happens at most a few
+times per track; values that already live elsewhere (queue lengths, cache
+hit ratio) are only read when the endpoint is scraped. The endpoint runs
+on the asyncio core's loop when there is one, otherwise in one thread.
+"""
+
+import asyncio
+import bisect
+import logging
+import threading
+import time
+from collections import deque
+from typing import Callable, Dict, Iterable, List, Optional, Tuple
+
+from autoripper import aio
+
+CONTENT_TYPE = 'text/plain; version=0.0.4; charset=utf-8'
+DEFAULT_LISTEN = '127.0.0.1'
+DEFAULT_PORT = 9310
+REQUEST_TIMEOUT = 5
+# Audio CDs play 75 sectors (frames) per second at 1x
+FRAMES_PER_SECOND = 75
+PCM_BYTES_PER_SECOND = 44100 * 4
+
+
+def _format_value(value: float) -> str:
+    if value == float('inf'):
+        return '+Inf'
+    return repr(float(value)) if isinstance(value, float) and not value.is_integer() else str(int(value))
+
+
+def _escape(value: str) -> str:
+    return str(value).replace('\\', r'\\').replace('\n', r'\n').replace('"', r'\"')
+
+
+def _label_text(names: Iterable[str], values: Iterable[str], extra: str = '') -> str:
+    pairs = [f'{name}="{_escape(value)}"' for name, value in zip(names, values)]
+    if extra:
+        pairs.append(extra)
+    return '{' + ','.join(pairs) + '}' if pairs else ''
+
+
+class Metric:
+    """A named metric with a fixed set of label names"""
+
+    kind = 'untyped'
+
+    def __init__(self, name: str, documentation: str, labelnames: Iterable[str] = ()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._lock = threading.Lock()
+        self._values: Dict[Tuple[str, ...], object] = {}
+
+    def _key(self, labels: Dict[str, str]) -> Tuple[str, ...]:
+        if set(labels) != set(self.labelnames):
+            raise ValueError(f"{self.name} takes labels {self.labelnames}, got {tuple(labels)}")
+        return tuple(str(labels[name]) for name in self.labelnames)
+
+    def samples(self) -> List[Tuple[str, str, float]]:
+        """(suffix, label text, value) for every labelled series"""
+        with self._lock:
+            items = list(self._values.items())
+        return [('', _label_text(self.labelnames, key), value) for key, value in items]
+
+    def render(self) -> List[str]:
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} {self.kind}"]
+        for suffix, labels, value in self.samples():
+            lines.append(f"{self.name}{suffix}{labels} {_format_value(value)}")
+        return lines
+
+
+class Counter(Metric):
+    kind = 'counter'
+
+    def inc(self, amount: float = 1, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def value(self, **labels) -> float:
+        with self._lock:
+            return self._values.get(self._key(labels), 0)
+
+
+class Gauge(Metric):
+    """A value that goes up and down; set_function() reads it at scrape time instead"""
+
+    kind = 'gauge'
+
+    def __init__(self, name: str, documentation: str, labelnames: Iterable[str] = ()):
+        super().__init__(name, documentation, labelnames)
+        self._functions: Dict[Tuple[str, ...], Callable[[], float]] = {}
+
+    def set(self, value: float, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = value
+
+    def set_function(self, function: Callable[[], float], **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._functions[key] = function
+
+    def samples(self) -> List[Tuple[str, str, float]]:
+        samples = super().samples()
+        with self._lock:
+            functions = list(self._functions.items())
+        for key, function in functions:
+            try:
+                value = function()
+            except Exception as e:
+                logging.debug(f"Metric {self.name} could not be read: {e}")
+                continue
+            if value is not None:
+                samples.append(('', _label_text(self.labelnames, key), value))
+        return samples
+
+
+class Histogram(Metric):
+    kind = 'histogram'
+
+    def __init__(self, name: str, documentation: str, labelnames: Iterable[str] = (),
+                 buckets: Iterable[float] = ()):
+        super().__init__(name, documentation, labelnames)
+        self.buckets = sorted(buckets)
+
+    def observe(self, value: float, **labels):
+        key = self._key(labels)
+        with self._lock:
+            series = self._values.get(key)
+            if series is None:
+                # Per-bucket counts (not cumulative), then sum and count
+                series = self._values[key] = [[0] * (len(self.buckets) + 1), 0.0, 0]
+            series[0][bisect.bisect_left(self.buckets, value)] += 1
+            series[1] += value
+            series[2] += 1
+
+    def samples(self) -> List[Tuple[str, str, float]]:
+        with self._lock:
+            items = [(key, list(counts), total, count) for key, (counts, total, count) in self._values.items()]
+        samples = []
+        for key, counts, total, count in items:
+            cumulative = 0
+            for bound, bucket_count in zip(self.buckets + [float('inf')], counts):
+                cumulative += bucket_count
+                samples.append(('_bucket', _label_text(self.labelnames, key, f'le="{_format_value(bound)}"'),
+                                cumulative))
+            samples.append(('_sum', _label_text(self.labelnames, key), total))
+            samples.append(('_count', _label_text(self.labelnames, key), count))
+        return samples
+
+
+class Registry:
+    def __init__(self):
+        self._metrics: List[Metric] = []
+
+    def register(self, metric: Metric) -> Metric:
+        self._metrics.append(metric)
+        return metric
+
+    def render(self) -> str:
+        lines = []
+        for metric in self._metrics:
+            lines.extend(metric.render())
+        return '\n'.join(lines) + '\n'
+
+
+REGISTRY = Registry()
+
+DISCS = REGISTRY.register(Counter(
+    'autoripper_discs_total', 'Discs processed, by disc type and result', ['drive', 'type', 'result']))
+DISCS_PER_HOUR = REGISTRY.register(Gauge(
+    'autoripper_discs_per_hour', 'Discs finished in the last hour (all drives)'))
+READ_SPEED = REGISTRY.register(Gauge(
+    'autoripper_drive_read_speed', 'Read speed of the last extracted track, as a multiple of 1x', ['drive']))
+TRACK_EXTRACT_SECONDS = REGISTRY.register(Histogram(
+    'autoripper_track_extract_seconds', 'Time to read one track from the disc', ['drive'],
+    buckets=(10, 20, 40, 60, 90, 120, 180, 300, 600, 1200)))
+TRACK_ENCODE_SECONDS = REGISTRY.register(Histogram(
+    'autoripper_track_encode_seconds', 'Time to encode one track', ['format'],
+    buckets=(2, 5, 10, 20, 30, 60, 120, 300, 600)))
+TRACK_READ_FAILURES = REGISTRY.register(Counter(
+    'autoripper_track_read_failures_total', 'Tracks that could not be read', ['drive']))
+TRACK_REREADS = REGISTRY.register(Counter(
+    'autoripper_track_rereads_total',
+    'Tracks read a second time (accuraterip: fast read did not match; suspect: burst read had bad sectors)',
+    ['drive', 'reason']))
+SECTOR_REREADS = REGISTRY.register(Counter(
+    'autoripper_sector_rereads_total', 'Single-sector reads in the careful re-read pass', ['drive']))
+UNRECOVERABLE_RANGES = REGISTRY.register(Counter(
+    'autoripper_unrecoverable_ranges_total', 'Suspect sector ranges no two reads agreed on', ['drive']))
+METADATA_CACHE = REGISTRY.register(Counter(
+    'autoripper_metadata_cache_requests_total', 'Metadata cache lookups by result', ['result']))
+METADATA_CACHE_HIT_RATIO = REGISTRY.register(Gauge(
+    'autoripper_metadata_cache_hit_ratio', 'Share of metadata cache lookups that were hits'))
+QUEUE_DEPTH = REGISTRY.register(Gauge(
+    'autoripper_queue_depth', 'Items waiting in a work queue', ['queue', 'drive']))
+
+_finished = deque()
+_finished_lock = threading.Lock()
+
+
+def record_disc(drive: str, disc_type: str, result: str):
+    DISCS.inc(drive=drive, type=disc_type, result=result)
+    if result == 'ok':
+        with _finished_lock:
+            _finished.append(time.monotonic())
+
+
+def _discs_last_hour() -> int:
+    cutoff = time.monotonic() - 3600
+    with _finished_lock:
+        while _finished and _finished[0] < cutoff:
+            _finished.popleft()
+        return len(_finished)
+
+
+def _cache_hit_ratio() -> Optional[float]:
+    hits, misses = METADATA_CACHE.value(result='hit'), METADATA_CACHE.value(result='miss')
+    return hits / (hits + misses) if hits + misses else None
+
+
+DISCS_PER_HOUR.set_function(_discs_last_hour)
+METADATA_CACHE_HIT_RATIO.set_function(_cache_hit_ratio)
+
+
+def record_track_read(drive: str, seconds: float, audio_seconds: Optional[float]):
+    """One track extracted in seconds; audio_seconds (its playing time) gives the x-factor"""
+    TRACK_EXTRACT_SECONDS.observe(seconds, drive=drive)
+    if audio_seconds and seconds > 0:
+        READ_SPEED.set(round(audio_seconds / seconds, 2), drive=drive)
+
+
+class MetricsServer:
+    """Serves REGISTRY at /metrics over plain HTTP/1.0"""
+
+    def __init__(self, host: str = DEFAULT_LISTEN, port: int = DEFAULT_PORT, registry: Registry = REGISTRY):
+        self.host = host
+        self.port = port
+        self.registry = registry
+        self._thread = None
+
+    def start(self):
+        core = aio.running_core()
+        if core is not None:
+            core.add_task(self.serve)
+        elif self._thread is None:
+            self._thread = threading.Thread(target=lambda: asyncio.run(self.serve()),
+                                            name='metrics', daemon=True)
+            self._thread.start()
+
+    async def serve(self):
+        try:
+            server = await asyncio.start_server(self._handle, self.host, self.port)
+        except OSError as e:
+            logging.error(f"Metrics endpoint could not listen on {self.host}:{self.port}: {e}")
+            return
+        logging.info(f"Serving metrics on http://{self.host}:{self.port}/metrics")
+        async with server:
+            await server.serve_forever()
+
+    async def _handle(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+        try:
+            request = await asyncio.wait_for(reader.readline(), REQUEST_TIMEOUT)
+            while True:
+                header = await asyncio.wait_for(reader.readline(), REQUEST_TIMEOUT)
+                if header in (b'\r\n', b'\n', b''):
+                    break
+            parts = request.split()
+            method = parts[0] if parts else b''
+            path = parts[1].split(b'?', 1)[0] if len(parts) > 1 else b''
+            if method not in (b'GET', b'HEAD'):
+                status, body = '405 Method Not Allowed', b'GET only\n'
+            elif path == b'/metrics':
+                status, body = '200 OK', self.registry.render().encode()
+            else:
+                status, body = '404 Not Found', b'See /metrics\n'
+            content_type = CONTENT_TYPE if status.startswith('200') else 'text/plain'
+            writer.write(f"HTTP/1.0 {status}\r\nContent-Type: {content_type}\r\n"
+                         f"Content-Length: {len(body)}\r\nConnection: close\r\n\r\n".encode())
+            if method != b'HEAD':
+                writer.write(body)
+            await writer.drain()
+        except (asyncio.TimeoutError, ConnectionError):
+            pass
+        finally:
+            writer.close()
+
+
+def start_metrics_server(config: dict) -> Optional[MetricsServer]:
+    """Start the /metrics endpoint from config.json 'metrics', or None if disabled"""
+    settings = config.get('metrics', {})
+    if not settings.get('enabled', True):
+        return None
+    server = MetricsServer(settings.get('listen', DEFAULT_LISTEN), settings.get('port', DEFAULT_PORT))
+    server.start()
+    return server
@@ -0,0 +1,330 @@
+#!/usr/bin/env python3
+"""
+Shared MusicBrainz web service client
+
+One client per process keeps a small pool of keep-alive HTTP(S)
+connections, so lookups after the first skip the TCP and TLS handshakes.
+Every request takes a token from a bucket refilled at MusicBrainz's
+one-request-per-second limit, 503 answers are retried after Retry-After,
+and identical requests in flight at the same time are sent once.
+lookup_many() works through a backlog of discs at the full allowed rate.
+release_metadata() turns a discid response (inc=recordings+artist-credits)
+into names, dates and the complete track listing of the matching medium.
+
+Usage: python3 -m autoripper.musicbrainz [--base-url URL] DISC_ID [TOC]
+"""
+
+import http.client
+import json
+import logging
+import ssl
+import sys
+import threading
+import time
+import urllib.parse
+from concurrent.futures import Future, ThreadPoolExecutor
+from typing import Dict, List, Optional, Tuple
+
+DEFAULT_BASE_URL = 'https://musicbrainz.org/ws/2'
+DEFAULT_USER_AGENT = 'GrimRipper/1.0 ( https://github.com/SatwantKumar/grim_ripper )'
+DEFAULT_RATE = 1.0
+DEFAULT_TIMEOUT = 15
+POOL_SIZE = 4
+MAX_ATTEMPTS = 3
+
+_shared = {}
+_shared_lock = threading.Lock()
+
+
+class MusicBrainzError(Exception):
+    """A lookup that got no usable answer; network is True for transport failures"""
+
+    def __init__(self, message: str, network: bool = False):
+        super().__init__(message)
+        self.network = network
+
+
+class TokenBucket:
+    """Blocking token bucket: rate tokens per second, up to capacity saved up"""
+
+    def __init__(self, rate: float, capacity: float = 1):
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = capacity
+        self.updated = time.monotonic()
+        self._lock = threading.Lock()
+
+    def acquire(self, amount: float = 1):
+        """
+        Take amount tokens, waiting until they are there. Amounts above the
+        capacity go through once the bucket is full and leave it in debt.
+        """
+        while True:
+            with self._lock:
+                now = time.monotonic()
+                self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+                self.updated = now
+                needed = min(amount, self.capacity)
+                if self.tokens >= needed:
+                    self.tokens -= amount
+                    return
+                wait = (needed - self.tokens) / self.rate
+            time.sleep(wait)
+
+    def penalize(self, seconds: float):
+        """Hold every caller back for seconds (server asked us to slow down)"""
+        with self._lock:
+            self.tokens = min(self.tokens, 0) - seconds * self.rate
+
+
+class MusicBrainzClient:
+    """Rate-limited, connection-pooling client for the MusicBrainz JSON API"""
+
+    def __init__(self, base_url: str = DEFAULT_BASE_URL, user_agent: str = DEFAULT_USER_AGENT,
+                 rate: float = DEFAULT_RATE, timeout: float = DEFAULT_TIMEOUT,
+                 pool_size: int = POOL_SIZE, connectivity=None):
+        parsed = urllib.parse.urlsplit(base_url.rstrip('/'))
+        self.base_url = base_url.rstrip('/')
+        self.scheme = parsed.scheme
+        self.host = parsed.hostname
+        self.port = parsed.port
+        self.path = parsed.path
+        self.user_agent = user_agent
+        self.timeout = timeout
+        self.pool_size = pool_size
+        self.connectivity = connectivity
+        self.bucket = TokenBucket(rate)
+        self._idle: List[http.client.HTTPConnection] = []
+        self._pool_lock = threading.Lock()
+        self._inflight: Dict[str, Future] = {}
+        self._inflight_lock = threading.Lock()
+        self._ssl_context = ssl.create_default_context() if self.scheme == 'https' else None
+
+    @classmethod
+    def shared(cls, config: dict, connectivity=None) -> 'MusicBrainzClient':
+        """One client per process so every drive shares the rate limit and connections"""
+        settings = config.get('musicbrainz', {})
+        with _shared_lock:
+            if 'client' not in _shared:
+                _shared['client'] = cls(settings.get('base_url') or DEFAULT_BASE_URL,
+                                        settings.get('user_agent') or DEFAULT_USER_AGENT,
+                                        settings.get('rate_limit', DEFAULT_RATE),
+                                        settings.get('timeout', DEFAULT_TIMEOUT),
+                                        connectivity=connectivity)
+            return _shared['client']
+
+    def _connect(self) -> http.client.HTTPConnection:
+        if self.scheme == 'https':
+            return http.client.HTTPSConnection(self.host, self.port, timeout=self.timeout,
+                                               context=self._ssl_context)
+        return http.client.HTTPConnection(self.host, self.port, timeout=self.timeout)
+
+    def _checkout(self) -> Tuple[http.client.HTTPConnection, bool]:
+        with self._pool_lock:
+            if self._idle:
+                return self._idle.pop(), True
+        return self._connect(), False
+
+    def _checkin(self, connection: http.client.HTTPConnection):
+        with self._pool_lock:
+            if len(self._idle) < self.pool_size:
+                self._idle.append(connection)
+                return
+        connection.close()
+
+    def _send(self, path: str) -> Tuple[int, dict, bytes]:
+        """One GET over a pooled connection; a stale keep-alive connection is retried once"""
+        headers = {'User-Agent': self.user_agent, 'Accept': 'application/json'}
+        for _ in range(2):
+            connection, reused = self._checkout()
+            try:
+                connection.request('GET', path, headers=headers)
+                response = connection.getresponse()
+                body = response.read()
+            except (http.client.HTTPException, OSError) as e:
+                connection.close()
+                if reused:
+                    continue  # The server closed the idle connection: reconnect
+                raise MusicBrainzError(f"request failed: {e}", network=True) from e
+            if response.will_close:
+                connection.close()
+            else:
+                self._checkin(connection)
+            return response.status, dict(response.getheaders()), body
+        raise MusicBrainzError("request failed on a fresh connection", network=True)
+
+    def get(self, resource: str, params: Dict[str, str]) -> Optional[dict]:
+        """
+        GET base_url/resource?params as JSON. Returns None for 404 and raises
+        MusicBrainzError for anything else that isn't a 200.
+        """
+        query = urllib.parse.urlencode(dict(params, fmt='json'), safe='+')
+        path = f"{self.path}/{resource}?{query}"
+        with self._inflight_lock:
+            future = self._inflight.get(path)
+            owner = future is None
+            if owner:
+                future = self._inflight[path] = Future()
+        if not owner:
+            return future.result()  # Same request already on the wire
+
+        try:
+            result = self._get(path)
+            future.set_result(result)
+            return result
+        except BaseException as e:
+            future.set_exception(e)
+            raise
+        finally:
+            with self._inflight_lock:
+                self._inflight.pop(path, None)
+
+    def _get(self, path: str) -> Optional[dict]:
+        for attempt in range(1, MAX_ATTEMPTS + 1):
+            self.bucket.acquire()
+            try:
+                status, headers, body = self._send(path)
+            except MusicBrainzError:
+                if self.connectivity is not None:
+                    self.connectivity.record_failure()
+                raise
+            if self.connectivity is not None:
+                self.connectivity.record_success()
+            if status == 200:
+                try:
+                    return json.loads(body.decode('utf-8'))
+                except ValueError as e:
+                    raise MusicBrainzError(f"invalid JSON from MusicBrainz: {e}") from e
+            if status == 404:
+                return None
+            if status in (503, 429) and attempt < MAX_ATTEMPTS:
+                retry_after = _retry_after(headers, attempt)
+                logging.info(f"MusicBrainz asked to slow down, retrying in {retry_after:.0f}s")
+                self.bucket.penalize(retry_after)
+                continue
+            raise MusicBrainzError(f"MusicBrainz returned HTTP {status}")
+        raise MusicBrainzError("MusicBrainz kept rate limiting the request")
+
+    def lookup_discid(self, disc_id: str, toc: str = None) -> Optional[dict]:
+        """
+        discid response with recordings and artist credits, or None if
+        MusicBrainz knows no release for the disc. toc (the Toc.musicbrainz_toc
+        string) lets MusicBrainz fall back to a fuzzy TOC match.
+        """
+        params = {'inc': 'recordings+artist-credits'}
+        if toc:
+            params['toc'] = toc
+        logging.info(f"Querying MusicBrainz for disc {disc_id}")
+        data = self.get(f"discid/{urllib.parse.quote(disc_id)}", params)
+        if data is not None and not data.get('releases'):
+            return None
+        return data
+
+    def lookup_many(self, discs: Dict[str, Optional[str]], workers: int = POOL_SIZE) -> Dict[str, Optional[dict]]:
+        """
+        Look up a batch of {disc_id: toc}. Requests overlap on pooled
+        connections so the batch runs at the full rate limit instead of one
+        round trip per second. The result holds an entry (None when not
+        found) for every disc that got an answer; failed lookups are left out.
+        """
+        results = {}
+        if not discs:
+            return results
+        with ThreadPoolExecutor(max_workers=min(workers, len(discs)),
+                                thread_name_prefix='musicbrainz') as executor:
+            futures = {disc_id: executor.submit(self.lookup_discid, disc_id, toc)
+                       for disc_id, toc in discs.items()}
+            for disc_id, future in futures.items():
+                try:
+                    results[disc_id] = future.result()
+                except MusicBrainzError as e:
+                    logging.warning(f"MusicBrainz lookup of {disc_id} failed: {e}")
+        return results
+
+    def close(self):
+        with self._pool_lock:
+            for connection in self._idle:
+                connection.close()
+            self._idle = []
+
+
+def _retry_after(headers: dict, attempt: int) -> float:
+    value = {key.lower(): item for key, item in headers.items()}.get('retry-after')
+    try:
+        return max(1.0, float(value))
+    except (TypeError, ValueError):
+        return float(2 ** attempt)
+
+
+def _credit(credits: Optional[list]) -> Optional[str]:
+    """Artist credit as printed, e.g. 'Simon & Garfunkel' or 'A feat. B'"""
+    if not credits:
+        return None
+    return ''.join(f"{credit.get('name') or credit.get('artist', {}).get('name', '')}"
+                   f"{credit.get('joinphrase', '')}" for credit in credits).strip() or None
+
+
+def release_metadata(data: dict, disc_id: str = None) -> dict:
+    """
+    Names and full track listing from a discid response
+
+    Uses the first release and, on it, the medium carrying disc_id (the
+    first medium otherwise). Track entries hold number, title, artist,
+    length in milliseconds and the recording MBID.
+    """
+    release = data['releases'][0]
+    media = release.get('media') or []
+    medium = next((m for m in media
+                   if any(disc.get('id') == disc_id for disc in m.get('discs') or [])),
+                  media[0] if media else None)
+    album_artist = _credit(release.get('artist-credit'))
+    tracks = []
+    for index, track in enumerate((medium or {}).get('tracks') or [], 1):
+        recording = track.get('recording') or {}
+        title = track.get('title') or recording.get('title')
+        if not title:
+            continue
+        tracks.append({
+            'number': int(track.get('position') or index),
+            'title': title,
+            'artist': _credit(track.get('artist-credit') or recording.get('artist-credit')) or album_artist,
+            'length': track.get('length') or recording.get('length'),
+            'recording_id': recording.get('id'),
+        })
+    return {
+        'artist': album_artist,
+        'album': release.get('title'),
+        'date': (release.get('date') or '')[:4] or None,
+        'release_id': release.get('id'),
+        'disc_number': (medium or {}).get('position'),
+        'disc_count': len(media),
+        'tracks': tracks,
+    }
+
+
+def main():
+    args = sys.argv[1:]
+    base_url = DEFAULT_BASE_URL
+    if '--base-url' in args:
+        index = args.index('--base-url')
+        base_url = args[index + 1]
+        del args[index:index + 2]
+    if not args:
+        print(__doc__.strip().splitlines()[-1], file=sys.stderr)
+        sys.exit(2)
+
+    logging.basicConfig(level=logging.INFO, format='%(message)s')
+    client = MusicBrainzClient(base_url)
+    try:
+        data = client.lookup_discid(args[0], args[1] if len(args) > 1 else None)
+    except MusicBrainzError as e:
+        print(f"Lookup failed: {e}", file=sys.stderr)
+        sys.exit(1)
+    if data is None:
+        print(f"Disc {args[0]} not found", file=sys.stderr)
+        sys.exit(1)
+    print(json.dumps(release_metadata(data, args[0]), indent=2))
+
+
+if __name__ == "__main__":
+    main()
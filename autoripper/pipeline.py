@@ -0,0 +1,843 @@
+"""
+Native audio CD rip pipeline
+
+Replaces the single abcde run with two stages. The reader extracts one
+track at a time with cdparanoia on the drive worker's thread. Each track is
+handed to the shared EncoderPool, which produces every configured format
+while the reader moves on to the next track. The number of extracted tracks
+waiting to be encoded is bounded, so a slow encoder throttles the reader
+instead of filling the disk.
+
+extract() returns as soon as the last sector has been read, so the disc can
+be ejected and the next one started while encoding finishes in the background.
+
+In "stream" mode no WAV is written at all: cdparanoia's output is fanned
+out through pipes to every encoder at once, using one fixed buffer, and each
+track is finished when its read is.
+
+With a Journal attached every finished read and encode is recorded, so a
+rip interrupted by a crash resumes from the last completed track.
+
+Discs found in the local AccurateRip database are read fast first; tracks
+whose checksum matches are accepted and only the others are read again
+with cdparanoia's careful settings.
+
+With read_engine "burst" the queue mode reads through the native two-pass
+engine in autoripper.readengine instead of cdparanoia: every track is read
+at full speed first, and only the sector ranges that failed or read back
+inconsistently are re-read slowly once the whole disc has been through.
+"""
+
+import logging
+import os
+import re
+import shutil
+import subprocess
+import threading
+import time
+from concurrent.futures import Future
+from string import Template
+from typing import Callable, Dict, List, Optional, Union
+
+from autoripper import aio, cdrom, metrics, tracing
+from autoripper.accuraterip import SAMPLES_PER_FRAME, AccurateRipDatabase, TrackChecksum
+from autoripper.encoding import FORMAT_EXTENSIONS, EncoderPool, encode_file, encoder_command
+from autoripper.discid import Toc
+from autoripper.journal import DiscState, Journal
+from autoripper.readengine import BURST_FRAMES, CACHE_FRAMES, BurstReader, ErrorMap, checksum_file
+from autoripper.runner import CdparanoiaProgress, ProgressEvent, StreamingCommand, start_command
+from autoripper.supervisor import set_drive_context
+
+DEFAULT_CD_FORMAT = '${ARTISTFILE}/${ALBUMFILE}/${TRACKNUM} - ${TRACKFILE}'
+DEFAULT_QUEUE_DEPTH = 4
+# Bytes moved from the reader to the encoders per pipe write in stream mode
+STREAM_CHUNK = 64 * 1024
+
+
+def sanitize_filename(name: str) -> str:
+    """Same character mapping as mungefilename in abcde.conf"""
+    name = re.sub(r'^\.*', '', str(name))
+    name = re.sub(r'[^A-Za-z0-9._-]', '_', name)
+    name = re.sub(r'_+', '_', name)
+    return name.strip('_')
+
+
+def sync_file(path: str):
+    """Flush a finished file to disk before the journal says it exists"""
+    fd = os.open(path, os.O_RDONLY)
+    try:
+        os.fsync(fd)
+    finally:
+        os.close(fd)
+
+
+class AlbumLayout:
+    """Where each track of one disc ends up and how it is tagged"""
+
+    def __init__(self, output_dir: str, artist: str, album: str,
+                 titles: Dict[int, str] = None, date: str = None,
+                 cd_format: str = DEFAULT_CD_FORMAT, sanitize: bool = True):
+        self.output_dir = output_dir
+        self.artist = artist
+        self.album = album
+        self.titles = titles or {}
+        self.date = date
+        self.cd_format = cd_format
+        self.sanitize = sanitize
+
+    def _clean(self, value: str) -> str:
+        return sanitize_filename(value) if self.sanitize else value
+
+    def title(self, number: int) -> str:
+        return self.titles.get(number) or f"Track_{number:02d}"
+
+    def track_path(self, number: int, fmt: str) -> str:
+        relative = Template(self.cd_format).safe_substitute(
+            ARTISTFILE=self._clean(self.artist),
+            ALBUMFILE=self._clean(self.album),
+            TRACKNUM=f"{number:02d}",
+            TRACKFILE=self._clean(self.title(number)),
+        )
+        return os.path.join(self.output_dir, f"{relative}.{FORMAT_EXTENSIONS[fmt]}")
+
+    @property
+    def album_dir(self) -> str:
+        return os.path.dirname(self.track_path(1, 'flac'))
+
+    def to_dict(self) -> dict:
+        return {'output_dir': self.output_dir, 'artist': self.artist, 'album': self.album,
+                'titles': self.titles, 'date': self.date, 'cd_format': self.cd_format,
+                'sanitize': self.sanitize}
+
+    @classmethod
+    def from_dict(cls, data: dict) -> 'AlbumLayout':
+        titles = {int(number): title for number, title in (data.get('titles') or {}).items()}
+        return cls(data['output_dir'], data['artist'], data['album'], titles, data.get('date'),
+                   data.get('cd_format', DEFAULT_CD_FORMAT), data.get('sanitize', True))
+
+    def tags(self, number: int, track_count: int) -> dict:
+        return {
+            'artist': self.artist,
+            'album': self.album,
+            'title': self.title(number),
+            'tracknumber': f"{number}/{track_count}",
+            'date': self.date,
+        }
+
+
+class RipJob:
+    """One disc going through the pipeline"""
+
+    def __init__(self, device: str, tracks: List[int], layout: Union[AlbumLayout, Future],
+                 formats: List[str], work_dir: str, disc_id: str = None,
+                 journal: Journal = None, state: DiscState = None):
+        self.device = device
+        self.disc_id = disc_id
+        self.journal = journal
+        self.state = state
+        self.tracks = tracks
+        self._layout = layout
+        self.formats = formats
+        self.work_dir = work_dir
+        self.started_at = time.time()
+        self.extracted_at = None
+        self.finished_at = None
+        self.read_failed = []
+        self.encode_failed = []
+        # Extraction was stopped by shutdown; the work dir is kept for the resume
+        self.cancelled = False
+        # AccurateRip state: submitted checksums, samples per track, verified checksums
+        self.accuraterip = None
+        self.track_samples = {}
+        self.checksums = {}
+        self.fast_reads = True
+        self.fast_misses = 0
+        # Frames per track from the TOC, for read speed metrics
+        self.track_frames = {}
+        self._lock = threading.Lock()
+        self._outstanding = 0
+        self._extracting = True
+        self._done = threading.Event()
+        self._callbacks = []
+
+    @property
+    def layout(self) -> AlbumLayout:
+        """Output names; waits for them if metadata is still being looked up"""
+        if isinstance(self._layout, Future):
+            self._layout = self._layout.result()
+        return self._layout
+
+    @property
+    def layout_known(self) -> bool:
+        return not isinstance(self._layout, Future) or self._layout.done()
+
+    @property
+    def layout_future(self) -> Optional[Future]:
+        """The metadata lookup the names still depend on, or None once they are known"""
+        return None if self.layout_known else self._layout
+
+    @property
+    def succeeded(self) -> bool:
+        return self.finished_at is not None and not self.read_failed and not self.encode_failed
+
+    def add_done_callback(self, callback: Callable[['RipJob'], None]):
+        """Call callback(job) once every encode has finished"""
+        with self._lock:
+            if self.finished_at is None:
+                self._callbacks.append(callback)
+                return
+        callback(self)
+
+    def record(self, number: int, stage: str, fmt: str = None, path: str = None):
+        """Journal a completed stage of a track, syncing its output file first"""
+        if self.journal is not None and self.disc_id:
+            if path is not None:
+                sync_file(path)
+            self.journal.track(self.disc_id, number, stage, fmt)
+
+    def was_read(self, number: int) -> bool:
+        """True if an earlier run already extracted this track"""
+        return self.state is not None and self.state.has(number, 'read')
+
+    def pending_formats(self, number: int) -> List[str]:
+        """Formats of a track that still need encoding (all of them on a fresh rip)"""
+        if self.state is None:
+            return list(self.formats)
+        return [fmt for fmt in self.formats
+                if not (self.state.has(number, 'encoded', fmt)
+                        and os.path.exists(self.layout.track_path(number, fmt)))]
+
+    def wav_path(self, number: int) -> str:
+        return os.path.join(self.work_dir, f"track{number:02d}.wav")
+
+    @property
+    def drive(self) -> str:
+        return os.path.basename(self.device)
+
+    def read_done(self, number: int, seconds: float):
+        """Record metrics for a track extracted in seconds"""
+        audio_seconds = None
+        if number in self.track_frames:
+            audio_seconds = self.track_frames[number] / metrics.FRAMES_PER_SECOND
+        else:
+            try:
+                audio_seconds = (os.path.getsize(self.wav_path(number)) - 44) / metrics.PCM_BYTES_PER_SECOND
+            except OSError:
+                pass
+        metrics.record_track_read(self.drive, seconds, audio_seconds)
+
+    def read_failed_on(self, number: int):
+        self.read_failed.append(number)
+        metrics.TRACK_READ_FAILURES.inc(drive=self.drive)
+
+    def cancelled_at(self, number: int):
+        """Extraction was cancelled before track number was read"""
+        self.cancelled = True
+        self.read_failed.append(number)
+
+    def wait(self, timeout: float = None) -> bool:
+        """Block until encoding has finished; returns succeeded"""
+        self._done.wait(timeout)
+        return self.succeeded
+
+    def _encode_started(self):
+        with self._lock:
+            self._outstanding += 1
+
+    def _encode_finished(self):
+        with self._lock:
+            self._outstanding -= 1
+        self._check_done()
+
+    def _extraction_finished(self):
+        with self._lock:
+            self._extracting = False
+            self.extracted_at = time.time()
+        self._check_done()
+
+    def _check_done(self):
+        with self._lock:
+            if self._extracting or self._outstanding or self.finished_at is not None:
+                return
+            self.finished_at = time.time()
+            callbacks, self._callbacks = self._callbacks, []
+        if not self.cancelled:
+            shutil.rmtree(self.work_dir, ignore_errors=True)
+        for callback in callbacks:
+            try:
+                callback(self)
+            except Exception as e:
+                logging.error(f"Rip completion callback failed: {e}")
+        # Waiters wake only after the callbacks (journal, notifications) ran
+        self._done.set()
+
+
+class RipPipeline:
+    """Reader stage plus background encoding for audio CDs"""
+
+    def __init__(self, config: dict, encoder_pool: EncoderPool, journal: Journal = None,
+                 accuraterip: AccurateRipDatabase = None,
+                 on_progress: Callable[[ProgressEvent], None] = None):
+        self.config = config
+        self.encoder_pool = encoder_pool
+        self.journal = journal
+        self.accuraterip = accuraterip
+        self.on_progress = on_progress
+        self.formats = [fmt for fmt in config.get('formats', ['flac', 'mp3'])
+                        if fmt in FORMAT_EXTENSIONS]
+        self.queue_depth = max(1, config.get('pipeline_queue_depth', DEFAULT_QUEUE_DEPTH))
+        self.paranoia_options = config.get('cdparanoia_options', ['--never-skip=40'])
+        self.read_timeout = config.get('track_read_timeout', 1800)
+        self.mode = config.get('pipeline_mode', 'queue')
+        settings = config.get('accuraterip', {})
+        self.read_offset = settings.get('read_offset', 0)
+        self.fast_read_options = settings.get('fast_read_options', ['-Z'])
+        self.read_engine = config.get('read_engine', 'cdparanoia')
+        self.burst_settings = config.get('burst_reader', {})
+
+    def work_dir_for(self, device: str, disc_id: Optional[str]) -> str:
+        base = self.config.get('work_dir') or os.path.join(
+            self.config.get('output_dir', '/mnt/MUSIC'), '.auto-ripper-work')
+        # Keyed by disc ID alone so a resumed rip finds its extracted tracks
+        name = disc_id or f"{os.path.basename(device)}-{int(time.time())}"
+        return os.path.join(base, name)
+
+    def resumable_layout(self, disc_id: Optional[str]) -> Optional[AlbumLayout]:
+        """Layout of an interrupted rip of disc_id, to finish it in place"""
+        state = self.journal.pending(disc_id) if self.journal is not None and disc_id else None
+        if state is None or 'layout' not in state.info:
+            return None
+        return AlbumLayout.from_dict(state.info['layout'])
+
+    def read_command(self, device: str, number: int, destination: str,
+                     options: List[str] = None) -> List[str]:
+        """cdparanoia command extracting one track; destination '-' means stdout"""
+        # Progress lines on stderr only when someone listens to them
+        command = ['cdparanoia', '-e' if self.on_progress is not None else '-q', '-d', device]
+        if self.read_offset:
+            command.append(f"--sample-offset={self.read_offset}")
+        command += list(self.paranoia_options if options is None else options)
+        return command + [str(number), destination]
+
+    def read_track(self, device: str, number: int, destination: str,
+                   options: List[str] = None, checksum: TrackChecksum = None) -> bool:
+        """Extract one track to a WAV file, checksumming the PCM on the way"""
+        with open(destination, 'wb') as wav:
+            try:
+                reader = self._start_reader(device, number, options)
+            except OSError as e:
+                logging.error(f"cdparanoia failed on track {number}: {e}")
+                return False
+            failed = self._fan_out(reader, {'wav': wav.write}, number, checksum)
+            ok = self._finish(reader, 'cdparanoia', number)
+        return ok and not failed
+
+    def stream_track(self, job: RipJob, number: int, formats: List[str],
+                     options: List[str] = None, checksum: TrackChecksum = None,
+                     accept: Callable[[], bool] = None) -> bool:
+        """
+        Extract one track straight into every encoder without a WAV file.
+
+        With a single format and no checksum the encoder reads cdparanoia's
+        pipe directly; otherwise the PCM is copied chunk by chunk into each
+        encoder's pipe. Blocking pipe writes throttle the drive to the
+        slowest encoder. If accept() returns False after the read, the
+        encoded files are discarded.
+        """
+        tags = job.layout.tags(number, len(job.tracks))
+        destinations = {fmt: job.layout.track_path(number, fmt) for fmt in formats}
+
+        try:
+            reader = self._start_reader(job.device, number, options)
+        except OSError as e:
+            logging.error(f"cdparanoia failed on track {number}: {e}")
+            return False
+
+        encoders = {}
+        passthrough = len(formats) == 1 and checksum is None
+        for fmt in formats:
+            command = encoder_command(fmt, '-', f"{destinations[fmt]}.part", self.config, tags)
+            try:
+                encoders[fmt] = start_command(
+                    command, stdin=reader.stdout if passthrough else subprocess.PIPE,
+                    stdout=subprocess.DEVNULL, timeout=self.read_timeout,
+                    cancel=aio.cancel_event(), tail_lines=20)
+            except OSError as e:
+                logging.error(f"{fmt} encoder failed to start for track {number}: {e}")
+                job.encode_failed.append((number, fmt))
+
+        if passthrough:
+            reader.stdout.close()  # The encoder holds the only read end now
+        else:
+            self._fan_out(reader, {fmt: encoder.stdin.write for fmt, encoder in encoders.items()},
+                          number, checksum)
+            for encoder in encoders.values():
+                try:
+                    encoder.stdin.close()
+                except BrokenPipeError:
+                    pass
+
+        ok = self._finish(reader, 'cdparanoia', number)
+        rejected = ok and accept is not None and not accept()
+        if ok and not rejected:
+            job.record(number, 'read')
+        for fmt, encoder in encoders.items():
+            partial = f"{destinations[fmt]}.part"
+            encoded = self._finish(encoder, fmt, number)
+            if encoded and ok and not rejected:
+                os.replace(partial, destinations[fmt])
+                job.record(number, 'encoded', fmt, destinations[fmt])
+            else:
+                if ok and not rejected:
+                    job.encode_failed.append((number, fmt))
+                try:
+                    os.remove(partial)
+                except OSError:
+                    pass
+        return ok and not rejected
+
+    def _start_reader(self, device: str, number: int, options: List[str] = None) -> StreamingCommand:
+        """cdparanoia writing one track to its stdout; killed with its process group on timeout"""
+        return start_command(self.read_command(device, number, '-', options), stdin=subprocess.DEVNULL,
+                             stdout=subprocess.PIPE, timeout=self.read_timeout,
+                             parsers=[CdparanoiaProgress()], on_progress=self.on_progress,
+                             cancel=aio.cancel_event(), tail_lines=20)
+
+    def _stopped(self, job: RipJob, number: int) -> bool:
+        """
+        True (and the job marked cancelled) once the stage running this rip
+        is cancelled, e.g. on shutdown; checked between tracks and after a
+        failed read, whose tools the cancel killed
+        """
+        cancel = aio.cancel_event()
+        if cancel is None or not cancel.is_set():
+            return False
+        if not job.cancelled:
+            logging.warning(f"Rip cancelled, stopping at track {number}")
+            job.cancelled_at(number)
+        return True
+
+    def _read_failed(self, job: RipJob, number: int):
+        if not self._stopped(job, number):
+            job.read_failed_on(number)
+
+    def _fan_out(self, reader: StreamingCommand, sinks: Dict[str, Callable], number: int,
+                 checksum: TrackChecksum = None) -> set:
+        """
+        Copy the reader's output into every sink through one fixed buffer.
+        Returns the names of sinks that failed.
+        """
+        buffer = bytearray(STREAM_CHUNK)
+        view = memoryview(buffer)
+        live = dict(sinks)
+        while True:
+            count = reader.stdout.readinto(buffer)
+            if not count:
+                break
+            if checksum is not None:
+                checksum.update(view[:count])
+            for name, write in list(live.items()):
+                try:
+                    write(view[:count])
+                except OSError as e:
+                    logging.error(f"{name} output failed on track {number}: {e}")
+                    del live[name]
+        reader.stdout.close()
+        return set(sinks) - set(live)
+
+    def _read_verified(self, job: RipJob, number: int,
+                       attempt: Callable[[Optional[List[str]], Optional[TrackChecksum],
+                                          Optional[Callable[[], bool]]], bool]) -> bool:
+        """
+        Read a track through attempt(options, checksum, accept).
+
+        When the disc is in the AccurateRip database the track is first read
+        fast (no paranoia) and accepted if its checksum matches; only
+        mismatches are read again with the careful paranoia options.
+        """
+        if job.accuraterip is None:
+            return attempt(None, None, None)
+        position = job.tracks.index(number) + 1
+        first, last = position == 1, position == len(job.tracks)
+
+        if job.fast_reads:
+            checksum = TrackChecksum(job.track_samples[number], first, last)
+            if attempt(self.fast_read_options, checksum,
+                       lambda: self._accurate(job, number, position, checksum)):
+                job.checksums[number] = checksum.as_dict()
+                return True
+            job.fast_misses += 1
+            if job.fast_misses >= 2 and not job.checksums:
+                # Nothing has matched yet: most likely the drive's read
+                # offset is wrong, so fast reads would only double the work
+                logging.warning("No track matches AccurateRip, check accuraterip.read_offset; "
+                                "using paranoia reads for the rest of this disc")
+                job.fast_reads = False
+            logging.info(f"Re-reading track {number} in paranoia mode")
+            metrics.TRACK_REREADS.inc(drive=job.drive, reason='accuraterip')
+
+        checksum = TrackChecksum(job.track_samples[number], first, last)
+        if not attempt(None, checksum, None):
+            return False
+        if self._accurate(job, number, position, checksum):
+            job.checksums[number] = checksum.as_dict()
+        else:
+            logging.warning(f"Track {number} could not be verified with AccurateRip, "
+                            f"keeping the paranoia read (CRC32 {checksum.crc32:08x})")
+        return True
+
+    def _accurate(self, job: RipJob, number: int, position: int, checksum: TrackChecksum) -> bool:
+        match = job.accuraterip.match(position, checksum)
+        if match is None:
+            logging.info(f"Track {number} does not match AccurateRip "
+                         f"(v1 {checksum.v1:08x}, v2 {checksum.v2:08x})")
+            return False
+        version, confidence = match
+        logging.info(f"Track {number} accurately ripped (AccurateRip {version}, "
+                     f"confidence {confidence}, CRC32 {checksum.crc32:08x})")
+        job.record(number, 'verified')
+        return True
+
+    def _finish(self, command: StreamingCommand, name: str, number: int) -> bool:
+        result = command.wait()
+        if result.ok:
+            return True
+        if result.timed_out or result.cancelled:
+            logging.error(f"{name} {result.describe()} on track {number}")
+        else:
+            logging.error(f"{name} failed on track {number} ({result.describe()}): {result.output[-500:]}")
+        return False
+
+    def extract(self, device: str, tracks: List[int], layout: Union[AlbumLayout, Future],
+                disc_id: str = None, toc: Toc = None) -> RipJob:
+        """
+        Read every track and queue it for encoding.
+
+        Returns once the drive is no longer needed; use the returned job to
+        wait for (or be called back on) encoding completion. Reading stops at
+        the first track that cannot be extracted.
+
+        layout may be a Future while metadata is still being looked up:
+        reading starts straight away and only encoding (or, in stream mode,
+        the first track) waits for the names.
+        """
+        if not self.formats:
+            raise ValueError(f"No supported output formats in {self.config.get('formats')}")
+        state = None
+        if self.journal is not None and disc_id:
+            state = self.journal.pending(disc_id)
+            if state is not None:
+                done = sum(1 for number in tracks if number in state.tracks)
+                logging.info(f"Resuming interrupted rip of {disc_id} ({done}/{len(tracks)} tracks started)")
+            else:
+                state = self.journal.begin(disc_id, {'device': device, 'tracks': list(tracks),
+                                                     'formats': self.formats})
+        job = RipJob(device, list(tracks), layout, self.formats,
+                     self.work_dir_for(device, disc_id), disc_id, self.journal, state)
+        job.add_done_callback(self._job_done)
+        if toc is not None:
+            job.track_frames = dict(zip(job.tracks, toc.track_lengths))
+        self._load_accuraterip(job, toc)
+        if self.mode != 'stream':
+            os.makedirs(job.work_dir, exist_ok=True)
+        if isinstance(layout, Future):
+            layout.add_done_callback(lambda _: self._layout_ready(job))
+        else:
+            self._layout_ready(job)
+        burst = self.read_engine == 'burst'
+        if burst and (self.mode == 'stream' or toc is None):
+            logging.warning("Burst read engine needs queue mode and a TOC, using cdparanoia")
+            burst = False
+        if self.mode == 'stream':
+            self._extract_streaming(job)
+        elif burst:
+            self._extract_two_pass(job, toc)
+        else:
+            self._extract_queued(job)
+
+        job._extraction_finished()
+        logging.info(f"Extraction finished in {job.extracted_at - job.started_at:.1f}s, "
+                     f"{self.encoder_pool.queue_depth} encodes pending",
+                     extra={'event': 'extracted', 'duration': round(job.extracted_at - job.started_at, 1)})
+        return job
+
+    def _layout_ready(self, job: RipJob):
+        """Create the album directory and journal the names once they are known"""
+        layout = job.layout
+        os.makedirs(layout.album_dir, exist_ok=True)
+        if job.state is not None and 'layout' not in job.state.info:
+            self.journal.update(job.disc_id, {'layout': layout.to_dict()})
+        logging.info(f"Tracks of {job.disc_id or job.device} go to {layout.album_dir}")
+
+    def _load_accuraterip(self, job: RipJob, toc: Optional[Toc]):
+        if self.accuraterip is None or toc is None:
+            return
+        _, offsets, _ = toc.audio_session
+        if len(offsets) != len(job.tracks):
+            return  # Leading data track: positions would not line up
+        job.accuraterip = self.accuraterip.lookup(toc)
+        if job.accuraterip is None:
+            logging.info("Disc not in the AccurateRip database, using paranoia reads")
+            return
+        job.track_samples = {number: frames * SAMPLES_PER_FRAME
+                             for number, frames in zip(job.tracks, toc.track_lengths)}
+        logging.info(f"Disc found in AccurateRip ({len(job.accuraterip.pressings)} pressings), "
+                     "reading fast and verifying")
+
+    def _extract_queued(self, job: RipJob):
+        """Read tracks to WAV files, encoding them in the background"""
+        queue_slots = threading.BoundedSemaphore(self.queue_depth)
+        for number in job.tracks:
+            if self._stopped(job, number):
+                break
+            formats = job.pending_formats(number)
+            if not formats:
+                logging.info(f"Track {number} already encoded, skipping")
+                continue
+            if not queue_slots.acquire(blocking=False):
+                logging.info(f"{self.queue_depth} tracks waiting for encoders, pausing reader")
+                queue_slots.acquire()
+            wav_path = job.wav_path(number)
+            if job.was_read(number) and os.path.exists(wav_path):
+                logging.info(f"Track {number} already extracted, reusing it")
+            else:
+                started = time.time()
+                read = lambda options, checksum, accept: (
+                    self.read_track(job.device, number, wav_path, options, checksum)
+                    and (accept is None or accept()))
+                with tracing.span('read_track', track=number):
+                    read_ok = self._read_verified(job, number, read)
+                if not read_ok:
+                    queue_slots.release()
+                    self._read_failed(job, number)
+                    break
+                job.record(number, 'read', path=wav_path)
+                job.read_done(number, time.time() - started)
+                logging.info(f"Extracted track {number}/{len(job.tracks)} in {time.time() - started:.1f}s",
+                             extra={'event': 'track_read', 'track': number,
+                                    'duration': round(time.time() - started, 1)})
+            self._queue_encodes(job, number, wav_path, formats, queue_slots)
+
+    def _extract_streaming(self, job: RipJob):
+        """Read and encode each track in one pass, holding an encoder slot per track"""
+        if not job.layout_known:
+            logging.info("Waiting for metadata before streaming (encoders need the file names)")
+        for number in job.tracks:
+            if self._stopped(job, number):
+                break
+            formats = job.pending_formats(number)
+            if not formats:
+                logging.info(f"Track {number} already encoded, skipping")
+                continue
+            started = time.time()
+            stream = lambda options, checksum, accept: self.stream_track(
+                job, number, formats, options, checksum, accept)
+            # Wait for the names before taking a slot other drives may need
+            job.layout
+            with self.encoder_pool.slots, tracing.span('stream_track', track=number):
+                if not self._read_verified(job, number, stream):
+                    self._read_failed(job, number)
+                    break
+            job.read_done(number, time.time() - started)
+            logging.info(f"Streamed track {number}/{len(job.tracks)} in {time.time() - started:.1f}s",
+                         extra={'event': 'track_read', 'track': number,
+                                'duration': round(time.time() - started, 1)})
+
+    def _extract_two_pass(self, job: RipJob, toc: Toc):
+        """
+        Burst-read every track, then go back only to suspect sectors.
+
+        Tracks without suspect ranges are queued for encoding straight away;
+        the others wait until the whole disc has been read at full speed so
+        the drive only slows down once. A clean-looking burst read is only
+        read a second time and compared block by block when it does not
+        match AccurateRip, or for every track with burst_reader.verify_reads.
+        """
+        settings = self.burst_settings
+        error_map = ErrorMap(job.disc_id, self.read_offset)
+        queue_slots = threading.BoundedSemaphore(self.queue_depth)
+        deferred = []
+        started = time.time()
+        try:
+            drive = cdrom.open_drive(job.device)
+        except OSError as e:
+            logging.error(f"Cannot open {job.device} for burst reads ({e}), using cdparanoia")
+            self._extract_queued(job)
+            return
+        with drive:
+            reader = BurstReader(drive, toc, error_map, self.read_offset,
+                                 settings.get('block_frames', BURST_FRAMES),
+                                 settings.get('careful_speed', 4),
+                                 settings.get('max_attempts', 8),
+                                 settings.get('cache_frames', CACHE_FRAMES))
+            for number in job.tracks:
+                if self._stopped(job, number):
+                    break
+                formats = job.pending_formats(number)
+                if not formats:
+                    logging.info(f"Track {number} already encoded, skipping")
+                    continue
+                if not queue_slots.acquire(blocking=False):
+                    logging.info(f"{self.queue_depth} tracks waiting for encoders, pausing reader")
+                    queue_slots.acquire()
+                wav_path = job.wav_path(number)
+                if job.was_read(number) and os.path.exists(wav_path):
+                    logging.info(f"Track {number} already extracted, reusing it")
+                    self._queue_encodes(job, number, wav_path, formats, queue_slots)
+                    continue
+                track_started = time.time()
+                checksum = self._track_checksum(job, number)
+                try:
+                    with tracing.span('burst_read', track=number) as span:
+                        suspect = reader.burst_read(number, wav_path, checksum)
+                        span.set(suspect=len(suspect))
+                    if not suspect and not self._burst_accurate(job, number, checksum):
+                        if checksum is not None or settings.get('verify_reads', False):
+                            suspect = reader.verify(number)
+                        if checksum is not None and not suspect:
+                            logging.warning(f"Track {number} reads back consistently but does not "
+                                            f"match AccurateRip, keeping it")
+                except OSError as e:
+                    logging.error(f"Burst read of track {number} failed: {e}")
+                    queue_slots.release()
+                    job.read_failed_on(number)
+                    break
+                if suspect:
+                    logging.info(f"Track {number}: {len(suspect)} suspect ranges, "
+                                 "re-reading after the burst pass")
+                    metrics.TRACK_REREADS.inc(drive=job.drive, reason='suspect')
+                    queue_slots.release()
+                    deferred.append((number, formats, suspect))
+                    continue
+                job.record(number, 'read', path=wav_path)
+                job.read_done(number, time.time() - track_started)
+                logging.info(f"Burst-read track {number}/{len(job.tracks)} "
+                             f"in {time.time() - track_started:.1f}s",
+                             extra={'event': 'track_read', 'track': number,
+                                    'duration': round(time.time() - track_started, 1)})
+                self._queue_encodes(job, number, wav_path, formats, queue_slots)
+            error_map.timings['burst_seconds'] = round(time.time() - started, 1)
+
+            repair_started = time.time()
+            for number, formats, suspect in deferred:
+                if job.read_failed or self._stopped(job, number):
+                    break
+                wav_path = job.wav_path(number)
+                queue_slots.acquire()
+                try:
+                    with tracing.span('repair', track=number, ranges=len(suspect)):
+                        reader.repair(number, wav_path, suspect)
+                except OSError as e:
+                    logging.error(f"Re-reading track {number} failed: {e}")
+                    queue_slots.release()
+                    job.read_failed_on(number)
+                    break
+                finally:
+                    metrics.SECTOR_REREADS.inc(sum(entry['attempts'] for entry in suspect), drive=job.drive)
+                    metrics.UNRECOVERABLE_RANGES.inc(
+                        sum(1 for entry in suspect if entry['status'] == 'unrecoverable'), drive=job.drive)
+                checksum = self._track_checksum(job, number)
+                if checksum is not None:
+                    checksum_file(wav_path, checksum)
+                    self._burst_accurate(job, number, checksum)
+                job.record(number, 'read', path=wav_path)
+                self._queue_encodes(job, number, wav_path, formats, queue_slots)
+            error_map.timings['repair_seconds'] = round(time.time() - repair_started, 1)
+
+        if error_map.tracks:
+            path = error_map.save(job.layout.album_dir)
+            logging.info(f"Saved read error map to {path}")
+        if error_map.unrecoverable:
+            logging.warning(f"{error_map.unrecoverable} sector ranges could not be recovered")
+        logging.info(f"Two-pass read: burst {error_map.timings['burst_seconds']}s, "
+                     f"re-reads {error_map.timings['repair_seconds']}s "
+                     f"({len(deferred)} tracks)")
+
+    def _track_checksum(self, job: RipJob, number: int) -> Optional[TrackChecksum]:
+        if job.accuraterip is None:
+            return None
+        position = job.tracks.index(number) + 1
+        return TrackChecksum(job.track_samples[number], position == 1, position == len(job.tracks))
+
+    def _burst_accurate(self, job: RipJob, number: int, checksum: Optional[TrackChecksum]) -> bool:
+        if checksum is None:
+            return False
+        if self._accurate(job, number, job.tracks.index(number) + 1, checksum):
+            job.checksums[number] = checksum.as_dict()
+            return True
+        return False
+
+    def resume_pending(self) -> List[RipJob]:
+        """
+        Finish encoding interrupted rips whose tracks were all extracted
+        before the crash; no disc is needed for these. Rips that still need
+        reads resume when the disc is inserted again.
+        """
+        jobs = []
+        if self.journal is None:
+            return jobs
+        for state in self.journal.unfinished():
+            info = state.info
+            if 'layout' not in info:
+                continue
+            job = RipJob(info.get('device', ''), info.get('tracks', []),
+                         AlbumLayout.from_dict(info['layout']), self.formats,
+                         self.work_dir_for(info.get('device', ''), state.disc_id),
+                         state.disc_id, self.journal, state)
+            missing = [number for number in job.tracks if job.pending_formats(number)
+                       and not (job.was_read(number) and os.path.exists(job.wav_path(number)))]
+            if missing:
+                logging.info(f"Interrupted rip of {state.disc_id} needs the disc again "
+                             f"(tracks {missing}), will resume on insertion")
+                continue
+            logging.info(f"Resuming encoding of interrupted rip {state.disc_id}")
+            job.add_done_callback(self._job_done)
+            queue_slots = threading.BoundedSemaphore(max(1, len(job.tracks)))
+            for number in job.tracks:
+                formats = job.pending_formats(number)
+                if formats:
+                    queue_slots.acquire()
+                    self._queue_encodes(job, number, job.wav_path(number), formats, queue_slots)
+            job._extraction_finished()
+            jobs.append(job)
+        return jobs
+
+    def _job_done(self, job: RipJob):
+        if self.journal is not None and job.disc_id and job.succeeded:
+            self.journal.finish(job.disc_id)
+
+    def _queue_encodes(self, job: RipJob, number: int, wav_path: str, formats: List[str],
+                       queue_slots: threading.BoundedSemaphore):
+        remaining = [len(formats)]
+        lock = threading.Lock()
+        parent = tracing.current()
+
+        def encode(fmt):
+            set_drive_context(job.device)
+            try:
+                destination = job.layout.track_path(number, fmt)
+                tags = job.layout.tags(number, len(job.tracks))
+                with tracing.span('encode', parent=parent, track=number, format=fmt) as span:
+                    encoded = encode_file(fmt, wav_path, destination, self.config, tags)
+                    span.set(ok=encoded)
+                if encoded:
+                    job.record(number, 'encoded', fmt, destination)
+                else:
+                    job.encode_failed.append((number, fmt))
+            finally:
+                with lock:
+                    remaining[0] -= 1
+                    last = remaining[0] == 0
+                if last:
+                    # Every format is done with this WAV: free its queue slot
+                    try:
+                        os.remove(wav_path)
+                    except OSError:
+                        pass
+                    queue_slots.release()
+                job._encode_finished()
+
+        # Queued only once the metadata is in: waiting for it must not hold an encoder slot
+        for fmt in formats:
+            job._encode_started()
+            self.encoder_pool.submit_after(job.layout_future, encode, fmt)
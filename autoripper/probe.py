@@ -0,0 +1,215 @@
+#!/usr/bin/env python3
+"""
+Per-insertion disc probe
+
+A DiscProbe holds everything learned about one inserted disc (media type,
+TOC, disc IDs, readiness timestamps). It is computed once per insertion,
+passed through the whole rip pipeline and dropped on media change, so the
+drive is asked about the same disc only once.
+
+Usage: python3 -m autoripper.probe [--wait SECONDS] [--save] /dev/sr0
+Prints the probe as JSON and exits non-zero if no usable disc is ready.
+"""
+
+import json
+import logging
+import os
+import stat
+import sys
+import tempfile
+import time
+from typing import Optional
+
+from autoripper import cdrom
+from autoripper.discid import Toc
+
+# Written by the root udev hook and read by the ripper running as a user;
+# a root-owned directory, unlike /tmp, can't be used to plant or swap files
+PROBE_DIR = "/run/auto-ripper"
+PROBE_CACHE_TEMPLATE = PROBE_DIR + "/probe-{drive}.json"
+
+
+class DiscProbe:
+    """Facts about the disc currently in a drive, valid until media change"""
+
+    def __init__(self, device: str, disc_type: str, toc: Optional[Toc] = None,
+                 inserted_at: float = None, ready_at: float = None, probed_at: float = None):
+        self.device = device
+        self.disc_type = disc_type
+        self.toc = toc
+        self.inserted_at = inserted_at
+        self.ready_at = ready_at
+        self.probed_at = probed_at or time.time()
+        self.valid = True
+
+    @property
+    def is_audio(self) -> bool:
+        return self.disc_type in ('audio_cd', 'mixed_cd')
+
+    @property
+    def disc_id(self) -> Optional[str]:
+        """MusicBrainz disc ID, or None for discs without an audio TOC"""
+        if self.toc is None or not self.toc.audio_tracks:
+            return None
+        return self.toc.musicbrainz_id
+
+    @property
+    def freedb_id(self) -> Optional[str]:
+        return self.toc.freedb_id if self.toc is not None else None
+
+    @property
+    def age(self) -> float:
+        return time.time() - self.probed_at
+
+    def invalidate(self):
+        """Mark the probe stale (media changed or disc ejected)"""
+        self.valid = False
+
+    def to_dict(self) -> dict:
+        return {
+            'device': self.device,
+            'disc_type': self.disc_type,
+            'toc': self.toc._asdict() if self.toc is not None else None,
+            'disc_id': self.disc_id,
+            'freedb_id': self.freedb_id,
+            'inserted_at': self.inserted_at,
+            'ready_at': self.ready_at,
+            'probed_at': self.probed_at,
+        }
+
+    @classmethod
+    def from_dict(cls, data: dict) -> 'DiscProbe':
+        toc = None
+        if data.get('toc'):
+            fields = data['toc']
+            toc = Toc(fields['first_track'], fields['last_track'], tuple(fields['offsets']),
+                      fields['leadout'], tuple(fields['data_tracks']))
+        return cls(data['device'], data['disc_type'], toc,
+                   data.get('inserted_at'), data.get('ready_at'), data.get('probed_at'))
+
+    def save(self, path: str = None):
+        """Hand the probe over to another process (e.g. trigger-rip.sh -> --daemon)"""
+        path = path or probe_cache_path(self.device)
+        directory = os.path.dirname(path)
+        os.makedirs(directory, mode=0o755, exist_ok=True)
+        info = os.lstat(directory)
+        if (not stat.S_ISDIR(info.st_mode) or info.st_uid not in (0, os.getuid())
+                or info.st_mode & (stat.S_IWGRP | stat.S_IWOTH)):
+            raise PermissionError(f"{directory} is not a private directory, not saving the probe")
+        fd, tmp_path = tempfile.mkstemp(dir=directory, prefix='.probe-', suffix='.tmp')
+        try:
+            os.fchmod(fd, 0o644)
+            with os.fdopen(fd, 'w') as f:
+                json.dump(self.to_dict(), f)
+            os.replace(tmp_path, path)
+        except BaseException:
+            os.unlink(tmp_path)
+            raise
+
+    def __repr__(self):
+        return f"DiscProbe({self.device}, {self.disc_type}, disc_id={self.disc_id})"
+
+
+def probe_cache_path(device: str) -> str:
+    return PROBE_CACHE_TEMPLATE.format(drive=os.path.basename(device))
+
+
+def probe_disc(device: str, wait: float = 0, inserted_at: float = None,
+               drive: cdrom.CdromBackend = None) -> DiscProbe:
+    """
+    Probe the disc in device with a single open of the drive.
+
+    Waits up to wait seconds for a spinning-up drive to report a disc, then
+    reads the TOC once. Raises OSError if the drive cannot be opened.
+    """
+    own_drive = drive is None
+    drive = drive or cdrom.open_drive(device)
+    try:
+        deadline = time.time() + wait
+        while True:
+            disc_type, entries = cdrom.classify_disc(drive)
+            if disc_type not in ('not_ready', 'no_disc') or time.time() >= deadline:
+                break
+            time.sleep(0.5)
+
+        ready_at = time.time() if entries is not None else None
+        toc = None
+        if entries:
+            try:
+                toc = Toc.from_entries(entries)
+            except ValueError as e:
+                logging.warning(f"Unusable TOC on {device}: {e}")
+
+        try:
+            # Clear the kernel's media-changed flag so later checks only see new changes
+            drive.media_changed()
+        except OSError:
+            pass
+        return DiscProbe(device, disc_type, toc, inserted_at, ready_at)
+    finally:
+        if own_drive:
+            drive.close()
+
+
+def load_saved_probe(device: str, max_age: float = 300) -> Optional[DiscProbe]:
+    """
+    Reuse a probe saved by another process if it is recent and the media
+    has not changed since. Returns None otherwise.
+    """
+    path = probe_cache_path(device)
+    try:
+        with open(path) as f:
+            probe = DiscProbe.from_dict(json.load(f))
+    except (OSError, ValueError, KeyError):
+        return None
+
+    if probe.device != device or probe.age > max_age:
+        return None
+    try:
+        with cdrom.open_drive(device) as drive:
+            if drive.drive_status() != cdrom.CDS_DISC_OK or drive.media_changed():
+                return None
+    except OSError:
+        return None
+    return probe
+
+
+def discard_saved_probe(device: str):
+    try:
+        os.remove(probe_cache_path(device))
+    except OSError:
+        pass
+
+
+def main():
+    args = sys.argv[1:]
+    wait = 0.0
+    save = False
+    device = '/dev/sr0'
+    while args:
+        arg = args.pop(0)
+        if arg == '--wait' and args:
+            wait = float(args.pop(0))
+        elif arg == '--save':
+            save = True
+        else:
+            device = arg
+
+    try:
+        probe = probe_disc(device, wait=wait, inserted_at=time.time())
+    except OSError as e:
+        print(f"Could not open {device}: {e}", file=sys.stderr)
+        sys.exit(2)
+
+    if save and probe.disc_type not in ('no_disc', 'not_ready'):
+        try:
+            probe.save()
+        except OSError as e:
+            # The ripper probes the drive itself then
+            print(f"Could not save probe: {e}", file=sys.stderr)
+    print(json.dumps(probe.to_dict()))
+    sys.exit(0 if probe.disc_type not in ('no_disc', 'not_ready') else 1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,288 @@
+"""
+Adaptive two-pass audio read engine
+
+Pass one reads every track at the drive's full speed in large blocks
+(CDROMREADAUDIO through autoripper.cdrom), zero-filling blocks that fail and
+noting their sector ranges. Blocks can also be read a second time at burst
+speed and compared, which finds sectors that read back differently without
+reporting an error. Pass two goes back only to those ranges at a low speed,
+sector by sector, until two reads agree, and patches them into the track
+file. Before every re-read it reads a distant stretch of the disc, so the
+drive has to read the sectors again instead of answering from its cache.
+
+Clean discs therefore rip at close to the drive's top speed while damaged
+discs only spend time where they are damaged. Every suspect range and how
+it was resolved goes into an ErrorMap that is saved next to the rip.
+"""
+
+import json
+import logging
+import os
+import struct
+import zlib
+from collections import Counter
+from typing import Dict, List, Tuple
+
+from autoripper.cdrom import CD_FRAMESIZE_RAW, CdromBackend
+from autoripper.discid import LEAD_IN_FRAMES, Toc
+
+BURST_FRAMES = 26
+# Larger than the read cache of most drives (about 2.4 MB)
+CACHE_FRAMES = 1024
+ERROR_MAP_NAME = 'rip-errors.json'
+
+
+def wav_header(data_bytes: int) -> bytes:
+    """Canonical 44-byte header for 44.1 kHz 16-bit stereo PCM"""
+    return struct.pack('<4sI4s4sIHHIIHH4sI', b'RIFF', data_bytes + 36, b'WAVE', b'fmt ', 16,
+                       1, 2, 44100, 44100 * 4, 4, 16, b'data', data_bytes)
+
+
+WAV_HEADER_BYTES = len(wav_header(0))
+
+
+class ErrorMap:
+    """Suspect sector ranges per track and how each was resolved"""
+
+    def __init__(self, disc_id: str = None, read_offset: int = 0):
+        self.disc_id = disc_id
+        self.read_offset = read_offset
+        self.tracks: Dict[int, List[dict]] = {}
+        self.timings: Dict[str, float] = {}
+
+    def add(self, number: int, start: int, end: int, reason: str) -> dict:
+        """Record sectors [start, end) of a track as suspect"""
+        entry = {'start': start, 'end': end, 'reason': reason, 'status': 'pending', 'attempts': 0}
+        self.tracks.setdefault(number, []).append(entry)
+        return entry
+
+    def ranges(self, number: int) -> List[dict]:
+        return self.tracks.get(number, [])
+
+    @property
+    def unrecoverable(self) -> int:
+        return sum(1 for entries in self.tracks.values()
+                   for entry in entries if entry['status'] == 'unrecoverable')
+
+    def to_dict(self) -> dict:
+        return {
+            'disc_id': self.disc_id,
+            'read_offset': self.read_offset,
+            'tracks': {str(number): entries for number, entries in sorted(self.tracks.items())},
+            'suspect_sectors': sum(entry['end'] - entry['start']
+                                   for entries in self.tracks.values() for entry in entries),
+            'unrecoverable_ranges': self.unrecoverable,
+            'timings': self.timings,
+        }
+
+    def save(self, directory: str) -> str:
+        path = os.path.join(directory, ERROR_MAP_NAME)
+        tmp_path = f"{path}.tmp"
+        with open(tmp_path, 'w') as f:
+            json.dump(self.to_dict(), f, indent=2)
+        os.replace(tmp_path, path)
+        return path
+
+
+def _merge(ranges: List[Tuple[int, int]]) -> List[Tuple[int, int]]:
+    merged = []
+    for start, end in sorted(ranges):
+        if merged and start <= merged[-1][1]:
+            merged[-1] = (merged[-1][0], max(merged[-1][1], end))
+        else:
+            merged.append((start, end))
+    return merged
+
+
+class BurstReader:
+    """Reads tracks of one disc through a CdromBackend in two passes"""
+
+    def __init__(self, drive: CdromBackend, toc: Toc, error_map: ErrorMap,
+                 read_offset: int = 0, block_frames: int = BURST_FRAMES,
+                 careful_speed: int = 4, max_attempts: int = 8, cache_frames: int = CACHE_FRAMES):
+        self.drive = drive
+        self.toc = toc
+        self.error_map = error_map
+        self.read_offset = read_offset
+        self.block_frames = block_frames
+        self.careful_speed = careful_speed
+        self.max_attempts = max_attempts
+        self.cache_frames = cache_frames
+        _, offsets, leadout = toc.audio_session
+        numbers = range(toc.first_track, toc.first_track + len(offsets))
+        ends = offsets[1:] + (leadout,)
+        # track number -> [first sector, end sector) in LBA
+        self.spans = {number: (start - LEAD_IN_FRAMES, end - LEAD_IN_FRAMES)
+                      for number, start, end in zip(numbers, offsets, ends)}
+        self.leadout = leadout - LEAD_IN_FRAMES
+        self._block_crcs: Dict[int, Dict[int, int]] = {}
+
+    def track_bytes(self, number: int) -> Tuple[int, int]:
+        """Byte range of the track on the disc, shifted by the read offset"""
+        start, end = self.spans[number]
+        shift = self.read_offset * 4
+        return start * CD_FRAMESIZE_RAW + shift, end * CD_FRAMESIZE_RAW + shift
+
+    def _sectors(self, number: int) -> Tuple[int, int]:
+        """Sectors that have to be read to cover the (offset) track"""
+        first, last = self.track_bytes(number)
+        return first // CD_FRAMESIZE_RAW, -(-last // CD_FRAMESIZE_RAW)
+
+    def _read(self, lba: int, frames: int) -> bytes:
+        """Read sectors, zero-filling those outside the disc's audio area"""
+        start, end = max(lba, 0), min(lba + frames, self.leadout)
+        if end <= start:
+            return bytes(frames * CD_FRAMESIZE_RAW)
+        data = self.drive.read_audio(start, end - start)
+        return (bytes((start - lba) * CD_FRAMESIZE_RAW) + data
+                + bytes((lba + frames - end) * CD_FRAMESIZE_RAW))
+
+    def _blocks(self, number: int):
+        first, end = self._sectors(number)
+        for lba in range(first, end, self.block_frames):
+            yield lba, min(self.block_frames, end - lba)
+
+    def burst_read(self, number: int, destination: str, checksum=None) -> List[dict]:
+        """
+        Pass one: read the whole track at full speed into a WAV file.
+        Returns the error map entries for blocks that failed to read.
+        """
+        first_byte, last_byte = self.track_bytes(number)
+        self._set_speed(0)
+        crcs = self._block_crcs[number] = {}
+        suspect = []
+        with open(destination, 'wb') as wav:
+            header = wav_header(last_byte - first_byte)
+            wav.write(header)
+            if checksum is not None:
+                checksum.update(header)
+            for lba, frames in self._blocks(number):
+                try:
+                    data = self._read(lba, frames)
+                    crcs[lba] = zlib.crc32(data)
+                except OSError:
+                    data = bytes(frames * CD_FRAMESIZE_RAW)
+                    suspect.append((lba, lba + frames))
+                # Trim the block to the offset-shifted track boundaries
+                block_start = lba * CD_FRAMESIZE_RAW
+                data = data[max(0, first_byte - block_start):last_byte - block_start]
+                wav.write(data)
+                if checksum is not None:
+                    checksum.update(data)
+        return [self.error_map.add(number, start, end, 'read_error') for start, end in _merge(suspect)]
+
+    def verify(self, number: int) -> List[dict]:
+        """
+        Read the track again at full speed and compare block checksums with
+        pass one. Returns error map entries for blocks that differ.
+        """
+        crcs = self._block_crcs.get(number, {})
+        suspect = []
+        for lba, frames in self._blocks(number):
+            if lba not in crcs:
+                continue  # Already a read error
+            try:
+                data = self._read(lba, frames)
+            except OSError:
+                suspect.append((lba, lba + frames))
+                continue
+            if zlib.crc32(data) != crcs[lba]:
+                suspect.append((lba, lba + frames))
+        return [self.error_map.add(number, start, end, 'mismatch') for start, end in _merge(suspect)]
+
+    def repair(self, number: int, destination: str, entries: List[dict]):
+        """
+        Pass two: re-read each suspect range slowly, one sector at a time,
+        until two reads agree, and patch the sectors into the WAV file.
+        Unresolvable sectors keep the most common read (or silence).
+        """
+        first_byte, last_byte = self.track_bytes(number)
+        self._set_speed(self.careful_speed)
+        try:
+            with open(destination, 'r+b') as wav:
+                for entry in entries:
+                    sectors, attempts = self._careful_range(entry['start'], entry['end'])
+                    entry['attempts'] += attempts
+                    recovered = all(agreed for _, agreed in sectors.values())
+                    for lba, (data, _) in sectors.items():
+                        self._patch(wav, lba, data, first_byte, last_byte)
+                    entry['status'] = 'recovered' if recovered else 'unrecoverable'
+                    log = logging.info if recovered else logging.warning
+                    log(f"Track {number}: sectors {entry['start']}-{entry['end'] - 1} "
+                        f"{entry['status']} after {entry['attempts']} reads")
+        finally:
+            self._set_speed(0)
+
+    def _set_speed(self, speed: int):
+        try:
+            self.drive.set_speed(speed)
+        except (OSError, NotImplementedError) as e:
+            logging.debug(f"Could not set read speed to {speed}: {e}")
+
+    def _defeat_cache(self, start: int, end: int):
+        """Read cache_frames sectors away from [start, end) so the drive drops them from its cache"""
+        if not self.cache_frames:
+            return
+        if end + 2 * self.cache_frames <= self.leadout:
+            far = end + self.cache_frames
+        elif start - 2 * self.cache_frames >= 0:
+            far = start - 2 * self.cache_frames
+        else:
+            logging.debug(f"Disc too short to flush a {self.cache_frames} sector cache")
+            return
+        for lba in range(far, far + self.cache_frames, self.block_frames):
+            try:
+                self._read(lba, min(self.block_frames, far + self.cache_frames - lba))
+            except OSError:
+                pass
+
+    def _careful_range(self, start: int, end: int) -> Tuple[Dict[int, Tuple[bytes, bool]], int]:
+        """
+        Read sectors [start, end) one by one, going over those not yet
+        confirmed until two reads of each agree or max_attempts rounds are
+        done. Returns {lba: (data, agreed)} and the number of sector reads.
+        """
+        reads = {lba: Counter() for lba in range(start, end)}
+        agreed = {}
+        attempts = 0
+        for _ in range(self.max_attempts):
+            pending = [lba for lba in reads if lba not in agreed]
+            if not pending:
+                break
+            self._defeat_cache(start, end)
+            for lba in pending:
+                attempts += 1
+                try:
+                    data = self._read(lba, 1)
+                except OSError:
+                    continue
+                reads[lba][data] += 1
+                if reads[lba][data] >= 2:
+                    agreed[lba] = data
+        sectors = {}
+        for lba, counts in reads.items():
+            if lba in agreed:
+                sectors[lba] = (agreed[lba], True)
+            elif counts:
+                sectors[lba] = (counts.most_common(1)[0][0], False)
+            else:
+                sectors[lba] = (bytes(CD_FRAMESIZE_RAW), False)
+        return sectors, attempts
+
+    @staticmethod
+    def _patch(wav, lba: int, data: bytes, first_byte: int, last_byte: int):
+        sector_start = lba * CD_FRAMESIZE_RAW
+        begin = max(sector_start, first_byte)
+        end = min(sector_start + len(data), last_byte)
+        if begin >= end:
+            return
+        wav.seek(WAV_HEADER_BYTES + begin - first_byte)
+        wav.write(data[begin - sector_start:end - sector_start])
+
+
+def checksum_file(path: str, checksum) -> None:
+    """Feed a finished WAV file into a TrackChecksum"""
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(256 * 1024), b''):
+            checksum.update(chunk)
+
@@ -0,0 +1,318 @@
+"""
+Background metadata reconciliation for placeholder rips
+
+Discs ripped while MusicBrainz could not be reached end up under
+Unknown_Artist_NN/Unknown_Album_NN. Their album directories carry a
+.disc-info.json (see autoripper.discinfo) with the disc's IDs and TOC. The
+reconciler keeps a persistent list of those directories. Once the network
+is back it sweeps the whole backlog: one batch of lookups with a single
+request per distinct disc ID, then each album is retagged and renamed in
+place. Every track is retagged through a sibling temporary file that
+replaces it atomically, so the SD card never has to hold a second copy of
+the album, and the directories are renamed last.
+"""
+
+import json
+import logging
+import os
+import shutil
+import threading
+import time
+from typing import Callable, Dict, List, Optional
+
+from autoripper import aio
+from autoripper.connectivity import ConnectivityMonitor
+from autoripper.discid import Toc
+from autoripper.discinfo import (DISC_INFO_NAME, needs_metadata, read_disc_info,
+                                 write_disc_info)
+from autoripper.encoding import tag_file, track_files
+from autoripper.pipeline import AlbumLayout, sync_file
+
+DEFAULT_INTERVAL = 15 * 60
+# How often to check whether the network is back while work is waiting
+OFFLINE_POLL = 60
+MAX_RETRY_DELAY = 24 * 60 * 60
+
+_shared = {}
+_shared_lock = threading.Lock()
+
+
+def default_state_path(config: dict) -> str:
+    state_dir = config.get('state_dir', '/var/lib/auto-ripper')
+    return os.path.join(state_dir, 'pending-metadata.json')
+
+
+class MetadataReconciler:
+    """
+    Persistent queue of placeholder album directories, resolved in the
+    background
+
+    lookup({disc_id: toc}) returns {disc_id: MusicBrainz discid response or
+    None} for a whole batch and is expected to do its own rate limiting;
+    resolve(info, data) turns it into the AlbumLayout to move the album to,
+    or None if the response has no usable names. Sweeps only run while the
+    ConnectivityMonitor reports the network as up, and start as soon as it
+    comes back. on_moved(old_dir, new_dir) is called after every rename.
+    """
+
+    def __init__(self, path: str, lookup: Callable[[Dict[str, Toc]], Dict[str, Optional[dict]]],
+                 resolve: Callable[[dict, dict], Optional[AlbumLayout]],
+                 connectivity: ConnectivityMonitor = None, interval: float = DEFAULT_INTERVAL,
+                 is_busy: Callable[[str], bool] = None,
+                 on_moved: Callable[[str, str], None] = None):
+        self.path = path
+        self.lookup = lookup
+        self.resolve = resolve
+        self.connectivity = connectivity
+        self.interval = interval
+        self.is_busy = is_busy or (lambda disc_id: False)
+        self.on_moved = on_moved
+        self._lock = threading.Lock()
+        self._wake = threading.Event()
+        self._thread = None
+        # album_dir -> {'disc_id', 'attempts', 'next_try'}
+        self.pending: Dict[str, dict] = self._load()
+        if connectivity is not None:
+            connectivity.add_listener(lambda online: online and self.wake())
+
+    @classmethod
+    def shared(cls, path: str, *args, **kwargs) -> 'MetadataReconciler':
+        """One reconciler per state file and process, shared by every drive worker"""
+        with _shared_lock:
+            if path not in _shared:
+                _shared[path] = cls(path, *args, **kwargs)
+            return _shared[path]
+
+    def _load(self) -> Dict[str, dict]:
+        try:
+            with open(self.path) as f:
+                return json.load(f)
+        except FileNotFoundError:
+            return {}
+        except (OSError, ValueError) as e:
+            logging.warning(f"Ignoring unreadable metadata backlog {self.path}: {e}")
+            return {}
+
+    def _save(self):
+        os.makedirs(os.path.dirname(self.path) or '.', exist_ok=True)
+        tmp_path = f"{self.path}.tmp"
+        with open(tmp_path, 'w') as f:
+            json.dump(self.pending, f, indent=2)
+        os.replace(tmp_path, self.path)
+
+    def add(self, album_dir: str) -> bool:
+        """Queue an album directory whose disc info says its names are placeholders"""
+        info = read_disc_info(album_dir)
+        if not needs_metadata(info):
+            return False
+        with self._lock:
+            if album_dir not in self.pending:
+                self.pending[album_dir] = {'disc_id': info['disc_id'], 'attempts': 0, 'next_try': 0}
+                self._save()
+                logging.info(f"Queued {album_dir} for metadata lookup (disc {info['disc_id']})")
+        self._wake.set()
+        return True
+
+    def scan(self, output_dir: str) -> int:
+        """Queue every placeholder album below output_dir (artist/album depth)"""
+        added = 0
+        for artist in _subdirs(output_dir):
+            for album_dir in _subdirs(artist):
+                if album_dir not in self.pending and os.path.exists(
+                        os.path.join(album_dir, DISC_INFO_NAME)) and self.add(album_dir):
+                    added += 1
+        return added
+
+    def sweep(self) -> int:
+        """
+        Look up every due disc once and move its albums into place.
+        Returns the number of albums renamed.
+        """
+        now = time.time()
+        with self._lock:
+            due: Dict[str, List[str]] = {}
+            for album_dir, entry in self.pending.items():
+                if entry['next_try'] <= now:
+                    due.setdefault(entry['disc_id'], []).append(album_dir)
+        if due:
+            logging.info(f"Reconciling metadata for {len(due)} discs")
+
+        batch: Dict[str, Dict[str, dict]] = {}
+        for disc_id, album_dirs in due.items():
+            if self.is_busy(disc_id):
+                continue
+            infos = {album_dir: read_disc_info(album_dir) for album_dir in album_dirs}
+            for album_dir in [d for d, info in infos.items() if not needs_metadata(info)]:
+                logging.info(f"{album_dir} no longer needs metadata, dropping it from the backlog")
+                self._forget(album_dir)
+                del infos[album_dir]
+            if infos:
+                batch[disc_id] = infos
+        if not batch:
+            return 0
+
+        try:
+            answers = self.lookup({disc_id: Toc.from_dict(next(iter(infos.values()))['toc'])
+                                   for disc_id, infos in batch.items()})
+        except Exception as e:
+            logging.warning(f"Metadata lookup failed: {e}")
+            answers = {}
+
+        fixed = 0
+        for disc_id, infos in batch.items():
+            data = answers.get(disc_id)
+            if not data:
+                self._retry_later(list(infos))
+                continue
+            for album_dir, info in infos.items():
+                layout = self.resolve(info, data)
+                if layout is None:
+                    self._retry_later([album_dir])
+                elif self.relocate(album_dir, info, layout):
+                    self._forget(album_dir)
+                    fixed += 1
+                else:
+                    self._retry_later([album_dir])
+        return fixed
+
+    def _retry_later(self, album_dirs: List[str]):
+        with self._lock:
+            for album_dir in album_dirs:
+                entry = self.pending.get(album_dir)
+                if entry is None:
+                    continue
+                entry['attempts'] += 1
+                delay = min(MAX_RETRY_DELAY, self.interval * 2 ** (entry['attempts'] - 1))
+                entry['next_try'] = time.time() + delay
+            self._save()
+
+    def _forget(self, album_dir: str):
+        with self._lock:
+            self.pending.pop(album_dir, None)
+            self._save()
+
+    def relocate(self, album_dir: str, info: dict, layout: AlbumLayout) -> bool:
+        """
+        Retag the album's tracks in place, rename them to layout's names and
+        rename the album (and, if it holds nothing else, the placeholder
+        artist) directory. Every step is atomic on its own and the disc info
+        is only marked resolved at the end, so an album left half done by a
+        failure or crash is finished by the next sweep.
+        """
+        files = track_files(album_dir)
+        if not files:
+            logging.warning(f"No tracks found in {album_dir}")
+            return False
+        target = layout.album_dir
+        moving = os.path.abspath(target) != os.path.abspath(album_dir)
+        if moving and os.path.exists(target):
+            logging.warning(f"{target} already exists, not moving {album_dir}")
+            return False
+        try:
+            track_count = len(info.get('tracks') or {number for number, _ in files})
+            for (number, fmt), path in sorted(files.items()):
+                self._retag(fmt, path, layout.tags(number, track_count))
+            for (number, fmt), path in files.items():
+                renamed = os.path.join(album_dir, os.path.basename(layout.track_path(number, fmt)))
+                if renamed != path:
+                    os.rename(path, renamed)
+            if moving:
+                album_dir_now = self._rename_artist_dir(album_dir, target)
+                os.rename(album_dir_now, target)
+            write_disc_info(target, dict(info, metadata_source='musicbrainz',
+                                         artist=layout.artist, album=layout.album,
+                                         renamed_from=album_dir, renamed_at=time.time()))
+        except OSError as e:
+            logging.error(f"Could not retag {album_dir}: {e}")
+            return False
+
+        try:
+            os.rmdir(os.path.dirname(album_dir))  # Only succeeds once the artist dir is empty
+        except OSError:
+            pass
+        logging.info(f"Renamed {album_dir} to {target}")
+        if self.on_moved is not None:
+            self.on_moved(album_dir, target)
+        return True
+
+    @staticmethod
+    def _retag(fmt: str, path: str, tags: dict):
+        """Tag a copy of path next to it and swap it in, so path is never left half written"""
+        tmp_path = os.path.join(os.path.dirname(path), f".{os.path.basename(path)}.retag")
+        try:
+            shutil.copy2(path, tmp_path)
+            if not tag_file(fmt, tmp_path, tags):
+                raise OSError(f"could not tag {path}")
+            sync_file(tmp_path)
+            os.replace(tmp_path, path)
+        except BaseException:
+            try:
+                os.remove(tmp_path)
+            except OSError:
+                pass
+            raise
+
+    @staticmethod
+    def _rename_artist_dir(album_dir: str, target: str) -> str:
+        """
+        Rename a placeholder artist directory holding only this album to the
+        target's artist; returns where the album directory is now
+        """
+        old_parent, new_parent = os.path.dirname(album_dir), os.path.dirname(target)
+        if (not os.path.exists(new_parent) and os.path.dirname(old_parent) == os.path.dirname(new_parent)
+                and os.listdir(old_parent) == [os.path.basename(album_dir)]):
+            os.rename(old_parent, new_parent)
+            return os.path.join(new_parent, os.path.basename(album_dir))
+        os.makedirs(new_parent, exist_ok=True)
+        return album_dir
+
+    def wake(self):
+        """Sweep now instead of at the next interval (e.g. when the network is back)"""
+        with self._lock:
+            for entry in self.pending.values():
+                entry['next_try'] = 0
+        self._wake.set()
+
+    def start(self):
+        if self._thread is None:
+            self._thread = aio.adopt('metadata-reconciler', self.step, self._wake)
+        if self._thread is None:
+            self._thread = threading.Thread(target=self.run, name='metadata-reconciler', daemon=True)
+            self._thread.start()
+
+    def step(self, readable: bool = False) -> float:
+        """Sweep if work is queued and the network is up; returns the seconds until the next sweep"""
+        if not self.pending:
+            return self._next_wait()
+        if self.connectivity is not None and not self.connectivity.is_online():
+            return min(self.interval, OFFLINE_POLL)
+        try:
+            fixed = self.sweep()
+            if fixed:
+                logging.info(f"Metadata reconciliation renamed {fixed} albums, "
+                             f"{len(self.pending)} still pending")
+        except Exception as e:
+            logging.error(f"Metadata reconciliation failed: {e}")
+        return self._next_wait()
+
+    def run(self, stop_event: threading.Event = None):
+        """Sweep whenever work is queued or due, while the network is up"""
+        stop_event = stop_event or threading.Event()
+        while not stop_event.is_set():
+            self._wake.wait(self.step())
+            self._wake.clear()
+
+    def _next_wait(self) -> float:
+        with self._lock:
+            due = [entry['next_try'] for entry in self.pending.values()]
+        if not due:
+            return self.interval
+        return max(1.0, min(self.interval, min(due) - time.time()))
+
+
+def _subdirs(path: str) -> List[str]:
+    try:
+        return [entry.path for entry in os.scandir(path)
+                if entry.is_dir(follow_symlinks=False) and not entry.name.startswith('.')]
+    except OSError:
+        return []
@@ -0,0 +1,377 @@
+"""
+Streaming supervision of external tools
+
+run_command() starts a tool in its own process group and reads its stdout
+and stderr line by line while it runs, instead of buffering hours of
+output until it exits. Lines are fed to parsers that turn the tool's
+progress output (cdparanoia, abcde, HandBrake) into ProgressEvents for a
+callback; everything else goes into a ring buffer holding only the last
+few hundred lines for error reports. On timeout or cancel the whole
+process group is terminated, so helpers such as the cdparanoia and lame
+processes abcde starts never outlive it and keep holding the drive.
+start_command() gives the same supervision to tools whose stdin and
+stdout are data pipes, such as cdparanoia streaming into the encoders.
+"""
+
+import logging
+import os
+import re
+import selectors
+import signal
+import subprocess
+import threading
+import time
+from collections import deque, namedtuple
+from typing import Callable, Iterable, List, Optional
+
+TAIL_LINES = 200
+MAX_LINE = 4096
+# Time between SIGTERM and SIGKILL for the process group
+KILL_GRACE = 5
+# How long pipes may stay open once the tool itself has exited
+DRAIN_GRACE = 5
+POLL_INTERVAL = 0.5
+
+ProgressEvent = namedtuple('ProgressEvent', ['tool', 'fraction', 'detail'])
+ProgressEvent.__doc__ = "fraction is 0..1 of the whole run; detail is a short human-readable status"
+
+
+class CommandResult:
+    """Outcome of run_command(); output holds only the last TAIL_LINES lines"""
+
+    def __init__(self, args: List[str], returncode: Optional[int], output: str,
+                 timed_out: bool, cancelled: bool, duration: float):
+        self.args = args
+        self.returncode = returncode
+        self.output = output
+        self.timed_out = timed_out
+        self.cancelled = cancelled
+        self.duration = duration
+
+    @property
+    def ok(self) -> bool:
+        return self.returncode == 0 and not (self.timed_out or self.cancelled)
+
+    def describe(self) -> str:
+        if self.timed_out:
+            return f"timed out after {self.duration:.0f}s"
+        if self.cancelled:
+            return "cancelled"
+        return f"return code {self.returncode}"
+
+
+class OutputParser:
+    """Turns output lines of one tool into ProgressEvents"""
+
+    tool = 'command'
+
+    def feed(self, line: str) -> Optional[ProgressEvent]:
+        return None
+
+
+class CdparanoiaProgress(OutputParser):
+    """
+    cdparanoia -e progress: "Ripping from sector N" and "to sector M" once,
+    then "##: CODE [function] @ POSITION" with POSITION in 16-bit words
+    """
+
+    tool = 'cdparanoia'
+    FROM = re.compile(r'from sector\s+(\d+)')
+    TO = re.compile(r'^\s*to sector\s+(\d+)')
+    POSITION = re.compile(r'^##:\s*-?\d+\s+\[([\w.]+)\]\s+@\s+(\d+)')
+    WORDS_PER_SECTOR = 1176
+
+    def __init__(self):
+        self.first = self.last = None
+
+    def feed(self, line: str) -> Optional[ProgressEvent]:
+        match = self.FROM.search(line)
+        if match:
+            self.first = int(match.group(1))
+            return ProgressEvent(self.tool, 0.0, f"from sector {self.first}")
+        match = self.TO.match(line)
+        if match:
+            self.last = int(match.group(1))
+            return ProgressEvent(self.tool, 0.0, f"sectors {self.first}-{self.last}")
+        match = self.POSITION.match(line)
+        if match is None or self.first is None or self.last is None or self.last <= self.first:
+            return None
+        sector = int(match.group(2)) // self.WORDS_PER_SECTOR
+        fraction = min(1.0, max(0.0, (sector - self.first) / (self.last - self.first)))
+        return ProgressEvent(self.tool, fraction, f"sector {sector} ({match.group(1)})")
+
+
+class AbcdeProgress(OutputParser):
+    """abcde's "Grabbing track N" / "Encoding track N of M" status lines"""
+
+    tool = 'abcde'
+    GRABBING = re.compile(r'Grabbing track (\d+)')
+    ENCODING = re.compile(r'Encoding track (\d+) of (\d+)')
+
+    def __init__(self, track_count: int = None):
+        self.track_count = track_count
+
+    def feed(self, line: str) -> Optional[ProgressEvent]:
+        match = self.ENCODING.search(line)
+        if match:
+            number, self.track_count = int(match.group(1)), int(match.group(2))
+            return ProgressEvent(self.tool, (number - 1) / self.track_count, f"encoding track {number}")
+        match = self.GRABBING.search(line)
+        if match:
+            number = int(match.group(1))
+            fraction = (number - 1) / self.track_count if self.track_count else 0.0
+            return ProgressEvent(self.tool, fraction, f"reading track {number}")
+        return None
+
+
+class HandBrakeProgress(OutputParser):
+    """HandBrakeCLI "Encoding: task 1 of 2, 45.67 % (123.45 fps, avg 110.23 fps, ETA 00h12m34s)" """
+
+    tool = 'handbrake'
+    ENCODING = re.compile(r'Encoding: task (\d+) of (\d+), ([\d.]+) %'
+                          r'(?: \(([\d.]+) fps, avg ([\d.]+) fps, ETA (\d+)h(\d+)m(\d+)s\))?')
+
+    def feed(self, line: str) -> Optional[ProgressEvent]:
+        match = self.ENCODING.search(line)
+        if match is None:
+            return None
+        task, tasks, percent = int(match.group(1)), int(match.group(2)), float(match.group(3))
+        fraction = ((task - 1) + percent / 100) / tasks
+        detail = f"task {task}/{tasks} {percent:.1f}%"
+        if match.group(4):
+            hours, minutes, seconds = (int(match.group(i)) for i in (6, 7, 8))
+            detail += f", {float(match.group(4)):.1f} fps, ETA {hours * 3600 + minutes * 60 + seconds}s"
+        return ProgressEvent(self.tool, fraction, detail)
+
+
+def _kill_group(process: subprocess.Popen):
+    """SIGTERM the process group, SIGKILL whatever is left after KILL_GRACE"""
+    for sig, grace in ((signal.SIGTERM, KILL_GRACE), (signal.SIGKILL, None)):
+        try:
+            os.killpg(process.pid, sig)
+        except (ProcessLookupError, PermissionError):
+            return
+        if grace is None:
+            break
+        try:
+            process.wait(timeout=grace)
+            # The leader is gone; make sure no helper survived it
+            os.killpg(process.pid, signal.SIGKILL)
+            return
+        except subprocess.TimeoutExpired:
+            continue
+        except (ProcessLookupError, PermissionError):
+            return
+
+
+class OutputSink:
+    """
+    Splits raw output of a tool into lines, sending progress lines to the
+    parsers and everything else into a tail of the last tail_lines lines
+    """
+
+    def __init__(self, parsers: Iterable[OutputParser] = (),
+                 on_progress: Callable[[ProgressEvent], None] = None, tail_lines: int = TAIL_LINES):
+        self.parsers = list(parsers)
+        self.on_progress = on_progress
+        self.tail = deque(maxlen=tail_lines)
+        self._last_progress = {}
+        self._buffers = {}
+
+    def line(self, raw: bytes):
+        line = raw.decode('utf-8', 'replace').rstrip()
+        if not line:
+            return
+        for parser in self.parsers:
+            event = parser.feed(line)
+            if event is not None:
+                # Progress redraws don't crowd errors out of the tail; one update per percent
+                key = (event.tool, round(event.fraction, 2))
+                if self.on_progress is not None and self._last_progress.get(event.tool) != key:
+                    self._last_progress[event.tool] = key
+                    try:
+                        self.on_progress(event)
+                    except Exception as e:
+                        logging.debug(f"Progress callback failed: {e}")
+                return
+        self.tail.append(line)
+
+    def feed(self, stream, data: bytes):
+        """Add a chunk read from stream; an empty chunk flushes its last partial line"""
+        buffered = self._buffers.pop(stream, b'')
+        if not data:
+            if buffered:
+                self.line(buffered)
+            return
+        # Progress bars redraw with \r; treat it as a line end too
+        lines = re.split(rb'[\r\n]', buffered + data)
+        rest = lines.pop()
+        if len(rest) > MAX_LINE:
+            lines.append(rest[:MAX_LINE])
+            rest = b''
+        self._buffers[stream] = rest
+        for raw in lines:
+            self.line(raw)
+
+    @property
+    def output(self) -> str:
+        return '\n'.join(self.tail)
+
+
+def run_command(args: List[str], timeout: float = None, parsers: Iterable[OutputParser] = (),
+                on_progress: Callable[[ProgressEvent], None] = None,
+                cancel: threading.Event = None, tail_lines: int = TAIL_LINES,
+                cwd: str = None, env: dict = None) -> CommandResult:
+    """
+    Run args to completion, streaming its output through parsers.
+    Raises OSError if the tool can't be started; timeouts and cancellation
+    are reported in the result.
+    """
+    sink = OutputSink(parsers, on_progress, tail_lines)
+    started = time.monotonic()
+    deadline = started + timeout if timeout else None
+    process = subprocess.Popen(args, stdin=subprocess.DEVNULL, stdout=subprocess.PIPE,
+                               stderr=subprocess.PIPE, cwd=cwd, env=env, start_new_session=True)
+
+    selector = selectors.DefaultSelector()
+    for pipe in (process.stdout, process.stderr):
+        os.set_blocking(pipe.fileno(), False)
+        selector.register(pipe, selectors.EVENT_READ)
+    timed_out = cancelled = False
+    exited_at = None
+    try:
+        while selector.get_map():
+            now = time.monotonic()
+            if deadline is not None and now >= deadline and exited_at is None:
+                timed_out = True
+                break
+            if cancel is not None and cancel.is_set():
+                cancelled = True
+                break
+            if exited_at is None and process.poll() is not None:
+                exited_at = now
+            if exited_at is not None and now - exited_at > DRAIN_GRACE:
+                break  # A daemonized helper kept the pipes open
+            wait = POLL_INTERVAL if deadline is None else max(0.0, min(POLL_INTERVAL, deadline - now))
+            for key, _ in selector.select(wait):
+                pipe = key.fileobj
+                try:
+                    data = os.read(pipe.fileno(), 65536)
+                except BlockingIOError:
+                    continue
+                if not data:
+                    selector.unregister(pipe)
+                sink.feed(pipe, data)
+    finally:
+        lingering = bool(selector.get_map())
+        selector.close()
+        if process.poll() is None or lingering:
+            _kill_group(process)
+        for pipe in (process.stdout, process.stderr):
+            pipe.close()
+        process.wait()
+
+    duration = time.monotonic() - started
+    log_interrupted(args, timed_out, cancelled, duration)
+    return CommandResult(list(args), process.returncode, sink.output, timed_out, cancelled, duration)
+
+
+class StreamingCommand:
+    """
+    A tool whose stdin and stdout carry data (cdparanoia's PCM, an
+    encoder's input) rather than output to parse, started by
+    start_command(). It runs in its own process group like run_command()
+    tools; a supervisor thread parses its stderr, keeps the tail and
+    terminates the group on timeout or cancel, so a pipe loop feeding or
+    draining it never hangs and no helper outlives it.
+    """
+
+    def __init__(self, args: List[str], stdin=None, stdout=None, timeout: float = None,
+                 parsers: Iterable[OutputParser] = (), on_progress: Callable[[ProgressEvent], None] = None,
+                 cancel: threading.Event = None, tail_lines: int = TAIL_LINES):
+        self.args = list(args)
+        self.cancel = cancel
+        self.timed_out = self.cancelled = False
+        self._sink = OutputSink(parsers, on_progress, tail_lines)
+        self._started = time.monotonic()
+        self._deadline = self._started + timeout if timeout else None
+        self._kill = threading.Event()
+        self.process = subprocess.Popen(args, bufsize=0, stdin=stdin, stdout=stdout, stderr=subprocess.PIPE,
+                                        start_new_session=True)
+        self._thread = threading.Thread(target=self._supervise, daemon=True,
+                                        name=f"supervise-{os.path.basename(args[0])}")
+        self._thread.start()
+
+    @property
+    def stdin(self):
+        return self.process.stdin
+
+    @property
+    def stdout(self):
+        return self.process.stdout
+
+    def kill(self):
+        """Terminate the process group now (reported as cancelled)"""
+        self._kill.set()
+
+    def _supervise(self):
+        stderr = self.process.stderr
+        os.set_blocking(stderr.fileno(), False)
+        selector = selectors.DefaultSelector()
+        selector.register(stderr, selectors.EVENT_READ)
+        try:
+            while True:
+                if self._deadline is not None and time.monotonic() >= self._deadline:
+                    self.timed_out = True
+                    break
+                if self._kill.is_set() or (self.cancel is not None and self.cancel.is_set()):
+                    self.cancelled = True
+                    break
+                if not selector.get_map():
+                    if self.process.poll() is not None:
+                        return
+                    self._kill.wait(POLL_INTERVAL)
+                    continue
+                for key, _ in selector.select(POLL_INTERVAL):
+                    try:
+                        data = os.read(stderr.fileno(), 65536)
+                    except BlockingIOError:
+                        continue
+                    if not data:
+                        selector.unregister(stderr)
+                    self._sink.feed(stderr, data)
+        finally:
+            selector.close()
+            if self.timed_out or self.cancelled:
+                _kill_group(self.process)
+                log_interrupted(self.args, self.timed_out, self.cancelled, time.monotonic() - self._started)
+
+    def wait(self) -> CommandResult:
+        """Wait for the tool (and its supervisor) to finish; closes its pipes"""
+        self.process.wait()
+        self._thread.join()
+        for pipe in (self.process.stdin, self.process.stdout, self.process.stderr):
+            if pipe is not None:
+                try:
+                    pipe.close()
+                except BrokenPipeError:
+                    pass
+        return CommandResult(self.args, self.process.returncode, self._sink.output, self.timed_out,
+                             self.cancelled, time.monotonic() - self._started)
+
+
+def start_command(args: List[str], stdin=None, stdout=None, timeout: float = None,
+                  parsers: Iterable[OutputParser] = (), on_progress: Callable[[ProgressEvent], None] = None,
+                  cancel: threading.Event = None, tail_lines: int = TAIL_LINES) -> StreamingCommand:
+    """
+    Start args with the given stdin/stdout (e.g. subprocess.PIPE or another
+    tool's stdout) and return at once; the caller moves the data and calls
+    wait(). Raises OSError if the tool can't be started.
+    """
+    return StreamingCommand(args, stdin, stdout, timeout, parsers, on_progress, cancel, tail_lines)
+
+
+def log_interrupted(args: List[str], timed_out: bool, cancelled: bool, duration: float):
+    if timed_out or cancelled:
+        logging.warning(f"{os.path.basename(args[0])} {'timed out' if timed_out else 'cancelled'} "
+                        f"after {duration:.0f}s, killed its process group")
@@ -0,0 +1,214 @@
+"""
+Multi-drive supervisor
+
+Discovers every optical drive (/dev/sr*) and runs an independent worker
+thread per drive. Each worker owns its own AutoRipper instance (state,
+probe cache, lock file) and tags its log records with the drive name, while
+CPU-heavy encoding is shared across workers through EncoderSlots.
+AsyncSupervisor does the same with one asyncio task per drive on the
+AsyncCore loop instead of a thread.
+"""
+
+import asyncio
+import contextvars
+import glob
+import logging
+import os
+import re
+import threading
+from typing import Callable, Dict, List, Optional
+
+from autoripper.aio import AsyncCore
+from autoripper.encoding import EncoderSlots
+
+# Per thread, and per asyncio task on the loop
+_drive_context = contextvars.ContextVar('drive', default=None)
+
+
+def discover_drives(pattern: str = '/dev/sr[0-9]*') -> List[str]:
+    """Return all optical drive device nodes, sorted by drive number"""
+    def drive_number(path):
+        match = re.search(r'(\d+)$', path)
+        return int(match.group(1)) if match else 0
+    return sorted(glob.glob(pattern), key=drive_number)
+
+
+def set_drive_context(device: Optional[str]):
+    """Bind log records emitted by the current thread (or asyncio task) to a drive"""
+    _drive_context.set(os.path.basename(device) if device else None)
+
+
+class DriveLogFilter(logging.Filter):
+    """
+    Add a ``drive`` attribute to every log record so one log file can be
+    followed per drive. Falls back to '-' outside of a drive worker.
+    """
+
+    def __init__(self, default: str = '-'):
+        super().__init__()
+        self.default = default
+
+    def filter(self, record):
+        record.drive = _drive_context.get() or self.default
+        return True
+
+
+class DriveWorker(threading.Thread):
+    """Wait/process loop for a single drive"""
+
+    def __init__(self, device: str, ripper_factory: Callable, stop_event: threading.Event):
+        super().__init__(name=os.path.basename(device), daemon=True)
+        self.device = device
+        self.ripper_factory = ripper_factory
+        self.stop_event = stop_event
+        self.ripper = None
+        self.discs_processed = 0
+
+    def run(self):
+        set_drive_context(self.device)
+        try:
+            self.ripper = self.ripper_factory(self.device)
+        except Exception as e:
+            logging.error(f"Could not start worker for {self.device}: {e}")
+            return
+
+        logging.info(f"Drive worker started for {self.device}")
+        while not self.stop_event.is_set():
+            try:
+                if not self.ripper.wait_for_disc(stop_event=self.stop_event):
+                    break
+                self.ripper.process_disc()
+                self.discs_processed += 1
+            except Exception as e:
+                logging.error(f"Unexpected error in drive worker: {e}")
+
+            # Wait a moment before checking for next disc
+            self.stop_event.wait(5)
+
+            if not os.path.exists(self.device):
+                logging.warning(f"Drive {self.device} disappeared, stopping worker")
+                break
+        logging.info(f"Drive worker for {self.device} stopped")
+
+
+class Supervisor:
+    """
+    Start a DriveWorker per discovered drive and keep the set current
+
+    Drives that are hot-plugged later (USB racks) are picked up on the next
+    rescan; workers whose drive disappears exit on their own.
+    """
+
+    def __init__(self, ripper_factory: Callable, config: dict = None,
+                 encoder_slots: EncoderSlots = None):
+        self.config = config or {}
+        self.encoder_slots = encoder_slots or EncoderSlots(self.config.get('encoder_slots'))
+        self.ripper_factory = ripper_factory
+        self.rescan_interval = self.config.get('drive_rescan_interval', 30)
+        self.stop_event = threading.Event()
+        self.workers: Dict[str, DriveWorker] = {}
+
+    def configured_drives(self) -> List[str]:
+        """Drives from config.json 'devices', or every sr* drive when empty"""
+        devices = self.config.get('devices') or []
+        if devices:
+            return [d for d in devices if os.path.exists(d)]
+        return discover_drives()
+
+    def start_workers(self):
+        for device in self.configured_drives():
+            worker = self.workers.get(device)
+            if worker and worker.is_alive():
+                continue
+            worker = DriveWorker(device, self._make_ripper, self.stop_event)
+            self.workers[device] = worker
+            worker.start()
+
+    def _make_ripper(self, device):
+        return self.ripper_factory(device, self.encoder_slots)
+
+    def run(self):
+        """Supervise drive workers until interrupted"""
+        logging.info(f"Supervisor started with {self.encoder_slots.slots} encoder slot(s)")
+        try:
+            while not self.stop_event.is_set():
+                self.start_workers()
+                if not self.workers:
+                    logging.warning("No optical drives found, rescanning later")
+                self.stop_event.wait(self.rescan_interval)
+        except KeyboardInterrupt:
+            logging.info("Supervisor stopped by user")
+        finally:
+            self.stop()
+
+    def stop(self, timeout: float = 10):
+        self.stop_event.set()
+        for worker in self.workers.values():
+            worker.join(timeout)
+
+
+class AsyncSupervisor(Supervisor):
+    """
+    Supervisor on the AsyncCore loop: one task per drive instead of a thread
+
+    A waiting drive costs no thread at all; processing a disc runs as a
+    cancellable stage, so SIGTERM kills the tools of every rip in progress.
+    """
+
+    def __init__(self, ripper_factory: Callable, core: AsyncCore, config: dict = None,
+                 encoder_slots: EncoderSlots = None):
+        super().__init__(ripper_factory, config, encoder_slots)
+        self.core = core
+        self.tasks: Dict[str, asyncio.Task] = {}
+
+    async def drive_loop(self, device: str):
+        """Wait/process loop for a single drive"""
+        set_drive_context(device)
+        try:
+            ripper = await self.core.run_blocking(self._make_ripper, device)
+        except Exception as e:
+            logging.error(f"Could not start worker for {device}: {e}")
+            return
+
+        logging.info(f"Drive task started for {device}")
+        while True:
+            try:
+                await ripper.wait_for_disc_async(self.core)
+                await self.core.stage(f"disc in {device}", ripper.process_disc)
+            except asyncio.CancelledError:
+                logging.info(f"Drive task for {device} stopped")
+                raise
+            except Exception as e:
+                logging.error(f"Unexpected error in drive task: {e}")
+
+            # Wait a moment before checking for next disc
+            await asyncio.sleep(5)
+
+            if not os.path.exists(device):
+                logging.warning(f"Drive {device} disappeared, stopping task")
+                break
+
+    def start_workers(self):
+        for device in self.configured_drives():
+            task = self.tasks.get(device)
+            if task and not task.done():
+                continue
+            self.tasks[device] = asyncio.get_running_loop().create_task(self.drive_loop(device))
+
+    async def supervise(self):
+        logging.info(f"Supervisor started with {self.encoder_slots.slots} encoder slot(s) "
+                     f"on the asyncio core")
+        try:
+            while True:
+                self.start_workers()
+                if not self.tasks:
+                    logging.warning("No optical drives found, rescanning later")
+                await asyncio.sleep(self.rescan_interval)
+        finally:
+            for task in self.tasks.values():
+                task.cancel()
+            await asyncio.gather(*self.tasks.values(), return_exceptions=True)
+
+    def run(self):
+        """Supervise drive tasks until interrupted or stopped with SIGTERM"""
+        self.core.run(self.supervise())
@@ -0,0 +1,279 @@
+#!/usr/bin/env python3
+"""
+Phase-level tracing of disc processing
+
+span() times one phase of processing a disc (probe, metadata lookup,
+each track read, each encode, eject, ...). Spans nest through a
+ContextVar, so a span opened inside another one in the same thread,
+asyncio task or aio stage becomes its child; work handed to other threads
+(encoders, metadata lookups) passes current() as the parent explicitly.
+Every disc is one trace rooted at its process_disc span. Finished spans
+are appended as one compact JSON line each to state_dir/traces.jsonl,
+which is rotated to traces.jsonl.1 when it reaches tracing.max_mb. Every
+drive daemon appends to the same file; rotation_lock() makes sure only
+one of them rotates it and the others follow to the new file.
+
+The report command summarises p50/p95 per phase over the most recent
+traces, optionally per drive; show prints the span tree of one trace.
+
+Usage: python3 -m autoripper.tracing [--file PATH] report [--last N] [--by-drive]|show [TRACE_ID]
+"""
+
+import contextlib
+import contextvars
+import fcntl
+import itertools
+import json
+import logging
+import math
+import os
+import sys
+import threading
+import time
+from collections import defaultdict
+from typing import Dict, Iterator, List, Optional
+
+DEFAULT_MAX_MB = 8
+DEFAULT_LAST = 50
+ROOT = 'process_disc'
+
+_current = contextvars.ContextVar('span', default=None)
+_span_ids = itertools.count(1)
+_writer = None
+_writer_lock = threading.Lock()
+
+
+def default_trace_path(config: dict) -> str:
+    path = config.get('tracing', {}).get('path')
+    return path or os.path.join(config.get('state_dir', '/var/lib/auto-ripper'), 'traces.jsonl')
+
+
+@contextlib.contextmanager
+def rotation_lock(path: str):
+    """Exclusive lock, across processes, for rotating (or pruning the segments of) path"""
+    with open(path + '.lock', 'a') as lock:
+        fcntl.flock(lock, fcntl.LOCK_EX)
+        yield
+
+
+def replaced(f, path: str) -> bool:
+    """Whether path no longer names the open file f, e.g. another process rotated it"""
+    try:
+        return os.stat(path).st_ino != os.fstat(f.fileno()).st_ino
+    except FileNotFoundError:
+        return True
+
+
+class TraceWriter:
+    """Appends finished spans to the trace file; write errors only cost the trace"""
+
+    def __init__(self, path: str, max_bytes: int = DEFAULT_MAX_MB * 1024 * 1024):
+        self.path = path
+        self.max_bytes = max_bytes
+        self._file = None
+        self._lock = threading.Lock()
+
+    def write(self, record: dict):
+        line = json.dumps(record, separators=(',', ':')) + '\n'
+        with self._lock:
+            try:
+                if self._file is not None and replaced(self._file, self.path):
+                    self._file.close()
+                    self._file = None
+                if self._file is None:
+                    os.makedirs(os.path.dirname(self.path) or '.', exist_ok=True)
+                    self._file = open(self.path, 'a')
+                self._file.write(line)
+                self._file.flush()
+                if self._file.tell() >= self.max_bytes:
+                    with rotation_lock(self.path):
+                        # Unless another process got there first
+                        if not replaced(self._file, self.path):
+                            os.replace(self.path, self.path + '.1')
+                    self._file.close()
+                    self._file = None
+            except OSError as e:
+                logging.debug(f"Could not write trace to {self.path}: {e}")
+
+
+def configure(config: dict):
+    """Start writing spans (once per process) unless tracing.enabled is false"""
+    global _writer
+    settings = config.get('tracing', {})
+    if not settings.get('enabled', True):
+        return
+    with _writer_lock:
+        if _writer is None:
+            _writer = TraceWriter(default_trace_path(config),
+                                  int(settings.get('max_mb', DEFAULT_MAX_MB) * 1024 * 1024))
+
+
+class Span:
+    """One timed phase; set() adds attributes such as the outcome"""
+
+    __slots__ = ('name', 'trace_id', 'span_id', 'parent_id', 'root', 'attrs', 'started', '_start')
+
+    def __init__(self, name: str, parent: Optional['Span'], attrs: dict):
+        self.name = name
+        self.span_id = next(_span_ids)
+        self.parent_id = parent.span_id if parent is not None else None
+        self.trace_id = parent.trace_id if parent is not None else os.urandom(6).hex()
+        self.root = parent.root if parent is not None else self
+        self.attrs = attrs
+        self.started = time.time()
+        self._start = time.monotonic()
+
+    def set(self, **attrs):
+        self.attrs.update(attrs)
+
+    def finish(self):
+        writer = _writer
+        if writer is None:
+            return
+        record = {'t': self.trace_id, 's': self.span_id, 'n': self.name,
+                  'ts': round(self.started, 3), 'd': round(time.monotonic() - self._start, 3)}
+        if self.parent_id is not None:
+            record['p'] = self.parent_id
+        if self.attrs:
+            record['a'] = self.attrs
+        writer.write(record)
+
+
+def current() -> Optional[Span]:
+    return _current.get()
+
+
+@contextlib.contextmanager
+def span(name: str, parent: Span = None, root: bool = False, **attrs) -> Iterator[Span]:
+    """
+    Time the enclosed block as a child of parent (default: the current
+    span), or as the root of a new trace with root=True
+    """
+    if not root and parent is None:
+        parent = _current.get()
+    opened = Span(name, None if root else parent, attrs)
+    token = _current.set(opened)
+    try:
+        yield opened
+    except BaseException as e:
+        opened.attrs['error'] = type(e).__name__
+        raise
+    finally:
+        _current.reset(token)
+        opened.finish()
+
+
+def read_spans(path: str) -> List[dict]:
+    """Spans from the rotated and the current trace file, oldest first"""
+    spans = []
+    for name in (path + '.1', path):
+        try:
+            with open(name) as f:
+                for line in f:
+                    try:
+                        spans.append(json.loads(line))
+                    except ValueError:
+                        continue  # Torn last line after a crash
+        except FileNotFoundError:
+            continue
+    return spans
+
+
+def recent_traces(spans: List[dict], last: int) -> Dict[str, List[dict]]:
+    """The last traces with a process_disc root, {trace id: spans}"""
+    traces = defaultdict(list)
+    roots = []
+    for record in spans:
+        traces[record['t']].append(record)
+        if record['n'] == ROOT and 'p' not in record:
+            roots.append(record)
+    roots.sort(key=lambda record: record['ts'])
+    return {root['t']: traces[root['t']] for root in roots[-last:]}
+
+
+def percentile(values: List[float], fraction: float) -> float:
+    """Nearest-rank percentile of sorted values"""
+    return values[max(0, math.ceil(fraction * len(values)) - 1)]
+
+
+def report(traces: Dict[str, List[dict]], by_drive: bool = False) -> List[dict]:
+    """count, p50, p95 and max duration per span name (and drive), slowest p95 first"""
+    durations = defaultdict(list)
+    for records in traces.values():
+        root = next(record for record in records if record['n'] == ROOT and 'p' not in record)
+        drive = root.get('a', {}).get('drive', '-')
+        for record in records:
+            durations[(record['n'], drive if by_drive else None)].append(record['d'])
+    rows = []
+    for (name, drive), values in durations.items():
+        values.sort()
+        rows.append({'phase': name, 'drive': drive, 'count': len(values),
+                     'p50': percentile(values, 0.5), 'p95': percentile(values, 0.95), 'max': values[-1]})
+    rows.sort(key=lambda row: row['p95'], reverse=True)
+    return rows
+
+
+def _print_tree(records: List[dict]):
+    children = defaultdict(list)
+    for record in records:
+        children[record.get('p')].append(record)
+    roots = children[None]
+    origin = min(record['ts'] for record in records)
+
+    def walk(record, depth):
+        attrs = ' '.join(f"{key}={value}" for key, value in record.get('a', {}).items())
+        print(f"{record['ts'] - origin:8.1f}s {'  ' * depth}{record['n']:<{32 - 2 * depth}} "
+              f"{record['d']:9.2f}s  {attrs}")
+        for child in sorted(children[record['s']], key=lambda child: child['ts']):
+            walk(child, depth + 1)
+
+    for root in sorted(roots, key=lambda root: root['ts']):
+        walk(root, 0)
+
+
+def main():
+    args = sys.argv[1:]
+    config = {}
+    if os.path.exists('/opt/auto-ripper/config.json'):
+        with open('/opt/auto-ripper/config.json') as f:
+            config = json.load(f)
+    path = default_trace_path(config)
+    if '--file' in args:
+        index = args.index('--file')
+        path = args[index + 1]
+        del args[index:index + 2]
+    last = DEFAULT_LAST
+    if '--last' in args:
+        index = args.index('--last')
+        last = int(args[index + 1])
+        del args[index:index + 2]
+    by_drive = '--by-drive' in args
+    if by_drive:
+        args.remove('--by-drive')
+    if not args or args[0] not in ('report', 'show'):
+        print(__doc__.strip().split('Usage:')[1].strip(), file=sys.stderr)
+        sys.exit(2)
+
+    spans = read_spans(path)
+    if args[0] == 'show':
+        trace_id = args[1] if len(args) > 1 else next(iter(recent_traces(spans, 1)), None)
+        records = [record for record in spans if record['t'] == trace_id]
+        if not records:
+            print(f"No trace {trace_id or 'found'} in {path}", file=sys.stderr)
+            sys.exit(1)
+        _print_tree(records)
+        return
+
+    traces = recent_traces(spans, last)
+    if not traces:
+        print(f"No rips traced in {path}", file=sys.stderr)
+        sys.exit(1)
+    print(f"{len(traces)} rips from {path}")
+    print(f"{'phase':<28} {'drive':<6} {'count':>6} {'p50':>9} {'p95':>9} {'max':>9}")
+    for row in report(traces, by_drive):
+        print(f"{row['phase']:<28} {row['drive'] or '':<6} {row['count']:>6} "
+              f"{row['p50']:>8.1f}s {row['p95']:>8.1f}s {row['max']:>8.1f}s")
+
+
+if __name__ == "__main__":
+    main()
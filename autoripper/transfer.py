@@ -0,0 +1,385 @@
+#!/usr/bin/env python3
+"""
+Copying finished albums to network storage
+
+When network_copy is on, every album whose encoding finished is queued for
+a copy to the same artist/album path under network_path (a mounted NAS
+share or any other directory). The queue is kept in the state dir, so
+albums still waiting after a restart or while the share is unreachable
+are copied later. Files go over a bounded number of parallel streams and
+are written in chunks to a hidden .part file. An interrupted copy resumes
+from the part already written. Each copy is read back from the share and
+checked against the checksum of the source before it is renamed into
+place. An optional bandwidth cap keeps the copies from crowding out the
+drives on a shared USB bus.
+
+Usage: python3 -m autoripper.transfer enqueue ALBUM_DIR... | run | status
+"""
+
+import hashlib
+import json
+import logging
+import os
+import shutil
+import sys
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict, Optional
+
+from autoripper import aio
+from autoripper.musicbrainz import TokenBucket
+
+DEFAULT_STREAMS = 2
+DEFAULT_CHUNK = 4 * 1024 * 1024
+RETRY_DELAY = 60
+MAX_RETRY_DELAY = 6 * 60 * 60
+# How often to look for the share again while it is missing
+UNAVAILABLE_POLL = 60
+PART_SUFFIX = '.part'
+
+_shared = {}
+_shared_lock = threading.Lock()
+
+
+def default_queue_path(config: dict) -> str:
+    state_dir = config.get('state_dir', '/var/lib/auto-ripper')
+    return os.path.join(state_dir, 'transfer-queue.json')
+
+
+class TransferError(Exception):
+    """A file could not be copied or did not verify"""
+
+
+class TransferEngine:
+    """
+    Persistent queue of album directories to copy from source_root to the
+    same relative path under destination_root
+
+    bandwidth is a cap in bytes per second shared by all streams (None for
+    no cap).
+    """
+
+    def __init__(self, source_root: str, destination_root: str, queue_path: str,
+                 streams: int = DEFAULT_STREAMS, chunk_size: int = DEFAULT_CHUNK,
+                 bandwidth: float = None):
+        self.source_root = os.path.normpath(source_root)
+        self.destination_root = os.path.normpath(destination_root)
+        self.queue_path = queue_path
+        self.streams = max(1, streams)
+        self.chunk_size = chunk_size
+        # One second's worth of burst, but at least one chunk so a chunk always fits
+        self.bucket = TokenBucket(bandwidth, max(bandwidth, chunk_size)) if bandwidth else None
+        self.bytes_copied = 0
+        self._lock = threading.Lock()
+        self._wake = threading.Event()
+        self._idle = threading.Condition(self._lock)
+        self._active: Optional[str] = None
+        self._thread = None
+        # album_dir -> {'attempts', 'next_try', 'replaces', 'queued_at'}
+        self.pending: Dict[str, dict] = self._load()
+
+    @classmethod
+    def shared(cls, config: dict) -> 'TransferEngine':
+        """One engine per queue file and process, shared by every drive worker"""
+        settings = config.get('network_transfer', {})
+        path = default_queue_path(config)
+        with _shared_lock:
+            if path not in _shared:
+                limit = settings.get('max_mb_per_second') or 0
+                _shared[path] = cls(config.get('output_dir', '/mnt/MUSIC'), config['network_path'], path,
+                                    settings.get('streams', DEFAULT_STREAMS),
+                                    settings.get('chunk_mb', DEFAULT_CHUNK // (1024 * 1024)) * 1024 * 1024,
+                                    limit * 1024 * 1024 if limit > 0 else None)
+            return _shared[path]
+
+    def _load(self) -> Dict[str, dict]:
+        try:
+            with open(self.queue_path) as f:
+                return json.load(f)
+        except FileNotFoundError:
+            return {}
+        except (OSError, ValueError) as e:
+            logging.warning(f"Ignoring unreadable transfer queue {self.queue_path}: {e}")
+            return {}
+
+    def _save(self):
+        os.makedirs(os.path.dirname(self.queue_path) or '.', exist_ok=True)
+        tmp_path = f"{self.queue_path}.tmp"
+        with open(tmp_path, 'w') as f:
+            json.dump(self.pending, f, indent=2)
+        os.replace(tmp_path, self.queue_path)
+
+    def destination(self, album_dir: str) -> Optional[str]:
+        """Where album_dir goes on the share, or None if it is outside source_root"""
+        relative = os.path.relpath(os.path.normpath(album_dir), self.source_root)
+        if relative == '.' or relative.startswith('..'):
+            return None
+        return os.path.join(self.destination_root, relative)
+
+    def enqueue(self, album_dir: str, replaces: str = None) -> bool:
+        """
+        Queue album_dir for copying. replaces is the album's previous
+        directory (e.g. before the metadata reconciler renamed it); its copy
+        on the share is removed once the new one is complete.
+        """
+        album_dir = os.path.normpath(album_dir)
+        if self.destination(album_dir) is None:
+            logging.warning(f"{album_dir} is outside {self.source_root}, not copying it")
+            return False
+        with self._lock:
+            if replaces is not None:
+                replaces = os.path.normpath(replaces)
+                # The old directory is gone; only its remote copy needs cleaning up
+                previous = self.pending.pop(replaces, None)
+                if previous and previous.get('replaces'):
+                    replaces = previous['replaces']
+            self.pending[album_dir] = {'attempts': 0, 'next_try': 0, 'replaces': replaces,
+                                       'queued_at': time.time()}
+            self._save()
+        logging.info(f"Queued {album_dir} for copying to {self.destination(album_dir)}")
+        self._wake.set()
+        return True
+
+    def available(self) -> bool:
+        """Whether the destination is there (an unmounted share must not fill the SD card)"""
+        return os.path.isdir(self.destination_root)
+
+    def _copy_file(self, source: str, destination: str) -> int:
+        """
+        Copy one file, resuming a previous partial copy, and verify it by
+        reading it back. Returns the number of bytes sent.
+        """
+        st = os.stat(source)
+        try:
+            existing = os.stat(destination)
+            if existing.st_size == st.st_size and int(existing.st_mtime) == int(st.st_mtime):
+                return 0  # Copied and verified on an earlier run
+        except FileNotFoundError:
+            pass
+
+        part = os.path.join(os.path.dirname(destination), f".{os.path.basename(destination)}{PART_SUFFIX}")
+        try:
+            offset = os.path.getsize(part)
+        except OSError:
+            offset = 0
+        # Only whole chunks of an interrupted copy are trusted; the read-back
+        # below catches anything else that is wrong with them
+        offset = offset // self.chunk_size * self.chunk_size if offset <= st.st_size else 0
+        if offset:
+            logging.info(f"Resuming {destination} at {offset / 1024 / 1024:.0f} MB")
+
+        digest = hashlib.blake2b()
+        sent = 0
+        with open(source, 'rb') as src, open(part, 'r+b' if offset else 'wb') as dst:
+            remaining = offset
+            while remaining:  # The source side of the resumed part, for the checksum
+                data = src.read(min(self.chunk_size, remaining))
+                if not data:
+                    break
+                digest.update(data)
+                remaining -= len(data)
+            dst.truncate(offset)
+            dst.seek(offset)
+            while True:
+                data = src.read(self.chunk_size)
+                if not data:
+                    break
+                if self.bucket is not None:
+                    self.bucket.acquire(len(data))
+                dst.write(data)
+                digest.update(data)
+                sent += len(data)
+                with self._lock:
+                    self.bytes_copied += len(data)
+            dst.flush()
+            os.fsync(dst.fileno())
+            if hasattr(os, 'posix_fadvise'):
+                # Drop the cached pages so the read-back comes from the share
+                os.posix_fadvise(dst.fileno(), 0, 0, os.POSIX_FADV_DONTNEED)
+
+        if _file_digest(part, self.chunk_size) != digest.hexdigest():
+            os.remove(part)
+            if offset:
+                logging.warning(f"Resumed copy of {destination} did not verify, starting over")
+                return sent + self._copy_file(source, destination)
+            raise TransferError(f"checksum mismatch after copying {destination}")
+        shutil.copystat(source, part)
+        os.replace(part, destination)
+        return sent
+
+    def transfer_album(self, album_dir: str) -> bool:
+        """Copy every file of album_dir over up to self.streams parallel streams"""
+        destination = self.destination(album_dir)
+        files = [entry.name for entry in os.scandir(album_dir)
+                 if entry.is_file(follow_symlinks=False) and not entry.name.endswith(('.tmp', PART_SUFFIX))]
+        os.makedirs(destination, exist_ok=True)
+        started = time.monotonic()
+        failed = []
+        sent = 0
+        with ThreadPoolExecutor(max_workers=min(self.streams, max(1, len(files))),
+                                thread_name_prefix='transfer') as executor:
+            futures = {name: executor.submit(self._copy_file, os.path.join(album_dir, name),
+                                             os.path.join(destination, name))
+                       for name in files}
+            for name, future in futures.items():
+                try:
+                    sent += future.result()
+                except (OSError, TransferError) as e:
+                    logging.error(f"Copy of {os.path.join(album_dir, name)} failed: {e}")
+                    failed.append(name)
+        if failed:
+            return False
+        elapsed = max(time.monotonic() - started, 0.001)
+        logging.info(f"Copied {album_dir} to {destination} ({len(files)} files, "
+                     f"{sent / 1024 / 1024:.1f} MB at {sent / 1024 / 1024 / elapsed:.1f} MB/s)")
+        return True
+
+    def _remove_replaced(self, replaces: Optional[str]):
+        old_destination = replaces and self.destination(replaces)
+        if old_destination and os.path.isdir(old_destination):
+            shutil.rmtree(old_destination, ignore_errors=True)
+            try:
+                os.rmdir(os.path.dirname(old_destination))  # Only succeeds once the artist dir is empty
+            except OSError:
+                pass
+            logging.info(f"Removed old copy {old_destination}")
+
+    def _due(self) -> list:
+        now = time.time()
+        with self._lock:
+            return [album_dir for album_dir, entry in self.pending.items() if entry['next_try'] <= now]
+
+    def process_due(self, limit: int = None) -> int:
+        """Copy the albums that are due, at most limit of them; returns the number copied"""
+        copied = attempted = 0
+        while limit is None or attempted < limit:
+            attempted += 1
+            now = time.time()
+            with self._lock:
+                due = [album_dir for album_dir, entry in self.pending.items() if entry['next_try'] <= now]
+                if not due:
+                    return copied
+                album_dir = due[0]
+                entry = dict(self.pending[album_dir])
+                self._active = album_dir
+            try:
+                if not os.path.isdir(album_dir):
+                    logging.warning(f"{album_dir} no longer exists, dropping it from the transfer queue")
+                    ok = True
+                else:
+                    ok = self.transfer_album(album_dir)
+                    if ok:
+                        self._remove_replaced(entry.get('replaces'))
+                        copied += 1
+            except OSError as e:
+                logging.error(f"Copy of {album_dir} failed: {e}")
+                ok = False
+            with self._lock:
+                self._active = None
+                current = self.pending.get(album_dir)
+                # Unless it was queued again while it was being copied
+                if current is not None and current.get('queued_at') == entry.get('queued_at'):
+                    if ok:
+                        del self.pending[album_dir]
+                    else:
+                        current['attempts'] += 1
+                        delay = min(MAX_RETRY_DELAY, RETRY_DELAY * 2 ** (current['attempts'] - 1))
+                        current['next_try'] = time.time() + delay
+                        logging.warning(f"Will retry copying {album_dir} in {delay:.0f}s")
+                self._save()
+                self._idle.notify_all()
+        return copied
+
+    def start(self):
+        if self._thread is None:
+            self._thread = aio.adopt('network-copy', self.step, self._wake)
+        if self._thread is None:
+            self._thread = threading.Thread(target=self.run, name='network-copy', daemon=True)
+            self._thread.start()
+
+    def step(self, readable: bool = False) -> float:
+        """
+        Copy the next due album if the destination is reachable; returns the
+        seconds to wait (0 while more albums are due). One album per step
+        keeps a backlog from holding a shared executor worker for hours.
+        """
+        if not self.pending:
+            return self._next_wait()
+        if not self.available():
+            logging.debug(f"{self.destination_root} unavailable, {len(self.pending)} albums waiting")
+            return UNAVAILABLE_POLL
+        try:
+            self.process_due(limit=1)
+        except Exception as e:
+            logging.error(f"Network copy failed: {e}")
+            return self._next_wait()
+        return 0 if self._due() else self._next_wait()
+
+    def run(self, stop_event: threading.Event = None):
+        """Copy queued albums as they become due, while the destination is reachable"""
+        stop_event = stop_event or threading.Event()
+        while not stop_event.is_set():
+            self._wake.wait(self.step())
+            self._wake.clear()
+
+    def _next_wait(self) -> float:
+        with self._lock:
+            due = [entry['next_try'] for entry in self.pending.values()]
+        if not due:
+            return UNAVAILABLE_POLL
+        return max(1.0, min(UNAVAILABLE_POLL, min(due) - time.time()))
+
+    def wait_idle(self, timeout: float = None) -> bool:
+        """
+        Block until no album is being copied or due now (albums waiting for a
+        retry don't count). Returns False on timeout.
+        """
+        def idle():
+            now = time.time()
+            return self._active is None and (not self.available() or not any(
+                entry['next_try'] <= now for entry in self.pending.values()))
+        with self._idle:
+            return self._idle.wait_for(idle, timeout)
+
+
+def _file_digest(path: str, chunk_size: int) -> str:
+    digest = hashlib.blake2b()
+    with open(path, 'rb') as f:
+        while True:
+            data = f.read(chunk_size)
+            if not data:
+                return digest.hexdigest()
+            digest.update(data)
+
+
+def main():
+    args = sys.argv[1:]
+    if not args or args[0] not in ('enqueue', 'run', 'status'):
+        print(__doc__.strip().split('Usage:')[1].strip(), file=sys.stderr)
+        sys.exit(2)
+
+    logging.basicConfig(level=logging.INFO, format='%(message)s')
+    config = {}
+    if os.path.exists('/opt/auto-ripper/config.json'):
+        with open('/opt/auto-ripper/config.json') as f:
+            config = json.load(f)
+    if not config.get('network_path'):
+        print("network_path is not set in config.json", file=sys.stderr)
+        sys.exit(1)
+    engine = TransferEngine.shared(config)
+    if args[0] == 'enqueue':
+        for album_dir in args[1:]:
+            engine.enqueue(album_dir)
+    elif args[0] == 'run':
+        if not engine.available():
+            print(f"{engine.destination_root} is not available", file=sys.stderr)
+            sys.exit(1)
+        engine.process_due()
+        sys.exit(1 if engine.pending else 0)
+    else:
+        print(json.dumps({'destination': engine.destination_root, 'pending': engine.pending}, indent=2))
+
+
+if __name__ == "__main__":
+    main()
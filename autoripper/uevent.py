@@ -0,0 +1,144 @@
+"""
+Event-driven disc detection via kernel uevents
+
+Listens on a NETLINK_KOBJECT_UEVENT socket for the same block-device
+``change`` events 99-auto-ripper.rules matches on, so a waiting drive
+worker sleeps in select() instead of forking dd once a second.
+"""
+
+import logging
+import os
+import select
+import socket
+import time
+from typing import Dict, Optional
+
+NETLINK_KOBJECT_UEVENT = 15
+KERNEL_UEVENT_GROUP = 1
+RECEIVE_BUFFER_SIZE = 1024 * 1024
+
+
+def parse_uevent(data: bytes) -> Optional[Dict[str, str]]:
+    """
+    Parse a kernel uevent datagram ("ACTION@DEVPATH\\0KEY=VALUE\\0...")
+    Returns None for messages that are not kernel uevents (e.g. libudev).
+    """
+    if data.startswith(b'libudev'):
+        return None
+    fields = data.split(b'\0')
+    if not fields or b'@' not in fields[0]:
+        return None
+
+    event = {}
+    for field in fields[1:]:
+        key, sep, value = field.partition(b'=')
+        if sep:
+            event[key.decode('utf-8', 'replace')] = value.decode('utf-8', 'replace')
+    return event
+
+
+def is_media_change(event: Dict[str, str], drive_name: str = None) -> bool:
+    """True for a block 'change' uevent reporting new media on drive_name"""
+    if event.get('SUBSYSTEM') != 'block' or event.get('ACTION') != 'change':
+        return False
+    if event.get('DISK_MEDIA_CHANGE') != '1':
+        return False
+    devname = os.path.basename(event.get('DEVNAME', ''))
+    return drive_name is None or devname == drive_name
+
+
+def ensure_kernel_polling(drive_name: str, interval_ms: int = 2000) -> bool:
+    """
+    Make sure the kernel polls the drive for media changes.
+
+    The kernel only emits DISK_MEDIA_CHANGE for optical drives when in-kernel
+    event polling is enabled (events_poll_msecs). Polling there is a cheap
+    TEST UNIT READY with no process fork. Returns True if polling is active.
+    """
+    path = f"/sys/block/{drive_name}/events_poll_msecs"
+    try:
+        with open(path) as f:
+            current = int(f.read().strip())
+        if current > 0:
+            return True
+        if current == -1 and _default_poll_msecs() > 0:
+            return True
+        with open(path, 'w') as f:
+            f.write(str(interval_ms))
+        logging.info(f"Enabled kernel media polling for {drive_name} ({interval_ms}ms)")
+        return True
+    except (OSError, ValueError) as e:
+        logging.warning(f"Kernel media polling for {drive_name} not enabled ({e}); "
+                        f"media change events may be missed")
+        return False
+
+
+def _default_poll_msecs() -> int:
+    try:
+        with open('/sys/module/block/parameters/events_dfl_poll_msecs') as f:
+            return int(f.read().strip())
+    except (OSError, ValueError):
+        return 0
+
+
+class UeventMonitor:
+    """
+    Kernel uevent listener for optical drive media changes
+
+    Raises OSError on construction when netlink sockets are unavailable,
+    in which case callers fall back to polling.
+    """
+
+    def __init__(self):
+        self.sock = socket.socket(socket.AF_NETLINK, socket.SOCK_DGRAM, NETLINK_KOBJECT_UEVENT)
+        try:
+            self.sock.setsockopt(socket.SOL_SOCKET, socket.SO_RCVBUF, RECEIVE_BUFFER_SIZE)
+            self.sock.bind((0, KERNEL_UEVENT_GROUP))
+            self.sock.setblocking(False)
+        except OSError:
+            self.sock.close()
+            raise
+
+    def fileno(self) -> int:
+        return self.sock.fileno()
+
+    def read_events(self):
+        """Yield every uevent currently queued on the socket"""
+        while True:
+            try:
+                data = self.sock.recv(RECEIVE_BUFFER_SIZE)
+            except (BlockingIOError, InterruptedError):
+                return
+            except OSError as e:
+                # ENOBUFS: events were dropped, callers should re-check the drive
+                logging.warning(f"uevent socket error: {e}")
+                yield {'ACTION': 'overflow'}
+                return
+            event = parse_uevent(data)
+            if event is not None:
+                yield event
+
+    def drain(self):
+        """Discard events queued while nobody was waiting (e.g. during a rip)"""
+        for _ in self.read_events():
+            pass
+
+    def wait_for_media_change(self, drive_name: str, timeout: float) -> bool:
+        """
+        Block until drive_name reports a media change or timeout expires.
+        Returns True if a media change (or a socket overflow) was seen.
+        """
+        deadline = time.monotonic() + timeout
+        while True:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                return False
+            readable, _, _ = select.select([self.sock], [], [], remaining)
+            if not readable:
+                return False
+            for event in self.read_events():
+                if event.get('ACTION') == 'overflow' or is_media_change(event, drive_name):
+                    return True
+
+    def close(self):
+        self.sock.close()
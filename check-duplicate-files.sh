@@ -6,51 +6,38 @@ echo "============================"
 
 OUTPUT_DIR="/mnt/MUSIC"
 
-echo "1. Current Output Directory Contents:"
-echo "------------------------------------"
-if [ -d "$OUTPUT_DIR" ]; then
-    echo "Total files in $OUTPUT_DIR:"
-    find "$OUTPUT_DIR" -type f | wc -l
-    echo
-    
-    echo "Directory structure:"
-    find "$OUTPUT_DIR" -type d | head -10
-    echo
-    
-    echo "Recent files (last 20):"
-    find "$OUTPUT_DIR" -type f -printf "%T@ %p\n" | sort -n | tail -20 | cut -d' ' -f2-
-    echo
-    
-    echo "File types and counts:"
-    find "$OUTPUT_DIR" -type f -name "*.*" | sed 's/.*\.//' | sort | uniq -c | sort -nr
-    echo
-else
+CATALOG="python3 -m autoripper.catalog"
+cd /opt/auto-ripper 2>/dev/null || cd "$(dirname "$0")"
+
+echo "1. Library Catalog:"
+echo "-------------------"
+if [ ! -d "$OUTPUT_DIR" ]; then
     echo "❌ Output directory $OUTPUT_DIR not found"
     exit 1
 fi
+# The catalog is kept current by the ripper; sync only re-reads albums that changed
+if ! $CATALOG --output-dir "$OUTPUT_DIR" sync 2>/dev/null; then
+    echo "❌ Library catalog not available"
+    exit 1
+fi
+echo
 
 echo "2. Checking for Actual Duplicates:"
 echo "----------------------------------"
-echo "Files with identical names:"
-find "$OUTPUT_DIR" -type f -printf "%f\n" | sort | uniq -d
-
-echo
-echo "Files with similar names (potential duplicates):"
-find "$OUTPUT_DIR" -type f -name "*.flac" -o -name "*.mp3" | while read file; do
-    basename="$(basename "$file" | sed 's/\.[^.]*$//')"
-    echo "$basename"
-done | sort | uniq -d
+echo "Discs ripped more than once (same disc ID):"
+DUPLICATES=$($CATALOG duplicates)
+if [ -n "$DUPLICATES" ]; then
+    echo "$DUPLICATES"
+else
+    echo "None"
+fi
 
 echo
 echo "3. Multiple Format Check:"
 echo "------------------------"
-echo "Checking if same songs exist in multiple formats..."
-
-# Group files by track number and title, ignoring extension
-find "$OUTPUT_DIR" -type f \( -name "*.flac" -o -name "*.mp3" \) -printf "%f\n" | \
-sed 's/\.[^.]*$//' | sort | uniq -c | grep -v "^ *1 " | head -10
-
+echo "Each album holds one file per track and format, so flac + mp3 copies of a track are expected."
 echo
+
 echo "4. abcde Configuration Check:"
 echo "-----------------------------"
 echo "Current OUTPUTTYPE setting:"
@@ -91,26 +78,11 @@ else
     echo "journalctl not available"
 fi
 
-echo
-echo "7. File Size Analysis:"
-echo "---------------------"
-echo "If there are duplicates, checking if they're identical..."
-
-# Find potential duplicate files and compare sizes
-find "$OUTPUT_DIR" -type f -name "*.flac" | while read file; do
-    basename="$(basename "$file" .flac)"
-    mp3file="$(dirname "$file")/$basename.mp3"
-    if [ -f "$mp3file" ]; then
-        echo "FLAC: $file ($(stat -c%s "$file" 2>/dev/null || echo "unknown") bytes)"
-        echo "MP3:  $mp3file ($(stat -c%s "$mp3file" 2>/dev/null || echo "unknown") bytes)"
-        echo "---"
-    fi
-done | head -10
-
 echo
 echo "🔍 Analysis complete!"
 echo
 echo "Summary:"
 echo "- If you see multiple formats (.flac AND .mp3), that's normal"
-echo "- If you see identical filenames, that indicates actual duplication"
+echo "- If a disc ID is listed under duplicates, that disc was ripped more than once"
+echo "- For the same audio under different names, run: python3 -m autoripper.dedup report"
 echo "- Check the abcde config OUTPUTTYPE setting above"
@@ -81,13 +81,12 @@ else
 fi
 
 echo
-echo "6. Disc Cache Status:"
-echo "--------------------"
-DISC_CACHE="/tmp/auto-ripper-last-disc"
-if [ -f "$DISC_CACHE" ]; then
-    echo "✅ Disc cache exists: $(cat "$DISC_CACHE" 2>/dev/null)"
+echo "6. Library Catalog Status:"
+echo "-------------------------"
+if CATALOG_STATS=$(cd /opt/auto-ripper && python3 -m autoripper.catalog stats 2>/dev/null); then
+    echo "✅ Library catalog: $CATALOG_STATS"
 else
-    echo "❌ No disc cache found"
+    echo "❌ Library catalog not available"
 fi
 
 echo
@@ -21,6 +21,7 @@ NC='\033[0m' # No Color
 # Configuration
 INSTALL_DIR="/opt/auto-ripper"
 LOG_DIR="/var/log/auto-ripper"
+STATE_DIR="/var/lib/auto-ripper"
 OUTPUT_DIR="/mnt/MUSIC"
 # Detect the actual user (the one who called sudo)
 if [ -n "$SUDO_USER" ]; then
@@ -172,6 +173,7 @@ create_directories() {
     
     mkdir -p "$INSTALL_DIR"
     mkdir -p "$LOG_DIR"
+    mkdir -p "$STATE_DIR"
     mkdir -p "$OUTPUT_DIR"
     mkdir -p "$INSTALL_DIR/utils"
     
@@ -226,6 +228,7 @@ install_files() {
         cp abcde-offline.conf "$INSTALL_DIR/"
         cp trigger-rip.sh "$INSTALL_DIR/"
         cp 99-auto-ripper.rules "$INSTALL_DIR/"
+        cp -r autoripper "$INSTALL_DIR/"
         
         # Copy utility scripts
         cp troubleshoot-cd-detection.sh "$INSTALL_DIR/utils/troubleshoot.sh"
@@ -250,6 +253,7 @@ install_files() {
         cp abcde-offline.conf "$INSTALL_DIR/"
         cp trigger-rip.sh "$INSTALL_DIR/"
         cp 99-auto-ripper.rules "$INSTALL_DIR/"
+        cp -r autoripper "$INSTALL_DIR/"
         cp utils/* "$INSTALL_DIR/utils/"
         
         cd /
@@ -288,6 +292,7 @@ setup_permissions() {
     
     # Set ownership for all directories and files
     chown -R "$SERVICE_USER:$SERVICE_USER" "$LOG_DIR"
+    chown -R "$SERVICE_USER:$SERVICE_USER" "$STATE_DIR"
     chown -R "$SERVICE_USER:$SERVICE_USER" "$INSTALL_DIR"
     
     # Ensure proper permissions for auto-ripper to work
@@ -350,16 +355,9 @@ EOF
 setup_logging() {
     print_status "Setting up log rotation..."
     
-    cat > /etc/logrotate.d/auto-ripper << EOF
-$LOG_DIR/*.log {
-    daily
-    missingok
-    rotate 14
-    compress
-    notifempty
-    create 644 $SERVICE_USER $SERVICE_USER
-}
-EOF
+    # The ripper rotates and compresses its own logs (config.json "logging");
+    # logrotate renaming the files underneath it would split them
+    rm -f /etc/logrotate.d/auto-ripper
 
     print_success "Log rotation configured"
 }
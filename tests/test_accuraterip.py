@@ -0,0 +1,112 @@
+import struct
+import zlib
+
+import pytest
+
+from autoripper import accuraterip
+from autoripper.accuraterip import (SKIPPED_SAMPLES, WAV_HEADER_BYTES, AccurateRipDatabase, DiscChecksums,
+                                    TrackChecksum, dbar_name, dbar_relative_path, disc_ids)
+from autoripper.cdrom import FakeBackend
+from autoripper.discid import Toc
+
+# Twelve frames of stereo words, scrambled so every sample differs
+WORDS = [(index * 2654435761 + 12345) & 0xFFFFFFFF for index in range(12 * 588)]
+PCM = struct.pack(f"<{len(WORDS)}I", *WORDS)
+
+# The example disc of the MusicBrainz disc ID documentation, as LBAs
+EXAMPLE_TOC = [(0, False), (15213, False), (32164, False), (46442, False),
+               (63264, False), (80339, False), 95312]
+
+
+def reference(first, last):
+    """(v1, v2) straight from the AccurateRip definition, one sample at a time"""
+    v1 = v2 = 0
+    for index, word in enumerate(WORDS):
+        if first and index < SKIPPED_SAMPLES - 1:
+            continue
+        if last and index >= len(WORDS) - SKIPPED_SAMPLES:
+            continue
+        product = word * (index + 1)
+        v1 += product & 0xFFFFFFFF
+        v2 += (product & 0xFFFFFFFF) + (product >> 32)
+    return v1 & 0xFFFFFFFF, v2 & 0xFFFFFFFF
+
+
+def checksum(first, last, chunk=1001):
+    """TrackChecksum fed a WAV in chunks that split samples"""
+    track = TrackChecksum(len(WORDS), first=first, last=last)
+    data = b'\0' * WAV_HEADER_BYTES + PCM
+    for start in range(0, len(data), chunk):
+        track.update(data[start:start + chunk])
+    return track
+
+
+@pytest.mark.parametrize('first, last, v1, v2', [
+    (True, False, 0x96c49206, 0x976187d0),   # First track: skips its first five frames
+    (False, False, 0x7b70ebd8, 0x7c2ed625),  # Middle track: every sample counts
+    (False, True, 0x8bf259e6, 0x8c32fb73),   # Last track: skips its last five frames
+    (True, True, 0xa7460014, 0xa765ad1e),    # Single-track disc: both windows
+])
+def test_known_checksums(first, last, v1, v2):
+    track = checksum(first, last)
+    assert (track.v1, track.v2) == (v1, v2) == reference(first, last)
+    assert track.crc32 == zlib.crc32(PCM)
+    assert track.as_dict() == {'crc32': f"{zlib.crc32(PCM):08x}", 'v1': f"{v1:08x}", 'v2': f"{v2:08x}"}
+
+
+def test_checksums_do_not_depend_on_chunking():
+    assert checksum(True, False, chunk=3).as_dict() == checksum(True, False, chunk=65536).as_dict()
+
+
+def test_pure_python_fallback(monkeypatch):
+    monkeypatch.setattr(accuraterip, 'numpy', None)
+    track = checksum(False, True)
+    assert (track.v1, track.v2) == reference(False, True)
+
+
+def dbar(*pressings):
+    """dBAR bytes: per pressing a header, then (confidence, crc, crc450) per track"""
+    data = b''
+    for tracks in pressings:
+        data += struct.pack('<BIII', len(tracks), 0x513be, 0x1b2231, 0x3404f606)
+        for confidence, crc in tracks:
+            data += struct.pack('<BII', confidence, crc, 0)
+    return data
+
+
+FIXTURE = dbar([(12, 0x96c49206), (3, 0x11111111), (7, 0x8c32fb73)],
+               [(2, 0x976187d0), (40, 0x7c2ed625), (1, 0x22222222)],
+               [(99, 0x7b70ebd8)])  # Other pressing with another track count
+
+
+def test_parse_dbar():
+    checksums = DiscChecksums.parse(FIXTURE + b'\x03\x00', 3)  # Torn trailing header
+    assert checksums.pressings == [[(12, 0x96c49206), (3, 0x11111111), (7, 0x8c32fb73)],
+                                   [(2, 0x976187d0), (40, 0x7c2ed625), (1, 0x22222222)]]
+
+
+def test_match_picks_most_confident_submission():
+    checksums = DiscChecksums.parse(FIXTURE, 3)
+    assert checksums.match(1, checksum(True, False)) == ('v1', 12)
+    assert checksums.match(2, checksum(False, False)) == ('v2', 40)
+    assert checksums.match(3, checksum(False, True)) == ('v2', 7)
+    assert checksums.match(2, checksum(True, False)) is None
+
+
+def test_dbar_path_layout():
+    toc = Toc.from_entries(FakeBackend(toc=EXAMPLE_TOC).read_toc())
+    assert disc_ids(toc) == (6, 0x513be, 0x1b2231, 0x3404f606)
+    assert dbar_name(toc) == 'dBAR-006-000513be-001b2231-3404f606.bin'
+    # Nested by the low three hex digits of id1, least significant first
+    assert dbar_relative_path(toc) == 'e/b/3/dBAR-006-000513be-001b2231-3404f606.bin'
+
+
+def test_database_finds_nested_and_flat_files(tmp_path):
+    toc = Toc.from_entries(FakeBackend(toc=EXAMPLE_TOC).read_toc())
+    nested = tmp_path / 'nested' / 'e' / 'b' / '3'
+    nested.mkdir(parents=True)
+    (nested / dbar_name(toc)).write_bytes(dbar([(5, 1)] * 6))
+    (tmp_path / dbar_name(toc)).write_bytes(dbar([(6, 2)] * 6))
+    assert AccurateRipDatabase(str(tmp_path / 'nested')).lookup(toc).pressings == [[(5, 1)] * 6]
+    assert AccurateRipDatabase(str(tmp_path)).lookup(toc).pressings == [[(6, 2)] * 6]
+    assert AccurateRipDatabase(str(tmp_path / 'missing')).lookup(toc) is None
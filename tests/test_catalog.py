@@ -0,0 +1,71 @@
+import pytest
+
+from autoripper import catalog
+from autoripper.catalog import LibraryCatalog, duplicate_policy
+
+
+@pytest.fixture
+def library(tmp_path):
+    output_dir = tmp_path / 'music'
+    output_dir.mkdir()
+    return output_dir
+
+
+def open_catalog(tmp_path):
+    return LibraryCatalog(str(tmp_path / 'library.sqlite'))
+
+
+def test_unique_name_reserves_the_name(tmp_path, library):
+    db = open_catalog(tmp_path)
+    assert db.unique_name(str(library), 'Unknown_Artist') == 'Unknown_Artist'
+    # Nothing created on disk yet, but the name is taken
+    assert db.unique_name(str(library), 'Unknown_Artist') == 'Unknown_Artist_01'
+    assert db.unique_name(str(library), 'Unknown_Artist') == 'Unknown_Artist_02'
+
+
+def test_unique_name_is_shared_between_connections(tmp_path, library):
+    # Two daemons, one per drive, each with its own connection to the catalog
+    first, second = open_catalog(tmp_path), open_catalog(tmp_path)
+    names = [db.unique_name(str(library), 'Unknown_Artist', numbered=True)
+             for db in (first, second, first, second)]
+    assert names == ['Unknown_Artist_01', 'Unknown_Artist_02', 'Unknown_Artist_03', 'Unknown_Artist_04']
+
+
+def test_unique_name_skips_directories_on_disk(tmp_path, library):
+    (library / 'Unknown_Artist').mkdir()
+    (library / 'Unknown_Artist_01').mkdir()
+    db = open_catalog(tmp_path)
+    assert db.unique_name(str(library), 'Unknown_Artist') == 'Unknown_Artist_02'
+
+
+def test_reservations_expire(tmp_path, library, monkeypatch):
+    db = open_catalog(tmp_path)
+    assert db.unique_name(str(library), 'Album') == 'Album'
+    monkeypatch.setattr(catalog, 'RESERVATION_SECONDS', -1)
+    # Never created: the rip was abandoned and the name is free again
+    assert db.unique_name(str(library), 'Album') == 'Album'
+
+
+def test_duplicate_policy():
+    assert duplicate_policy({}) == 'rip'
+    assert duplicate_policy({'library_catalog': {'duplicates': 'skip'}}) == 'skip'
+    assert duplicate_policy({'library_catalog': {'duplicates': 'bogus'}}) == 'rip'
+
+
+def test_lookup_disc_never_creates_the_catalog(tmp_path):
+    path = tmp_path / 'library.sqlite'
+    assert catalog.lookup_disc(str(path), 'disc') == []
+    assert list(tmp_path.iterdir()) == []
+
+
+def test_lookup_disc_reads_without_writing(tmp_path, library):
+    db = open_catalog(tmp_path)
+    db._db.execute("INSERT INTO albums (path, disc_id, track_count, complete, indexed_at) "
+                   "VALUES (?, 'disc', 10, 1, 0)", (str(library / 'Artist' / 'Album'),))
+    db.close()
+    assert [album['path'] for album in catalog.lookup_disc(str(tmp_path / 'library.sqlite'), 'disc')] == \
+        [str(library / 'Artist' / 'Album')]
+    readonly = LibraryCatalog(str(tmp_path / 'library.sqlite'), readonly=True)
+    with pytest.raises(catalog.sqlite3.OperationalError):
+        readonly.add_dir(str(library / 'Other'))
+    readonly.close()
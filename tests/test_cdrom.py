@@ -0,0 +1,66 @@
+import pytest
+
+from autoripper import cdrom
+from autoripper.cdrom import (CD_FRAMESIZE_RAW, CDROM_LEADOUT, CDS_AUDIO, CDS_DISC_OK, CDS_MIXED,
+                              CDS_NO_DISC, FakeBackend, TocEntry, classify_disc, open_drive,
+                              register_backend)
+
+
+@pytest.fixture
+def fake_drive():
+    drive = FakeBackend(toc=[(0, False), (15000, False), 30000])
+    register_backend(lambda device: drive)
+    yield drive
+    register_backend(cdrom.IoctlBackend)
+
+
+def test_toc_entries_end_with_leadout():
+    drive = FakeBackend(toc=[(0, False), (15000, False), (25000, True), 30000])
+    assert drive.read_toc() == [TocEntry(1, 0, False), TocEntry(2, 15000, False),
+                                TocEntry(3, 25000, True), TocEntry(CDROM_LEADOUT, 30000, False)]
+    assert drive.drive_status() == CDS_DISC_OK
+    assert drive.disc_status() == CDS_MIXED
+
+
+def test_empty_drive():
+    drive = FakeBackend()
+    assert drive.drive_status() == CDS_NO_DISC
+    with pytest.raises(OSError):
+        drive.read_toc()
+    assert classify_disc(drive) == ('no_disc', None)
+
+
+def test_classify_disc():
+    assert classify_disc(FakeBackend(toc=[(0, False), 1000]))[0] == 'audio_cd'
+    assert classify_disc(FakeBackend(toc=[(0, True), 1000]))[0] == 'data_disc'
+    assert classify_disc(FakeBackend(toc=[(0, False), (500, True), 1000]))[0] == 'mixed_cd'
+
+
+def test_open_drive_uses_registered_backend(fake_drive):
+    with open_drive('/dev/sr0') as drive:
+        assert drive is fake_drive
+        assert drive.disc_status() == CDS_AUDIO
+
+
+def test_media_changed_is_reported_once():
+    drive = FakeBackend(toc=[(0, False), 1000], media_changed=True)
+    assert drive.media_changed()
+    assert not drive.media_changed()
+
+
+def test_read_audio_is_deterministic():
+    drive = FakeBackend(toc=[(0, False), 1000])
+    data = drive.read_audio(10, 3)
+    assert len(data) == 3 * CD_FRAMESIZE_RAW
+    assert data == b''.join(FakeBackend.sector_data(lba) for lba in (10, 11, 12))
+    with pytest.raises(OSError):
+        drive.read_audio(999, 2)
+
+
+def test_bad_and_unstable_sectors_recover():
+    drive = FakeBackend(toc=[(0, False), 1000], bad_sectors={5: 1}, unstable_sectors={7: 1})
+    with pytest.raises(OSError):
+        drive.read_audio(5, 1)
+    assert drive.read_audio(5, 1) == FakeBackend.sector_data(5)
+    assert drive.read_audio(7, 1) != FakeBackend.sector_data(7)
+    assert drive.read_audio(7, 1) == FakeBackend.sector_data(7)
@@ -0,0 +1,77 @@
+import pytest
+
+from autoripper import connectivity
+from autoripper.connectivity import SETTLE_SECONDS, ConnectivityMonitor
+
+
+class FakeProbe:
+    """Answers the queued results in turn, counting calls"""
+
+    def __init__(self, *results):
+        self.results = list(results)
+        self.calls = 0
+
+    def __call__(self):
+        self.calls += 1
+        return self.results.pop(0)
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    now = [1000.0]
+    monkeypatch.setattr('autoripper.connectivity.time.monotonic', lambda: now[0])
+    return now
+
+
+def test_circuit_opens_half_opens_and_closes(clock):
+    probe = FakeProbe(False, False, True)
+    flips = []
+    monitor = ConnectivityMonitor(interval=300, base_backoff=5, max_backoff=600, probe=probe)
+    monitor.add_listener(flips.append)
+    assert monitor.is_online()  # Unknown counts as online
+
+    # Open: the failed probe blocks further probes for the backoff
+    assert monitor.step() == 5
+    assert monitor.online is False and not monitor.is_online()
+    clock[0] += 4
+    assert monitor.step() == 1
+    assert probe.calls == 1
+
+    # Half-open: one probe goes through; it fails and the backoff doubles
+    clock[0] += 1
+    assert monitor.step() == 10
+    assert probe.calls == 2 and monitor.failures == 2
+
+    # Closed again by the next successful probe
+    clock[0] += 10
+    assert monitor.step() == 300
+    assert monitor.online is True and monitor.failures == 0
+    assert flips == [False, True]
+
+
+def test_backoff_is_capped():
+    monitor = ConnectivityMonitor(base_backoff=5, max_backoff=30, probe=FakeProbe())
+    for _ in range(6):
+        monitor.record_failure()
+    assert monitor.failures == 6
+    assert monitor.step() == pytest.approx(30, abs=1)
+
+
+def test_route_change_reprobes_after_settling(clock, monkeypatch):
+    monkeypatch.setattr(connectivity, '_drain', lambda sock: True)
+    probe = FakeProbe(False, True)
+    monitor = ConnectivityMonitor(base_backoff=60, probe=probe)
+    monitor._sock = object()
+    assert monitor.step() == 60
+    assert monitor.online is False
+
+    # Returns the settle time instead of sleeping, probing nothing yet
+    assert monitor.step(readable=True) == SETTLE_SECONDS
+    clock[0] += 1
+    assert monitor.step(readable=True) == SETTLE_SECONDS - 1  # Same burst
+    assert probe.calls == 1
+
+    # Settled: probed long before the backoff would have allowed it
+    clock[0] += SETTLE_SECONDS
+    assert monitor.step() == monitor.interval
+    assert probe.calls == 2 and monitor.online is True
@@ -0,0 +1,52 @@
+import pytest
+
+from autoripper import cdrom
+from autoripper.cdrom import FakeBackend, register_backend
+from autoripper.discid import SESSION_GAP_FRAMES, Toc, read_toc
+
+# The example disc of the MusicBrainz disc ID documentation, as LBAs
+EXAMPLE_TOC = [(0, False), (15213, False), (32164, False), (46442, False),
+               (63264, False), (80339, False), 95312]
+
+
+@pytest.fixture
+def example_disc():
+    register_backend(lambda device: FakeBackend(device, toc=EXAMPLE_TOC))
+    yield
+    register_backend(cdrom.IoctlBackend)
+
+
+def test_read_toc_through_backend(example_disc):
+    toc = read_toc('/dev/sr0')
+    assert toc.first_track == 1 and toc.last_track == 6
+    assert toc.offsets == (150, 15363, 32314, 46592, 63414, 80489)
+    assert toc.leadout == 95462
+    assert toc.musicbrainz_toc == '1 6 95462 150 15363 32314 46592 63414 80489'
+
+
+def test_musicbrainz_id(example_disc):
+    assert read_toc('/dev/sr0').musicbrainz_id == '49HHV7Eb8UKF3aQiNmu1GR8vKTY-'
+
+
+def test_freedb_id(example_disc):
+    toc = read_toc('/dev/sr0')
+    assert toc.freedb_id == '3404f606'
+    assert toc.cd_discid_line() == '3404f606 6 150 15363 32314 46592 63414 80489 1272'
+
+
+def test_track_lengths(example_disc):
+    assert read_toc('/dev/sr0').track_lengths == (15213, 16951, 14278, 16822, 17075, 14973)
+
+
+def test_enhanced_cd_drops_data_session():
+    toc = Toc.from_entries(FakeBackend(toc=EXAMPLE_TOC[:-1] + [(110000, True), 120000]).read_toc())
+    last, offsets, leadout = toc.audio_session
+    assert last == 6
+    assert offsets == tuple(lba + 150 for lba, _ in EXAMPLE_TOC[:-1])
+    assert leadout == 110150 - SESSION_GAP_FRAMES
+    assert toc.audio_tracks == (1, 2, 3, 4, 5, 6)
+
+
+def test_as_dict_round_trip(example_disc):
+    toc = read_toc('/dev/sr0')
+    assert Toc.from_dict(toc.as_dict()) == toc
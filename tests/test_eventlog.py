@@ -0,0 +1,104 @@
+import gzip
+import json
+import logging
+import os
+import sys
+
+import pytest
+
+from autoripper import eventlog, tracing
+from autoripper.eventlog import RotatingLogFile, compress_segments, segments
+from autoripper.tracing import TraceWriter
+
+
+def record(message):
+    return logging.LogRecord('test', logging.INFO, __file__, 0, message, None, None)
+
+
+@pytest.fixture
+def no_throttle(monkeypatch):
+    monkeypatch.setattr(eventlog, 'FLUSH_INTERVAL', 0)
+    monkeypatch.setattr(eventlog, 'SEGMENT_SETTLE', 0)
+
+
+@pytest.fixture
+def no_compression(monkeypatch):
+    monkeypatch.setattr(eventlog, 'compress_segments', lambda *args: None)
+
+
+def test_writers_follow_a_rotation_by_another_process(tmp_path, no_throttle, no_compression):
+    # Two daemons writing the same log, each with its own handler
+    path = str(tmp_path / 'auto-ripper.log')
+    first, second = RotatingLogFile(path, max_bytes=10), RotatingLogFile(path, max_bytes=10)
+    first.emit(record('one'))
+    second.emit(record('two'))
+    first.emit(record('three, rotated'))
+    second.emit(record('four'))
+    first.close()
+    second.close()
+
+    [segment] = segments(path)
+    with open(segment) as f:
+        assert f.read().split() == ['one', 'two']
+    with open(path) as f:
+        assert sorted(f.read().splitlines()) == ['four', 'three, rotated']
+
+
+def test_second_rotation_does_not_rename_the_new_file(tmp_path, no_throttle, no_compression):
+    path = str(tmp_path / 'auto-ripper.log')
+    first, second = RotatingLogFile(path, max_bytes=10), RotatingLogFile(path, max_bytes=10)
+    first.emit(record('a' * 8))
+    second.emit(record('b' * 8))
+    first._rotate()
+    # second saw a full file too, but it is already rotated
+    second._rotate()
+    first.close()
+    second.close()
+    assert len(segments(path)) == 1
+
+
+def test_compress_keeps_the_newest(tmp_path, no_throttle):
+    path = str(tmp_path / 'events.jsonl')
+    for stamp in ('20260101-000000', '20260102-000000', '20260103-000000'):
+        with open(f"{path}.{stamp}", 'w') as f:
+            f.write(stamp + '\n')
+    compress_segments(path, keep=2)
+    assert [os.path.basename(name) for name in segments(path)] == \
+        ['events.jsonl.20260102-000000.gz', 'events.jsonl.20260103-000000.gz']
+    with gzip.open(segments(path)[-1], 'rt') as f:
+        assert f.read() == '20260103-000000\n'
+
+
+def test_compress_leaves_fresh_segments(tmp_path, monkeypatch):
+    monkeypatch.setattr(eventlog, 'SEGMENT_SETTLE', 60)
+    path = str(tmp_path / 'events.jsonl')
+    with open(f"{path}.20260101-000000", 'w') as f:
+        f.write('still being flushed\n')
+    compress_segments(path)
+    assert segments(path) == [f"{path}.20260101-000000"]
+
+
+def test_trace_writers_share_one_rotation(tmp_path):
+    path = str(tmp_path / 'traces.jsonl')
+    first, second = TraceWriter(path, max_bytes=20), TraceWriter(path, max_bytes=20)
+    first.write({'n': 1})
+    second.write({'n': 2})
+    first.write({'n': 3})   # Rotates
+    second.write({'n': 4})  # Must not rotate the fresh file away
+    with open(path + '.1') as f:
+        assert f.read().split() == ['{"n":1}', '{"n":2}', '{"n":3}']
+    with open(path) as f:
+        assert f.read().split() == ['{"n":4}']
+    assert not tracing.replaced(second._file, path)
+
+
+def test_cli_matches_disc_and_phase_exactly(tmp_path, monkeypatch, capsys):
+    path = tmp_path / 'events.jsonl'
+    events = [{'ts': 1, 'level': 'INFO', 'drive': 'sr0', 'disc': 'abc', 'phase': 'metadata', 'msg': 'wanted'},
+              {'ts': 2, 'level': 'INFO', 'drive': 'sr0', 'disc': 'abcdef', 'phase': 'metadata', 'msg': 'other disc'},
+              {'ts': 3, 'level': 'INFO', 'drive': 'sr0', 'disc': 'abc', 'phase': 'metadata.local', 'msg': 'subphase'}]
+    path.write_text(''.join(json.dumps(event, separators=(',', ':')) + '\n' for event in events))
+    monkeypatch.setattr(sys, 'argv', ['eventlog', '--file', str(path), '--disc', 'abc',
+                                      '--phase', 'metadata', '--json'])
+    eventlog.main()
+    assert [json.loads(line)['msg'] for line in capsys.readouterr().out.splitlines()] == ['wanted']
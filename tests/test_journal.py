@@ -0,0 +1,86 @@
+from autoripper import journal
+from autoripper.journal import Journal
+
+
+def open_journal(tmp_path):
+    return Journal(str(tmp_path / 'journal.jsonl'), sync=False)
+
+
+def test_replay_resumes_unfinished_disc(tmp_path):
+    first = open_journal(tmp_path)
+    first.begin('disc', {'tracks': [1, 2, 3]})
+    first.update('disc', {'layout': {'artist': 'Artist'}})
+    first.track('disc', 1, 'read')
+    first.track('disc', 1, 'encoded', 'flac')
+    first.track('disc', 1, 'encoded', 'mp3')
+    first.track('disc', 2, 'read')
+    first.close()
+
+    state = open_journal(tmp_path).pending('disc')
+    assert state.info == {'tracks': [1, 2, 3], 'layout': {'artist': 'Artist'}}
+    assert state.has(1, 'encoded', 'flac') and state.has(1, 'encoded', 'mp3')
+    assert state.has(2, 'read') and not state.has(2, 'encoded', 'flac')
+    assert not state.has(3, 'read')
+
+
+def test_finished_disc_is_not_pending(tmp_path):
+    first = open_journal(tmp_path)
+    first.begin('done', {})
+    first.finish('done')
+    first.begin('open', {})
+    first.close()
+    replayed = open_journal(tmp_path)
+    assert replayed.pending('done') is None
+    assert [state.disc_id for state in replayed.unfinished()] == ['open']
+
+
+def test_torn_tail_is_cut_before_the_next_append(tmp_path):
+    first = open_journal(tmp_path)
+    first.begin('disc', {})
+    first.track('disc', 1, 'read')
+    first.close()
+    with open(first.path, 'ab') as f:
+        f.write(b'{"disc":"disc","event":"track","tr')  # Power lost mid-write
+
+    second = open_journal(tmp_path)
+    assert second.pending('disc').has(1, 'read')
+    second.track('disc', 2, 'read')
+    second.close()
+
+    # The record written after the crash survives the next replay
+    state = open_journal(tmp_path).pending('disc')
+    assert state.has(1, 'read') and state.has(2, 'read')
+    with open(first.path, 'rb') as f:
+        assert b'"tr{' not in f.read()
+
+
+def test_complete_last_record_without_newline_is_kept(tmp_path):
+    first = open_journal(tmp_path)
+    first.begin('disc', {})
+    first.close()
+    with open(first.path, 'ab') as f:
+        f.write(b'{"disc":"disc","event":"track","track":1,"stage":"read","ts":0}')
+
+    second = open_journal(tmp_path)
+    second.track('disc', 2, 'read')
+    second.close()
+    state = open_journal(tmp_path).pending('disc')
+    assert state.has(1, 'read') and state.has(2, 'read')
+
+
+def test_compaction_keeps_unfinished_discs(tmp_path, monkeypatch):
+    first = open_journal(tmp_path)
+    for number in range(20):
+        first.begin(f"old{number}", {})
+        first.finish(f"old{number}")
+    first.begin('disc', {'tracks': [1]})
+    first.track('disc', 1, 'encoded', 'flac')
+    first.close()
+
+    monkeypatch.setattr(journal, 'COMPACT_BYTES', 100)
+    compacted = open_journal(tmp_path)
+    assert list(compacted.discs) == ['disc']
+    compacted.track('disc', 1, 'read')
+    compacted.close()
+    state = open_journal(tmp_path).pending('disc')
+    assert state.has(1, 'encoded', 'flac') and state.has(1, 'read')
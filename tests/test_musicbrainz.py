@@ -0,0 +1,192 @@
+import json
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import pytest
+
+from autoripper import musicbrainz
+from autoripper.metadata_cache import MetadataCache
+from autoripper.musicbrainz import MusicBrainzClient, MusicBrainzError
+
+RELEASE = {'releases': [{'id': 'r1', 'title': 'Album', 'artist-credit': [{'name': 'Artist'}],
+                         'media': [{'position': 1, 'discs': [{'id': 'disc1'}],
+                                    'tracks': [{'position': 1, 'title': 'One'}]}]}]}
+
+
+class StandIn(ThreadingHTTPServer):
+    """Local MusicBrainz: answers queued per disc ID, every request recorded"""
+
+    daemon_threads = True
+
+    def __init__(self):
+        super().__init__(('127.0.0.1', 0), Handler)
+        self.answers = {}
+        self.requests = []
+        # Client port of every request: one port per TCP connection
+        self.ports = []
+        self.delay = 0
+
+    def answer(self, disc_id, *answers):
+        """Queue (status, body, headers) answers; the last one repeats"""
+        self.answers[disc_id] = list(answers)
+
+
+class Handler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+
+    def do_GET(self):
+        disc_id = self.path.split('?')[0].rsplit('/', 1)[-1]
+        self.server.requests.append((time.monotonic(), self.path, self.headers.get('User-Agent')))
+        self.server.ports.append(self.client_address[1])
+        time.sleep(self.server.delay)
+        answers = self.server.answers.get(disc_id) or [(404, {'error': 'Not Found'}, {})]
+        status, body, headers = answers.pop(0) if len(answers) > 1 else answers[0]
+        payload = json.dumps(body).encode()
+        self.send_response(status)
+        for key, value in headers.items():
+            self.send_header(key, value)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(payload)))
+        self.end_headers()
+        self.wfile.write(payload)
+
+    def log_message(self, *args):
+        pass
+
+
+@pytest.fixture
+def server():
+    server = StandIn()
+    thread = threading.Thread(target=server.serve_forever, args=(0.05,), daemon=True)
+    thread.start()
+    yield server
+    server.shutdown()
+    server.server_close()
+
+
+def make_client(server, rate=100.0):
+    return MusicBrainzClient(f"http://127.0.0.1:{server.server_port}/ws/2", rate=rate, timeout=5)
+
+
+def test_lookup_returns_release(server):
+    server.answer('disc1', (200, RELEASE, {}))
+    client = make_client(server)
+    assert client.lookup_discid('disc1', '1 1 100 0') == RELEASE
+    _, path, agent = server.requests[0]
+    assert path.startswith('/ws/2/discid/disc1?')
+    assert 'inc=recordings+artist-credits' in path and 'toc=1+1+100+0' in path and 'fmt=json' in path
+    assert agent == musicbrainz.DEFAULT_USER_AGENT
+    client.close()
+
+
+def test_concurrent_lookups_of_one_disc_are_sent_once(server):
+    server.answer('disc1', (200, RELEASE, {}))
+    server.delay = 0.3  # Keeps the first request on the wire while the others arrive
+    client = make_client(server)
+    results = []
+    threads = [threading.Thread(target=lambda: results.append(client.lookup_discid('disc1')))
+               for _ in range(5)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert results == [RELEASE] * 5
+    assert len(server.requests) == 1
+    client.close()
+
+
+def test_one_connection_serves_several_requests(server):
+    server.answer('disc1', (200, RELEASE, {}))
+    client = make_client(server)
+    for disc_id in ('disc1', 'disc2', 'disc1', 'disc3'):
+        client.lookup_discid(disc_id)
+    assert len(server.ports) == 4
+    assert len(set(server.ports)) == 1
+    client.close()
+
+
+def test_requests_are_rate_limited(server):
+    server.answer('disc1', (200, RELEASE, {}))
+    client = make_client(server, rate=20.0)
+    for _ in range(5):
+        client.lookup_discid('disc1')
+    times = [stamp for stamp, _, _ in server.requests]
+    # The first token is there at once, every further request waits 1/rate
+    assert times[-1] - times[0] >= 4 / 20.0 * 0.9
+    client.close()
+
+
+def test_lookup_many_shares_the_rate_limit(server):
+    server.answer('disc1', (200, RELEASE, {}))
+    client = make_client(server, rate=20.0)
+    started = time.monotonic()
+    results = client.lookup_many({f"disc{number}": None for number in range(1, 7)})
+    assert time.monotonic() - started >= 5 / 20.0 * 0.9
+    assert results['disc1'] == RELEASE
+    assert all(results[f"disc{number}"] is None for number in range(2, 7))
+    client.close()
+
+
+def test_503_is_retried_after_retry_after(server, monkeypatch):
+    monkeypatch.setattr(musicbrainz, '_retry_after', lambda headers, attempt: float(headers['Retry-After']) / 10)
+    server.answer('disc1', (503, {}, {'Retry-After': '2'}), (200, RELEASE, {}))
+    client = make_client(server)
+    assert client.lookup_discid('disc1') == RELEASE
+    first, second = server.requests
+    assert second[0] - first[0] >= 0.2 * 0.9
+    client.close()
+
+
+def test_gives_up_after_max_attempts(server, monkeypatch):
+    monkeypatch.setattr(musicbrainz, '_retry_after', lambda headers, attempt: 0.01)
+    server.answer('disc1', (503, {}, {}))
+    client = make_client(server)
+    with pytest.raises(MusicBrainzError):
+        client.lookup_discid('disc1')
+    assert len(server.requests) == musicbrainz.MAX_ATTEMPTS
+    client.close()
+
+
+def test_retry_after_header():
+    assert musicbrainz._retry_after({'retry-after': '5'}, 1) == 5.0
+    assert musicbrainz._retry_after({'Retry-After': '0'}, 1) == 1.0
+    assert musicbrainz._retry_after({}, 2) == 4.0
+
+
+def test_unreachable_server_is_a_network_error():
+    with ThreadingHTTPServer(('127.0.0.1', 0), Handler) as closed:
+        port = closed.server_port
+    client = MusicBrainzClient(f"http://127.0.0.1:{port}/ws/2", rate=100.0, timeout=1)
+    with pytest.raises(MusicBrainzError) as error:
+        client.lookup_discid('disc1')
+    assert error.value.network
+
+
+def test_not_found_is_cached_negatively(server, tmp_path):
+    client = make_client(server)
+    cache = MetadataCache(str(tmp_path / 'metadata.sqlite'), negative_ttl=60)
+    data = client.lookup_discid('missing')
+    assert data is None
+    cache.put('missing', data)
+    entry = cache.get('missing')
+    assert entry is not None and entry.data is None
+    assert len(server.requests) == 1
+    client.close()
+
+
+def test_empty_release_list_counts_as_not_found(server):
+    server.answer('disc1', (200, {'releases': []}, {}))
+    client = make_client(server)
+    assert client.lookup_discid('disc1') is None
+    client.close()
+
+
+def test_negative_entries_expire_before_positive_ones(tmp_path, monkeypatch):
+    cache = MetadataCache(str(tmp_path / 'metadata.sqlite'), ttl=3600, negative_ttl=60)
+    cache.put('missing', None)
+    cache.put('disc1', RELEASE)
+    later = time.time() + 120
+    monkeypatch.setattr('autoripper.metadata_cache.time.time', lambda: later)
+    assert cache.get('missing') is None
+    assert cache.get('disc1').data == RELEASE
@@ -0,0 +1,71 @@
+import contextvars
+import os
+import subprocess
+import time
+
+import pytest
+
+from autoripper import aio, pipeline
+from autoripper.encoding import EncoderPool, EncoderSlots
+from autoripper.pipeline import AlbumLayout, RipPipeline
+from autoripper.runner import start_command
+
+
+@pytest.fixture
+def stage():
+    """Run code as if inside an AsyncCore stage"""
+    stage = aio.Stage('test')
+    context = contextvars.copy_context()
+    context.run(aio._stage.set, stage)
+    return stage, context
+
+
+@pytest.fixture
+def rip(tmp_path, monkeypatch):
+    monkeypatch.setattr(pipeline, 'encode_file', lambda fmt, source, destination, config, tags: True)
+    config = {'formats': ['flac'], 'work_dir': str(tmp_path / 'work'), 'output_dir': str(tmp_path / 'music')}
+    return RipPipeline(config, EncoderPool(EncoderSlots(1))), AlbumLayout(str(tmp_path / 'music'), 'Artist', 'Album')
+
+
+def test_cancel_event_outside_a_stage():
+    assert aio.cancel_event() is None
+
+
+def test_cancelled_stage_stops_between_tracks(rip, stage, monkeypatch):
+    rip_pipeline, layout = rip
+    stage, context = stage
+    read = []
+
+    def read_track(device, number, destination, options=None, checksum=None):
+        read.append(number)
+        with open(destination, 'wb') as f:
+            f.write(b'pcm')
+        stage.cancel()  # Shutdown arrives while track 1 is read
+        return True
+    monkeypatch.setattr(rip_pipeline, 'read_track', read_track)
+
+    job = context.run(rip_pipeline.extract, '/dev/sr0', [1, 2, 3], layout, 'disc')
+    assert read == [1]
+    assert job.cancelled and job.read_failed == [2]
+    job.wait(5)
+    assert not job.succeeded
+    # Kept for the resume
+    assert os.path.isdir(job.work_dir)
+
+
+def test_cancelled_read_is_not_a_read_failure(rip, stage, monkeypatch):
+    rip_pipeline, layout = rip
+    stage, context = stage
+    monkeypatch.setattr(rip_pipeline, 'read_track', lambda *args, **kwargs: stage.cancel() or False)
+    job = context.run(rip_pipeline.extract, '/dev/sr0', [1, 2], layout, 'disc')
+    assert job.cancelled and job.read_failed == [1]
+
+
+def test_cancel_kills_streaming_tools(stage):
+    stage, context = stage
+    command = context.run(lambda: start_command(['sleep', '30'], stdout=subprocess.PIPE,
+                                                cancel=aio.cancel_event()))
+    started = time.monotonic()
+    stage.cancel()
+    assert command.wait().cancelled
+    assert time.monotonic() - started < 5
@@ -0,0 +1,116 @@
+import pytest
+
+from autoripper.cdrom import CD_FRAMESIZE_RAW, FakeBackend
+from autoripper.discid import Toc
+from autoripper.readengine import WAV_HEADER_BYTES, BurstReader, ErrorMap
+
+# Two tracks of 100 and 150 sectors
+DISC = [(0, False), (100, False), 250]
+
+
+def make_reader(read_offset=0, **faults):
+    drive = FakeBackend(toc=DISC, **faults)
+    toc = Toc.from_entries(drive.read_toc())
+    return drive, BurstReader(drive, toc, ErrorMap('disc', read_offset), read_offset, block_frames=26)
+
+
+def expected_audio(first, end):
+    return b''.join(FakeBackend.sector_data(lba) for lba in range(first, end))
+
+
+def audio(path):
+    with open(path, 'rb') as f:
+        return f.read()[WAV_HEADER_BYTES:]
+
+
+def test_clean_burst_read(tmp_path):
+    _, reader = make_reader()
+    wav = tmp_path / 'track02.wav'
+    assert reader.burst_read(2, str(wav)) == []
+    assert audio(wav) == expected_audio(100, 250)
+
+
+def test_read_offset_shifts_the_track(tmp_path):
+    _, reader = make_reader(read_offset=30)
+    wav = tmp_path / 'track01.wav'
+    reader.burst_read(1, str(wav))
+    shift = 30 * 4
+    assert audio(wav) == expected_audio(0, 101)[shift:shift + 100 * CD_FRAMESIZE_RAW]
+
+
+def test_read_error_is_repaired(tmp_path):
+    _, reader = make_reader(bad_sectors={110: 1})
+    wav = tmp_path / 'track02.wav'
+    suspect = reader.burst_read(2, str(wav))
+    assert [(entry['start'], entry['end'], entry['reason']) for entry in suspect] == [(100, 126, 'read_error')]
+    assert audio(wav) != expected_audio(100, 250)
+    reader.repair(2, str(wav), suspect)
+    assert suspect[0]['status'] == 'recovered'
+    assert audio(wav) == expected_audio(100, 250)
+    assert reader.error_map.unrecoverable == 0
+
+
+def test_silent_corruption_found_by_verify(tmp_path):
+    _, reader = make_reader(unstable_sectors={30: 1})
+    wav = tmp_path / 'track01.wav'
+    assert reader.burst_read(1, str(wav)) == []
+    suspect = reader.verify(1)
+    assert [(entry['start'], entry['end'], entry['reason']) for entry in suspect] == [(26, 52, 'mismatch')]
+    reader.repair(1, str(wav), suspect)
+    assert audio(wav) == expected_audio(0, 100)
+
+
+def test_unreadable_sector_is_unrecoverable(tmp_path):
+    _, reader = make_reader(bad_sectors={5: 1000})
+    wav = tmp_path / 'track01.wav'
+    suspect = reader.burst_read(1, str(wav))
+    reader.repair(1, str(wav), suspect)
+    assert suspect[0]['status'] == 'unrecoverable'
+    assert reader.error_map.unrecoverable == 1
+    assert reader.error_map.to_dict()['suspect_sectors'] == 26
+    # Everything but the unreadable sector was recovered
+    data = audio(wav)
+    assert data[5 * CD_FRAMESIZE_RAW:6 * CD_FRAMESIZE_RAW] == bytes(CD_FRAMESIZE_RAW)
+    assert data[:5 * CD_FRAMESIZE_RAW] == expected_audio(0, 5)
+
+
+def test_repair_reads_slowly_then_restores_speed(tmp_path):
+    drive, reader = make_reader(bad_sectors={0: 1})
+    wav = tmp_path / 'track01.wav'
+    suspect = reader.burst_read(1, str(wav))
+    speeds = []
+    drive.set_speed = speeds.append
+    reader.repair(1, str(wav), suspect)
+    assert speeds == [reader.careful_speed, 0]
+
+
+def test_error_map_saved(tmp_path):
+    _, reader = make_reader(bad_sectors={0: 1})
+    reader.burst_read(1, str(tmp_path / 'track01.wav'))
+    path = reader.error_map.save(str(tmp_path))
+    assert path.endswith('rip-errors.json')
+    assert (tmp_path / 'rip-errors.json').exists()
+
+
+def test_rereads_are_not_answered_from_the_drive_cache(tmp_path):
+    # Sector 30 reads back corrupted three times: in the burst pass, in
+    # verify and on the first careful read, which the drive then caches
+    drive = FakeBackend(toc=DISC, unstable_sectors={30: 3}, cache_frames=64)
+    reader = BurstReader(drive, Toc.from_entries(drive.read_toc()), ErrorMap('disc'),
+                         block_frames=26, cache_frames=64)
+    wav = tmp_path / 'track01.wav'
+    reader.burst_read(1, str(wav))
+    suspect = reader.verify(1)
+    reader.repair(1, str(wav), suspect)
+    assert suspect[0]['status'] == 'recovered'
+    assert audio(wav) == expected_audio(0, 100)
+
+
+def test_cached_rereads_would_agree_on_bad_data(tmp_path):
+    drive = FakeBackend(toc=DISC, unstable_sectors={30: 3}, cache_frames=64)
+    reader = BurstReader(drive, Toc.from_entries(drive.read_toc()), ErrorMap('disc'),
+                         block_frames=26, cache_frames=0)
+    wav = tmp_path / 'track01.wav'
+    reader.burst_read(1, str(wav))
+    reader.repair(1, str(wav), reader.verify(1))
+    assert audio(wav) != expected_audio(0, 100)
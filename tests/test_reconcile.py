@@ -0,0 +1,70 @@
+import os
+
+import pytest
+
+from autoripper import reconcile
+from autoripper.discinfo import read_disc_info, write_disc_info
+from autoripper.pipeline import AlbumLayout
+from autoripper.reconcile import MetadataReconciler
+
+INFO = {'disc_id': 'abc', 'tracks': [1, 2], 'metadata_source': 'pending'}
+
+
+@pytest.fixture
+def tagged(monkeypatch):
+    """Tags written by the (fake) tagger, by path at the time of tagging"""
+    tags = {}
+
+    def tag_file(fmt, path, values):
+        with open(path, 'ab') as f:
+            f.write(f"|{values['title']}".encode())
+        tags[path] = values
+        return True
+    monkeypatch.setattr(reconcile, 'tag_file', tag_file)
+    return tags
+
+
+@pytest.fixture
+def placeholder(tmp_path):
+    album_dir = tmp_path / 'Unknown_Artist_01' / 'Unknown_Album_01'
+    album_dir.mkdir(parents=True)
+    for number in (1, 2):
+        (album_dir / f"{number:02d}.Track_{number}.flac").write_bytes(b'audio')
+    (album_dir / 'cover.jpg').write_bytes(b'jpeg')
+    write_disc_info(str(album_dir), INFO)
+    return album_dir
+
+
+def make_reconciler(tmp_path, moved):
+    return MetadataReconciler(str(tmp_path / 'state.json'), lambda discs: {}, lambda info, data: None,
+                              on_moved=lambda old, new: moved.append((old, new)))
+
+
+def test_relocate_retags_and_renames_in_place(tmp_path, placeholder, tagged):
+    moved = []
+    layout = AlbumLayout(str(tmp_path), 'Artist', 'Album', {1: 'One', 2: 'Two'})
+    assert make_reconciler(tmp_path, moved).relocate(str(placeholder), INFO, layout)
+
+    target = tmp_path / 'Artist' / 'Album'
+    assert sorted(os.listdir(target)) == ['.disc-info.json', '01 - One.flac', '02 - Two.flac', 'cover.jpg']
+    assert (target / '01 - One.flac').read_bytes() == b'audio|One'
+    assert not (tmp_path / 'Unknown_Artist_01').exists()
+    assert read_disc_info(str(target))['metadata_source'] == 'musicbrainz'
+    assert moved == [(str(placeholder), str(target))]
+
+
+def test_relocate_into_existing_artist(tmp_path, placeholder, tagged):
+    (tmp_path / 'Artist' / 'Other_Album').mkdir(parents=True)
+    layout = AlbumLayout(str(tmp_path), 'Artist', 'Album', {1: 'One', 2: 'Two'})
+    assert make_reconciler(tmp_path, []).relocate(str(placeholder), INFO, layout)
+    assert sorted(os.listdir(tmp_path / 'Artist')) == ['Album', 'Other_Album']
+    assert not (tmp_path / 'Unknown_Artist_01').exists()
+
+
+def test_failed_tag_leaves_album_in_place(tmp_path, placeholder, monkeypatch):
+    monkeypatch.setattr(reconcile, 'tag_file', lambda fmt, path, tags: False)
+    layout = AlbumLayout(str(tmp_path), 'Artist', 'Album', {1: 'One', 2: 'Two'})
+    assert not make_reconciler(tmp_path, []).relocate(str(placeholder), INFO, layout)
+    assert sorted(os.listdir(placeholder)) == ['.disc-info.json', '01.Track_1.flac', '02.Track_2.flac',
+                                               'cover.jpg']
+    assert read_disc_info(str(placeholder))['metadata_source'] == 'pending'
@@ -0,0 +1,70 @@
+import os
+import subprocess
+import sys
+import threading
+import time
+
+from autoripper import runner
+from autoripper.runner import CdparanoiaProgress, start_command
+
+
+def alive(pid):
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    # A zombie still answers signal 0 until it is reaped
+    try:
+        with open(f"/proc/{pid}/stat") as f:
+            return f.read().split(') ')[1][0] != 'Z'
+    except FileNotFoundError:
+        return False
+
+
+def test_streams_data_between_tools():
+    producer = start_command([sys.executable, '-c', 'import sys; sys.stdout.write("pcm" * 1000)'],
+                             stdout=subprocess.PIPE)
+    consumer = start_command([sys.executable, '-c', 'import sys; sys.exit(len(sys.stdin.read()) != 3000)'],
+                             stdin=producer.stdout, stdout=subprocess.DEVNULL)
+    producer.stdout.close()
+    assert producer.wait().ok
+    assert consumer.wait().ok
+
+
+def test_stderr_goes_to_progress_and_tail():
+    script = ('import sys\n'
+              'sys.stderr.write("Ripping from sector 0\\n\\t to sector 1176\\n")\n'
+              'sys.stderr.write("##: 0 [read] @ 691488\\n")\n'
+              'sys.stderr.write("drive said no\\n")\n'
+              'sys.exit(3)\n')
+    events = []
+    command = start_command([sys.executable, '-c', script], stdout=subprocess.DEVNULL,
+                            parsers=[CdparanoiaProgress()], on_progress=events.append)
+    result = command.wait()
+    assert result.returncode == 3 and not result.ok
+    assert result.output == 'drive said no'
+    assert events[-1].fraction == 0.5
+
+
+def test_timeout_kills_the_process_group(monkeypatch):
+    monkeypatch.setattr(runner, 'KILL_GRACE', 1)
+    # The tool leaves a helper behind, like abcde's lame
+    command = start_command(['sh', '-c', 'sleep 30 & echo $! >&2; wait'], stdout=subprocess.PIPE, timeout=0.5)
+    started = time.monotonic()
+    result = command.wait()
+    assert result.timed_out
+    assert time.monotonic() - started < 5
+    helper = int(result.output.split()[0])
+    assert not alive(helper)
+
+
+def test_cancel_unblocks_a_reader():
+    cancel = threading.Event()
+    command = start_command(['sleep', '30'], stdout=subprocess.PIPE, cancel=cancel)
+    threading.Timer(0.2, cancel.set).start()
+    started = time.monotonic()
+    # The pipe loop sees EOF once the group is killed
+    assert command.stdout.read() == b''
+    result = command.wait()
+    assert result.cancelled and not result.ok
+    assert time.monotonic() - started < 5
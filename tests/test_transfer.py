@@ -0,0 +1,162 @@
+import os
+import time
+
+import pytest
+
+from autoripper import transfer
+from autoripper.transfer import PART_SUFFIX, UNAVAILABLE_POLL, TransferEngine, TransferError
+
+CHUNK = 16
+
+
+@pytest.fixture
+def roots(tmp_path):
+    """(music, share) with one album of two files in music"""
+    music, share = tmp_path / 'music', tmp_path / 'share'
+    album = music / 'Artist' / 'Album'
+    album.mkdir(parents=True)
+    (album / '01 - One.flac').write_bytes(bytes(range(50)))
+    (album / 'cover.jpg').write_bytes(b'jpeg')
+    share.mkdir()
+    return music, share
+
+
+def make_engine(tmp_path, music, share):
+    return TransferEngine(str(music), str(share), str(tmp_path / 'transfer-queue.json'), chunk_size=CHUNK)
+
+
+def test_copies_album_and_empties_queue(tmp_path, roots):
+    music, share = roots
+    engine = make_engine(tmp_path, music, share)
+    engine.enqueue(str(music / 'Artist' / 'Album'))
+    assert engine.process_due() == 1
+    assert (share / 'Artist' / 'Album' / '01 - One.flac').read_bytes() == bytes(range(50))
+    assert (share / 'Artist' / 'Album' / 'cover.jpg').read_bytes() == b'jpeg'
+    assert engine.pending == {}
+    assert make_engine(tmp_path, music, share).pending == {}
+
+
+def test_queue_survives_a_restart(tmp_path, roots):
+    music, share = roots
+    make_engine(tmp_path, music, share).enqueue(str(music / 'Artist' / 'Album'))
+    assert list(make_engine(tmp_path, music, share).pending) == [str(music / 'Artist' / 'Album')]
+
+
+def test_resumes_from_part_file(tmp_path, roots):
+    music, share = roots
+    source = music / 'Artist' / 'Album' / '01 - One.flac'
+    destination = share / 'Artist' / 'Album' / '01 - One.flac'
+    destination.parent.mkdir(parents=True)
+    # Interrupted after one whole chunk and a few bytes of the next
+    part = destination.parent / f".{destination.name}{PART_SUFFIX}"
+    part.write_bytes(source.read_bytes()[:CHUNK + 4])
+    engine = make_engine(tmp_path, music, share)
+    sent = engine._copy_file(str(source), str(destination))
+    assert sent == 50 - CHUNK
+    assert destination.read_bytes() == source.read_bytes()
+    assert not part.exists()
+    assert int(destination.stat().st_mtime) == int(source.stat().st_mtime)
+
+
+def test_corrupt_part_file_starts_over(tmp_path, roots):
+    music, share = roots
+    source = music / 'Artist' / 'Album' / '01 - One.flac'
+    destination = share / 'Artist' / 'Album' / '01 - One.flac'
+    destination.parent.mkdir(parents=True)
+    (destination.parent / f".{destination.name}{PART_SUFFIX}").write_bytes(b'x' * CHUNK)
+    engine = make_engine(tmp_path, music, share)
+    sent = engine._copy_file(str(source), str(destination))
+    assert sent == (50 - CHUNK) + 50
+    assert destination.read_bytes() == source.read_bytes()
+
+
+def test_finished_file_is_not_copied_again(tmp_path, roots):
+    music, share = roots
+    engine = make_engine(tmp_path, music, share)
+    source = str(music / 'Artist' / 'Album' / '01 - One.flac')
+    destination = str(share / 'Artist' / 'Album' / '01 - One.flac')
+    os.makedirs(os.path.dirname(destination))
+    assert engine._copy_file(source, destination) == 50
+    assert engine._copy_file(source, destination) == 0
+
+
+def test_checksum_mismatch_is_retried_later(tmp_path, roots, monkeypatch):
+    music, share = roots
+    album_dir = str(music / 'Artist' / 'Album')
+    monkeypatch.setattr(transfer, '_file_digest', lambda path, chunk_size: 'corrupted on the share')
+    engine = make_engine(tmp_path, music, share)
+    source = os.path.join(album_dir, 'cover.jpg')
+    with pytest.raises(TransferError):
+        engine._copy_file(source, str(share / 'cover.jpg'))
+    assert os.listdir(share) == []
+
+    engine.enqueue(album_dir)
+    assert engine.process_due() == 0
+    entry = engine.pending[album_dir]
+    assert entry['attempts'] == 1
+    assert entry['next_try'] > time.time()
+    assert not any(name.endswith(PART_SUFFIX) for name in os.listdir(share / 'Artist' / 'Album'))
+    assert not (share / 'Artist' / 'Album' / 'cover.jpg').exists()
+
+
+def test_waits_while_share_is_unavailable(tmp_path, roots):
+    music, share = roots
+    share.rmdir()  # Not mounted
+    engine = make_engine(tmp_path, music, share)
+    engine.enqueue(str(music / 'Artist' / 'Album'))
+    assert engine.step() == UNAVAILABLE_POLL
+    assert engine.pending
+    assert not share.exists()  # Nothing written where the mount point should be
+
+    share.mkdir()
+    engine.step()
+    assert engine.pending == {}
+    assert (share / 'Artist' / 'Album' / 'cover.jpg').exists()
+
+
+def test_replaced_copy_is_removed(tmp_path, roots):
+    music, share = roots
+    old = share / 'Unknown_Artist_01' / 'Unknown_Album_01'
+    old.mkdir(parents=True)
+    (old / '01 - Track_01.flac').write_bytes(b'old')
+    engine = make_engine(tmp_path, music, share)
+    # The reconciler renamed the album after its first copy
+    engine.enqueue(str(music / 'Artist' / 'Album'),
+                   replaces=str(music / 'Unknown_Artist_01' / 'Unknown_Album_01'))
+    assert engine.process_due() == 1
+    assert not (share / 'Unknown_Artist_01').exists()
+    assert (share / 'Artist' / 'Album' / '01 - One.flac').exists()
+
+
+def test_replaced_copy_is_kept_until_new_copy_succeeds(tmp_path, roots, monkeypatch):
+    music, share = roots
+    old = share / 'Unknown_Artist_01' / 'Unknown_Album_01'
+    old.mkdir(parents=True)
+    monkeypatch.setattr(transfer, '_file_digest', lambda path, chunk_size: 'corrupted on the share')
+    engine = make_engine(tmp_path, music, share)
+    engine.enqueue(str(music / 'Artist' / 'Album'),
+                   replaces=str(music / 'Unknown_Artist_01' / 'Unknown_Album_01'))
+    engine.process_due()
+    assert old.exists()
+
+
+def test_albums_outside_source_root_are_refused(tmp_path, roots):
+    music, share = roots
+    engine = make_engine(tmp_path, music, share)
+    assert not engine.enqueue(str(tmp_path / 'elsewhere'))
+    assert engine.pending == {}
+
+
+def test_step_copies_one_album_at_a_time(tmp_path, roots):
+    music, share = roots
+    second = music / 'Artist' / 'Second'
+    second.mkdir()
+    (second / 'cover.jpg').write_bytes(b'jpeg')
+    engine = make_engine(tmp_path, music, share)
+    engine.enqueue(str(music / 'Artist' / 'Album'))
+    engine.enqueue(str(second))
+    # Handed back to the loop between albums, asking to run again at once
+    assert engine.step() == 0
+    assert len(engine.pending) == 1
+    assert engine.step() > 0
+    assert engine.pending == {}
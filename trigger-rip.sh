@@ -23,7 +23,8 @@ if [ -z "$DEVICE_NODE" ] || [ "$DEVICE_NODE" = "/dev/" ]; then
 fi
 
 # ROBUST LOCKING: Use flock for atomic lock acquisition
-LOCKFILE="/tmp/auto-ripper.lock"
+# Per-drive trigger lock so several drives can be triggered at once
+LOCKFILE="/tmp/auto-ripper-trigger-$(basename "$DEVICE_NODE").lock"
 LOCKFD=200
 
 # Try to acquire exclusive lock with immediate failure if already locked
@@ -55,8 +56,7 @@ trap 'rm -f "$LOCKFILE"; exit' INT TERM EXIT
 # Log the trigger event
 echo "$(date): Disc insertion detected on $DEVICE_NODE (Action: $ACTION, User: $(whoami), UID: $(id -u))" >> "$LOG_FILE"
 
-# Wait for the disc to settle
-sleep 5
+# No fixed settle delay: the probe below waits for the drive to report the disc
 
 # Check if disc is actually present and readable
 if [ -e "$DEVICE_NODE" ]; then
@@ -74,52 +74,45 @@ echo "$(date): Environment debug - DEVICE_NODE: $DEVICE_NODE" >> "$LOG_FILE"
 # Critical: Wait for disc to be actually readable (not just device present)
 echo "$(date): Waiting for disc media to become ready..." >> "$LOG_FILE"
 
-# Smart waiting: try multiple times with increasing delays
-MAX_ATTEMPTS=6
-ATTEMPT=1
-MEDIA_READY=false
+# Probe the disc once: waits for the drive, reads the TOC and saves the result
+# for the ripper so nothing below has to query the drive again
+PROBE_JSON=$(cd /opt/auto-ripper && python3 -m autoripper.probe --wait 40 --save "$DEVICE_NODE" 2>>"$LOG_FILE")
+PROBE_STATUS=$?
 
-while [ $ATTEMPT -le $MAX_ATTEMPTS ] && [ "$MEDIA_READY" = false ]; do
-    echo "$(date): Attempt $ATTEMPT/$MAX_ATTEMPTS - checking if media is ready..." >> "$LOG_FILE"
-    
-    # Try a quick cdparanoia test to see if media is readable
-    if timeout 5 cdparanoia -Q -d "$DEVICE_NODE" >/dev/null 2>&1; then
-        echo "$(date): Media is ready! (detected on attempt $ATTEMPT)" >> "$LOG_FILE"
-        MEDIA_READY=true
-        break
-    fi
-    
-    # Progressive delays: 2, 4, 6, 8, 10, 12 seconds
-    DELAY=$((ATTEMPT * 2))
-    echo "$(date): Media not ready yet, waiting ${DELAY}s before retry..." >> "$LOG_FILE"
-    sleep $DELAY
-    ATTEMPT=$((ATTEMPT + 1))
-done
-
-if [ "$MEDIA_READY" = false ]; then
-    echo "$(date): Media never became ready after $MAX_ATTEMPTS attempts, aborting" >> "$LOG_FILE"
+if [ $PROBE_STATUS -ne 0 ]; then
+    echo "$(date): Media never became ready (probe: $PROBE_JSON), aborting" >> "$LOG_FILE"
     exit 1
 fi
+echo "$(date): Media is ready: $PROBE_JSON" >> "$LOG_FILE"
+
+probe_field() {
+    echo "$PROBE_JSON" | python3 -c "import json, sys; print(json.load(sys.stdin).get('$1') or '')"
+}
 
 # Get disc ID to prevent processing the same disc multiple times
-DISC_ID=""
-if command -v cd-discid >/dev/null; then
-    DISC_ID=$(timeout 5 cd-discid "$DEVICE_NODE" 2>/dev/null | awk '{print $1}' || echo "")
+DISC_ID=$(probe_field disc_id)
+DISC_TYPE=$(probe_field disc_type)
+
+# Detect the non-root user to run as
+if [ -n "$SUDO_USER" ]; then
+    RUN_USER="$SUDO_USER"
+elif id -u rsd >/dev/null 2>&1; then
+    RUN_USER="rsd"
+elif id -u pi >/dev/null 2>&1; then
+    RUN_USER="pi"
+else
+    RUN_USER=$(getent passwd 1000 | cut -d: -f1)
 fi
 
-# Check if we've already processed this disc recently
-DISC_CACHE="/tmp/auto-ripper-last-disc"
-if [ -n "$DISC_ID" ] && [ -f "$DISC_CACHE" ]; then
-    LAST_DISC=$(cat "$DISC_CACHE" 2>/dev/null)
-    if [ "$DISC_ID" = "$LAST_DISC" ]; then
-        echo "$(date): Same disc already processed recently (ID: $DISC_ID), skipping" >> "$LOG_FILE"
+# Skip discs that are already in the library if library_catalog.duplicates is "skip"
+# (the daemon applies the same policy; with "rip" it logs the existing copy and rips another).
+# Checked as the service user so no catalog file ever ends up owned by root.
+if [ -n "$DISC_ID" ]; then
+    EXISTING=$(cd /opt/auto-ripper && sudo -u "$RUN_USER" python3 -m autoripper.catalog skip "$DISC_ID" 2>>"$LOG_FILE")
+    if [ $? -eq 0 ]; then
+        echo "$(date): Disc already in library (ID: $DISC_ID) at $(echo "$EXISTING" | head -1), skipping" >> "$LOG_FILE"
         exit 0
     fi
-fi
-
-# Remember this disc
-if [ -n "$DISC_ID" ]; then
-    echo "$DISC_ID" > "$DISC_CACHE"
     echo "$(date): Processing new disc (ID: $DISC_ID)" >> "$LOG_FILE"
 fi
 
@@ -129,17 +122,18 @@ export PATH="/usr/local/bin:/usr/local/sbin:/usr/bin:/usr/sbin:/bin:/sbin"
 # Media is confirmed ready, now determine disc type
 echo "$(date): Determining disc type..." >> "$LOG_FILE"
 
-# Since cdparanoia already confirmed it's readable, it's likely an audio CD
-if timeout 10 cdparanoia -Q -d "$DEVICE_NODE" >/dev/null 2>&1; then
-    echo "$(date): Confirmed audio CD via cdparanoia" >> "$LOG_FILE"
-    DISC_DETECTED=true
-elif timeout 10 /usr/sbin/blkid "$DEVICE_NODE" >/dev/null 2>&1; then
-    echo "$(date): Confirmed data disc via blkid" >> "$LOG_FILE"
-    DISC_DETECTED=true
-else
-    echo "$(date): Unknown disc type, but media is ready - proceeding anyway" >> "$LOG_FILE"
-    DISC_DETECTED=true
-fi
+case "$DISC_TYPE" in
+    audio_cd|mixed_cd)
+        echo "$(date): Confirmed audio CD via probe ($DISC_TYPE)" >> "$LOG_FILE"
+        ;;
+    data_disc)
+        echo "$(date): Confirmed data disc via probe" >> "$LOG_FILE"
+        ;;
+    *)
+        echo "$(date): Unknown disc type, but media is ready - proceeding anyway" >> "$LOG_FILE"
+        ;;
+esac
+DISC_DETECTED=true
     
     if [ "$DISC_DETECTED" = true ]; then
         echo "$(date): Disc confirmed readable on $DEVICE_NODE, starting rip process" >> "$LOG_FILE"
@@ -147,22 +141,11 @@ fi
         # Export device for the Python script
         export CDROM_DEVICE="$DEVICE_NODE"
         
-        # Detect the non-root user to run as
-        if [ -n "$SUDO_USER" ]; then
-            RUN_USER="$SUDO_USER"
-        elif id -u rsd >/dev/null 2>&1; then
-            RUN_USER="rsd"
-        elif id -u pi >/dev/null 2>&1; then
-            RUN_USER="pi"
-        else
-            RUN_USER=$(getent passwd 1000 | cut -d: -f1)
-        fi
-        
         echo "$(date): Running auto-ripper as user: $RUN_USER" >> "$LOG_FILE"
         
         # Set up proper environment for the detected user session
         # Run the auto-ripper in daemon mode with proper environment
-        sudo -u "$RUN_USER" -i CDROM_DEVICE="$DEVICE_NODE" /usr/bin/python3 /opt/auto-ripper/auto-ripper.py --daemon >> "$LOG_FILE" 2>&1 &
+        sudo -u "$RUN_USER" -i CDROM_DEVICE="$DEVICE_NODE" /usr/bin/python3 /opt/auto-ripper/auto-ripper.py --daemon "$DEVICE_NODE" >> "$LOG_FILE" 2>&1 &
         
         echo "$(date): Rip process initiated for $DEVICE_NODE" >> "$LOG_FILE"
     else
@@ -9,6 +9,11 @@ LOCKFILES=(
     "/tmp/auto-ripper-trigger.lock"
 )
 
+# Per-drive locks (multi-drive supervisor and udev triggers)
+for lockfile in /tmp/auto-ripper-sr*.lock /tmp/auto-ripper-trigger-sr*.lock; do
+    [ -e "$lockfile" ] && LOCKFILES+=("$lockfile")
+done
+
 for lockfile in "${LOCKFILES[@]}"; do
     if [ -f "$lockfile" ]; then
         # Check if process is still running
@@ -5,11 +5,19 @@ Addresses issues where CD detection fails after initial success
 """
 
 import subprocess
+import sys
 import time
 import os
 import logging
 from typing import Optional, Tuple
 
+# Native TOC/disc ID support lives in the autoripper package one level up
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+try:
+    from autoripper.discid import read_toc
+except ImportError:
+    read_toc = None
+
 class EnhancedCDDetector:
     """
     Enhanced CD detection with improved reliability and error handling
@@ -85,6 +93,23 @@ class EnhancedCDDetector:
         logging.warning("Drive did not become ready within timeout")
         return False
     
+    def read_disc_id(self) -> Optional[str]:
+        """
+        MusicBrainz disc ID of the inserted audio CD, computed from the TOC
+        Returns None if there is no readable audio TOC
+        """
+        if read_toc is None:
+            logging.debug("autoripper package not available, cannot compute disc ID")
+            return None
+        try:
+            toc = read_toc(self.device)
+        except (OSError, ValueError) as e:
+            logging.debug(f"TOC read failed: {e}")
+            return None
+        if not toc.audio_tracks:
+            return None
+        return toc.musicbrainz_id
+    
     def detect_audio_cd_robust(self) -> Tuple[bool, Optional[str]]:
         """
         Robust audio CD detection with multiple methods and retries
@@ -108,21 +133,11 @@ class EnhancedCDDetector:
             
             logging.info(f"Audio CD detection attempt {attempt}/{self.max_detection_attempts} (timeout: {timeout}s)")
             
-            # Method 1: cd-discid (most reliable for audio CDs)
-            try:
-                result = subprocess.run(['cd-discid', self.device], 
-                                      capture_output=True, text=True, timeout=timeout)
-                if result.returncode == 0 and result.stdout.strip():
-                    disc_id = result.stdout.strip().split()[0]
-                    logging.info(f"Audio CD detected via cd-discid: {disc_id}")
-                    return True, disc_id
-                    
-            except subprocess.TimeoutExpired:
-                logging.warning(f"cd-discid timed out on attempt {attempt}")
-            except FileNotFoundError:
-                logging.error("cd-discid command not found")
-            except Exception as e:
-                logging.warning(f"cd-discid failed on attempt {attempt}: {e}")
+            # Method 1: read the TOC in-process (most reliable for audio CDs)
+            disc_id = self.read_disc_id()
+            if disc_id:
+                logging.info(f"Audio CD detected via TOC: {disc_id}")
+                return True, disc_id
             
             # Method 2: cdparanoia with query
             try:
@@ -130,16 +145,7 @@ class EnhancedCDDetector:
                                       capture_output=True, text=True, timeout=timeout)
                 if result.returncode == 0 and 'track' in result.stderr.lower():
                     logging.info("Audio CD detected via cdparanoia")
-                    # Try to get disc ID with cd-discid if available
-                    try:
-                        id_result = subprocess.run(['cd-discid', self.device], 
-                                                 capture_output=True, text=True, timeout=5)
-                        if id_result.returncode == 0:
-                            disc_id = id_result.stdout.strip().split()[0]
-                            return True, disc_id
-                    except:
-                        pass
-                    return True, None
+                    return True, self.read_disc_id()
                     
             except subprocess.TimeoutExpired:
                 logging.warning(f"cdparanoia timed out on attempt {attempt}")